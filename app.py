@@ -1,4 +1,6 @@
 import os
+import io
+import csv
 import json
 import re
 import time
@@ -9,9 +11,13 @@ import urllib.error
 import urllib.parse
 import html as _html
 import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
 import hmac as _hmac_module
 from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 from datetime import datetime, timedelta, timezone
+from markupsafe import Markup
 from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_from_directory, current_app, Response
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.utils import secure_filename
@@ -25,9 +31,11 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import secrets
 import requests as _requests_lib
+from urllib3.util.retry import Retry as _HttpRetry
 import google.generativeai as genai
 from google.api_core import exceptions as google_api_exceptions
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
@@ -90,6 +98,24 @@ if DB_URL:
     elif "postgresql+psycopg2://" in DB_URL:
         DB_URL = DB_URL.replace("postgresql+psycopg2://", "postgresql+psycopg://", 1)
     app.config["SQLALCHEMY_DATABASE_URI"] = DB_URL
+    # gunicorn runs gthread with WEB_THREADS request threads (Procfile), plus
+    # the job consumers and the order-events poller of this process: size the
+    # pool so every one of them can hold a connection without queueing on
+    # checkout. DB_POOL_SIZE / DB_MAX_OVERFLOW override.
+    _db_pool_consumers = (
+        int(os.environ.get("JOB_QUEUE_INLINE_CONSUMERS", "2") or 2)
+        if (os.environ.get("JOB_QUEUE_MODE") or "inline").strip().lower() == "inline"
+        else int(os.environ.get("JOB_WORKER_CONSUMERS", "4") or 4)
+    )
+    _db_pool_size = int(os.environ.get("DB_POOL_SIZE", "0") or 0) or (
+        max(int(os.environ.get("WEB_THREADS", "32") or 32), 1) + max(_db_pool_consumers, 0)
+        + max(int(os.environ.get("CAPTURE_OCR_CONSUMERS", "1") or 1), 1) + 2
+    )
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": _db_pool_size,
+        "max_overflow": max(int(os.environ.get("DB_MAX_OVERFLOW", str(_db_pool_size // 2)) or 0), 0),
+        "pool_pre_ping": True,
+    }
 else:
     SQLITE_PATH = os.environ.get("SQLITE_PATH", "").strip()
     if SQLITE_PATH:
@@ -129,6 +155,117 @@ def _disable_admin_cache(response):
         pass
     return response
 
+
+# Public storefront JSON cache. Responses are kept per worker, keyed on path +
+# query args, and stamped with the config version token (see get_config_value):
+# any config write — and every catalog mutation, which bumps
+# STOREFRONT_CACHE_VERSION_KEY — makes the stamped entries stale in all workers
+# within CONFIG_CACHE_POLL_SECONDS. The TTL only bounds data that changes
+# without an admin action (sales ranking). Turning CONFIG_CACHE_ENABLED off
+# disables this cache too, since there is no version token to check against.
+STOREFRONT_CACHE_VERSION_KEY = "storefront_cache_version"
+_STOREFRONT_CACHE_ENABLED = (os.environ.get("STOREFRONT_CACHE_ENABLED", "1").strip().lower() not in ("0", "false", "no"))
+_STOREFRONT_CACHE_MAX_ENTRIES = int(os.environ.get("STOREFRONT_CACHE_MAX_ENTRIES", "512") or 512)
+# Admin endpoints whose successful writes change what the storefront shows.
+_STOREFRONT_CACHE_INVALIDATING_ENDPOINTS = (
+    "admin_packages_",
+    "admin_game_items_",
+    "admin_config_",
+    "admin_smileone_connections_",
+    "admin_mini_tiers_",
+    "admin_revendedores_",
+)
+_STOREFRONT_CACHE = {}
+_STOREFRONT_CACHE_LOCK = threading.Lock()
+_STOREFRONT_CACHE_STATS = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0}
+
+
+def _storefront_cache_stat(name: str) -> None:
+    with _STOREFRONT_CACHE_LOCK:
+        _STOREFRONT_CACHE_STATS[name] = _STOREFRONT_CACHE_STATS.get(name, 0) + 1
+
+
+def _storefront_cache_version() -> str:
+    try:
+        return _config_snapshot_values().get(CONFIG_VERSION_KEY, "") if _CONFIG_CACHE_ENABLED else None
+    except Exception:
+        return None
+
+
+def _storefront_cache_invalidate(*, broadcast: bool = True) -> None:
+    """Drop this worker's entries; with broadcast, bump the shared version token
+    so the other workers drop theirs on their next config poll."""
+    with _STOREFRONT_CACHE_LOCK:
+        _STOREFRONT_CACHE.clear()
+        _STOREFRONT_CACHE_STATS["invalidations"] += 1
+    if broadcast:
+        set_config_value(STOREFRONT_CACHE_VERSION_KEY, uuid.uuid4().hex)
+
+
+def _storefront_response(body: bytes, status: int, mimetype: str, etag: str):
+    resp = app.response_class(body, status=status, mimetype=mimetype)
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
+
+
+def storefront_cached(ttl: float):
+    """Cache a public JSON endpoint for up to `ttl` seconds, with ETag/304 support."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            version = _storefront_cache_version() if _STOREFRONT_CACHE_ENABLED else None
+            if version is None:
+                return view(*args, **kwargs)
+            key = (request.path, tuple(sorted(request.args.items(multi=True))))
+            now_ts = time.monotonic()
+            with _STOREFRONT_CACHE_LOCK:
+                entry = _STOREFRONT_CACHE.get(key)
+            if entry and entry["version"] == version and entry["expires_at"] > now_ts:
+                resp = _storefront_response(entry["body"], entry["status"], entry["mimetype"], entry["etag"])
+                _storefront_cache_stat("not_modified" if resp.status_code == 304 else "hits")
+                return resp
+
+            _storefront_cache_stat("misses")
+            resp = app.make_response(view(*args, **kwargs))
+            if resp.status_code != 200 or resp.mimetype != "application/json" or resp.direct_passthrough:
+                return resp
+            body = resp.get_data()
+            entry = {
+                "body": body,
+                "status": resp.status_code,
+                "mimetype": resp.mimetype,
+                "etag": hashlib.sha1(body).hexdigest(),
+                "version": version,
+                "expires_at": now_ts + ttl,
+            }
+            with _STOREFRONT_CACHE_LOCK:
+                if len(_STOREFRONT_CACHE) >= _STOREFRONT_CACHE_MAX_ENTRIES:
+                    _STOREFRONT_CACHE.clear()
+                _STOREFRONT_CACHE[key] = entry
+            return _storefront_response(body, entry["status"], entry["mimetype"], entry["etag"])
+        return wrapper
+    return decorator
+
+
+@app.after_request
+def _invalidate_storefront_cache(response):
+    try:
+        if (
+            request.method in ("POST", "PUT", "PATCH", "DELETE")
+            and response.status_code < 400
+            and (request.endpoint or "").startswith(_STOREFRONT_CACHE_INVALIDATING_ENDPOINTS)
+        ):
+            _storefront_cache_invalidate()
+    except Exception as exc:
+        try:
+            db.session.rollback()
+        except Exception:
+            pass
+        print(f"[StorefrontCache] Invalidation error: {exc}")
+    return response
+
+
 DEFAULT_UPLOAD = os.path.join(app.root_path, "static", "uploads")
 app.config["UPLOAD_FOLDER"] = os.environ.get("UPLOAD_FOLDER", DEFAULT_UPLOAD)
 # Public URL prefix that points to where images are served from.
@@ -167,18 +304,192 @@ GENAI_API_KEY = (
 GENAI_MODEL_NAME = (os.environ.get("GENAI_MODEL", "gemini-2.5-flash") or "gemini-2.5-flash").strip()
 _GENAI_MODEL = None
 _GENAI_MODEL_READY = False
-_CAPTURE_REFERENCE_CACHE = {}
+_CAPTURE_REFERENCE_CACHE = OrderedDict()
 _CAPTURE_REFERENCE_CACHE_LOCK = threading.Lock()
 _GENAI_COOLDOWN_UNTIL = 0.0
 _GENAI_COOLDOWN_REASON = ""
 _CAPTURE_REFERENCE_CACHE_TTL_SECONDS = max(int(os.environ.get("CAPTURE_REFERENCE_CACHE_TTL_SECONDS", "43200") or 43200), 60)
+_CAPTURE_REFERENCE_CACHE_MAX_ENTRIES = max(int(os.environ.get("CAPTURE_REFERENCE_CACHE_MAX_ENTRIES", "2000") or 2000), 1)
 _GENAI_RETRY_COOLDOWN_SECONDS = max(int(os.environ.get("GENAI_RETRY_COOLDOWN_SECONDS", "90") or 90), 15)
+# Shared budget for capture OCR calls, across every web/worker process (see _capture_ocr_claim)
+GENAI_OCR_MAX_CONCURRENCY = max(int(os.environ.get("GENAI_OCR_MAX_CONCURRENCY", "2") or 2), 1)
+GENAI_OCR_MAX_PER_MINUTE = max(int(os.environ.get("GENAI_OCR_MAX_PER_MINUTE", "20") or 20), 1)
 
 db = SQLAlchemy(app)
 
-_PLAYER_SCRAPE_CACHE = {}
+# Player nick lookups (FFMania / Smile.One scrapes). Two tiers:
+#  - an in-process LRU (_PLAYER_SCRAPE_CACHE), bounded to PLAYER_NICK_CACHE_MAX_ENTRIES;
+#  - a shared `player_nick_cache` table so every gunicorn worker reuses the same
+#    result. Its lease columns make the table a cross-process singleflight: only
+#    the worker holding the lease scrapes, the others poll for its result.
+# "Not found" answers are cached too, for PLAYER_NICK_NEGATIVE_TTL_SECONDS.
+# PLAYER_NICK_SHARED_CACHE=off keeps the lookups per process.
+_PLAYER_NICK_CACHE_TTL_SECONDS = max(int(os.environ.get("PLAYER_NICK_CACHE_TTL_SECONDS", "600") or 600), 1)
+_PLAYER_NICK_NEGATIVE_TTL_SECONDS = max(int(os.environ.get("PLAYER_NICK_NEGATIVE_TTL_SECONDS", "60") or 60), 0)
+_PLAYER_NICK_CACHE_MAX_ENTRIES = max(int(os.environ.get("PLAYER_NICK_CACHE_MAX_ENTRIES", "5000") or 5000), 1)
+_PLAYER_NICK_SHARED_CACHE = (os.environ.get("PLAYER_NICK_SHARED_CACHE", "db").strip().lower() not in ("0", "off", "false", "no", "none"))
+_PLAYER_NICK_LEASE_SECONDS = 20
+_PLAYER_NICK_LEASE_POLL_SECONDS = 0.15
+_PLAYER_SCRAPE_CACHE = OrderedDict()
 _PLAYER_LOOKUP_INFLIGHT = {}
 _PLAYER_LOOKUP_LOCK = threading.Lock()
+_PLAYER_NICK_STATS = {
+    "lookups": 0,
+    "local_hits": 0,
+    "shared_hits": 0,
+    "negative_hits": 0,
+    "local_waits": 0,
+    "lease_waits": 0,
+    "upstream_calls": 0,
+    "upstream_errors": 0,
+    "shared_errors": 0,
+}
+
+
+class PlayerNickCache(db.Model):
+    __tablename__ = "player_nick_cache"
+    cache_key = db.Column(db.String(160), primary_key=True)
+    nick = db.Column(db.String(200), nullable=True)  # "" = ID no encontrado (negativo)
+    expires_at = db.Column(db.DateTime, nullable=True)
+    lease_owner = db.Column(db.String(64), nullable=True)
+    lease_until = db.Column(db.DateTime, nullable=True)
+
+
+class CaptureOcrResult(db.Model):
+    """Reference read from a payment capture by the capture_ocr job, keyed by file hash."""
+    __tablename__ = "capture_ocr_results"
+    id = db.Column(db.Integer, primary_key=True)
+    capture_sha256 = db.Column(db.String(64), nullable=False, unique=True)
+    status = db.Column(db.String(20), nullable=False, default="queued")  # queued | running | ok | not_detected | error
+    reference = db.Column(db.String(40), default="")
+    error = db.Column(db.Text, default="")  # last "error:..." status while not settled
+    capture_path = db.Column(db.String(500), default="")
+    capture_is_temp = db.Column(db.Boolean, default=False)  # checkout preview upload, deleted once settled
+    attempts = db.Column(db.Integer, default=0)
+    started_at = db.Column(db.DateTime, nullable=True, index=True)  # last GenAI call, for the budget
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+# Pooled HTTP sessions, one per upstream provider. Each provider gets its own
+# urllib3 pool (keep-alive, so bursts reuse TCP+TLS connections), a default
+# (connect, read) timeout for calls that do not pass one, and a retry policy.
+# Retries only cover connection failures — the request never reached the
+# server — except for idempotent GETs, which also retry 502/503/504, so a
+# recharge POST is never sent twice. Pool sizes: HTTP_POOL_<PROVIDER>=<n>.
+_HTTP_PROVIDERS = {
+    "ffmania": {"pool": 20, "timeout": (2.5, 3.5), "connect_retries": 0, "get_retries": 0},
+    "smileone": {"pool": 10, "timeout": (5, 8), "connect_retries": 1, "get_retries": 0},
+    "revendedores": {"pool": 20, "timeout": (5, 60), "connect_retries": 2, "get_retries": 1},
+    "connection_api": {"pool": 10, "timeout": (5, 60), "connect_retries": 2, "get_retries": 1},
+    "pabilo": {"pool": 10, "timeout": (5, 30), "connect_retries": 2, "get_retries": 0},
+    "binance": {"pool": 5, "timeout": (5, 15), "connect_retries": 1, "get_retries": 1},
+    "game_script": {"pool": 5, "timeout": (5, 25), "connect_retries": 1, "get_retries": 0},
+}
+_HTTP_SESSIONS = {}
+_HTTP_ADAPTERS = {}
+_HTTP_SESSIONS_LOCK = threading.Lock()
+_HTTP_STATS = {}
+
+
+def _http_adapter(provider: str):
+    """Shared transport adapter (connection pool) for `provider`."""
+    with _HTTP_SESSIONS_LOCK:
+        adapter = _HTTP_ADAPTERS.get(provider)
+        if adapter is not None:
+            return adapter
+        cfg = _HTTP_PROVIDERS.get(provider) or _HTTP_PROVIDERS["game_script"]
+        pool = max(int(os.environ.get(f"HTTP_POOL_{provider.upper()}", cfg["pool"]) or cfg["pool"]), 1)
+        retry = _HttpRetry(
+            total=max(cfg["connect_retries"], cfg["get_retries"]),
+            connect=cfg["connect_retries"],
+            read=cfg["get_retries"],
+            status=cfg["get_retries"],
+            other=0,
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            status_forcelist=(502, 503, 504),
+            backoff_factor=0.2,
+            raise_on_status=False,
+        )
+        adapter = _requests_lib.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool, max_retries=retry)
+        _HTTP_ADAPTERS[provider] = adapter
+        _HTTP_STATS.setdefault(provider, {"requests": 0, "errors": 0, "seconds": 0.0})
+        return adapter
+
+
+def _http_mount(sess, provider: str):
+    adapter = _http_adapter(provider)
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+    return sess
+
+
+def _http_session(provider: str):
+    """Process-wide pooled session for `provider` (stateless API calls)."""
+    with _HTTP_SESSIONS_LOCK:
+        sess = _HTTP_SESSIONS.get(provider)
+    if sess is None:
+        sess = _http_mount(_requests_lib.Session(), provider)
+        with _HTTP_SESSIONS_LOCK:
+            sess = _HTTP_SESSIONS.setdefault(provider, sess)
+    return sess
+
+
+def _http_scrape_session(provider: str):
+    """Fresh session (own cookie jar, e.g. for CSRF scrapes) on the provider's
+    shared connection pool. Do not close it: that would drop the shared pool."""
+    return _http_mount(_requests_lib.Session(), provider)
+
+
+def _http_request(provider: str, method: str, url: str, **kwargs):
+    """requests.request() through the pooled session of `provider`."""
+    cfg = _HTTP_PROVIDERS.get(provider) or {}
+    if kwargs.get("timeout") is None and cfg.get("timeout"):
+        kwargs["timeout"] = cfg["timeout"]
+    sess = _http_session(provider)
+    started = time.perf_counter()
+    try:
+        return sess.request(method, url, **kwargs)
+    except Exception:
+        with _HTTP_SESSIONS_LOCK:
+            _HTTP_STATS[provider]["errors"] += 1
+        raise
+    finally:
+        with _HTTP_SESSIONS_LOCK:
+            _HTTP_STATS[provider]["requests"] += 1
+            _HTTP_STATS[provider]["seconds"] += time.perf_counter() - started
+
+
+def _http_pool_stats() -> dict:
+    """Per provider: requests sent vs. TCP connections opened (the rest reused one)."""
+    out = {}
+    with _HTTP_SESSIONS_LOCK:
+        adapters = dict(_HTTP_ADAPTERS)
+        calls = {name: dict(vals) for name, vals in _HTTP_STATS.items()}
+    for provider, adapter in adapters.items():
+        opened = sent = 0
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            try:
+                pool = pools[key]
+            except KeyError:
+                continue
+            opened += int(getattr(pool, "num_connections", 0) or 0)
+            sent += int(getattr(pool, "num_requests", 0) or 0)
+        entry = calls.get(provider, {})
+        entry.update({
+            "connections_opened": opened,
+            "http_requests": sent,
+            "connections_reused": max(sent - opened, 0),
+            "pool_maxsize": adapter._pool_maxsize,
+        })
+        if entry.get("requests"):
+            entry["avg_ms"] = round(entry["seconds"] * 1000.0 / entry["requests"], 1)
+        entry["seconds"] = round(entry.get("seconds", 0.0), 3)
+        out[provider] = entry
+    return out
+
+
 _FFMANIA_TIMEOUT = (
     float(os.environ.get("FFMANIA_CONNECT_TIMEOUT_SECONDS", "2.5")),
     float(os.environ.get("FFMANIA_READ_TIMEOUT_SECONDS", "3.5")),
@@ -189,36 +500,213 @@ _FFMANIA_HEADERS = {
     "Accept-Language": "es-ES,es;q=0.9,en;q=0.8,pt-BR;q=0.7",
     "Cache-Control": "no-cache",
 }
-_FFMANIA_SESSION = _requests_lib.Session()
-try:
-    _ffmania_adapter = _requests_lib.adapters.HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=0)
-    _FFMANIA_SESSION.mount("https://", _ffmania_adapter)
-    _FFMANIA_SESSION.mount("http://", _ffmania_adapter)
-except Exception:
-    pass
+_FFMANIA_SESSION = _http_session("ffmania")
+
+
+def _player_nick_stat(name: str, amount: int = 1) -> None:
+    with _PLAYER_LOOKUP_LOCK:
+        _PLAYER_NICK_STATS[name] = _PLAYER_NICK_STATS.get(name, 0) + amount
 
 
 def _player_cache_get(key: str):
-    try:
+    """Local tier. Returns the cached nick ("" for a cached "not found") or None."""
+    with _PLAYER_LOOKUP_LOCK:
         ent = _PLAYER_SCRAPE_CACHE.get(key)
         if not ent:
             return None
-        exp = float(ent.get("exp") or 0)
-        if exp and time.time() > exp:
+        if time.time() > float(ent.get("exp") or 0):
             _PLAYER_SCRAPE_CACHE.pop(key, None)
             return None
+        _PLAYER_SCRAPE_CACHE.move_to_end(key)
         return ent.get("val")
-    except Exception:
+
+
+def _player_cache_set(key: str, val, ttl_seconds: int = _PLAYER_NICK_CACHE_TTL_SECONDS):
+    if not ttl_seconds or ttl_seconds <= 0:
+        return
+    with _PLAYER_LOOKUP_LOCK:
+        _PLAYER_SCRAPE_CACHE[key] = {"val": val, "exp": time.time() + ttl_seconds}
+        _PLAYER_SCRAPE_CACHE.move_to_end(key)
+        while len(_PLAYER_SCRAPE_CACHE) > _PLAYER_NICK_CACHE_MAX_ENTRIES:
+            _PLAYER_SCRAPE_CACHE.popitem(last=False)
+
+
+def _player_nick_ttl(nick: str) -> int:
+    return _PLAYER_NICK_CACHE_TTL_SECONDS if nick else _PLAYER_NICK_NEGATIVE_TTL_SECONDS
+
+
+def _player_nick_shared_upsert(conn, values: dict, set_: dict, where=None):
+    table = PlayerNickCache.__table__
+    dialect = conn.dialect.name
+    if dialect not in ("postgresql", "sqlite"):
+        raise RuntimeError(f"player_nick_cache: dialecto no soportado ({dialect})")
+    stmt = (pg_insert if dialect == "postgresql" else sqlite_insert)(table).values(**values)
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c.cache_key], set_=set_, where=where)
+    return conn.execute(stmt)
+
+
+def _player_nick_shared_get(key: str):
+    """Shared tier. Returns (nick, seconds_left) for a fresh row, else None."""
+    table = PlayerNickCache.__table__
+    now = datetime.utcnow()
+    try:
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                db.select(table.c.nick, table.c.expires_at)
+                .where(table.c.cache_key == key, table.c.nick.isnot(None), table.c.expires_at > now)
+            ).first()
+    except Exception as exc:
+        _player_nick_stat("shared_errors")
+        print(f"[PlayerNick] Shared cache read error: {exc}")
+        return None
+    if not row:
         return None
+    return row[0], max(int((row[1] - now).total_seconds()), 0)
+
+
+def _player_nick_shared_set(key: str, nick: str, owner: str = "") -> None:
+    """Store a result and release the lease (only if `owner` still holds it)."""
+    table = PlayerNickCache.__table__
+    ttl = _player_nick_ttl(nick)
+    expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+    try:
+        with db.engine.begin() as conn:
+            if ttl > 0:
+                _player_nick_shared_upsert(
+                    conn,
+                    {"cache_key": key, "nick": nick, "expires_at": expires_at, "lease_owner": None, "lease_until": None},
+                    {"nick": nick, "expires_at": expires_at, "lease_owner": None, "lease_until": None},
+                )
+            elif owner:
+                conn.execute(
+                    table.update()
+                    .where(table.c.cache_key == key, table.c.lease_owner == owner)
+                    .values(lease_owner=None, lease_until=None)
+                )
+    except Exception as exc:
+        _player_nick_stat("shared_errors")
+        print(f"[PlayerNick] Shared cache write error: {exc}")
+
+
+def _player_nick_lease_acquire(key: str, owner: str) -> bool:
+    """Claim the right to scrape `key`. True if this process holds the lease.
+
+    The conditional upsert only takes over a row whose lease is free or expired,
+    so a worker that died mid-scrape blocks the others for at most
+    _PLAYER_NICK_LEASE_SECONDS.
+    """
+    table = PlayerNickCache.__table__
+    now = datetime.utcnow()
+    lease_until = now + timedelta(seconds=_PLAYER_NICK_LEASE_SECONDS)
+    try:
+        with db.engine.begin() as conn:
+            _player_nick_shared_upsert(
+                conn,
+                {"cache_key": key, "nick": None, "expires_at": None, "lease_owner": owner, "lease_until": lease_until},
+                {"lease_owner": owner, "lease_until": lease_until},
+                where=db.or_(table.c.lease_until.is_(None), table.c.lease_until < now),
+            )
+            holder = conn.execute(db.select(table.c.lease_owner).where(table.c.cache_key == key)).scalar()
+        return holder == owner
+    except Exception as exc:
+        _player_nick_stat("shared_errors")
+        print(f"[PlayerNick] Lease error: {exc}")
+        return True  # fail open: scrape without coordination
 
 
-def _player_cache_set(key: str, val, ttl_seconds: int = 600):
+def _player_nick_release_lease(key: str, owner: str) -> None:
+    table = PlayerNickCache.__table__
     try:
-        _PLAYER_SCRAPE_CACHE[key] = {"val": val, "exp": time.time() + int(ttl_seconds or 0)}
+        with db.engine.begin() as conn:
+            conn.execute(
+                table.update()
+                .where(table.c.cache_key == key, table.c.lease_owner == owner)
+                .values(lease_owner=None, lease_until=None)
+            )
     except Exception:
         pass
 
 
+def _player_nick_call_upstream(loader) -> str:
+    _player_nick_stat("upstream_calls")
+    try:
+        return (loader() or "").strip()
+    except Exception:
+        _player_nick_stat("upstream_errors")
+        raise
+
+
+def _player_nick_load_shared(key: str, loader, wait_timeout: float = _PLAYER_NICK_LEASE_SECONDS):
+    """Local miss: consult the shared tier, scraping under its lease if needed."""
+    if not _PLAYER_NICK_SHARED_CACHE:
+        nick = _player_nick_call_upstream(loader)
+        _player_cache_set(key, nick, _player_nick_ttl(nick))
+        return nick, False
+
+    hit = _player_nick_shared_get(key)
+    if hit is not None:
+        _player_nick_stat("shared_hits")
+        _player_cache_set(key, hit[0], min(hit[1], _player_nick_ttl(hit[0])))
+        return hit[0], True
+
+    owner = uuid.uuid4().hex
+    if not _player_nick_lease_acquire(key, owner):
+        # Another worker is scraping this ID right now: wait for its answer.
+        deadline = time.monotonic() + wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(_PLAYER_NICK_LEASE_POLL_SECONDS)
+            hit = _player_nick_shared_get(key)
+            if hit is not None:
+                _player_nick_stat("lease_waits")
+                _player_cache_set(key, hit[0], min(hit[1], _player_nick_ttl(hit[0])))
+                return hit[0], True
+        owner = ""  # lease holder is too slow; scrape without it
+
+    try:
+        nick = _player_nick_call_upstream(loader)
+    except Exception:
+        if owner:
+            _player_nick_release_lease(key, owner)
+        raise
+    _player_nick_shared_set(key, nick, owner)
+    _player_cache_set(key, nick, _player_nick_ttl(nick))
+    return nick, False
+
+
+def _player_nick_lookup(key: str, loader):
+    """Cached nick lookup. Returns (nick, cached); nick is "" when the ID was not found.
+
+    Exceptions raised by `loader` propagate and are never cached.
+    """
+    _player_nick_stat("lookups")
+    cached = _player_cache_get(key)
+    if cached is not None:
+        _player_nick_stat("local_hits" if cached else "negative_hits")
+        return cached, True
+    result = _player_lookup_singleflight(
+        key,
+        lambda: _player_nick_load_shared(key, loader),
+        wait_timeout=2 * _PLAYER_NICK_LEASE_SECONDS,
+    )
+    if result is None:
+        raise TimeoutError(f"player lookup {key} timed out")
+    return result
+
+
+def _player_nick_cache_prune() -> int:
+    """Delete expired rows of the shared tier whose lease is not held."""
+    table = PlayerNickCache.__table__
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        res = conn.execute(
+            table.delete().where(
+                db.or_(table.c.expires_at.is_(None), table.c.expires_at < now),
+                db.or_(table.c.lease_until.is_(None), table.c.lease_until < now),
+            )
+        )
+    return int(res.rowcount or 0)
+
+
 def _player_lookup_singleflight(key: str, loader, wait_timeout: float = 6.5):
     created = False
     with _PLAYER_LOOKUP_LOCK:
@@ -238,6 +726,7 @@ def _player_lookup_singleflight(key: str, loader, wait_timeout: float = 6.5):
             state["event"].set()
             with _PLAYER_LOOKUP_LOCK:
                 _PLAYER_LOOKUP_INFLIGHT.pop(key, None)
+    _player_nick_stat("local_waits")
     state["event"].wait(wait_timeout)
     if state.get("error"):
         raise state["error"]
@@ -402,10 +891,26 @@ def _smileone_extract_username(resp_json: dict) -> str:
     return ""
 
 
+_SMILEONE_TRANSIENT_FRAGMENTS = (
+    "network",
+    "conexión de la red",
+    "conexao de rede",
+    "inténtalo de nuevo",
+    "tente novamente",
+    "try again",
+)
+
+
+def _smileone_answer_is_transient(resp_json: dict) -> bool:
+    """True when a checkrole error is Smile.One's "network problem, try again", not a missing ID."""
+    info = str(resp_json.get("info") or "").lower()
+    return any(fragment in info for fragment in _SMILEONE_TRANSIENT_FRAGMENTS)
+
+
 def _scrape_smileone_bloodstrike_nick(role_id: str) -> str:
     """Consulta la API interna de Smile.One Brasil para obtener el nickname de Blood Strike."""
     try:
-        sess = _requests_lib.Session()
+        sess = _http_scrape_session("smileone")
         sess.headers.update({
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
             "Accept-Language": "pt-BR,pt;q=0.9,en;q=0.8",
@@ -414,6 +919,7 @@ def _scrape_smileone_bloodstrike_nick(role_id: str) -> str:
         page_url = "https://www.smile.one/br/merchant/game/bloodstrike?source=other"
         page = sess.get(page_url, timeout=8)
         print(f"[BS] page status={page.status_code} cookies={dict(sess.cookies)}")
+        page.raise_for_status()
         # Extract CSRF token from _csrf cookie (Yii2 PHP serialized format)
         # Cookie value: "...%3Bs%3A32%3A%220ze4k_...%22%7D" -> extract the 32-char token
         csrf = ""
@@ -466,8 +972,10 @@ def _scrape_smileone_bloodstrike_nick(role_id: str) -> str:
             print(f"[BS] {_endpoint} -> {resp.status_code} {resp.text[:150]}")
             if resp.status_code == 200:
                 break
+        # Transport errors and non-200 answers raise, so _player_nick_lookup
+        # does not negative-cache them; "" is only returned for a definite miss.
         if resp.status_code != 200:
-            return ""
+            raise RuntimeError(f"checkrole HTTP {resp.status_code}")
         try:
             data = resp.json()
         except Exception:
@@ -476,7 +984,7 @@ def _scrape_smileone_bloodstrike_nick(role_id: str) -> str:
             if txt.startswith('{"code":'):
                 data = json.loads(txt)
             else:
-                return ""
+                raise RuntimeError("checkrole answered without JSON")
         # Extract username from various possible structures
         username = _smileone_extract_username(data)
         if username:
@@ -485,18 +993,20 @@ def _scrape_smileone_bloodstrike_nick(role_id: str) -> str:
         if int(data.get("code") or 0) != 200:
             # 201 = USER ID não existe, 404 = not found, etc.
             print(f"[BS] API error: {data.get('info', '')}")
+            if _smileone_answer_is_transient(data):
+                raise RuntimeError(f"checkrole: {data.get('info', '')}")
             return ""
         print(f"[BS] JSON completo: {data}")
         return ""
     except Exception as e:
         print(f"[BS] Error: {e}")
-        return ""
+        raise
 
 
 def _scrape_smileone_mobilelegends_nick(role_id: str, zone_id: str) -> str:
     """Consulta la API interna de Smile.One para obtener el nickname de Mobile Legends."""
     try:
-        sess = _requests_lib.Session()
+        sess = _http_scrape_session("smileone")
         sess.headers.update({
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
             "Accept-Language": "pt-BR,pt;q=0.9,en;q=0.8",
@@ -504,6 +1014,7 @@ def _scrape_smileone_mobilelegends_nick(role_id: str, zone_id: str) -> str:
         page_url = "https://www.smile.one/merchant/mobilelegends?source=other"
         page = sess.get(page_url, timeout=8)
         print(f"[ML] page status={page.status_code} cookies={dict(sess.cookies)}")
+        page.raise_for_status()
 
         csrf = ""
         raw_csrf_cookie = sess.cookies.get("_csrf", "")
@@ -550,6 +1061,9 @@ def _scrape_smileone_mobilelegends_nick(role_id: str, zone_id: str) -> str:
             "https://www.smile.one/merchant/checkrole",
         ]
 
+        # Only a checkrole error answer counts as "not found"; if every variant
+        # failed at the HTTP level the lookup raises instead of caching a miss.
+        not_found = False
         for endpoint in endpoints:
             for payload in payload_variants:
                 # Exact payload matching Smile.One's real checkrole form
@@ -589,6 +1103,8 @@ def _scrape_smileone_mobilelegends_nick(role_id: str, zone_id: str) -> str:
                     print(f"[ML] JSON code={code} info={data_json.get('info','')}")
                     # code 200 with username found → already returned above
                     # code != 200 with this payload → try next variant
+                    if not _smileone_answer_is_transient(data_json):
+                        not_found = True
                     continue
 
                 # Some endpoints return the nickname as plain text or in HTML
@@ -597,10 +1113,12 @@ def _scrape_smileone_mobilelegends_nick(role_id: str, zone_id: str) -> str:
 
                 print(f"[ML] non-JSON body len={len(body)}")
 
-        return ""
+        if not_found:
+            return ""
+        raise RuntimeError("checkrole gave no definite answer")
     except Exception as e:
         print(f"[ML] Error: {e}")
-        return ""
+        raise
 
 
 @app.route("/store/player/verify/bloodstrike")
@@ -619,16 +1137,14 @@ def store_player_verify_bloodstrike():
         return jsonify({"ok": False, "error": "Verificación no disponible para este juego"}), 403
 
     cache_key = f"bs_smileone:{uid}"
-    cached = _player_cache_get(cache_key)
-    if cached:
-        return jsonify({"ok": True, "uid": uid, "nick": cached, "cached": True})
-
-    nick = _scrape_smileone_bloodstrike_nick(uid)
+    try:
+        nick, cached = _player_nick_lookup(cache_key, lambda: _scrape_smileone_bloodstrike_nick(uid))
+    except Exception:
+        return jsonify({"ok": False, "error": "No se pudo verificar el ID"}), 502
 
     if not nick:
         return jsonify({"ok": False, "error": "ID no encontrado"}), 404
-    _player_cache_set(cache_key, nick, ttl_seconds=600)
-    return jsonify({"ok": True, "uid": uid, "nick": nick, "cached": False})
+    return jsonify({"ok": True, "uid": uid, "nick": nick, "cached": cached})
 
 
 @app.route("/store/player/verify/mobilelegends")
@@ -650,16 +1166,14 @@ def store_player_verify_mobilelegends():
         return jsonify({"ok": False, "error": "Verificación no disponible para este juego"}), 403
 
     cache_key = f"ml_smileone:{uid}:{zid}"
-    cached = _player_cache_get(cache_key)
-    if cached:
-        return jsonify({"ok": True, "uid": uid, "zid": zid, "nick": cached, "cached": True})
-
-    nick = _scrape_smileone_mobilelegends_nick(uid, zid)
+    try:
+        nick, cached = _player_nick_lookup(cache_key, lambda: _scrape_smileone_mobilelegends_nick(uid, zid))
+    except Exception:
+        return jsonify({"ok": False, "error": "No se pudo verificar el ID"}), 502
 
     if not nick:
         return jsonify({"ok": False, "error": "ID no encontrado"}), 404
-    _player_cache_set(cache_key, nick, ttl_seconds=600)
-    return jsonify({"ok": True, "uid": uid, "zid": zid, "nick": nick, "cached": False})
+    return jsonify({"ok": True, "uid": uid, "zid": zid, "nick": nick, "cached": cached})
 
 
 # ==============================
@@ -668,7 +1182,7 @@ def store_player_verify_mobilelegends():
 def _scrape_smileone_generic(conn, uid: str, zid: str = "") -> str:
     """Generic Smile.One checkrole using a SmileOneConnection config."""
     try:
-        sess = _requests_lib.Session()
+        sess = _http_scrape_session("smileone")
         sess.headers.update({
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
             "Accept-Language": "pt-BR,pt;q=0.9,en;q=0.8",
@@ -676,6 +1190,7 @@ def _scrape_smileone_generic(conn, uid: str, zid: str = "") -> str:
         page_url = conn.page_url
         page = sess.get(page_url, timeout=8)
         print(f"[SO:{conn.name}] page status={page.status_code}")
+        page.raise_for_status()
 
         csrf = ""
         raw_csrf_cookie = sess.cookies.get("_csrf", "")
@@ -751,6 +1266,9 @@ def _scrape_smileone_generic(conn, uid: str, zid: str = "") -> str:
                 seen.add(ep)
                 unique_endpoints.append(ep)
 
+        # Same rule as _scrape_smileone_mobilelegends_nick: "" only after a
+        # checkrole error answer, never because every request failed.
+        not_found = False
         for endpoint in unique_endpoints:
             for payload in payload_variants:
                 post_data = {
@@ -784,10 +1302,14 @@ def _scrape_smileone_generic(conn, uid: str, zid: str = "") -> str:
                     return username
                 code = int(data.get("code") or 0)
                 print(f"[SO:{conn.name}] code={code} info={data.get('info','')}")
-        return ""
+                if not _smileone_answer_is_transient(data):
+                    not_found = True
+        if not_found:
+            return ""
+        raise RuntimeError("checkrole gave no definite answer")
     except Exception as e:
         print(f"[SO:{conn.name}] Error: {e}")
-        return ""
+        raise
 
 
 def _resolve_player_nick(gid_raw, uid, zid=""):
@@ -821,17 +1343,13 @@ def _resolve_player_nick(gid_raw, uid, zid=""):
         if so_conn.requires_zone and (not zid or not zid.isdigit()):
             return {"ok": False, "error": "Zona ID requerida", "requires_zone": True}, 422
         cache_key = f"so_{so_conn.id}:{uid}" + (f":{zid}" if so_conn.requires_zone else "")
-        cached = _player_cache_get(cache_key)
-        if cached:
-            result = {"ok": True, "uid": uid, "nick": cached, "cached": True}
-            if so_conn.requires_zone:
-                result["zid"] = zid
-            return result, 200
-        nick = _scrape_smileone_generic(so_conn, uid, zid)
+        try:
+            nick, cached = _player_nick_lookup(cache_key, lambda: _scrape_smileone_generic(so_conn, uid, zid))
+        except Exception:
+            return {"ok": False, "error": "No se pudo verificar el ID"}, 502
         if not nick:
             return {"ok": False, "error": "ID no encontrado"}, 404
-        _player_cache_set(cache_key, nick, ttl_seconds=600)
-        result = {"ok": True, "uid": uid, "nick": nick, "cached": False}
+        result = {"ok": True, "uid": uid, "nick": nick, "cached": cached}
         if so_conn.requires_zone:
             result["zid"] = zid
         return result, 200
@@ -844,43 +1362,37 @@ def _resolve_player_nick(gid_raw, uid, zid=""):
     # Free Fire (freefiremania.com.br)
     if active_login_game_id and active_login_game_id == str(gid):
         cache_key = f"ffmania:{uid}"
-        cached = _player_cache_get(cache_key)
-        if cached:
-            return {"ok": True, "uid": uid, "nick": cached, "cached": True}, 200
         try:
-            nick = _player_lookup_singleflight(cache_key, lambda: _scrape_ffmania_nick(uid))
+            nick, cached = _player_nick_lookup(cache_key, lambda: _scrape_ffmania_nick(uid))
         except Exception:
             return {"ok": False, "error": "No se pudo verificar el ID"}, 502
         if not nick:
             return {"ok": False, "error": "ID no encontrado"}, 404
-        _player_cache_set(cache_key, nick, ttl_seconds=600)
-        return {"ok": True, "uid": uid, "nick": nick, "cached": False}, 200
+        return {"ok": True, "uid": uid, "nick": nick, "cached": cached}, 200
 
     # Blood Strike (Smile.One)
     if bs_package_id and bs_package_id == str(gid):
         cache_key = f"bs_smileone:{uid}"
-        cached = _player_cache_get(cache_key)
-        if cached:
-            return {"ok": True, "uid": uid, "nick": cached, "cached": True}, 200
-        nick = _scrape_smileone_bloodstrike_nick(uid)
+        try:
+            nick, cached = _player_nick_lookup(cache_key, lambda: _scrape_smileone_bloodstrike_nick(uid))
+        except Exception:
+            return {"ok": False, "error": "No se pudo verificar el ID"}, 502
         if not nick:
             return {"ok": False, "error": "ID no encontrado"}, 404
-        _player_cache_set(cache_key, nick, ttl_seconds=600)
-        return {"ok": True, "uid": uid, "nick": nick, "cached": False}, 200
+        return {"ok": True, "uid": uid, "nick": nick, "cached": cached}, 200
 
     # Mobile Legends (Smile.One, requires zone)
     if ml_package_id and ml_package_id == str(gid):
         if not zid or not zid.isdigit():
             return {"ok": False, "error": "Zona ID requerida", "requires_zone": True}, 422
         cache_key = f"ml_smileone:{uid}:{zid}"
-        cached = _player_cache_get(cache_key)
-        if cached:
-            return {"ok": True, "uid": uid, "nick": cached, "zid": zid, "cached": True}, 200
-        nick = _scrape_smileone_mobilelegends_nick(uid, zid)
+        try:
+            nick, cached = _player_nick_lookup(cache_key, lambda: _scrape_smileone_mobilelegends_nick(uid, zid))
+        except Exception:
+            return {"ok": False, "error": "No se pudo verificar el ID"}, 502
         if not nick:
             return {"ok": False, "error": "ID no encontrado"}, 404
-        _player_cache_set(cache_key, nick, ttl_seconds=600)
-        return {"ok": True, "uid": uid, "nick": nick, "zid": zid, "cached": False}, 200
+        return {"ok": True, "uid": uid, "nick": nick, "zid": zid, "cached": cached}, 200
 
     return {"ok": False, "error": "Verificacion no disponible para este juego"}, 403
 
@@ -924,19 +1436,14 @@ def store_player_verify_smileone():
         return jsonify({"ok": False, "error": "Zona ID inválida"}), 400
 
     cache_key = f"so_{conn.id}:{uid}" + (f":{zid}" if conn.requires_zone else "")
-    cached = _player_cache_get(cache_key)
-    if cached:
-        result = {"ok": True, "uid": uid, "nick": cached, "cached": True}
-        if conn.requires_zone:
-            result["zid"] = zid
-        return jsonify(result)
-
-    nick = _scrape_smileone_generic(conn, uid, zid)
+    try:
+        nick, cached = _player_nick_lookup(cache_key, lambda: _scrape_smileone_generic(conn, uid, zid))
+    except Exception:
+        return jsonify({"ok": False, "error": "No se pudo verificar el ID"}), 502
 
     if not nick:
         return jsonify({"ok": False, "error": "ID no encontrado"}), 404
-    _player_cache_set(cache_key, nick, ttl_seconds=600)
-    result = {"ok": True, "uid": uid, "nick": nick, "cached": False}
+    result = {"ok": True, "uid": uid, "nick": nick, "cached": cached}
     if conn.requires_zone:
         result["zid"] = zid
     return jsonify(result)
@@ -964,19 +1471,14 @@ def store_player_verify():
         return jsonify({"ok": False, "error": "Juego no encontrado"}), 404
 
     cache_key = f"ffmania:{uid}"
-    cached = _player_cache_get(cache_key)
-    if cached:
-        return jsonify({"ok": True, "uid": uid, "nick": cached, "cached": True})
-
     try:
-        nick = _player_lookup_singleflight(cache_key, lambda: _scrape_ffmania_nick(uid))
+        nick, cached = _player_nick_lookup(cache_key, lambda: _scrape_ffmania_nick(uid))
     except Exception:
         return jsonify({"ok": False, "error": "No se pudo verificar el ID"}), 502
 
     if not nick:
         return jsonify({"ok": False, "error": "ID no encontrado"}), 404
-    _player_cache_set(cache_key, nick, ttl_seconds=600)
-    return jsonify({"ok": True, "uid": uid, "nick": nick, "cached": False})
+    return jsonify({"ok": True, "uid": uid, "nick": nick, "cached": cached})
 
 # ==============================
 # Serve uploaded files (runtime uploads)
@@ -1018,12 +1520,67 @@ def favicon():
         mimetype="image/x-icon",
     )
 
+
+# Keyset pagination cursors for the admin listings ordered by
+# (created_at DESC, id DESC): "<created_at iso>_<id>" of the boundary row.
+def _keyset_cursor(row) -> str:
+    return f"{row.created_at.isoformat() if row.created_at else ''}_{row.id}"
+
+
+def _keyset_parse_cursor(raw: str):
+    try:
+        created_raw, id_raw = (raw or "").strip().rsplit("_", 1)
+        return datetime.fromisoformat(created_raw), int(id_raw)
+    except Exception:
+        return None
+
+
+# Secondary indexes on orders, by name -> columns. Declared on the model for
+# create_all and re-applied to existing databases by _ensure_order_indexes().
+_ORDER_MANAGED_INDEXES = (
+    # Duplicate reference / voucher checks (create_order, Pabilo, auto-approve)
+    ("ix_orders_reference_norm_status", ("reference_norm", "status")),
+    ("ix_orders_capture_reference_norm_status", ("capture_reference_norm", "status")),
+    ("ix_orders_capture_sha256_status", ("capture_sha256", "status")),
+    # /webhook-ubii: match key + normalized method among pending/approved orders
+    ("ix_orders_ref_match_key_method_status", ("reference_match_key", "method_norm", "status")),
+    # RevAutoVerify / Pabilo loops and _aggregate_and_cleanup_orders
+    ("ix_orders_status_created_at", ("status", "created_at")),
+    # Binance loop: method='binance' AND status='pending'
+    ("ix_orders_method_status", ("method", "status")),
+    # /store/recent-recharges: item_id IN (...) AND status IN (...)
+    ("ix_orders_item_id_status", ("item_id", "status")),
+    # Best sellers / popular sort: GROUP BY store_package_id over successful statuses
+    ("ix_orders_status_store_package_id", ("status", "store_package_id")),
+    # /orders/my and the per-buyer purge in create_order
+    ("ix_orders_email_created_at", ("email", "created_at")),
+    ("ix_orders_user_id_created_at", ("user_id", "created_at")),
+    ("ix_orders_customer_id_created_at", ("customer_id", "created_at")),
+    # /admin/orders keyset pagination (created_at DESC, id DESC)
+    ("ix_orders_created_at_id", ("created_at", "id")),
+    # Affiliate code uses (_special_code_uses_map): GROUP BY special_user_id
+    ("ix_orders_special_user_id_status", ("special_user_id", "status")),
+)
+# Superseded by a managed index above; dropped by _ensure_order_indexes().
+_ORDER_RETIRED_INDEXES = ("ix_orders_created_at",)
+# Postgres only: trigram GIN indexes so the /admin/orders search
+# (lower(col) LIKE '%q%' on reference / player id / capture reference) is an
+# index lookup instead of a full scan. Needs the pg_trgm extension.
+_ORDER_SEARCH_TRGM_INDEXES = (
+    ("ix_orders_reference_trgm", "reference"),
+    ("ix_orders_customer_id_trgm", "customer_id"),
+    ("ix_orders_capture_reference_trgm", "capture_reference"),
+)
+
+
 # Models
 class Order(db.Model):
     __tablename__ = "orders"
     id = db.Column(db.Integer, primary_key=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    status = db.Column(db.String(20), default="pending")  # pending, approved, rejected
+    # active_history: the sales-counter flush hook needs the previous status even
+    # when the attribute was expired by an earlier commit.
+    status = db.column_property(db.Column(db.String(20), default="pending"), active_history=True)  # pending, approved, rejected
     # associations
     store_package_id = db.Column(db.Integer, nullable=False)
     item_id = db.Column(db.Integer, nullable=True)
@@ -1043,6 +1600,15 @@ class Order(db.Model):
     amount = db.Column(db.Float, default=0.0)
     reference = db.Column(db.String(120), default="")
     capture_reference = db.Column(db.String(120), default="")
+    # Normalized copies of reference/capture_reference (see
+    # _normalize_order_reference_for_match), kept in sync by attribute events so
+    # duplicate-reference checks are a single indexed lookup.
+    reference_norm = db.Column(db.String(120), default="")
+    capture_reference_norm = db.Column(db.String(120), default="")
+    # Ubii match key (_ubii_reference_match_key: last 4 digits of a numeric
+    # reference) and _pabilo_normalize_method(method), synced the same way.
+    reference_match_key = db.Column(db.String(120), default="")
+    method_norm = db.Column(db.String(20), default="pm")
     price = db.Column(db.Float, default=0.0)
     active = db.Column(db.Boolean, default=True)
     # Gift card or delivery code (for gift category)
@@ -1065,6 +1631,8 @@ class Order(db.Model):
     automation_json = db.Column(db.Text, default="")
     # Payment capture (voucher/comprobante image path relative to UPLOAD_FOLDER)
     payment_capture = db.Column(db.String(500), default="")
+    # SHA-256 of the capture file, computed once while saving it (_save_capture)
+    capture_sha256 = db.Column(db.String(64), default="")
     payer_dni_type = db.Column(db.String(2), default="")
     payer_dni_number = db.Column(db.String(20), default="")
     payer_bank_origin = db.Column(db.String(20), default="")
@@ -1075,6 +1643,7 @@ class Order(db.Model):
     payment_verified_at = db.Column(db.DateTime, nullable=True)
     payment_verification_attempts = db.Column(db.Integer, default=0)
     payment_last_verification_at = db.Column(db.DateTime, nullable=True)
+    __table_args__ = tuple(db.Index(index_name, *index_cols) for index_name, index_cols in _ORDER_MANAGED_INDEXES)
 
 
 class OrderSummary(db.Model):
@@ -1096,35 +1665,249 @@ class OrderSummary(db.Model):
     )
 
 
+class PackageSalesCounter(db.Model):
+    """Ventas exitosas acumuladas por paquete (órdenes vivas + archivadas en OrderSummary).
+
+    Se mantiene de forma incremental desde el flush de la sesión para que
+    /store/best_sellers y ?sort=popular no tengan que agrupar toda la tabla orders.
+    """
+    __tablename__ = "package_sales_counters"
+    store_package_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    sales_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 _ORDER_CLEANUP_DAYS = int(os.environ.get("ORDER_CLEANUP_DAYS", "7"))
 _ORDER_CLEANUP_INTERVAL_HOURS = float(os.environ.get("ORDER_CLEANUP_INTERVAL_HOURS", "6"))
+# Orders archived per transaction by _aggregate_and_cleanup_orders.
+_ORDER_CLEANUP_CHUNK_SIZE = max(int(os.environ.get("ORDER_CLEANUP_CHUNK_SIZE", "500") or 500), 1)
 
 
-def _calculate_profit_components_for_order(order: 'Order', items_by_id: dict[int, 'GamePackageItem']) -> tuple[float, float]:
-    # Un canje de código de regalo no cobra nada. Sin esto el fallback legacy
-    # (`order.price or it.price`) le contaría el precio de venta como ingreso
-    # y la ganancia saldría inflada por cada código redimido.
-    if str(getattr(order, "method", "") or "").strip().lower() == "gift":
-        return 0.0, 0.0
-    use_affiliate = False
+_SALES_COUNTER_STATUSES = ("approved", "delivered")
+
+
+def _package_sales_write(counts: dict, *, increment: bool, session=None) -> None:
+    """Upsert package_sales_counters rows. increment=True adds the values to the
+    stored counts (ON CONFLICT ... sales_count + excluded); otherwise they replace them."""
+    session = session or db.session
+    now = datetime.utcnow()
+    rows = [
+        {"store_package_id": int(package_id), "sales_count": int(count), "updated_at": now}
+        for package_id, count in (counts or {}).items()
+        if package_id is not None and (count or not increment)
+    ]
+    if not rows:
+        return
+    table = PackageSalesCounter.__table__
+    try:
+        dialect = (session.get_bind(mapper=PackageSalesCounter.__mapper__).dialect.name or "").lower()
+    except Exception:
+        dialect = ""
+
+    if dialect in ("postgresql", "sqlite"):
+        stmt = (pg_insert if dialect == "postgresql" else sqlite_insert)(table).values(rows)
+        new_count = (table.c.sales_count + stmt.excluded.sales_count) if increment else stmt.excluded.sales_count
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.store_package_id],
+            set_={"sales_count": new_count, "updated_at": stmt.excluded.updated_at},
+        )
+        session.execute(stmt)
+        return
+
+    # Fallback for other dialects.
+    for row_data in rows:
+        current = session.execute(
+            db.select(table.c.sales_count).where(table.c.store_package_id == row_data["store_package_id"])
+        ).scalar()
+        if current is None:
+            session.execute(table.insert().values(**row_data))
+        else:
+            value = current + row_data["sales_count"] if increment else row_data["sales_count"]
+            session.execute(
+                table.update()
+                .where(table.c.store_package_id == row_data["store_package_id"])
+                .values(sales_count=value, updated_at=now)
+            )
+
+
+def _package_sales_adjust(deltas: dict, session=None) -> None:
+    _package_sales_write({k: v for k, v in (deltas or {}).items() if v}, increment=True, session=session)
+
+
+@db.event.listens_for(db.session, "before_flush")
+def _package_sales_counter_before_flush(session, flush_context, instances):
+    """Turn Order inserts/deletes/status changes in this flush into counter deltas.
+
+    The upsert runs inside the same transaction as the order write, so the counter
+    commits or rolls back together with it. Bulk query.update() calls bypass this
+    hook and must adjust the counters themselves (see _try_transition_order_to_approved).
+    """
+    deltas = {}
+
+    def _bump(package_id, status, amount):
+        if package_id is not None and (status or "").lower() in _SALES_COUNTER_STATUSES:
+            deltas[int(package_id)] = deltas.get(int(package_id), 0) + amount
+
+    for obj in session.new:
+        if isinstance(obj, Order):
+            _bump(obj.store_package_id, obj.status, 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Order):
+            status_hist = db.inspect(obj).attrs.status.history
+            package_hist = db.inspect(obj).attrs.store_package_id.history
+            old_status = status_hist.deleted[0] if status_hist.deleted else obj.status
+            old_package = package_hist.deleted[0] if package_hist.deleted else obj.store_package_id
+            _bump(old_package, old_status, -1)
+
+    for obj in session.dirty:
+        if not isinstance(obj, Order):
+            continue
+        status_hist = db.inspect(obj).attrs.status.history
+        package_hist = db.inspect(obj).attrs.store_package_id.history
+        if not status_hist.has_changes() and not package_hist.has_changes():
+            continue
+        old_status = status_hist.deleted[0] if status_hist.deleted else obj.status
+        old_package = package_hist.deleted[0] if package_hist.deleted else obj.store_package_id
+        _bump(old_package, old_status, -1)
+        _bump(obj.store_package_id, obj.status, 1)
+
+    if any(deltas.values()):
+        _package_sales_adjust(deltas, session=session)
+
+
+def _package_sales_expected_counts() -> dict:
+    """Recompute successful sales per package from scratch (live orders + OrderSummary)."""
+    sales_by_package = {}
+    live_counts = (
+        db.session.query(Order.store_package_id, db.func.count(Order.id))
+        .filter(Order.status.in_(_SALES_COUNTER_STATUSES))
+        .group_by(Order.store_package_id)
+        .all()
+    )
+    archived_counts = (
+        db.session.query(
+            OrderSummary.store_package_id,
+            db.func.coalesce(db.func.sum(OrderSummary.order_count), 0),
+        )
+        .filter(OrderSummary.status.in_(_SALES_COUNTER_STATUSES))
+        .group_by(OrderSummary.store_package_id)
+        .all()
+    )
+    for package_id, count in list(live_counts) + list(archived_counts):
+        if package_id is None:
+            continue
+        sales_by_package[int(package_id)] = sales_by_package.get(int(package_id), 0) + int(count or 0)
+    return sales_by_package
+
+
+def _reconcile_package_sales_counters(*, apply: bool = True) -> dict:
+    """Compare package_sales_counters against a full recount and report drift.
+
+    With apply=True the stored counters are rewritten to the recomputed values.
+    On Postgres the counter table is locked for the duration so concurrent
+    increments wait for the rewrite instead of being lost or double counted.
+    """
+    from sqlalchemy import text
+    try:
+        if apply and db.engine.dialect.name == "postgresql":
+            db.session.execute(text("LOCK TABLE package_sales_counters IN EXCLUSIVE MODE"))
+        expected = _package_sales_expected_counts()
+        stored = {
+            int(package_id): int(count or 0)
+            for package_id, count in db.session.query(
+                PackageSalesCounter.store_package_id, PackageSalesCounter.sales_count
+            ).all()
+        }
+        drift = []
+        for package_id in sorted(set(expected) | set(stored)):
+            want = expected.get(package_id, 0)
+            have = stored.get(package_id, 0)
+            if want != have:
+                drift.append({"store_package_id": package_id, "expected": want, "stored": have, "diff": have - want})
+        if apply and drift:
+            _package_sales_write({d["store_package_id"]: d["expected"] for d in drift}, increment=False)
+        db.session.commit()
+        return {
+            "ok": True,
+            "packages": len(expected),
+            "total_sales": sum(expected.values()),
+            "drift": drift,
+            "applied": bool(apply and drift),
+        }
+    except Exception as exc:
+        try:
+            db.session.rollback()
+        except Exception:
+            pass
+        print(f"[SalesCounters] Reconcile error: {exc}")
+        return {"ok": False, "error": str(exc), "drift": []}
+
+
+def _ensure_package_sales_counters_seeded() -> None:
+    """First run after the table is created: fill it from a full recount."""
+    try:
+        if PackageSalesCounter.query.first() is not None:
+            return
+        report = _reconcile_package_sales_counters(apply=True)
+        if report.get("applied"):
+            print(f"[Migration] Seeded package_sales_counters for {report.get('packages', 0)} packages")
+    except Exception as exc:
+        try:
+            db.session.rollback()
+        except Exception:
+            pass
+        print(f"[Migration] package_sales_counters seed error: {exc}")
+
+
+def _package_sales_ranking(limit: int = None) -> list:
+    """[(store_package_id, sales_count), ...] best sellers first, ties by package id."""
+    q = (
+        db.session.query(PackageSalesCounter.store_package_id, PackageSalesCounter.sales_count)
+        .filter(PackageSalesCounter.sales_count > 0)
+        .order_by(PackageSalesCounter.sales_count.desc(), PackageSalesCounter.store_package_id.asc())
+    )
+    if limit:
+        q = q.limit(limit)
+    return [(int(package_id), int(count or 0)) for package_id, count in q.all()]
+
+
+_STATS_SUCCESS_STATUSES = ("approved", "delivered")
+_STATS_STREAM_BATCH_SIZE = 1000
+
+
+def _stats_special_user_lookup() -> tuple[dict, dict]:
+    """Load every SpecialUser once: (by id, active by lower(code))."""
+    by_id = {}
+    active_by_code = {}
+    for su in SpecialUser.query.order_by(SpecialUser.id.asc()).all():
+        by_id[su.id] = su
+        code = (su.code or "").strip().lower()
+        if code and su.active:
+            active_by_code.setdefault(code, su)
+    return by_id, active_by_code
+
+
+def _stats_resolve_affiliate(order, special_users: tuple[dict, dict]):
+    """Return (special user, applies) for an order, without touching the DB."""
+    by_id, active_by_code = special_users
     su = None
     if order.special_user_id:
-        su = SpecialUser.query.get(order.special_user_id)
+        su = by_id.get(order.special_user_id)
     if (not su) and (order.special_code or ""):
-        su = SpecialUser.query.filter(
-            db.func.lower(SpecialUser.code) == (order.special_code or "").lower(),
-            SpecialUser.active == True,
-        ).first()
-    if su and su.active:
-        scope_ok = True
-        sc = (su.scope or "all")
-        if sc == "package":
-            try:
-                scope_ok = (su.scope_package_id == order.store_package_id)
-            except Exception:
-                scope_ok = False
-        use_affiliate = scope_ok
+        su = active_by_code.get((order.special_code or "").lower())
+    if not (su and su.active):
+        return su, False
+    if (su.scope or "all") == "package":
+        try:
+            return su, (su.scope_package_id == order.store_package_id)
+        except Exception:
+            return su, False
+    return su, True
 
+
+def _stats_order_item_totals(order, items_by_id: dict) -> dict:
+    """Per-item {qty, revenue, cost_total} for an order, from items_json or the legacy item_id."""
     items_map = {}
     try:
         if (order.items_json or "").strip():
@@ -1138,7 +1921,11 @@ def _calculate_profit_components_for_order(order: 'Order', items_by_id: dict[int
                     if iid <= 0:
                         continue
                     q = max(int(ent.get("qty") or 1), 1)
-                    p = float(ent.get("price") or 0.0)
+                    try:
+                        p = float(ent.get("price") or 0.0)
+                    except Exception:
+                        p = 0.0
+                    # Usar costo guardado en la orden, o costo actual si no existe
                     it = items_by_id.get(iid)
                     cost_unit = float(ent.get("cost_unit_usd") or (it.profit_net_usd if it else 0.0) or 0.0)
                     cur = items_map.get(iid) or {"qty": 0, "revenue": 0.0, "cost_total": 0.0}
@@ -1150,44 +1937,121 @@ def _calculate_profit_components_for_order(order: 'Order', items_by_id: dict[int
         items_map = {}
 
     if not items_map and order.item_id:
+        # Legacy: single item orders without items_json
         try:
             iid = int(order.item_id)
-            if iid > 0:
-                it = items_by_id.get(iid)
-                if it:
-                    cur = items_map.get(iid) or {"qty": 0, "revenue": 0.0, "cost_total": 0.0}
-                    cur["qty"] += 1
-                    cur["revenue"] += float(order.price or it.price or 0.0)
-                    cur["cost_total"] += float(it.profit_net_usd or 0.0)
-                    items_map[iid] = cur
+            it = items_by_id.get(iid) if iid > 0 else None
+            if it:
+                items_map[iid] = {
+                    "qty": 1,
+                    "revenue": float(order.price or it.price or 0.0),
+                    "cost_total": float(it.profit_net_usd or 0.0),
+                }
         except Exception:
             pass
+    return items_map
+
 
+def _stats_order_item_profits(order, items_by_id: dict, special_users: tuple[dict, dict]):
+    """Yield one profit record per item of an order that has a known cost."""
+    # Un canje de código de regalo no cobra nada. Sin esto el fallback legacy
+    # (`order.price or it.price`) le contaría el precio de venta como ingreso
+    # y la ganancia saldría inflada por cada código redimido.
+    if str(getattr(order, "method", "") or "").strip().lower() == "gift":
+        return
+    su, use_affiliate = _stats_resolve_affiliate(order, special_users)
     comm_pct = float(su.commission_percent or 0.0) if use_affiliate and su else 0.0
-    profit_total = 0.0
-    commission_total = 0.0
-    for iid, agg in items_map.items():
-        it = items_by_id.get(iid)
-        if not it:
+    for iid, agg in _stats_order_item_totals(order, items_by_id).items():
+        if iid not in items_by_id:
             continue
         qty = int(agg.get("qty") or 0)
         revenue = float(agg.get("revenue") or 0.0)
         cost_total = float(agg.get("cost_total") or 0.0)
         if qty <= 0 or cost_total <= 0.0:
             continue
+        commission_item = 0.0
         if use_affiliate and comm_pct > 0:
             commission_item = round(revenue * (comm_pct / 100.0), 2)
-            commission_total += commission_item
-            profit_val = revenue - cost_total - commission_item
-        else:
-            profit_val = revenue - cost_total
-        if profit_val < 0.0:
-            profit_val = 0.0
-        profit_total += profit_val
+        profit_val = max(revenue - cost_total - commission_item, 0.0)
+        yield {
+            "item_id": iid,
+            "qty": qty,
+            "revenue": revenue,
+            "use_affiliate": use_affiliate,
+            "commission": commission_item,
+            "profit": profit_val,
+        }
+
+
+def _stats_stream_successful_orders(*filters):
+    """Stream approved/delivered, non-gift orders matching filters, one id-ordered query."""
+    return (
+        db.session.query(
+            Order.id,
+            Order.created_at,
+            Order.method,
+            Order.store_package_id,
+            Order.item_id,
+            Order.price,
+            Order.items_json,
+            Order.special_user_id,
+            Order.special_code,
+        )
+        .filter(
+            Order.status.in_(_STATS_SUCCESS_STATUSES),
+            db.func.coalesce(Order.method, "") != "gift",
+            *filters,
+        )
+        .order_by(Order.id.asc())
+        .yield_per(_STATS_STREAM_BATCH_SIZE)
+    )
+
+
+def _stats_profit_records(*filters, items_by_id: dict | None = None):
+    """Yield per-item profit records over every successful order matching filters.
+
+    Three queries total regardless of order count: items, special users and one
+    streamed orders scan. Shared by the summary, package and snapshot stats.
+    """
+    if items_by_id is None:
+        items_by_id = {it.id: it for it in GamePackageItem.query.all()}
+    special_users = _stats_special_user_lookup()
+    for order in _stats_stream_successful_orders(*filters):
+        try:
+            for record in _stats_order_item_profits(order, items_by_id, special_users):
+                yield record
+        except Exception:
+            continue
+
+
+def _stats_profit_totals(*filters, items_by_id: dict | None = None) -> tuple[float, float]:
+    profit = 0.0
+    commission = 0.0
+    for record in _stats_profit_records(*filters, items_by_id=items_by_id):
+        profit += record["profit"]
+        commission += record["commission"]
+    return profit, commission
+
+
+def _calculate_profit_components_for_order(order: 'Order', items_by_id: dict[int, 'GamePackageItem'], special_users: tuple[dict, dict] | None = None) -> tuple[float, float]:
+    if special_users is None:
+        special_users = _stats_special_user_lookup()
+    profit_total = 0.0
+    commission_total = 0.0
+    for record in _stats_order_item_profits(order, items_by_id, special_users):
+        profit_total += record["profit"]
+        commission_total += record["commission"]
     return profit_total, commission_total
 
 
-def _snapshot_closed_periods_from_orders(orders: list['Order']) -> None:
+def _snapshot_closed_periods_from_orders(orders, *, items_by_id=None, special_users=None, run_totals=None) -> None:
+    """Write a ProfitSnapshot for every closed stats period these orders fall in.
+
+    Periods that already had a snapshot are left alone. To feed the orders in
+    chunks, pass the same run_totals dict for every chunk: a snapshot created
+    by an earlier chunk keeps accumulating instead of being skipped. Commit
+    only after the last chunk, or a partial snapshot would be final.
+    """
     successful_orders = [o for o in orders if o.status in ("approved", "delivered") and o.created_at]
     if not successful_orders:
         return
@@ -1203,164 +2067,534 @@ def _snapshot_closed_periods_from_orders(orders: list['Order']) -> None:
     if not periods:
         return
 
-    items_by_id = {it.id: it for it in GamePackageItem.query.all()}
+    if items_by_id is None:
+        items_by_id = {it.id: it for it in GamePackageItem.query.all()}
+    if special_users is None:
+        special_users = _stats_special_user_lookup()
+    if run_totals is None:
+        run_totals = {}
     for (period_start, period_end), period_orders in periods.items():
-        existing = ProfitSnapshot.query.filter_by(period_start=period_start, period_end=period_end).first()
-        if existing:
+        key = (period_start, period_end)
+        if key not in run_totals:
+            existing = ProfitSnapshot.query.filter_by(period_start=period_start, period_end=period_end).first()
+            run_totals[key] = None if existing else {
+                "row": ProfitSnapshot(period_start=period_start, period_end=period_end),
+                "profit": 0.0,
+                "commission": 0.0,
+            }
+        totals = run_totals[key]
+        if totals is None:
             continue
-        profit = 0.0
-        commission = 0.0
         for order in period_orders:
             try:
-                order_profit, order_commission = _calculate_profit_components_for_order(order, items_by_id)
-                profit += order_profit
-                commission += order_commission
+                order_profit, order_commission = _calculate_profit_components_for_order(order, items_by_id, special_users)
+                totals["profit"] += order_profit
+                totals["commission"] += order_commission
             except Exception:
                 continue
-        db.session.add(ProfitSnapshot(
-            period_start=period_start,
-            period_end=period_end,
-            profit_usd=round(profit, 2),
-            commission_usd=round(commission, 2),
-        ))
+        snapshot = totals["row"]
+        snapshot.profit_usd = round(totals["profit"], 2)
+        snapshot.commission_usd = round(totals["commission"], 2)
+        db.session.add(snapshot)
+
+
+def _order_summary_upsert(rows: list[dict]) -> None:
+    """Add aggregated counts/amounts into OrderSummary, one statement per chunk.
+
+    Keys with a NULL item_id/method never hit uq_order_summary (NULLs are
+    distinct in a unique constraint), so those few rows keep the lookup path.
+    """
+    table = OrderSummary.__table__
+    dialect = (db.session.get_bind(mapper=OrderSummary.__mapper__).dialect.name or "").lower()
+    key_cols = ("period", "store_package_id", "item_id", "status", "method", "currency")
+    bulk = [r for r in rows if r["item_id"] is not None and r["method"] is not None]
+    if bulk and dialect in ("postgresql", "sqlite"):
+        stmt = (pg_insert if dialect == "postgresql" else sqlite_insert)(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c[c] for c in key_cols],
+            set_={
+                "order_count": table.c.order_count + stmt.excluded.order_count,
+                "total_amount": table.c.total_amount + stmt.excluded.total_amount,
+                "total_price_usd": table.c.total_price_usd + stmt.excluded.total_price_usd,
+            },
+        )
+        db.session.execute(stmt, bulk)
+        rows = [r for r in rows if r["item_id"] is None or r["method"] is None]
+    for data in rows:
+        row = OrderSummary.query.filter_by(**{c: data[c] for c in key_cols}).first()
+        if row:
+            row.order_count += data["order_count"]
+            row.total_amount += data["total_amount"]
+            row.total_price_usd += data["total_price_usd"]
+        else:
+            db.session.add(OrderSummary(**data))
 
 
 def _aggregate_and_cleanup_orders():
     """Aggregate old terminal-state orders into OrderSummary, then delete them.
-    Keeps ALL pending orders and recent orders (< ORDER_CLEANUP_DAYS days)."""
+    Keeps ALL pending orders and recent orders (< ORDER_CLEANUP_DAYS days).
+
+    Walks the old orders in id order, _ORDER_CLEANUP_CHUNK_SIZE at a time, and
+    commits each chunk on its own so a backlog after downtime never holds one
+    huge transaction or loads every row at once. The ProfitSnapshots of closed
+    periods are written by a first read-only pass and committed before any
+    order is deleted: a run that dies between chunks leaves complete snapshots
+    (which later runs skip) rather than partial ones. Package names/item
+    titles are prefetched once; capture files are removed by a background job
+    after the chunk commits."""
+    started = time.perf_counter()
+    count = 0
+    chunks = 0
     try:
         cutoff = datetime.utcnow() - timedelta(days=_ORDER_CLEANUP_DAYS)
         terminal = ("approved", "rejected", "delivered")
-        old_orders = Order.query.filter(
-            Order.status.in_(terminal),
-            Order.created_at < cutoff,
-        ).all()
+        package_names = dict(db.session.query(StorePackage.id, StorePackage.name).all())
+        items_by_id = {it.id: it for it in GamePackageItem.query.all()}
+        special_users = _stats_special_user_lookup()
+        columns = (
+            Order.id,
+            Order.created_at,
+            Order.status,
+            Order.method,
+            Order.currency,
+            Order.store_package_id,
+            Order.item_id,
+            Order.amount,
+            Order.price,
+            Order.items_json,
+            Order.special_user_id,
+            Order.special_code,
+            Order.payment_capture,
+        )
 
-        if not old_orders:
-            return 0
+        def next_chunk(statuses, after_id):
+            return (
+                db.session.query(*columns)
+                .filter(Order.status.in_(statuses), Order.created_at < cutoff, Order.id > after_id)
+                .order_by(Order.id.asc())
+                .limit(_ORDER_CLEANUP_CHUNK_SIZE)
+                .all()
+            )
 
-        _snapshot_closed_periods_from_orders(old_orders)
+        snapshot_totals = {}
+        last_id = 0
+        while True:
+            chunk = next_chunk(("approved", "delivered"), last_id)
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+            _snapshot_closed_periods_from_orders(
+                chunk, items_by_id=items_by_id, special_users=special_users, run_totals=snapshot_totals,
+            )
+        db.session.commit()
 
-        # Aggregate into OrderSummary
-        agg = {}
-        for o in old_orders:
-            period = o.created_at.strftime("%Y-%m-%d") if o.created_at else "unknown"
-            pkg = StorePackage.query.get(o.store_package_id)
-            it = GamePackageItem.query.get(o.item_id) if o.item_id else None
-            key = (period, o.store_package_id, o.item_id, o.status, o.method, o.currency or "USD")
-            if key not in agg:
-                agg[key] = {
-                    "period": period,
-                    "store_package_id": o.store_package_id,
-                    "item_id": o.item_id,
-                    "package_name": pkg.name if pkg else "",
-                    "item_title": it.title if it else "",
-                    "status": o.status,
-                    "method": o.method,
-                    "currency": o.currency or "USD",
-                    "order_count": 0,
-                    "total_amount": 0.0,
-                    "total_price_usd": 0.0,
-                }
-            agg[key]["order_count"] += 1
-            agg[key]["total_amount"] += float(o.amount or 0)
-            agg[key]["total_price_usd"] += float(o.price or 0)
-
-        for key, data in agg.items():
-            row = OrderSummary.query.filter_by(
-                period=data["period"],
-                store_package_id=data["store_package_id"],
-                item_id=data["item_id"],
-                status=data["status"],
-                method=data["method"],
-                currency=data["currency"],
-            ).first()
-            if row:
-                row.order_count += data["order_count"]
-                row.total_amount += data["total_amount"]
-                row.total_price_usd += data["total_price_usd"]
-            else:
-                db.session.add(OrderSummary(**data))
+        last_id = 0
+        while True:
+            chunk = next_chunk(terminal, last_id)
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+
+            agg = {}
+            for o in chunk:
+                period = o.created_at.strftime("%Y-%m-%d") if o.created_at else "unknown"
+                key = (period, o.store_package_id, o.item_id, o.status, o.method, o.currency or "USD")
+                if key not in agg:
+                    it = items_by_id.get(o.item_id) if o.item_id else None
+                    agg[key] = {
+                        "period": period,
+                        "store_package_id": o.store_package_id,
+                        "item_id": o.item_id,
+                        "package_name": package_names.get(o.store_package_id) or "",
+                        "item_title": it.title if it else "",
+                        "status": o.status,
+                        "method": o.method,
+                        "currency": o.currency or "USD",
+                        "order_count": 0,
+                        "total_amount": 0.0,
+                        "total_price_usd": 0.0,
+                    }
+                agg[key]["order_count"] += 1
+                agg[key]["total_amount"] += float(o.amount or 0)
+                agg[key]["total_price_usd"] += float(o.price or 0)
+            _order_summary_upsert(list(agg.values()))
+
+            # Core DELETE skips the before_flush sales-counter hook on purpose:
+            # archived sales move into OrderSummary, so the counters stay as they are.
+            orders_table = Order.__table__
+            db.session.execute(
+                orders_table.delete().where(
+                    orders_table.c.id.in_([o.id for o in chunk]),
+                    orders_table.c.status.in_(terminal),
+                )
+            )
+            db.session.commit()
+            count += len(chunk)
+            chunks += 1
 
-        count = len(old_orders)
-        for o in old_orders:
-            _delete_capture(o.payment_capture)
-            db.session.delete(o)
+            captures = [o.payment_capture for o in chunk if o.payment_capture]
+            if captures and not enqueue_job("delete_captures", {"paths": captures}):
+                for path in captures:
+                    _delete_capture(path)
 
-        db.session.commit()
+        if count:
+            elapsed = time.perf_counter() - started
+            print(
+                f"[OrderCleanup] Archivadas {count} órdenes antiguas (>{_ORDER_CLEANUP_DAYS} días) "
+                f"en {chunks} lotes, {elapsed:.1f}s ({count / max(elapsed, 1e-6):.0f} filas/s)"
+            )
         return count
     except Exception as exc:
         try:
             db.session.rollback()
         except Exception:
             pass
-        print(f"[OrderCleanup] Error: {exc}")
+        print(f"[OrderCleanup] Error tras archivar {count} órdenes: {exc}")
         return -1
 
 
-# Distinct Postgres advisory-lock keys, one per background loop below.
-_LOCK_ORDER_CLEANUP = 911001
-_LOCK_BINANCE_VERIFY = 911002
-_LOCK_REV_VERIFY = 911003
-_LOCK_PABILO_VERIFY = 911004
-_SINGLETON_LOCK_CONNS = {}
+# ==============================
+# Background job queue
+# ==============================
+# Durable `background_jobs` table shared by every process. Web requests only
+# enqueue rows; consumers claim them (FOR UPDATE SKIP LOCKED on Postgres, a
+# conditional UPDATE on SQLite), run the registered handler and either finish
+# the row or reschedule it with exponential backoff. A consumer that dies
+# mid-job leaves its lease to expire and another one picks the row up again.
+# Periodic work (cleanup, Binance/Revendedores/Pabilo scans) lives in one row
+# per kind keyed by dedupe_key that reschedules itself after each run, so only
+# one consumer across all processes runs each scan at a time; the scans fan
+# out one job per order instead of walking the orders serially.
+#   JOB_QUEUE_MODE=inline (default): each web process also runs
+#       JOB_QUEUE_INLINE_CONSUMERS consumer threads (single-service deploys).
+#   JOB_QUEUE_MODE=worker: web processes only enqueue; run
+#       `python worker.py --consumers N` as a separate service.
+# Slow kinds registered with consumers=N (capture_ocr) are left to N threads
+# of their own in every consuming process, so a burst of them cannot hold up
+# order verification, dispatch and mail on the shared consumers.
+_JOB_QUEUE_MODE = (os.environ.get("JOB_QUEUE_MODE") or "inline").strip().lower()
+_JOB_QUEUE_INLINE_CONSUMERS = max(int(os.environ.get("JOB_QUEUE_INLINE_CONSUMERS", "2") or 2), 0)
+_JOB_POLL_SECONDS = max(float(os.environ.get("JOB_POLL_SECONDS", "1.0") or 1.0), 0.05)
+_JOB_LEASE_SECONDS = 600
+_JOB_DEFAULT_MAX_ATTEMPTS = 5
+_JOB_BACKOFF_BASE_SECONDS = 15
+_JOB_BACKOFF_MAX_SECONDS = 1800
+_JOB_RETENTION_DAYS = 7
+_JOB_HANDLERS = {}
+_JOB_WAKE = threading.Event()
+_JOB_STATS = {
+    "enqueued": 0,
+    "deduped": 0,
+    "claimed": 0,
+    "succeeded": 0,
+    "retried": 0,
+    "deferred": 0,
+    "dead": 0,
+    "enqueue_errors": 0,
+}
+_JOB_STATS_LOCK = threading.Lock()
+
+
+class BackgroundJob(db.Model):
+    __tablename__ = "background_jobs"
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    payload_json = db.Column(db.Text, nullable=False, default="{}")
+    status = db.Column(db.String(16), nullable=False, default="queued")  # queued | running | done | dead
+    # Unique while the job is live (cleared when it finishes), so the same
+    # order is never queued twice; periodic rows keep "periodic:<kind>".
+    dedupe_key = db.Column(db.String(160), nullable=True, unique=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=_JOB_DEFAULT_MAX_ATTEMPTS)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(64), nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    __table_args__ = (
+        db.Index("ix_background_jobs_status_run_at", "status", "run_at"),
+    )
+
+
+def _job_stat(name: str, n: int = 1) -> None:
+    with _JOB_STATS_LOCK:
+        _JOB_STATS[name] = _JOB_STATS.get(name, 0) + n
+
 
+class JobDeferred(Exception):
+    """Raised by a handler that cannot run yet: requeue in delay_seconds without using an attempt."""
 
-def _acquire_singleton_lock(lock_key: int) -> bool:
-    """Claim exclusive ownership of a background loop across gunicorn workers.
+    def __init__(self, delay_seconds: float, reason: str = ""):
+        super().__init__(reason or f"deferred {delay_seconds:.0f}s")
+        self.delay_seconds = max(float(delay_seconds or 0), 0.0)
 
-    Each worker process runs its own copy of these daemon threads; without this,
-    two workers would both poll/verify/dispatch the same pending orders at once,
-    double-charging Revendedores or stomping each other's automation state. The
-    Postgres advisory lock is held on a dedicated connection for the process
-    lifetime, so if the holder dies (worker restart), Postgres auto-releases it
-    and another worker's thread picks it up on its next retry.
-    Under SQLite (single-process dev) there is nothing to arbitrate.
+
+def job_handler(kind: str, *, max_attempts: int = _JOB_DEFAULT_MAX_ATTEMPTS, interval_seconds=None, consumers=None):
+    """Register fn(payload) as the handler for `kind` jobs.
+
+    With interval_seconds the kind is periodic: _ensure_periodic_jobs keeps one
+    row for it and the row is rescheduled after every run, success or not.
+    With consumers the shared consumers never claim the kind; each consuming
+    process runs that many threads dedicated to it instead.
+    A handler signals failure by raising; the job is retried with backoff
+    until max_attempts. Raising JobDeferred requeues it without an attempt.
     """
-    if lock_key in _SINGLETON_LOCK_CONNS:
-        return True
+    def decorator(fn):
+        _JOB_HANDLERS[kind] = {
+            "fn": fn,
+            "max_attempts": max(int(max_attempts), 1),
+            "interval": interval_seconds,
+            "consumers": max(int(consumers), 1) if consumers else 0,
+        }
+        return fn
+    return decorator
+
+
+def _job_dedicated_kinds() -> list:
+    return [kind for kind, spec in _JOB_HANDLERS.items() if spec.get("consumers")]
+
+
+def enqueue_job(kind: str, payload=None, *, delay_seconds: float = 0, dedupe_key=None, max_attempts=None) -> bool:
+    """Insert a job row on its own connection (independent of db.session).
+
+    With dedupe_key, a job already queued/running under that key wins and this
+    call is a no-op. Returns False only if the row could not be written.
+    """
+    spec = _JOB_HANDLERS.get(kind) or {}
+    table = BackgroundJob.__table__
+    now = datetime.utcnow()
+    values = {
+        "kind": kind,
+        "payload_json": json.dumps(payload or {}, ensure_ascii=False),
+        "status": "queued",
+        "dedupe_key": dedupe_key,
+        "attempts": 0,
+        "max_attempts": int(max_attempts or spec.get("max_attempts") or _JOB_DEFAULT_MAX_ATTEMPTS),
+        "run_at": now + timedelta(seconds=max(float(delay_seconds or 0), 0)),
+        "created_at": now,
+    }
     try:
-        from sqlalchemy import text
-        with app.app_context():
-            if db.engine.dialect.name != "postgresql":
-                return True
-            conn = db.engine.connect()
-            got = conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": lock_key}).scalar()
-        # conn is a raw checked-out Connection independent of the app context /
-        # Flask-SQLAlchemy scoped session — it stays open (and the lock held)
-        # after the `with` block above exits.
-        if got:
-            _SINGLETON_LOCK_CONNS[lock_key] = conn
+        with db.engine.begin() as conn:
+            if dedupe_key:
+                dialect = conn.dialect.name
+                if dialect not in ("postgresql", "sqlite"):
+                    raise RuntimeError(f"background_jobs: dialecto no soportado ({dialect})")
+                stmt = (pg_insert if dialect == "postgresql" else sqlite_insert)(table).values(**values)
+                result = conn.execute(stmt.on_conflict_do_nothing(index_elements=[table.c.dedupe_key]))
+            else:
+                result = conn.execute(table.insert().values(**values))
+        if dedupe_key and not result.rowcount:
+            _job_stat("deduped")
             return True
-        conn.close()
-        return False
+        _job_stat("enqueued")
+        _JOB_WAKE.set()
+        return True
     except Exception as exc:
-        print(f"[SingletonLock] Error acquiring lock {lock_key}: {exc}")
-        return True  # fail open — better a rare duplicate run than none at all
+        _job_stat("enqueue_errors")
+        print(f"[JobQueue] Enqueue error ({kind}): {exc}")
+        return False
 
 
-def _order_cleanup_loop():
-    """Background thread: periodically clean up old orders."""
-    import time as _t
-    _t.sleep(60)  # Wait for app startup
-    while not _acquire_singleton_lock(_LOCK_ORDER_CLEANUP):
-        _t.sleep(30)
-    while True:
+def _ensure_periodic_jobs() -> None:
+    for kind, spec in _JOB_HANDLERS.items():
+        if spec.get("interval"):
+            enqueue_job(kind, dedupe_key=f"periodic:{kind}", max_attempts=1)
+
+
+def _job_claim(worker_id: str, kind=None):
+    """Lease the next runnable job for worker_id. Returns a row or None.
+
+    Runnable = queued and due, or running with an expired lease (its consumer
+    died). attempts is bumped on claim, so a job that keeps killing its worker
+    still runs out of attempts. With `kind` only that kind is claimed;
+    without it, every kind except those with dedicated consumers.
+    """
+    table = BackgroundJob.__table__
+    now = datetime.utcnow()
+    ready = db.or_(
+        db.and_(table.c.status == "queued", table.c.run_at <= now),
+        db.and_(table.c.status == "running", table.c.locked_until < now),
+    )
+    dedicated = _job_dedicated_kinds()
+    if kind:
+        ready = db.and_(ready, table.c.kind == kind)
+    elif dedicated:
+        ready = db.and_(ready, table.c.kind.notin_(dedicated))
+    lease = {
+        "status": "running",
+        "locked_by": worker_id,
+        "locked_until": now + timedelta(seconds=_JOB_LEASE_SECONDS),
+        "attempts": table.c.attempts + 1,
+    }
+    columns = (table.c.id, table.c.kind, table.c.payload_json, table.c.attempts, table.c.max_attempts, table.c.dedupe_key)
+    order = (table.c.run_at, table.c.id)
+    with db.engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            candidate = (
+                db.select(table.c.id).where(ready).order_by(*order).limit(1)
+                .with_for_update(skip_locked=True).scalar_subquery()
+            )
+            return conn.execute(table.update().where(table.c.id == candidate).values(**lease).returning(*columns)).first()
+        # SQLite: the write lock serialises claimers; the conditional UPDATE
+        # loses cleanly if another consumer took the row first.
+        for job_id in conn.execute(db.select(table.c.id).where(ready).order_by(*order).limit(5)).scalars().all():
+            if conn.execute(table.update().where(table.c.id == job_id, ready).values(**lease)).rowcount:
+                return conn.execute(db.select(*columns).where(table.c.id == job_id)).first()
+    return None
+
+
+def _job_backoff_seconds(attempts: int) -> float:
+    import random
+    delay = min(_JOB_BACKOFF_BASE_SECONDS * (2 ** max(attempts - 1, 0)), _JOB_BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _job_finish(job, worker_id: str, error=None, defer_seconds=None) -> None:
+    table = BackgroundJob.__table__
+    now = datetime.utcnow()
+    spec = _JOB_HANDLERS.get(job.kind) or {}
+    values = {"locked_by": None, "locked_until": None, "last_error": (error or None) and error[:2000]}
+    if spec.get("interval") and (job.dedupe_key or "").startswith("periodic:"):
+        values.update(status="queued", attempts=0, run_at=now + timedelta(seconds=spec["interval"]))
+    elif defer_seconds is not None:
+        # Hand back the attempt taken by _job_claim
+        values.update(status="queued", attempts=max(job.attempts - 1, 0), run_at=now + timedelta(seconds=defer_seconds))
+    elif error is None:
+        values.update(status="done", dedupe_key=None, finished_at=now)
+    elif job.attempts < job.max_attempts:
+        values.update(status="queued", run_at=now + timedelta(seconds=_job_backoff_seconds(job.attempts)))
+    else:
+        values.update(status="dead", dedupe_key=None, finished_at=now)
+    with db.engine.begin() as conn:
+        # Only the lease holder may finish the row: if the lease expired and
+        # another consumer re-claimed it, that consumer owns the outcome.
+        conn.execute(table.update().where(table.c.id == job.id, table.c.locked_by == worker_id).values(**values))
+    if defer_seconds is not None:
+        _job_stat("deferred")
+    elif error is None:
+        _job_stat("succeeded")
+    elif values["status"] == "dead":
+        _job_stat("dead")
+        print(f"[JobQueue] Job #{job.id} ({job.kind}) agotó {job.attempts} intentos: {error}")
+    elif values["status"] == "queued" and not spec.get("interval"):
+        _job_stat("retried")
+
+
+def _job_run_one(worker_id: str, kind=None) -> bool:
+    """Claim and run one job. Returns False when nothing was runnable."""
+    with app.app_context():
+        job = _job_claim(worker_id, kind)
+        if job is None:
+            return False
+        _job_stat("claimed")
+        spec = _JOB_HANDLERS.get(job.kind)
+        error = None
+        defer_seconds = None
+        if spec is None:
+            error = f"Tipo de job desconocido: {job.kind}"
+        elif job.attempts > job.max_attempts:
+            error = "Lease expirado tras el último intento"
+        else:
+            try:
+                spec["fn"](json.loads(job.payload_json or "{}"))
+            except JobDeferred as exc:
+                error = str(exc)
+                defer_seconds = exc.delay_seconds
+            except Exception as exc:
+                try:
+                    db.session.rollback()
+                except Exception:
+                    pass
+                error = f"{type(exc).__name__}: {exc}"
         try:
-            with app.app_context():
-                db.create_all()
-                n = _aggregate_and_cleanup_orders()
-                if n and n > 0:
-                    print(f"[OrderCleanup] Eliminadas {n} órdenes antiguas (>{_ORDER_CLEANUP_DAYS} días)")
-                elif n == 0:
-                    pass  # Nothing to clean
+            _job_finish(job, worker_id, error, defer_seconds)
+        except Exception as exc:
+            print(f"[JobQueue] Finish error job #{job.id}: {exc}")
+        return True
+
+
+def _job_consumer_loop(worker_id: str, stop_event, kind=None) -> None:
+    while not stop_event.is_set():
+        try:
+            ran = _job_run_one(worker_id, kind)
         except Exception as exc:
-            print(f"[OrderCleanup] Thread error: {exc}")
-        _t.sleep(_ORDER_CLEANUP_INTERVAL_HOURS * 3600)
+            print(f"[JobQueue] Consumer {worker_id} error: {exc}")
+            ran = False
+        if not ran:
+            _JOB_WAKE.wait(_JOB_POLL_SECONDS)
+            _JOB_WAKE.clear()
+
+
+def _start_job_consumers(n: int, stop_event=None) -> list:
+    """Start n shared consumer threads in this process, plus the dedicated ones, and return them."""
+    stop_event = stop_event or threading.Event()
+    prefix = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    n = max(int(n), 0)
+    slots = [(f"{prefix}-{i}", None, f"job-consumer-{i}") for i in range(n)]
+    if n:
+        for kind in _job_dedicated_kinds():
+            slots += [
+                (f"{prefix}-{kind}-{i}", kind, f"job-consumer-{kind}-{i}")
+                for i in range(_JOB_HANDLERS[kind]["consumers"])
+            ]
+    threads = []
+    for worker_id, kind, name in slots:
+        t = threading.Thread(
+            target=_job_consumer_loop,
+            args=(worker_id, stop_event, kind),
+            daemon=True,
+            name=name,
+        )
+        t.start()
+        threads.append(t)
+    return threads
+
+
+def _job_prune() -> int:
+    """Delete finished jobs older than _JOB_RETENTION_DAYS."""
+    table = BackgroundJob.__table__
+    cutoff = datetime.utcnow() - timedelta(days=_JOB_RETENTION_DAYS)
+    with db.engine.begin() as conn:
+        return conn.execute(
+            table.delete().where(table.c.status.in_(("done", "dead")), table.c.finished_at < cutoff)
+        ).rowcount or 0
+
 
+@job_handler("aggregate_orders", max_attempts=1, interval_seconds=_ORDER_CLEANUP_INTERVAL_HOURS * 3600)
+def _job_aggregate_orders(payload):
+    """Periodic: archive old orders, prune caches/jobs/progress events and reconcile sales counters."""
+    _aggregate_and_cleanup_orders()
+    try:
+        _player_nick_cache_prune()
+    except Exception as exc:
+        print(f"[PlayerNick] Prune error: {exc}")
+    try:
+        _job_prune()
+    except Exception as exc:
+        print(f"[JobQueue] Prune error: {exc}")
+    try:
+        _order_events_prune()
+    except Exception as exc:
+        print(f"[OrderEvents] Prune error: {exc}")
+    try:
+        _capture_ocr_prune()
+    except Exception as exc:
+        print(f"[CaptureOCR] Prune error: {exc}")
+    try:
+        _mail_send_log_prune()
+    except Exception as exc:
+        print(f"[Mail] Prune error: {exc}")
+    report = _reconcile_package_sales_counters(apply=True)
+    if report.get("drift"):
+        print(f"[SalesCounters] Drift corregido en {len(report['drift'])} paquetes: {report['drift'][:10]}")
 
-_cleanup_thread = threading.Thread(target=_order_cleanup_loop, daemon=True)
-_cleanup_thread.start()
+
+@job_handler("delete_captures", max_attempts=3)
+def _job_delete_captures(payload):
+    """Remove the capture files of a chunk of archived orders."""
+    for path in payload.get("paths") or []:
+        _delete_capture(path)
 
 
 # ==============================
@@ -1374,6 +2608,20 @@ _BINANCE_API_ENDPOINTS = [
     "https://api4.binance.com",
     "https://api.binance.com",
 ]
+# Optional override (e.g. a local stub server) tried before the public hosts.
+BINANCE_API_BASE_URL = os.environ.get("BINANCE_API_BASE_URL", "").strip().rstrip("/")
+if BINANCE_API_BASE_URL:
+    _BINANCE_API_ENDPOINTS.insert(0, BINANCE_API_BASE_URL)
+_BINANCE_PAGE_LIMIT = 100
+_BINANCE_MAX_PAGES = max(int(os.environ.get("BINANCE_MAX_PAGES_PER_CYCLE", "50") or 50), 1)
+# Re-read this much before the newest transaction already seen, in case Binance
+# indexes a payment a little after its transactionTime.
+_BINANCE_RECONCILE_OVERLAP_MS = 2 * 60 * 1000
+_BINANCE_ORDER_LOOKBACK = timedelta(minutes=5)
+# Config row holding the newest transactionTime seen and when that cycle
+# started, so the next cycle (in whichever process claims the job) only pulls
+# new rows. Rewritten every cycle, so it stays out of the config snapshot.
+BINANCE_RECONCILE_CURSOR_KEY = "binance_reconcile_cursor"
 
 
 def _binance_create_signature(query_string: str) -> str:
@@ -1384,7 +2632,7 @@ def _binance_create_signature(query_string: str) -> str:
     ).hexdigest()
 
 
-def _binance_get_pay_transactions(start_time_ms: int, limit: int = 100):
+def _binance_get_pay_transactions(start_time_ms: int, limit: int = 100, end_time_ms: int | None = None):
     """Fetch Binance Pay transactions starting from start_time_ms (epoch ms).
 
     Returns a list of transaction dicts, or None on error.
@@ -1399,6 +2647,8 @@ def _binance_get_pay_transactions(start_time_ms: int, limit: int = 100):
         "limit": limit,
         "timestamp": timestamp_ms,
     }
+    if end_time_ms is not None:
+        params["endTime"] = end_time_ms
     query_string = "&".join(f"{k}={v}" for k, v in params.items())
     signature = _binance_create_signature(query_string)
     full_query = f"{query_string}&signature={signature}"
@@ -1406,7 +2656,9 @@ def _binance_get_pay_transactions(start_time_ms: int, limit: int = 100):
     path = "/sapi/v1/pay/transactions"
     for base_url in _BINANCE_API_ENDPOINTS:
         try:
-            resp = _requests_lib.get(
+            resp = _http_request(
+                "binance",
+                "GET",
                 f"{base_url}{path}?{full_query}",
                 headers=headers,
                 proxies=proxies,
@@ -1421,57 +2673,202 @@ def _binance_get_pay_transactions(start_time_ms: int, limit: int = 100):
     return None
 
 
-def _binance_verify_payment(order_reference: str, expected_usdt: float, since_ms: int):
-    """Return True if a Binance Pay transaction matches the reference and amount.
+def _binance_tx_time_ms(tx) -> int:
+    try:
+        return int(tx.get("transactionTime") or tx.get("createTime") or 0)
+    except Exception:
+        return 0
+
+
+def _binance_tx_key(tx) -> str:
+    tx_id = tx.get("transactionId") or tx.get("orderId") or tx.get("id")
+    if tx_id:
+        return str(tx_id)
+    return f"{_binance_tx_time_ms(tx)}:{tx.get('orderMemo') or tx.get('remark') or tx.get('note') or ''}:{tx.get('amount') or ''}"
+
 
-    Looks for order_reference string inside the transaction's beneficiary note
-    (orderMemo / remark / note fields) AND verifies exact USDT amount (±0.01).
+def _binance_fetch_transaction_window(start_time_ms: int):
+    """Fetch every transaction since start_time_ms, paging backwards through endTime.
+
+    Binance returns at most `limit` rows per call (newest first), so a full page
+    means there may be older rows left in the window. Returns None on API error.
     """
-    txs = _binance_get_pay_transactions(start_time_ms=since_ms)
-    if txs is None:
-        return None  # API error — caller decides whether to retry
-    if not txs:
-        return False
-    ref_upper = str(order_reference).upper().strip()
-    for tx in txs:
-        # Extract note written by payer
-        tx_note = (
-            tx.get("orderMemo")
-            or tx.get("remark")
-            or tx.get("note")
-            or ""
-        )
-        tx_note_upper = str(tx_note).upper().strip()
-        if not tx_note_upper:
+    collected = {}
+    end_time_ms = None
+    for _page in range(_BINANCE_MAX_PAGES):
+        page = _binance_get_pay_transactions(start_time_ms, limit=_BINANCE_PAGE_LIMIT, end_time_ms=end_time_ms)
+        if page is None:
+            # A partial window would advance last_tx_ms past rows never seen.
+            return None
+        for tx in page:
+            collected[_binance_tx_key(tx)] = tx
+        if len(page) < _BINANCE_PAGE_LIMIT:
+            break
+        oldest_ms = min((_binance_tx_time_ms(tx) for tx in page), default=0)
+        if oldest_ms <= start_time_ms:
+            break
+        # endTime is inclusive: keep the boundary millisecond so rows sharing it
+        # are not skipped, unless the whole page sat on that same millisecond.
+        end_time_ms = oldest_ms if oldest_ms != end_time_ms else oldest_ms - 1
+    return list(collected.values())
+
+
+def _binance_tx_usdt_amount(tx):
+    """Return the USDT amount of a transaction, or None if it is in another currency."""
+    tx_currency = ""
+    funds = tx.get("fundsDetail") or []
+    if isinstance(funds, list) and funds:
+        tx_currency = str(funds[0].get("currency") or "").upper()
+    if not tx_currency:
+        tx_currency = str(tx.get("transactedCurrency") or tx.get("currency") or "").upper()
+    if tx_currency and tx_currency != "USDT":
+        return None
+    tx_amount = 0.0
+    if isinstance(funds, list) and funds:
+        try:
+            tx_amount = float(funds[0].get("amount") or 0)
+        except Exception:
+            pass
+    if tx_amount == 0.0:
+        try:
+            tx_amount = float(tx.get("transactedAmount") or tx.get("amount") or 0)
+        except Exception:
+            pass
+    return tx_amount
+
+
+def _binance_index_transactions_by_memo(txs):
+    """Index transactions by their upper-cased note and by each alphanumeric token in it.
+
+    The payer usually writes just the order code, but may add text around it;
+    the token index covers that without a substring scan per order.
+    """
+    by_memo = {}
+    for tx in txs:
+        tx_note = str(tx.get("orderMemo") or tx.get("remark") or tx.get("note") or "").upper().strip()
+        if not tx_note:
             continue
-        if ref_upper not in tx_note_upper:
+        keys = {tx_note}
+        keys.update(token for token in re.split(r"[^A-Z0-9]+", tx_note) if token)
+        for key in keys:
+            by_memo.setdefault(key, []).append((tx_note, tx))
+    return by_memo
+
+
+def _binance_match_order(order_reference: str, expected_usdt: float, since_ms: int, by_memo: dict, all_notes: list) -> bool:
+    """True if an indexed transaction carries the reference with the exact USDT amount (±0.01)."""
+    ref_upper = str(order_reference).upper().strip()
+    if not ref_upper:
+        return False
+    candidates = by_memo.get(ref_upper)
+    if candidates is None:
+        # Reference glued to other text (e.g. "PAGOABC123"): fall back to substring.
+        candidates = [(note, tx) for note, tx in all_notes if ref_upper in note]
+    for _note, tx in candidates:
+        if _binance_tx_time_ms(tx) and _binance_tx_time_ms(tx) < since_ms:
             continue
-        # Verify currency is USDT
-        tx_currency = ""
-        funds = tx.get("fundsDetail") or []
-        if isinstance(funds, list) and funds:
-            tx_currency = str(funds[0].get("currency") or "").upper()
-        if not tx_currency:
-            tx_currency = str(tx.get("transactedCurrency") or tx.get("currency") or "").upper()
-        if tx_currency and tx_currency != "USDT":
+        tx_amount = _binance_tx_usdt_amount(tx)
+        if tx_amount is None:
             continue
-        # Verify amount
-        tx_amount = 0.0
-        if isinstance(funds, list) and funds:
-            try:
-                tx_amount = float(funds[0].get("amount") or 0)
-            except Exception:
-                pass
-        if tx_amount == 0.0:
-            try:
-                tx_amount = float(tx.get("transactedAmount") or tx.get("amount") or 0)
-            except Exception:
-                pass
         if abs(tx_amount - expected_usdt) <= 0.01:
             return True
     return False
 
 
+def _binance_reconcile_cursor_load() -> dict:
+    try:
+        cursor = json.loads(get_config_value(BINANCE_RECONCILE_CURSOR_KEY, "") or "{}")
+    except Exception:
+        cursor = {}
+    if not isinstance(cursor, dict):
+        cursor = {}
+    return cursor
+
+
+def _binance_reconcile_pending_orders() -> dict:
+    """One reconciliation pass: fetch the transaction window once and match all pending orders.
+
+    The window starts at the oldest pending order's created_at (minus the usual
+    5-minute lookback). The newest transactionTime seen and the pending orders
+    already checked against it are saved in the config table, so the next pass,
+    in whichever process runs it, only requests rows after that point, reaching
+    back further just for orders it has not checked yet.
+    """
+    stats = {"pending": 0, "matched": 0, "approved": 0, "fetched": 0, "api_error": False}
+    candidates = []
+    for order in Order.query.filter_by(method="binance", status="pending").order_by(Order.created_at.asc()).all():
+        try:
+            if not order.reference or not order.created_at:
+                continue
+            if float(order.amount or 0.0) <= 0:
+                continue
+            if not _order_has_auto_recharges(order):
+                continue
+        except Exception as exc:
+            print(f"[BinanceAuto] Error processing order #{order.id}: {exc}")
+            continue
+        candidates.append(order)
+    stats["pending"] = len(candidates)
+    cursor = _binance_reconcile_cursor_load()
+    if not candidates:
+        if cursor:
+            set_config_values({BINANCE_RECONCILE_CURSOR_KEY: ""})
+        return stats
+
+    def created_ms(order):
+        return int((order.created_at - _BINANCE_ORDER_LOOKBACK).timestamp() * 1000)
+
+    window_start_ms = created_ms(candidates[0])
+    fetch_from_ms = window_start_ms
+    last_tx_ms = int(cursor.get("last_tx_ms") or 0)
+    if last_tx_ms:
+        # Orders not checked by the last pass may have been paid before its
+        # cursor, so the window reaches back to the oldest of them.
+        checked_ids = set(cursor.get("order_ids") or [])
+        unchecked = [o for o in candidates if o.id not in checked_ids]
+        resume_ms = last_tx_ms - _BINANCE_RECONCILE_OVERLAP_MS
+        if unchecked:
+            resume_ms = min(resume_ms, created_ms(unchecked[0]))
+        fetch_from_ms = max(window_start_ms, resume_ms)
+    fetched = _binance_fetch_transaction_window(fetch_from_ms)
+    if fetched is None:
+        stats["api_error"] = True
+        return stats
+    stats["fetched"] = len(fetched)
+    if fetched:
+        last_tx_ms = max(last_tx_ms, max(_binance_tx_time_ms(tx) for tx in fetched))
+
+    candidate_ids = [o.id for o in candidates]
+    by_memo = _binance_index_transactions_by_memo(fetched)
+    all_notes = [entry for entries in by_memo.values() for entry in entries]
+    failed_ids = set()
+    for order_id, order in zip(candidate_ids, candidates):
+        try:
+            if not _binance_match_order(order.reference, float(order.amount or 0.0), created_ms(order), by_memo, all_notes):
+                continue
+            stats["matched"] += 1
+            # Re-read from DB to avoid race with manual admin approval
+            db.session.refresh(order)
+            if (order.status or "").lower() != "pending":
+                print(f"[BinanceAuto] Order #{order.id} no longer pending (status={order.status}). Skipping.")
+                continue
+            print(f"[BinanceAuto] Payment verified for order #{order.id}. Auto-approving.")
+            _binance_auto_approve(order)
+            stats["approved"] += 1
+        except Exception as exc:
+            # Left out of the cursor so the next pass fetches its payment again.
+            failed_ids.add(order_id)
+            print(f"[BinanceAuto] Error processing order #{order_id}: {exc}")
+    try:
+        set_config_values({BINANCE_RECONCILE_CURSOR_KEY: json.dumps({
+            "last_tx_ms": last_tx_ms,
+            "order_ids": [order_id for order_id in candidate_ids if order_id not in failed_ids],
+        })})
+    except Exception as exc:
+        print(f"[BinanceAuto] Could not save reconcile cursor: {exc}")
+    return stats
+
+
 def _try_transition_order_to_approved(order_obj) -> bool:
     """Atomically flip a pending order to 'approved'.
 
@@ -1486,9 +2883,14 @@ def _try_transition_order_to_approved(order_obj) -> bool:
         Order.id == order_obj.id,
         Order.status == "pending",
     ).update({"status": "approved"}, synchronize_session=False)
+    if updated:
+        # Bulk UPDATE skips the flush hook; count the sale in the same transaction.
+        _package_sales_adjust({order_obj.store_package_id: 1})
     db.session.commit()
     if updated:
-        order_obj.status = "approved"
+        set_committed_value(order_obj, "status", "approved")
+        _orders_my_invalidate(order_obj.email, order_obj.user_id)
+        _order_progress_publish(order_obj.id)
     else:
         db.session.refresh(order_obj)
     return bool(updated)
@@ -1527,10 +2929,7 @@ def _auto_approve_order(order, *, source_label: str = "AutoApprove", binance_aut
                 brand = _email_brand()
                 html, text = build_order_approved_email(order, pkg, it)
                 subject = _email_subject_for_order(order, pkg, brand)
-                try:
-                    send_email_html(order.email, subject, html, text)
-                except Exception:
-                    send_email_async(order.email, subject, text)
+                send_email_html_async(order.email, subject, html, text)
         except Exception:
             pass
 
@@ -1564,6 +2963,8 @@ def _auto_reject_order(order, *, reason: str = "", source_label: str = "AutoReje
             db.session.refresh(order)
             return False
         order.status = "rejected"
+        _orders_my_invalidate(order.email, order.user_id)
+        _order_progress_publish(order.id)
     except Exception as exc:
         try:
             db.session.rollback()
@@ -1598,10 +2999,7 @@ def _auto_reject_order(order, *, reason: str = "", source_label: str = "AutoReje
             brand = _email_brand()
             html, text = build_order_rejected_email(order, pkg, it, reason=reason)
             subject = f"Orden #{order.id} rechazada - {brand}"
-            try:
-                send_email_html(order.email, subject, html, text)
-            except Exception:
-                send_email_async(order.email, subject, text)
+            send_email_html_async(order.email, subject, html, text)
     except Exception:
         pass
     print(f"[{source_label}] Order #{order.id} auto-rejected: {reason}")
@@ -1612,7 +3010,7 @@ def _binance_auto_approve(order):
     """Approve a Binance-paid order and trigger Revendedores automation.
 
     Mirrors the approval logic of admin_orders_set_status but is called from
-    the background thread after Binance API payment confirmation.
+    the Binance scan job after API payment confirmation.
     ONLY triggers for orders where the item has auto_enabled=True in the mapping.
     """
     if _is_reference_already_used(order.reference, exclude_order_id=order.id):
@@ -1621,67 +3019,20 @@ def _binance_auto_approve(order):
     _auto_approve_order(order, source_label="BinanceAuto", binance_auto=True)
 
 
-def _binance_order_verification_loop():
-    """Background thread: poll Binance Pay API every 30 s for pending Binance orders.
+@job_handler("binance_verify_scan", max_attempts=1, interval_seconds=30)
+def _job_binance_verify_scan(payload):
+    """Periodic (30 s): poll Binance Pay for pending Binance orders.
 
-    For each pending Binance order whose item has auto_enabled=True in
-    RevendedoresItemMapping, verify payment via Binance API. On confirmation,
-    auto-approve and dispatch via Revendedores.
+    Each run is one _binance_reconcile_pending_orders pass: a single paged
+    fetch of the transaction window, matched in memory against every pending
+    Binance order whose item has auto_enabled=True in RevendedoresItemMapping.
+    On confirmation, auto-approve and dispatch via Revendedores.
     """
-    import time as _t
-    _t.sleep(45)  # extra startup delay
-    while not _acquire_singleton_lock(_LOCK_BINANCE_VERIFY):
-        _t.sleep(30)
-    while True:
-        try:
-            with app.app_context():
-                enabled = get_config_value("binance_auto_enabled", "0")
-                if enabled != "1":
-                    _t.sleep(30)
-                    continue
-                if not BINANCE_API_KEY or not BINANCE_API_SECRET:
-                    _t.sleep(60)
-                    continue
-                pending_orders = Order.query.filter_by(
-                    method="binance", status="pending"
-                ).all()
-                for order in pending_orders:
-                    try:
-                        if not _order_has_auto_recharges(order):
-                            continue
-                        if not order.reference:
-                            continue
-                        # Search from 5 minutes before order creation
-                        since_ms = int(
-                            (order.created_at - timedelta(minutes=5)).timestamp() * 1000
-                        )
-                        expected_usdt = float(order.amount or 0.0)
-                        if expected_usdt <= 0:
-                            continue
-                        result = _binance_verify_payment(
-                            order_reference=order.reference,
-                            expected_usdt=expected_usdt,
-                            since_ms=since_ms,
-                        )
-                        if result is True:
-                            # Re-read from DB to avoid race with manual admin approval
-                            db.session.refresh(order)
-                            if (order.status or "").lower() != "pending":
-                                print(f"[BinanceAuto] Order #{order.id} no longer pending (status={order.status}). Skipping.")
-                                continue
-                            print(f"[BinanceAuto] Payment verified for order #{order.id}. Auto-approving.")
-                            _binance_auto_approve(order)
-                        # None = API error, False = not found yet — both silently retry
-                    except Exception as exc:
-                        print(f"[BinanceAuto] Error processing order #{order.id}: {exc}")
-                    _t.sleep(2)  # rate-limit between orders
-        except Exception as exc:
-            print(f"[BinanceAuto] Thread error: {exc}")
-        _t.sleep(30)
-
-
-_binance_thread = threading.Thread(target=_binance_order_verification_loop, daemon=True)
-_binance_thread.start()
+    if get_config_value("binance_auto_enabled", "0") != "1":
+        return
+    if not BINANCE_API_KEY or not BINANCE_API_SECRET:
+        return
+    _binance_reconcile_pending_orders()
 
 
 def _ensure_automation_json_column():
@@ -1746,79 +3097,351 @@ def _inject_deliverability_headers(msg) -> None:
     # Make sure To is preserved
 
 
-def _smtp_send_starttls(msg, to_email):
-    # STARTTLS on port (default 587)
-    with smtplib.SMTP(MAIL_SMTP_HOST, MAIL_SMTP_PORT, timeout=15) as server:
-        server.ehlo()
-        server.starttls()
-        server.ehlo()
-        server.login(MAIL_USER, (MAIL_APP_PASSWORD or '').replace(' ', ''))
-        server.sendmail(MAIL_USER, to_email, msg.as_string())
+# Outbound mail goes through a small pool of persistent, authenticated SMTP
+# connections instead of one EHLO/STARTTLS/login/quit round per message.
+# Connections are reused for up to MAIL_SMTP_MAX_PER_CONN messages (Gmail cuts
+# sessions at ~100), NOOP-checked after sitting idle and reopened when the
+# server dropped them. MAIL_RATE_PER_MINUTE is the provider quota for the whole
+# deploy: every message first claims a slot in the shared `mail_send_log`
+# window (one row per send, see _mail_rate_wait), so web processes and
+# worker.py together stay under it. The durable outbox is the job queue:
+# send_email_async / send_email_html_async enqueue "send_email" jobs, which
+# retry with backoff.
+_SMTP_POOL_SIZE = max(int(os.environ.get("MAIL_SMTP_POOL_SIZE", "2") or 2), 1)
+_SMTP_MAX_PER_CONN = max(int(os.environ.get("MAIL_SMTP_MAX_PER_CONN", "90") or 90), 1)
+_SMTP_NOOP_AFTER_SECONDS = 30
+_SMTP_IDLE_MAX_SECONDS = 240
+_MAIL_RATE_PER_MINUTE = max(int(os.environ.get("MAIL_RATE_PER_MINUTE", "60") or 60), 1)
+_SMTP_SLOTS = threading.BoundedSemaphore(_SMTP_POOL_SIZE)
+_SMTP_IDLE = []  # [{"server", "last_used", "sent"}], most recently used last
+_SMTP_POOL_LOCK = threading.Lock()
+_MAIL_RATE = {"tokens": float(_MAIL_RATE_PER_MINUTE), "updated": time.monotonic()}
+_MAIL_RATE_LOCK = threading.Lock()
+_MAIL_RATE_LOCK_KEY = 4_000_000_002
+_MAIL_SEND_LOG_RETENTION_HOURS = 24
+_MAIL_LATENCIES = deque(maxlen=500)
+_MAIL_STATS = {
+    "sent": 0,
+    "failed": 0,
+    "refused": 0,
+    "connections_opened": 0,
+    "reconnects": 0,
+    "rate_limited_waits": 0,
+    "rate_local_fallbacks": 0,
+}
+_MAIL_STATS_LOCK = threading.Lock()
+
+
+class MailSendLog(db.Model):
+    """One row per outgoing message: the shared MAIL_RATE_PER_MINUTE window."""
+    __tablename__ = "mail_send_log"
+    id = db.Column(db.Integer, primary_key=True)
+    sent_at = db.Column(db.DateTime, nullable=False, index=True)
 
 
-def _smtp_send_ssl(msg, to_email):
-    # SSL on 465 (fallback)
-    port = 465
-    with smtplib.SMTP_SSL(MAIL_SMTP_HOST, port, timeout=15) as server:
-        server.login(MAIL_USER, (MAIL_APP_PASSWORD or '').replace(' ', ''))
-        server.sendmail(MAIL_USER, to_email, msg.as_string())
+def _mail_stat(name: str, n: int = 1) -> None:
+    with _MAIL_STATS_LOCK:
+        _MAIL_STATS[name] = _MAIL_STATS.get(name, 0) + n
 
 
-def send_email(to_email: str, subject: str, body: str) -> bool:
-    if not MAIL_USER or not MAIL_APP_PASSWORD or not to_email:
-        return False
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = MAIL_USER
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        _inject_deliverability_headers(msg)
-        msg.attach(MIMEText(body or "", 'plain'))
+def _mail_rate_claim() -> float:
+    """Take a slot in the shared one-minute window. Returns 0 if granted, else seconds to wait."""
+    from sqlalchemy import text
+
+    table = MailSendLog.__table__
+    now = datetime.utcnow()
+    since = now - timedelta(seconds=60)
+    in_window = db.select(db.func.count()).select_from(table).where(table.c.sent_at >= since).scalar_subquery()
+    with db.engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _MAIL_RATE_LOCK_KEY})
+        # INSERT ... SELECT WHERE count < quota: one statement, so on SQLite the
+        # write lock alone makes check-and-claim atomic.
+        granted = conn.execute(
+            table.insert().from_select(
+                ["sent_at"],
+                db.select(db.literal(now, db.DateTime)).where(in_window < _MAIL_RATE_PER_MINUTE),
+            )
+        ).rowcount
+        if granted:
+            return 0.0
+        oldest = conn.execute(db.select(db.func.min(table.c.sent_at)).where(table.c.sent_at >= since)).scalar()
+    if not oldest:
+        return 0.5
+    return min(max((oldest - since).total_seconds(), 0.2), 5.0)
+
+
+def _mail_rate_wait() -> None:
+    """Block until the shared window allows one more message.
+
+    If the window cannot be read (database down), fall back to this process's
+    token bucket rather than sending unthrottled.
+    """
+    waited = False
+    while True:
         try:
-            _smtp_send_starttls(msg, to_email)
-            return True
+            sleep_for = _mail_rate_claim()
+        except Exception as exc:
+            _mail_stat("rate_local_fallbacks")
+            print(f"[Mail] Ventana de envío compartida no disponible, límite por proceso: {exc}")
+            _mail_rate_wait_local()
+            return
+        if not sleep_for:
+            return
+        if not waited:
+            _mail_stat("rate_limited_waits")
+            waited = True
+        time.sleep(sleep_for)
+
+
+def _mail_send_log_prune() -> int:
+    table = MailSendLog.__table__
+    cutoff = datetime.utcnow() - timedelta(hours=_MAIL_SEND_LOG_RETENTION_HOURS)
+    with db.engine.begin() as conn:
+        return conn.execute(table.delete().where(table.c.sent_at < cutoff)).rowcount or 0
+
+
+def _mail_rate_wait_local() -> None:
+    """Block until this process's token bucket allows one more message."""
+    per_second = _MAIL_RATE_PER_MINUTE / 60.0
+    waited = False
+    while True:
+        with _MAIL_RATE_LOCK:
+            now = time.monotonic()
+            _MAIL_RATE["tokens"] = min(
+                float(_MAIL_RATE_PER_MINUTE),
+                _MAIL_RATE["tokens"] + (now - _MAIL_RATE["updated"]) * per_second,
+            )
+            _MAIL_RATE["updated"] = now
+            if _MAIL_RATE["tokens"] >= 1.0:
+                _MAIL_RATE["tokens"] -= 1.0
+                return
+            sleep_for = (1.0 - _MAIL_RATE["tokens"]) / per_second
+        if not waited:
+            _mail_stat("rate_limited_waits")
+            waited = True
+        time.sleep(sleep_for)
+
+
+def _smtp_open():
+    """Open and authenticate a connection: STARTTLS on MAIL_SMTP_PORT, SSL 465 as fallback."""
+    password = (MAIL_APP_PASSWORD or '').replace(' ', '')
+    try:
+        server = smtplib.SMTP(MAIL_SMTP_HOST, MAIL_SMTP_PORT, timeout=15)
+        try:
+            server.ehlo()
+            server.starttls()
+            server.ehlo()
+            server.login(MAIL_USER, password)
         except Exception:
-            # Fallback to SSL 465
-            _smtp_send_ssl(msg, to_email)
-            return True
+            _smtp_close(server)
+            raise
     except Exception:
-        return False
-
-def send_email_async(to_email: str, subject: str, body: str) -> None:
-    def _runner():
+        server = smtplib.SMTP_SSL(MAIL_SMTP_HOST, 465, timeout=15)
         try:
-            send_email(to_email, subject, body)
+            server.login(MAIL_USER, password)
         except Exception:
-            pass
+            _smtp_close(server)
+            raise
+    _mail_stat("connections_opened")
+    return server
+
+
+def _smtp_close(server) -> None:
     try:
-        t = threading.Thread(target=_runner, daemon=True)
-        t.start()
+        server.quit()
     except Exception:
-        # fallback to sync (best effort)
         try:
-            send_email(to_email, subject, body)
+            server.close()
         except Exception:
             pass
 
+
+def _smtp_checkout():
+    """Return (entry, reused). Reused connections idle for a while get a NOOP first."""
+    now = time.monotonic()
+    while True:
+        with _SMTP_POOL_LOCK:
+            entry = _SMTP_IDLE.pop() if _SMTP_IDLE else None
+        if entry is None:
+            return {"server": _smtp_open(), "last_used": now, "sent": 0}, False
+        idle = now - entry["last_used"]
+        if idle > _SMTP_IDLE_MAX_SECONDS:
+            _smtp_close(entry["server"])
+            continue
+        if idle > _SMTP_NOOP_AFTER_SECONDS:
+            try:
+                if entry["server"].noop()[0] != 250:
+                    raise smtplib.SMTPServerDisconnected("NOOP rechazado")
+            except Exception:
+                _smtp_close(entry["server"])
+                continue
+        return entry, True
+
+
+def _smtp_checkin(entry) -> None:
+    entry["last_used"] = time.monotonic()
+    if entry["sent"] >= _SMTP_MAX_PER_CONN:
+        _smtp_close(entry["server"])
+        return
+    with _SMTP_POOL_LOCK:
+        _SMTP_IDLE.append(entry)
+
+
+def _smtp_deliver(msg, to_email) -> None:
+    """Send msg over a pooled connection. Raises on failure.
+
+    A send that fails on a reused connection (server closed it while idle) is
+    retried once on a fresh one. SMTPRecipientsRefused leaves the connection
+    healthy, so it goes back to the pool.
+    """
+    _mail_rate_wait()
+    payload = msg.as_string()
+    started = time.perf_counter()
+    with _SMTP_SLOTS:
+        entry, reused = _smtp_checkout()
+        try:
+            try:
+                entry["server"].sendmail(MAIL_USER, to_email, payload)
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPHeloError, OSError):
+                if not reused:
+                    raise
+                _smtp_close(entry["server"])
+                _mail_stat("reconnects")
+                entry = {"server": _smtp_open(), "last_used": time.monotonic(), "sent": 0}
+                entry["server"].sendmail(MAIL_USER, to_email, payload)
+        except smtplib.SMTPRecipientsRefused:
+            _mail_stat("refused")
+            _smtp_checkin(entry)
+            raise
+        except Exception:
+            _mail_stat("failed")
+            _smtp_close(entry["server"])
+            raise
+        entry["sent"] += 1
+        _smtp_checkin(entry)
+    _mail_stat("sent")
+    _MAIL_LATENCIES.append(time.perf_counter() - started)
+
+
+def _smtp_pool_close_all() -> int:
+    with _SMTP_POOL_LOCK:
+        entries = list(_SMTP_IDLE)
+        _SMTP_IDLE.clear()
+    for entry in entries:
+        _smtp_close(entry["server"])
+    return len(entries)
+
+
+def _mail_outbox_stats() -> dict:
+    with _MAIL_STATS_LOCK:
+        stats = dict(_MAIL_STATS)
+    latencies = sorted(_MAIL_LATENCIES)
+    if latencies:
+        stats["latency_ms"] = {
+            "samples": len(latencies),
+            "p50": round(latencies[len(latencies) // 2] * 1000, 1),
+            "p95": round(latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000, 1),
+            "max": round(latencies[-1] * 1000, 1),
+        }
+    with _SMTP_POOL_LOCK:
+        stats["idle_connections"] = len(_SMTP_IDLE)
+    stats["pool_size"] = _SMTP_POOL_SIZE
+    stats["rate_per_minute"] = _MAIL_RATE_PER_MINUTE
+    log_table = MailSendLog.__table__
+    stats["sent_last_minute"] = int(db.session.execute(
+        db.select(db.func.count()).select_from(log_table)
+        .where(log_table.c.sent_at >= datetime.utcnow() - timedelta(seconds=60))
+    ).scalar() or 0)
+    table = BackgroundJob.__table__
+    rows = db.session.execute(
+        db.select(table.c.status, db.func.count(), db.func.min(table.c.created_at))
+        .where(table.c.kind == "send_email", table.c.status.in_(("queued", "running", "dead")))
+        .group_by(table.c.status)
+    ).all()
+    stats["queue"] = {status: int(count or 0) for status, count, _oldest in rows}
+    oldest = min((r[2] for r in rows if r[0] == "queued" and r[2]), default=None)
+    stats["queue"]["oldest_queued_seconds"] = int((datetime.utcnow() - oldest).total_seconds()) if oldest else 0
+    return stats
+
+
+def _build_text_message(to_email: str, subject: str, body: str):
+    msg = MIMEMultipart()
+    msg['From'] = MAIL_USER
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    _inject_deliverability_headers(msg)
+    msg.attach(MIMEText(body or "", 'plain'))
+    return msg
+
+
+def _build_html_message(to_email: str, subject: str, html_body: str, text_body: str = ""):
+    msg = MIMEMultipart('alternative')
+    msg['From'] = MAIL_USER
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    _inject_deliverability_headers(msg)
+    if text_body:
+        msg.attach(MIMEText(text_body, 'plain', 'utf-8'))
+    msg.attach(MIMEText(html_body or "", 'html', 'utf-8'))
+    return msg
+
+
+def send_email(to_email: str, subject: str, body: str) -> bool:
+    if not MAIL_USER or not MAIL_APP_PASSWORD or not to_email:
+        return False
+    try:
+        _smtp_deliver(_build_text_message(to_email, subject, body), to_email)
+        return True
+    except Exception:
+        return False
+
+def send_email_async(to_email: str, subject: str, body: str) -> None:
+    if not to_email:
+        return
+    if enqueue_job("send_email", {"to": to_email, "subject": subject, "text": body}):
+        return
+    # fallback to sync (best effort) if the queue table is unreachable
+    try:
+        send_email(to_email, subject, body)
+    except Exception:
+        pass
+
+
+def send_email_html_async(to_email: str, subject: str, html_body: str, text_body: str = "") -> None:
+    if not to_email:
+        return
+    if enqueue_job("send_email", {"to": to_email, "subject": subject, "html": html_body, "text": text_body}):
+        return
+    try:
+        send_email_html(to_email, subject, html_body, text_body)
+    except Exception:
+        pass
+
+
+@job_handler("send_email", max_attempts=6)
+def _job_send_email(payload):
+    to_email = payload.get("to") or ""
+    if not MAIL_USER or not MAIL_APP_PASSWORD or not to_email:
+        return
+    subject = payload.get("subject") or ""
+    if payload.get("html"):
+        msg = _build_html_message(to_email, subject, payload["html"], payload.get("text") or "")
+    else:
+        msg = _build_text_message(to_email, subject, payload.get("text") or "")
+    try:
+        _smtp_deliver(msg, to_email)
+    except smtplib.SMTPRecipientsRefused as exc:
+        # Permanent: retrying a rejected address only burns quota.
+        print(f"[Mail] Destinatario rechazado {to_email}: {exc.recipients}")
+
 # HTML email support
 def send_email_html(to_email: str, subject: str, html_body: str, text_body: str = "") -> bool:
     if not MAIL_USER or not MAIL_APP_PASSWORD or not to_email:
         return False
     try:
-        msg = MIMEMultipart('alternative')
-        msg['From'] = MAIL_USER
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        _inject_deliverability_headers(msg)
-        if text_body:
-            msg.attach(MIMEText(text_body, 'plain', 'utf-8'))
-        msg.attach(MIMEText(html_body or "", 'html', 'utf-8'))
-        try:
-            _smtp_send_starttls(msg, to_email)
-            return True
-        except Exception:
-            _smtp_send_ssl(msg, to_email)
-            return True
+        _smtp_deliver(_build_html_message(to_email, subject, html_body, text_body), to_email)
+        return True
     except Exception:
         return False
 
@@ -1840,124 +3463,94 @@ def _email_style():
     }
 
 
+# Emails render from templates/email/*.html + *.txt through app.jinja_env,
+# which compiles each template once and keeps it. The brand chrome (header,
+# footer with support links) only depends on config, so it is rendered once
+# per config version (and year) and reused; any config write bumps the
+# version and the next email re-renders it.
+_EMAIL_CHROME_CACHE = {"key": None, "value": None}
+_EMAIL_CHROME_LOCK = threading.Lock()
+
+
+def _email_chrome():
+    try:
+        version = _config_snapshot_values().get(CONFIG_VERSION_KEY, "") if _CONFIG_CACHE_ENABLED else None
+    except Exception:
+        version = None
+    key = (version, now_ve().year)
+    if version is not None:
+        with _EMAIL_CHROME_LOCK:
+            if _EMAIL_CHROME_CACHE["key"] == key:
+                return _EMAIL_CHROME_CACHE["value"]
+
+    s = _email_style()
+    brand = get_config_value("site_name", "InefableStore")
+    support = {
+        'whatsapp': get_config_value("whatsapp_url", "") or '',
+        'support': get_config_value("support_url", "") or '',
+        'privacy': get_config_value("privacy_url", "") or '',
+    }
+    links = [(label, support[k]) for label, k in (('WhatsApp', 'whatsapp'), ('Soporte', 'support'), ('Privacidad', 'privacy')) if support[k]]
+    ctx = {"s": s, "brand": brand, "links": links, "year": key[1]}
+    env = app.jinja_env
+    chrome = {
+        "style": s,
+        "brand": brand,
+        "support": support,
+        "open": Markup(env.get_template("email/_chrome_open.html").render(ctx)),
+        "close": Markup(env.get_template("email/_chrome_close.html").render(ctx)),
+    }
+    if version is not None:
+        with _EMAIL_CHROME_LOCK:
+            _EMAIL_CHROME_CACHE["key"] = key
+            _EMAIL_CHROME_CACHE["value"] = chrome
+    return chrome
+
+
 def _email_brand():
-    return get_config_value("site_name", "InefableStore")
+    return _email_chrome()["brand"]
 
 
 def _email_support_links():
-    whatsapp = get_config_value("whatsapp_url", "")
-    support = get_config_value("support_url", "")
-    privacy = get_config_value("privacy_url", "")
-    return {'whatsapp': whatsapp or '', 'support': support or '', 'privacy': privacy or ''}
+    return dict(_email_chrome()["support"])
 
 
-def _email_wrap(title, body_content):
-    """Wrap body content in a full HTML email structure."""
-    s = _email_style()
-    brand = _email_brand()
-    sup = _email_support_links()
-
-    links_html = ''
-    if sup['whatsapp']:
-        links_html += f'<a href="{sup["whatsapp"]}" style="color:{s["accent_light"]}; text-decoration:none; margin-right:16px;">WhatsApp</a>'
-    if sup['support']:
-        links_html += f'<a href="{sup["support"]}" style="color:{s["accent_light"]}; text-decoration:none; margin-right:16px;">Soporte</a>'
-    if sup['privacy']:
-        links_html += f'<a href="{sup["privacy"]}" style="color:{s["accent_light"]}; text-decoration:none;">Privacidad</a>'
-
-    return f"""<!DOCTYPE html>
-<html lang="es">
-<head>
-<meta charset="UTF-8">
-<meta name="viewport" content="width=device-width, initial-scale=1.0">
-<title>{title}</title>
-</head>
-<body style="margin:0; padding:0; background-color:{s['bg']}; font-family:{s['font']}; color:{s['text']}; -webkit-text-size-adjust:100%;">
-<table role="presentation" width="100%" cellpadding="0" cellspacing="0" style="background-color:{s['bg']};">
-<tr><td align="center" style="padding:24px 16px;">
-
-<table role="presentation" width="600" cellpadding="0" cellspacing="0" style="max-width:600px; width:100%; background-color:{s['card_bg']}; border-radius:12px; overflow:hidden; border:1px solid {s['border']};">
-
-<!-- Header -->
-<tr>
-<td style="background: linear-gradient(135deg, {s['accent']} 0%, #1e40af 100%); padding:28px 32px; text-align:center;">
-    <h1 style="margin:0; font-size:24px; font-weight:700; color:{s['white']}; letter-spacing:0.5px;">{brand}</h1>
-</td>
-</tr>
-
-<!-- Body -->
-<tr>
-<td style="padding:32px 32px 24px 32px;">
-    {body_content}
-</td>
-</tr>
-
-<!-- Footer -->
-<tr>
-<td style="padding:20px 32px 28px 32px; border-top:1px solid {s['border']}; text-align:center;">
-    {f'<p style="margin:0 0 8px 0; font-size:13px; color:{s["muted"]};">¿Necesitas ayuda?</p><p style="margin:0 0 12px 0; font-size:13px;">{links_html}</p>' if links_html else ''}
-    <p style="margin:0; font-size:12px; color:{s['muted']};">&copy; {now_ve().year} {brand} &mdash; Todos los derechos reservados</p>
-</td>
-</tr>
-
-</table>
-</td></tr></table>
-</body>
-</html>"""
-
-
-def _email_detail_row(label, value, value_color=None):
-    """Single detail row for order info tables."""
-    s = _email_style()
-    vc = value_color or s['white']
-    return f"""<tr>
-<td style="padding:8px 0; color:{s['muted']}; font-size:14px; border-bottom:1px solid {s['border']}; width:40%;">{label}</td>
-<td style="padding:8px 0; color:{vc}; font-size:14px; font-weight:600; border-bottom:1px solid {s['border']}; text-align:right;">{value}</td>
-</tr>"""
+def _email_render(name: str, title: str, **context):
+    """Render templates/email/<name>.html and .txt from the same context. Returns (html, text)."""
+    chrome = _email_chrome()
+    ctx = dict(context, s=chrome["style"], brand=chrome["brand"], chrome=chrome, title=title)
+    env = app.jinja_env
+    html = env.get_template(f"email/{name}.html").render(ctx)
+    text = env.get_template(f"email/{name}.txt").render(ctx)
+    return html, text
 
 
-def _email_status_badge(label, color):
-    """Inline status badge."""
-    return f'<span style="display:inline-block; padding:4px 14px; background-color:{color}; color:#fff; border-radius:20px; font-size:13px; font-weight:600; letter-spacing:0.3px;">{label}</span>'
+def _email_wrap(title, body_content):
+    """Wrap body content in a full HTML email structure."""
+    chrome = _email_chrome()
+    return app.jinja_env.get_template("email/layout.html").render(
+        title=title, chrome=chrome, s=chrome["style"], brand=chrome["brand"], body_content=Markup(body_content),
+    )
 
 
-def _email_code_block(codes):
-    """Render delivery code(s) as a highlighted block."""
-    s = _email_style()
-    if not codes:
-        return ''
-    rows = []
-    for idx, c in enumerate(codes, start=1):
-        label = 'Tu codigo' if len(codes) == 1 else f'Codigo #{idx}'
-        rows.append(f"""
-<div style="margin:{('16' if idx > 1 else '24')}px 0 0 0; padding:20px; background-color:#0b0f14; border:2px dashed {s['accent']}; border-radius:10px; text-align:center;">
-    <p style="margin:0 0 8px 0; font-size:13px; color:{s['muted']}; text-transform:uppercase; letter-spacing:1px;">{label}</p>
-    <p style="margin:0; font-size:28px; font-weight:700; color:{s['accent_light']}; letter-spacing:2px; font-family:monospace;">{c}</p>
-    <p style="margin:8px 0 0 0; font-size:12px; color:{s['muted']};">Copia este codigo y canjealo en la plataforma correspondiente</p>
-</div>""")
-    return "\n".join(rows)
-
-
-def _email_items_rows(o):
-    """Build detail rows and compute metadata for multi-item or single-item orders."""
-    items_html = ''
+def _email_order_items(o):
+    """Parse items_json into [{title, qty, price}] and the total quantity."""
+    items = []
     qty_total = 1
     try:
         if (o.items_json or '').strip():
-            items = json.loads(o.items_json or '[]')
-            if isinstance(items, list) and items:
-                qty_total = sum(int(ent.get('qty') or 1) for ent in items)
-                for ent in items:
-                    t = ent.get('title', 'N/A')
-                    q = int(ent.get('qty') or 1)
+            parsed = json.loads(o.items_json or '[]')
+            if isinstance(parsed, list) and parsed:
+                qty_total = sum(int(ent.get('qty') or 1) for ent in parsed)
+                for ent in parsed:
                     try:
                         p = float(ent.get('price') or 0.0)
                     except Exception:
                         p = 0.0
-                    items_html += _email_detail_row(f'{q} x', f'{t} - ${p:.2f} c/u')
+                    items.append({'title': ent.get('title', 'N/A'), 'qty': int(ent.get('qty') or 1), 'price': p})
     except Exception:
         pass
-    return items_html, qty_total
+    return items, qty_total
 
 
 def _email_delivery_codes(o):
@@ -1975,6 +3568,16 @@ def _email_delivery_codes(o):
     return codes
 
 
+def _email_order_context(o, pkg, it):
+    return {
+        'o': o,
+        'juego': (pkg.name if pkg else '').strip(),
+        'item_t': (it.title if it else 'N/A'),
+        'monto': f"{o.amount} {o.currency}",
+        'method': (o.method or '').upper(),
+    }
+
+
 # ──────────────────────────────────────────────────────────────────────
 # Email subject helper — friendly subjects to avoid spam filters
 # ──────────────────────────────────────────────────────────────────────
@@ -1992,71 +3595,18 @@ def _email_subject_for_order(order: 'Order', pkg: 'StorePackage' or None, brand:
 # ──────────────────────────────────────────────────────────────────────
 
 def build_order_approved_email(o: 'Order', pkg: 'StorePackage', it: 'GamePackageItem'):
-    s = _email_style()
-    brand = _email_brand()
-    juego = (pkg.name if pkg else '').strip()
-    item_t = (it.title if it else 'N/A')
-    monto = f"{o.amount} {o.currency}"
     is_gift = (pkg.category or '').lower() == 'gift' if pkg else False
-
-    codes = _email_delivery_codes(o)
-    code_html = _email_code_block(codes)
-    items_html, qty_total = _email_items_rows(o)
-    qty_label = 'Cantidad de tarjetas' if is_gift else 'Recargas totales'
-
-    body = f"""
-<h2 style="margin:0 0 8px 0; font-size:20px; color:{s['white']};">{'Gift enviado' if is_gift else 'Recarga Exitosa'}</h2>
-<p style="margin:0 0 20px 0; font-size:15px; color:{s['text']}; line-height:1.6;">
-    Tu orden <strong style="color:{s['accent_light']};">#{o.id}</strong> ha sido procesada exitosamente.
-    {('Aqui tienes tu codigo:' if codes else 'Tu recarga ha sido aplicada.')}
-</p>
-
-{_email_status_badge('Completada', s['success'])}
-
-{code_html}
-
-<table role="presentation" width="100%" cellpadding="0" cellspacing="0" style="margin-top:20px;">
-{_email_detail_row('Orden', f'#{o.id}')}
-{_email_detail_row('Juego', juego or 'N/A')}
-{items_html if items_html else _email_detail_row('Paquete', item_t)}
-{_email_detail_row(qty_label, str(qty_total))}
-{_email_detail_row('Monto', monto, s['accent_light'])}
-{_email_detail_row('Jugador', o.customer_name or o.customer_id or 'N/A') if o.customer_id else ''}
-</table>
-
-<p style="margin:24px 0 0 0; font-size:14px; color:{s['text']}; line-height:1.5;">
-    Gracias por tu compra! Esperamos verte pronto de nuevo.
-</p>
-"""
-
-    html = _email_wrap(f'Orden #{o.id} aprobada - {brand}', body)
-
-    # Plain text fallback
-    try:
-        lines = [f"Orden #{o.id} aprobada\n", f"Juego: {juego}", f"Paquete: {item_t}"]
-        if (o.items_json or '').strip():
-            items = json.loads(o.items_json or '[]')
-            if isinstance(items, list) and items:
-                lines.append("Paquetes:")
-                for ent in items:
-                    t = ent.get('title')
-                    q = int(ent.get('qty') or 1)
-                    try:
-                        p = float(ent.get('price') or 0.0)
-                    except Exception:
-                        p = 0.0
-                    lines.append(f" - {q} x {t} (${p:.2f} c/u)")
-        lines.append(f"{qty_label}: {qty_total}")
-        lines.append(f"Monto: {monto}")
-        if codes:
-            for i, c in enumerate(codes, start=1):
-                label = 'Codigo' if len(codes) == 1 else f'Codigo #{i}'
-                lines.append(f"{label}: {c}")
-        lines.append(f"\nGracias por tu compra!\n- {brand}")
-        text = "\n".join(lines)
-    except Exception:
-        text = f"Orden #{o.id} aprobada - {juego} - {monto}\nGracias por tu compra!\n- {brand}"
-    return html, text
+    items, qty_total = _email_order_items(o)
+    return _email_render(
+        "order_approved",
+        f'Orden #{o.id} aprobada - {_email_brand()}',
+        **_email_order_context(o, pkg, it),
+        is_gift=is_gift,
+        codes=_email_delivery_codes(o),
+        items=items,
+        qty_total=qty_total,
+        qty_label='Cantidad de tarjetas' if is_gift else 'Recargas totales',
+    )
 
 
 # ──────────────────────────────────────────────────────────────────────
@@ -2064,47 +3614,11 @@ def build_order_approved_email(o: 'Order', pkg: 'StorePackage', it: 'GamePackage
 # ──────────────────────────────────────────────────────────────────────
 
 def build_order_created_email(o: 'Order', pkg: 'StorePackage', it: 'GamePackageItem'):
-    s = _email_style()
-    brand = _email_brand()
-    juego = (pkg.name if pkg else '').strip()
-    item_t = (it.title if it else 'N/A')
-    monto = f"{o.amount} {o.currency}"
-
-    body = f"""
-<h2 style="margin:0 0 8px 0; font-size:20px; color:{s['white']};">Orden recibida!</h2>
-<p style="margin:0 0 20px 0; font-size:15px; color:{s['text']}; line-height:1.6;">
-    Hemos recibido tu orden <strong style="color:{s['accent_light']};">#{o.id}</strong>.
-    Estamos verificando tu pago. Te notificaremos cuando sea procesada.
-</p>
-
-{_email_status_badge('Pendiente de verificacion', s['warning'])}
-
-<table role="presentation" width="100%" cellpadding="0" cellspacing="0" style="margin-top:24px;">
-{_email_detail_row('Orden', f'#{o.id}')}
-{_email_detail_row('Juego', juego or 'N/A')}
-{_email_detail_row('Paquete', item_t)}
-{_email_detail_row('Monto', monto, s['accent_light'])}
-{_email_detail_row('Metodo de pago', (o.method or '').upper())}
-{_email_detail_row('Referencia', o.reference or 'N/A')}
-{_email_detail_row('Jugador', o.customer_name or o.customer_id or 'N/A') if o.customer_id else ''}
-</table>
-
-<p style="margin:24px 0 0 0; font-size:13px; color:{s['muted']}; line-height:1.5;">
-    El tiempo de procesamiento habitual es de <strong>5 a 30 minutos</strong> en horario de atencion.
-    Recibiras un correo cuando tu orden sea aprobada.
-</p>
-"""
-
-    html = _email_wrap(f'Orden #{o.id} recibida - {brand}', body)
-
-    text = (
-        f"Orden recibida!\n\n"
-        f"Tu orden #{o.id} ha sido registrada.\n"
-        f"Juego: {juego}\nPaquete: {item_t}\nMonto: {monto}\n"
-        f"Metodo: {(o.method or '').upper()}\nReferencia: {o.reference or 'N/A'}\n\n"
-        f"Estamos verificando tu pago. Te notificaremos cuando sea procesada.\n\n- {brand}"
+    return _email_render(
+        "order_created",
+        f'Orden #{o.id} recibida - {_email_brand()}',
+        **_email_order_context(o, pkg, it),
     )
-    return html, text
 
 
 # ──────────────────────────────────────────────────────────────────────
@@ -2112,57 +3626,12 @@ def build_order_created_email(o: 'Order', pkg: 'StorePackage', it: 'GamePackageI
 # ──────────────────────────────────────────────────────────────────────
 
 def build_order_rejected_email(o: 'Order', pkg: 'StorePackage', it: 'GamePackageItem', reason=''):
-    s = _email_style()
-    brand = _email_brand()
-    juego = (pkg.name if pkg else '').strip()
-    item_t = (it.title if it else 'N/A')
-    monto = f"{o.amount} {o.currency}"
-    reason_text = reason or ''
-
-    reason_html = ''
-    if reason_text:
-        reason_html = f"""
-<div style="margin:20px 0; padding:16px; background-color:rgba(239,68,68,0.1); border-left:4px solid {s['danger']}; border-radius:6px;">
-    <p style="margin:0 0 4px 0; font-size:12px; color:{s['danger']}; text-transform:uppercase; letter-spacing:0.5px; font-weight:600;">Motivo</p>
-    <p style="margin:0; font-size:14px; color:{s['text']}; line-height:1.5;">{reason_text}</p>
-</div>
-"""
-
-    body = f"""
-<h2 style="margin:0 0 8px 0; font-size:20px; color:{s['white']};">Orden rechazada</h2>
-<p style="margin:0 0 20px 0; font-size:15px; color:{s['text']}; line-height:1.6;">
-    Lamentamos informarte que tu orden <strong style="color:{s['accent_light']};">#{o.id}</strong>
-    no pudo ser procesada.
-</p>
-
-{_email_status_badge('Rechazada', s['danger'])}
-
-{reason_html}
-
-<table role="presentation" width="100%" cellpadding="0" cellspacing="0" style="margin-top:20px;">
-{_email_detail_row('Orden', f'#{o.id}')}
-{_email_detail_row('Juego', juego or 'N/A')}
-{_email_detail_row('Paquete', item_t)}
-{_email_detail_row('Monto', monto, s['accent_light'])}
-{_email_detail_row('Referencia', o.reference or 'N/A')}
-</table>
-
-<p style="margin:24px 0 0 0; font-size:14px; color:{s['text']}; line-height:1.5;">
-    Si crees que esto es un error, por favor contactanos con tu numero de orden para que podamos revisar tu caso.
-</p>
-"""
-
-    html = _email_wrap(f'Orden #{o.id} rechazada - {brand}', body)
-
-    text = (
-        f"Orden rechazada\n\n"
-        f"Tu orden #{o.id} no pudo ser procesada.\n"
-        + (f"Motivo: {reason_text}\n" if reason_text else "")
-        + f"Juego: {juego}\nPaquete: {item_t}\nMonto: {monto}\n"
-        f"Referencia: {o.reference or 'N/A'}\n\n"
-        f"Si crees que es un error, contactanos con tu numero de orden.\n\n- {brand}"
+    return _email_render(
+        "order_rejected",
+        f'Orden #{o.id} rechazada - {_email_brand()}',
+        **_email_order_context(o, pkg, it),
+        reason=reason or '',
     )
-    return html, text
 
 
 # ──────────────────────────────────────────────────────────────────────
@@ -2170,53 +3639,13 @@ def build_order_rejected_email(o: 'Order', pkg: 'StorePackage', it: 'GamePackage
 # ──────────────────────────────────────────────────────────────────────
 
 def build_admin_new_order_email(o: 'Order', pkg: 'StorePackage', it: 'GamePackageItem'):
-    s = _email_style()
-    brand = _email_brand()
-    monto = f"{o.amount} {o.currency}"
-    juego = (pkg.name if pkg else '').strip()
-    item_t = (it.title if it else 'N/A')
-
-    items_html, qty_total = _email_items_rows(o)
-
-    body = f"""
-<h2 style="margin:0 0 8px 0; font-size:20px; color:{s['white']};">Nueva orden recibida</h2>
-<p style="margin:0 0 20px 0; font-size:15px; color:{s['text']}; line-height:1.6;">
-    Se ha registrado una nueva orden <strong style="color:{s['accent_light']};">#{o.id}</strong>
-    que requiere tu atencion.
-</p>
-
-<table role="presentation" width="100%" cellpadding="0" cellspacing="0" style="margin-top:16px;">
-{_email_detail_row('Orden', f'#{o.id}')}
-{_email_detail_row('Juego', juego or 'N/A')}
-{items_html if items_html else _email_detail_row('Paquete', item_t)}
-{_email_detail_row('Monto', monto, s['accent_light'])}
-{_email_detail_row('Metodo', (o.method or '').upper())}
-{_email_detail_row('Referencia', o.reference or 'N/A')}
-{_email_detail_row('Email cliente', o.email or 'N/A')}
-{_email_detail_row('Telefono', o.phone or 'N/A')}
-{_email_detail_row('ID Jugador', o.customer_id or 'N/A') if o.customer_id else ''}
-{_email_detail_row('Nickname', o.customer_name or 'N/A') if o.customer_name else ''}
-{_email_detail_row('Zona ID', o.customer_zone) if o.customer_zone else ''}
-{_email_detail_row('Codigo afiliado', o.special_code) if o.special_code else ''}
-</table>
-
-<div style="margin-top:24px; text-align:center;">
-    <p style="margin:0; font-size:14px; color:{s['muted']};">Ingresa al panel de administracion para procesar esta orden.</p>
-</div>
-"""
-
-    html = _email_wrap(f'Nueva orden #{o.id} - {brand}', body)
-
-    text = (
-        f"Nueva orden recibida\n\n"
-        f"Orden: #{o.id}\nJuego: {juego}\nPaquete: {item_t}\n"
-        f"Monto: {monto}\nMetodo: {(o.method or '').upper()}\n"
-        f"Referencia: {o.reference or 'N/A'}\nEmail: {o.email or 'N/A'}\n"
-        + (f"Jugador: {o.customer_name or o.customer_id}\n" if o.customer_id else "")
-        + (f"Codigo afiliado: {o.special_code}\n" if o.special_code else "")
-        + f"\nIngresa al panel de administracion para procesar esta orden.\n\n- {brand}"
+    items, _qty_total = _email_order_items(o)
+    return _email_render(
+        "admin_new_order",
+        f'Nueva orden #{o.id} - {_email_brand()}',
+        **_email_order_context(o, pkg, it),
+        items=items,
     )
-    return html, text
 
 
 def amount_to_usd(amount: float, currency: str) -> float:
@@ -2343,6 +3772,8 @@ class RevendedoresCatalogItem(db.Model):
     remote_package_name = db.Column(db.String(250), default="")
     active = db.Column(db.Boolean, default=True)
     raw_json = db.Column(db.Text, default="")
+    # sha1 of the normalized entry (_rev_catalog_hash); unchanged rows are skipped on sync
+    content_hash = db.Column(db.String(64), default="")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     __table_args__ = (
@@ -2350,6 +3781,20 @@ class RevendedoresCatalogItem(db.Model):
     )
 
 
+class RevendedoresCatalogChange(db.Model):
+    """What a catalog sync changed: one row per created/updated/deactivated package."""
+    __tablename__ = "rev_catalog_changes"
+    id = db.Column(db.Integer, primary_key=True)
+    sync_id = db.Column(db.String(32), nullable=False, index=True)
+    source = db.Column(db.String(20), default="")  # admin | job
+    action = db.Column(db.String(20), nullable=False)  # created | updated | deactivated
+    remote_product_id = db.Column(db.Integer, nullable=True)
+    remote_package_id = db.Column(db.Integer, nullable=False)
+    remote_package_name = db.Column(db.String(250), default="")
+    fields = db.Column(db.String(200), default="")  # comma separated, for updates
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
 class RevendedoresItemMapping(db.Model):
     __tablename__ = "rev_item_mappings"
     id = db.Column(db.Integer, primary_key=True)
@@ -2583,26 +4028,77 @@ def _credit_affiliate_commission(order_obj) -> bool:
         return False
 
 
-def _special_code_uses(su) -> int:
-    """How many approved/delivered orders were placed with this affiliate's codes."""
-    try:
-        from sqlalchemy import or_
-        code_filters = [db.func.lower(Order.special_code) == (su.code or "").lower()]
+def _special_code_uses_map(users) -> dict:
+    """{special_user_id: approved/delivered orders placed with that affiliate's codes}.
+
+    Same rule as the per-affiliate OR (special_user_id matches, or the order's
+    code is the affiliate's primary/secondary code), answered for many
+    affiliates with two grouped queries: one by special_user_id and one by
+    (lower(special_code), special_user_id). An order tagged with one affiliate
+    and typed with another's code counts for both, as before.
+    """
+    users = [su for su in (users or []) if su is not None]
+    if not users:
+        return {}
+    codes_by_user = {}
+    for su in users:
+        codes = {(su.code or "").lower()}
         if (su.secondary_code or "").strip():
-            code_filters.append(db.func.lower(Order.special_code) == su.secondary_code.lower())
-        return int(Order.query.filter(
-            Order.status.in_(["approved", "delivered"]),
-            or_(Order.special_user_id == su.id, *code_filters)
-        ).count())
+            codes.add(su.secondary_code.lower())
+        codes_by_user[su.id] = codes
+    all_codes = sorted(set().union(*codes_by_user.values()))
+    code_expr = db.func.lower(Order.special_code)
+    try:
+        by_id = {
+            int(sid): int(n or 0)
+            for sid, n in db.session.query(Order.special_user_id, db.func.count(Order.id))
+            .filter(
+                Order.status.in_(["approved", "delivered"]),
+                Order.special_user_id.in_(list(codes_by_user)),
+            )
+            .group_by(Order.special_user_id)
+            .all()
+        }
+        by_code = {}
+        for code, sid, n in (
+            db.session.query(code_expr, Order.special_user_id, db.func.count(Order.id))
+            .filter(Order.status.in_(["approved", "delivered"]), code_expr.in_(all_codes))
+            .group_by(code_expr, Order.special_user_id)
+            .all()
+        ):
+            by_code.setdefault(code, []).append((sid, int(n or 0)))
     except Exception:
-        return 0
+        return {su.id: 0 for su in users}
+    out = {}
+    for su_id, codes in codes_by_user.items():
+        uses = by_id.get(su_id, 0)
+        for code in codes:
+            # Rows already counted by special_user_id must not be counted twice
+            uses += sum(n for sid, n in by_code.get(code, ()) if sid != su_id)
+        out[su_id] = uses
+    return out
 
 
-def _mini_videos_pending_count(su_id: int) -> int:
+def _special_code_uses(su) -> int:
+    """How many approved/delivered orders were placed with this affiliate's codes."""
+    return _special_code_uses_map([su]).get(su.id, 0) if su else 0
+
+
+def _mini_videos_pending_counts(su_ids) -> dict:
+    """{special_user_id: pending videos} with one grouped query."""
+    ids = sorted({int(x) for x in (su_ids or []) if x})
+    if not ids:
+        return {}
     try:
-        return int(MiniVideo.query.filter_by(special_user_id=su_id, status="pending").count())
+        return {
+            int(sid): int(n or 0)
+            for sid, n in db.session.query(MiniVideo.special_user_id, db.func.count(MiniVideo.id))
+            .filter(MiniVideo.special_user_id.in_(ids), MiniVideo.status == "pending")
+            .group_by(MiniVideo.special_user_id)
+            .all()
+        }
     except Exception:
-        return 0
+        return {}
 
 
 def _detect_video_platform(url: str) -> str:
@@ -2704,7 +4200,7 @@ def _refund_order_credit(order_obj, *, reason: str = "") -> float:
         su = SpecialUser.query.get(order_obj.credit_user_id)
         try:
             if su and su.email:
-                send_email(
+                send_email_async(
                     su.email,
                     f"Te devolvimos el crédito de la orden #{order_obj.id}",
                     "\n".join([
@@ -2718,7 +4214,7 @@ def _refund_order_credit(order_obj, *, reason: str = "") -> float:
             pass
         try:
             to_addr = get_config_value("admin_notify_email", ADMIN_NOTIFY_EMAIL or ADMIN_EMAIL)
-            send_email(to_addr, f"Canje reintegrado: orden #{order_obj.id}", "\n".join([
+            send_email_async(to_addr, f"Canje reintegrado: orden #{order_obj.id}", "\n".join([
                 f"Se devolvio ${amount:.2f} USD de credito por la orden #{order_obj.id}.",
                 f"Mini: {(su.name if su else '')} ({(su.code if su else '')})",
                 (f"Motivo: {reason}" if reason else ""),
@@ -2911,9 +4407,10 @@ def _game_script_request(method: str, endpoint_path: str, payload=None, timeout=
     request_timeout = timeout if timeout is not None else default_timeout
     url = f"{base_url}/{str(endpoint_path or '').lstrip('/')}"
     try:
-        response = _requests_lib.request(
-            method=str(method or "GET").upper(),
-            url=url,
+        response = _http_request(
+            "game_script",
+            str(method or "GET").upper(),
+            url,
             json=payload,
             headers=_game_script_headers(),
             timeout=request_timeout,
@@ -2968,7 +4465,7 @@ def _apply_dispatch_result_to_unit(unit, result):
     return unit
 
 
-def _dispatch_game_script_unit(unit, order_obj, remote_meta):
+def _dispatch_game_script_unit(unit, role_id, remote_meta):
     package_key = str(remote_meta.get("provider_package_key") or remote_meta.get("script_package_key") or "").strip()
     if not package_key:
         return {
@@ -2978,7 +4475,7 @@ def _dispatch_game_script_unit(unit, order_obj, remote_meta):
         }
 
     payload = {
-        "roleId": str(order_obj.customer_id or "").strip(),
+        "roleId": str(role_id or "").strip(),
         "packageKey": package_key,
         "requestId": str(unit.get("external_order_id") or "").strip(),
     }
@@ -3109,7 +4606,9 @@ def _connection_api_login():
         return None, None
 
     try:
-        resp = _requests_lib.post(
+        resp = _http_request(
+            "connection_api",
+            "POST",
             f"{url}/api/connection/login",
             json={"email": email, "password": password},
             timeout=15,
@@ -3138,7 +4637,9 @@ def _connection_api_purchase_pin(package_id: int, quantity: int = 1):
         return {"status": "error", "message": "API key not configured for Connection API"}
 
     try:
-        resp = _requests_lib.post(
+        resp = _http_request(
+            "connection_api",
+            "POST",
             f"{url}/api/connection/pin-purchase",
             data={"package_id": str(package_id), "quantity": str(quantity)},
             headers={"X-API-Key": api_key},
@@ -3167,7 +4668,9 @@ def _connection_api_fetch_packages():
     if not url:
         return []
     try:
-        resp = _requests_lib.get(
+        resp = _http_request(
+            "connection_api",
+            "GET",
             f"{url}/api/connection/packages",
             timeout=15,
         )
@@ -3779,71 +5282,116 @@ def _validate_reference_input(method_value: str, reference: str):
     return True, ref
 
 
-def _find_existing_order_by_reference(reference: str, *, exclude_order_id: int | None = None, statuses=None):
-    normalized_reference = _normalize_order_reference_for_match(reference)
-    if not normalized_reference:
-        return None
+@db.event.listens_for(Order.reference, "set")
+def _order_reference_set(target, value, oldvalue, initiator):
+    target.reference_norm = _normalize_order_reference_for_match(value)
+    target.reference_match_key = _ubii_reference_match_key(value)
 
-    query = Order.query
-    if statuses:
-        query = query.filter(Order.status.in_(tuple(statuses)))
-    if exclude_order_id:
-        query = query.filter(Order.id != int(exclude_order_id))
 
-    for existing_order in query.order_by(Order.created_at.desc()).all():
-        if _normalize_order_reference_for_match(existing_order.reference) == normalized_reference:
-            return existing_order
-    return None
+@db.event.listens_for(Order.method, "set")
+def _order_method_set(target, value, oldvalue, initiator):
+    target.method_norm = _pabilo_normalize_method(value)
+
+
+@db.event.listens_for(Order.capture_reference, "set")
+def _order_capture_reference_set(target, value, oldvalue, initiator):
+    target.capture_reference_norm = _normalize_order_reference_for_match(value)
+
+
+def _backfill_order_reference_norms(batch_size: int = 1000) -> int:
+    """Fill the normalized reference/method columns for rows written before they existed.
+
+    Rows added by the ALTER TABLE migration have NULL in these columns; every
+    ORM write fills them afterwards, so this only does work once per database.
+    """
+    from sqlalchemy import text
+
+    total = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            text(
+                "SELECT id, reference, capture_reference, method FROM orders "
+                "WHERE id > :last_id AND (reference_norm IS NULL OR capture_reference_norm IS NULL "
+                "OR reference_match_key IS NULL OR method_norm IS NULL) "
+                "ORDER BY id LIMIT :lim"
+            ),
+            {"last_id": last_id, "lim": int(batch_size)},
+        ).fetchall()
+        if not rows:
+            break
+        db.session.execute(
+            text(
+                "UPDATE orders SET reference_norm = :ref, capture_reference_norm = :cap, "
+                "reference_match_key = :match_key, method_norm = :method WHERE id = :id"
+            ),
+            [
+                {
+                    "id": row[0],
+                    "ref": _normalize_order_reference_for_match(row[1]),
+                    "cap": _normalize_order_reference_for_match(row[2]),
+                    "match_key": _ubii_reference_match_key(row[1]),
+                    "method": _pabilo_normalize_method(row[3]),
+                }
+                for row in rows
+            ],
+        )
+        db.session.commit()
+        total += len(rows)
+        last_id = rows[-1][0]
+    return total
 
 
-def _find_existing_order_by_capture_reference(reference: str, *, exclude_order_id: int | None = None, statuses=None):
+def _find_existing_order_by_normalized_column(column, reference: str, *, exclude_order_id: int | None = None, statuses=None):
     normalized_reference = _normalize_order_reference_for_match(reference)
     if not normalized_reference:
         return None
 
-    query = Order.query
+    query = Order.query.filter(column == normalized_reference)
     if statuses:
         query = query.filter(Order.status.in_(tuple(statuses)))
     if exclude_order_id:
         query = query.filter(Order.id != int(exclude_order_id))
+    return query.order_by(Order.created_at.desc()).first()
 
-    for existing_order in query.order_by(Order.created_at.desc()).all():
-        if _normalize_order_reference_for_match(existing_order.capture_reference or "") == normalized_reference:
-            return existing_order
-    return None
 
+def _find_existing_order_by_reference(reference: str, *, exclude_order_id: int | None = None, statuses=None):
+    return _find_existing_order_by_normalized_column(
+        Order.reference_norm,
+        reference,
+        exclude_order_id=exclude_order_id,
+        statuses=statuses,
+    )
 
-def _find_existing_order_by_capture_fingerprint(relative_path: str, *, exclude_order_id: int | None = None, statuses=None):
-    capture_path = _capture_absolute_path(relative_path)
-    if not capture_path or not os.path.exists(capture_path):
-        return None
 
-    try:
-        target_fingerprint = _capture_reference_file_fingerprint(capture_path)
-    except Exception:
-        return None
+def _find_existing_order_by_capture_reference(reference: str, *, exclude_order_id: int | None = None, statuses=None):
+    return _find_existing_order_by_normalized_column(
+        Order.capture_reference_norm,
+        reference,
+        exclude_order_id=exclude_order_id,
+        statuses=statuses,
+    )
+
+
+def _find_existing_order_by_capture_fingerprint(relative_path: str, *, fingerprint: str = "", exclude_order_id: int | None = None, statuses=None):
+    target_fingerprint = str(fingerprint or "").strip()
+    if not target_fingerprint:
+        capture_path = _capture_absolute_path(relative_path)
+        if not capture_path or not os.path.exists(capture_path):
+            return None
+        try:
+            target_fingerprint = _capture_reference_file_fingerprint(capture_path)
+        except Exception:
+            return None
     if not target_fingerprint:
         return None
 
-    query = Order.query
+    query = Order.query.filter(Order.capture_sha256 == target_fingerprint)
     if statuses:
         query = query.filter(Order.status.in_(tuple(statuses)))
     if exclude_order_id:
         query = query.filter(Order.id != int(exclude_order_id))
-
-    for existing_order in query.order_by(Order.created_at.desc()).all():
-        other_relative_path = str(existing_order.payment_capture or "").strip()
-        if not other_relative_path:
-            continue
-        other_capture_path = _capture_absolute_path(other_relative_path)
-        if not other_capture_path or not os.path.exists(other_capture_path):
-            continue
-        try:
-            if _capture_reference_file_fingerprint(other_capture_path) == target_fingerprint:
-                return existing_order
-        except Exception:
-            continue
-    return None
+    return query.order_by(Order.created_at.desc()).first()
 
 
 def _is_reference_already_used(reference: str, exclude_order_id: int | None = None) -> bool:
@@ -3898,12 +5446,11 @@ def _ubii_find_matching_order(reference: str, amount: Decimal | None, method: st
         return None, "Referencia no encontrada en la notificación", False
 
     normalized_method = _pabilo_normalize_method(method or "pm")
-    pending_rows = Order.query.filter(Order.status == "pending").order_by(Order.created_at.desc()).all()
-    candidates = [
-        row for row in pending_rows
-        if _ubii_reference_match_key(row.reference or "") == reference_match_key
-        and _pabilo_normalize_method(row.method or "") == normalized_method
-    ]
+    candidates = Order.query.filter(
+        Order.reference_match_key == reference_match_key,
+        Order.method_norm == normalized_method,
+        Order.status == "pending",
+    ).order_by(Order.created_at.desc()).all()
 
     if amount is not None:
         amount_candidates = [row for row in candidates if _ubii_order_amount_matches(row, amount)]
@@ -3917,14 +5464,12 @@ def _ubii_find_matching_order(reference: str, amount: Decimal | None, method: st
     if len(candidates) == 1:
         return candidates[0], "", False
 
-    processed_rows = Order.query.filter(Order.status.in_(["approved", "delivered"]))\
-        .order_by(Order.created_at.desc()).all()
-    processed = [
-        row for row in processed_rows
-        if _ubii_reference_match_key(row.reference or "") == reference_match_key
-        and _pabilo_normalize_method(row.method or "") == normalized_method
-        and _ubii_order_amount_matches(row, amount)
-    ]
+    processed_rows = Order.query.filter(
+        Order.reference_match_key == reference_match_key,
+        Order.method_norm == normalized_method,
+        Order.status.in_(["approved", "delivered"]),
+    ).order_by(Order.created_at.desc()).all()
+    processed = [row for row in processed_rows if _ubii_order_amount_matches(row, amount)]
     if processed:
         return processed[0], "La orden ya estaba procesada anteriormente", True
 
@@ -3996,6 +5541,17 @@ def _ubii_verify_and_update_order(order_obj, extracted: dict, *, payload: dict |
     }
 
 
+@job_handler("ubii_verify_order", max_attempts=3)
+def _job_ubii_verify_order(payload):
+    """Webhook stage 2: mark the matched order paid, then auto-approve/dispatch."""
+    order_obj = Order.query.get(int(payload.get("order_id") or 0))
+    if not order_obj or (order_obj.status or "").lower() != "pending":
+        return
+    extracted = dict(payload.get("extracted") or {})
+    extracted["amount"] = _ubii_parse_amount(extracted.get("amount"))
+    _ubii_verify_and_update_order(order_obj, extracted, payload=payload.get("payload") or {})
+
+
 def _validate_order_reference_value(order_obj, reference: str, *, exclude_order_id: int | None = None):
     ok, ref_or_error = _validate_reference_input(order_obj.method, reference)
     if not ok:
@@ -4360,7 +5916,9 @@ def _pabilo_verify_payment_once(
 
     def _post_verify(current_url, current_payload):
         try:
-            current_resp = _requests_lib.post(
+            current_resp = _http_request(
+                "pabilo",
+                "POST",
                 current_url,
                 json=current_payload,
                 headers=headers,
@@ -4400,7 +5958,9 @@ def _pabilo_verify_payment_once(
                 retry_payload = dict(current_payload)
                 retry_payload.pop("movement_type", None)
                 try:
-                    current_resp = _requests_lib.post(
+                    current_resp = _http_request(
+                        "pabilo",
+                        "POST",
                         current_url,
                         json=retry_payload,
                         headers=headers,
@@ -4412,7 +5972,9 @@ def _pabilo_verify_payment_once(
 
         if int(current_resp.status_code or 0) == 405 and official_url != configured_url:
             try:
-                current_resp = _requests_lib.post(
+                current_resp = _http_request(
+                    "pabilo",
+                    "POST",
                     official_url,
                     json=current_payload,
                     headers=headers,
@@ -4809,6 +6371,7 @@ def _pabilo_verify_and_update_order(order_obj, *, auto_approve_on_verified: bool
         else:
             conflicting_order = _find_existing_order_by_capture_fingerprint(
                 str(order_obj.payment_capture or "").strip(),
+                fingerprint=str(order_obj.capture_sha256 or ""),
                 exclude_order_id=order_obj.id,
                 statuses=_ACTIVE_REFERENCE_ORDER_STATUSES,
             )
@@ -4927,10 +6490,7 @@ def _send_order_completed_email_if_needed(order_obj, state: dict | None = None)
     brand = _email_brand()
     html, text = build_order_approved_email(order_obj, pkg, it)
     subject = _email_subject_for_order(order_obj, pkg, brand)
-    try:
-        send_email_html(order_obj.email, subject, html, text)
-    except Exception:
-        send_email_async(order_obj.email, subject, text)
+    send_email_html_async(order_obj.email, subject, html, text)
 
     auto_state["completion_email_sent"] = True
     auto_state["completion_email_sent_at"] = datetime.utcnow().isoformat()
@@ -5274,6 +6834,258 @@ def _thanks_progress_payload(order_obj):
     }
 
 
+# Thank-you progress memo: /gracias/<oid>/progress and the SSE stream serve
+# _thanks_progress_payload from a small per-worker cache keyed by a version
+# token computed from the order row alone (status, payment verification
+# columns, length + CRC of automation_json, the fields shown on the page) plus
+# the config version, which every admin catalog/mapping edit bumps. While the
+# token is unchanged the payload is not rebuilt, and the ETag (hash of the
+# JSON body) lets the poller get a 304. THANKS_PROGRESS_MEMO_SECONDS bounds
+# anything the token does not cover.
+_THANKS_PROGRESS_MEMO_SECONDS = max(float(os.environ.get("THANKS_PROGRESS_MEMO_SECONDS", "30") or 30), 0.0)
+_THANKS_PROGRESS_MEMO_MAX_ENTRIES = max(int(os.environ.get("THANKS_PROGRESS_MEMO_MAX_ENTRIES", "2000") or 2000), 1)
+_THANKS_PROGRESS_MEMO = OrderedDict()
+_THANKS_PROGRESS_MEMO_LOCK = threading.Lock()
+_THANKS_PROGRESS_MEMO_STATS = {"hits": 0, "misses": 0, "not_modified": 0}
+
+
+def _thanks_progress_memo_stat(name: str) -> None:
+    with _THANKS_PROGRESS_MEMO_LOCK:
+        _THANKS_PROGRESS_MEMO_STATS[name] = _THANKS_PROGRESS_MEMO_STATS.get(name, 0) + 1
+
+
+def _thanks_progress_version(order_obj) -> str:
+    automation = (order_obj.automation_json or "").encode("utf-8")
+    items = (order_obj.items_json or "").encode("utf-8")
+    parts = (
+        order_obj.id,
+        order_obj.status or "",
+        order_obj.method or "",
+        bool((order_obj.reference or "").strip()),
+        bool((order_obj.payment_capture or "").strip()),
+        order_obj.payment_verified_at.isoformat() if order_obj.payment_verified_at else "",
+        order_obj.payment_verification_id or "",
+        order_obj.payment_verification_attempts or 0,
+        len(automation),
+        zlib.crc32(automation),
+        zlib.crc32(items),
+        order_obj.store_package_id or 0,
+        order_obj.item_id or 0,
+        order_obj.customer_id or "",
+        order_obj.customer_name or "",
+        _storefront_cache_version() or "",
+    )
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+
+def _thanks_progress_cached(order_obj):
+    """Return (payload, body, etag) for the order, rebuilding only when its version changed."""
+    version = _thanks_progress_version(order_obj)
+    now_ts = time.monotonic()
+    with _THANKS_PROGRESS_MEMO_LOCK:
+        entry = _THANKS_PROGRESS_MEMO.get(order_obj.id)
+        if entry and entry["version"] == version and now_ts - entry["stored_at"] < _THANKS_PROGRESS_MEMO_SECONDS:
+            _THANKS_PROGRESS_MEMO.move_to_end(order_obj.id)
+            _THANKS_PROGRESS_MEMO_STATS["hits"] += 1
+            return entry["payload"], entry["body"], entry["etag"]
+    _thanks_progress_memo_stat("misses")
+    payload = _thanks_progress_payload(order_obj)
+    body = app.json.dumps(payload).encode("utf-8")
+    etag = hashlib.sha1(body).hexdigest()
+    with _THANKS_PROGRESS_MEMO_LOCK:
+        _THANKS_PROGRESS_MEMO[order_obj.id] = {
+            "version": version,
+            "payload": payload,
+            "body": body,
+            "etag": etag,
+            "stored_at": now_ts,
+        }
+        _THANKS_PROGRESS_MEMO.move_to_end(order_obj.id)
+        while len(_THANKS_PROGRESS_MEMO) > _THANKS_PROGRESS_MEMO_MAX_ENTRIES:
+            _THANKS_PROGRESS_MEMO.popitem(last=False)
+    return payload, body, etag
+
+
+# ==============================
+# Order progress push (SSE for /gracias/<oid>)
+# ==============================
+# Thank-you pages subscribe to /gracias/<oid>/events instead of polling every
+# 5 s. Publishing is in-process (one threading.Event per open stream) and
+# bridged across gunicorn workers and worker.py through the small
+# `order_progress_events` table: each process runs one poller thread, only
+# while it has open streams, that reads new rows once per
+# ORDER_EVENTS_POLL_SECONDS and wakes the local subscribers. An idle tab costs
+# no queries until its order changes. Events are published after commit for
+# every order whose status, automation state, payment verification or codes
+# changed (flush hook), and explicitly by the bulk UPDATEs in
+# _try_transition_order_to_approved/_auto_reject_order. Streams are capped per
+# process (ORDER_EVENTS_MAX_STREAMS) and live ORDER_EVENTS_STREAM_SECONDS
+# before the browser reconnects; the page falls back to polling
+# /gracias/<oid>/progress when the stream is refused or drops.
+_ORDER_EVENTS_ENABLED = os.environ.get("ORDER_EVENTS_ENABLED", "1").strip().lower() not in ("0", "off", "false", "no")
+_ORDER_EVENTS_POLL_SECONDS = max(float(os.environ.get("ORDER_EVENTS_POLL_SECONDS", "1.0") or 1.0), 0.1)
+# Each open stream pins one gunicorn thread: keep them to a quarter of
+# WEB_THREADS by default (and never more than half) so checkout/admin traffic
+# always has threads left.
+_WEB_THREADS = max(int(os.environ.get("WEB_THREADS", "32") or 32), 1)
+_ORDER_EVENTS_MAX_STREAMS = min(
+    max(int(os.environ.get("ORDER_EVENTS_MAX_STREAMS", "0") or 0) or _WEB_THREADS // 4, 0),
+    _WEB_THREADS // 2,
+)
+_ORDER_EVENTS_STREAM_SECONDS = max(float(os.environ.get("ORDER_EVENTS_STREAM_SECONDS", "120") or 120), 5.0)
+_ORDER_EVENTS_HEARTBEAT_SECONDS = 15.0
+_ORDER_EVENTS_RETENTION_SECONDS = 3600
+_ORDER_EVENTS_SUBSCRIBERS = {}
+_ORDER_EVENTS_LOCK = threading.Lock()
+_ORDER_EVENTS_POLLER = {"thread": None}
+_ORDER_EVENTS_STATS = {
+    "published": 0,
+    "bridge_rows_seen": 0,
+    "bridge_polls": 0,
+    "streams_opened": 0,
+    "streams_refused": 0,
+    "deltas_sent": 0,
+}
+_ORDER_PROGRESS_FIELDS = (
+    "status", "automation_json", "payment_verified_at", "payment_verification_id",
+    "delivery_code", "delivery_codes_json", "customer_name",
+)
+
+
+class OrderProgressEvent(db.Model):
+    __tablename__ = "order_progress_events"
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+def _order_events_stat(name: str, n: int = 1) -> None:
+    with _ORDER_EVENTS_LOCK:
+        _ORDER_EVENTS_STATS[name] = _ORDER_EVENTS_STATS.get(name, 0) + n
+
+
+def _order_events_wake_local(order_ids) -> None:
+    with _ORDER_EVENTS_LOCK:
+        for oid in order_ids:
+            for wake in _ORDER_EVENTS_SUBSCRIBERS.get(int(oid), ()):
+                wake.set()
+
+
+def _order_progress_publish(order_ids) -> None:
+    """Tell every process that these orders' progress changed. Call after commit."""
+    if isinstance(order_ids, int):
+        order_ids = [order_ids]
+    ids = sorted({int(oid) for oid in order_ids or () if oid})
+    if not ids or not _ORDER_EVENTS_ENABLED:
+        return
+    _order_events_wake_local(ids)
+    _order_events_stat("published", len(ids))
+    now = datetime.utcnow()
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(
+                OrderProgressEvent.__table__.insert(),
+                [{"order_id": oid, "created_at": now} for oid in ids],
+            )
+    except Exception as exc:
+        print(f"[OrderEvents] Publish error: {exc}")
+
+
+@db.event.listens_for(db.session, "after_flush")
+def _order_progress_collect_changes(session_obj, flush_context):
+    changed = set()
+    for obj in session_obj.dirty:
+        if not isinstance(obj, Order):
+            continue
+        attrs = db.inspect(obj).attrs
+        if any(attrs[name].history.has_changes() for name in _ORDER_PROGRESS_FIELDS):
+            changed.add(obj.id)
+    if changed:
+        session_obj.info.setdefault("order_progress_changed", set()).update(changed)
+
+
+def _order_progress_session_finished(session_obj, *args) -> None:
+    changed = session_obj.info.pop("order_progress_changed", None)
+    if changed:
+        _order_progress_publish(changed)
+
+
+def _order_progress_session_rolled_back(session_obj, *args) -> None:
+    session_obj.info.pop("order_progress_changed", None)
+
+
+db.event.listen(db.session, "after_commit", _order_progress_session_finished)
+db.event.listen(db.session, "after_soft_rollback", _order_progress_session_rolled_back)
+
+
+def _order_events_poller_loop() -> None:
+    """Bridge: wake local streams for rows other processes wrote to order_progress_events."""
+    table = OrderProgressEvent.__table__
+    last_id = None
+    while True:
+        with _ORDER_EVENTS_LOCK:
+            watching = set(_ORDER_EVENTS_SUBSCRIBERS)
+            if not watching:
+                _ORDER_EVENTS_POLLER["thread"] = None
+                return
+        try:
+            with app.app_context(), db.engine.connect() as conn:
+                if last_id is None:
+                    last_id = conn.execute(db.select(db.func.coalesce(db.func.max(table.c.id), 0))).scalar() or 0
+                rows = conn.execute(
+                    db.select(table.c.id, table.c.order_id)
+                    .where(table.c.id > last_id)
+                    .order_by(table.c.id.asc())
+                    .limit(1000)
+                ).all()
+            _order_events_stat("bridge_polls")
+            if rows:
+                last_id = rows[-1].id
+                _order_events_stat("bridge_rows_seen", len(rows))
+                _order_events_wake_local({r.order_id for r in rows if r.order_id in watching})
+        except Exception as exc:
+            print(f"[OrderEvents] Bridge poll error: {exc}")
+        time.sleep(_ORDER_EVENTS_POLL_SECONDS)
+
+
+def _order_events_subscribe(order_id: int):
+    """Register a stream; returns its wake Event, or None when the process is at its cap."""
+    wake = threading.Event()
+    with _ORDER_EVENTS_LOCK:
+        open_streams = sum(len(subs) for subs in _ORDER_EVENTS_SUBSCRIBERS.values())
+        if open_streams >= _ORDER_EVENTS_MAX_STREAMS:
+            _ORDER_EVENTS_STATS["streams_refused"] += 1
+            return None
+        _ORDER_EVENTS_SUBSCRIBERS.setdefault(int(order_id), set()).add(wake)
+        _ORDER_EVENTS_STATS["streams_opened"] += 1
+        if _ORDER_EVENTS_POLLER["thread"] is None:
+            t = threading.Thread(target=_order_events_poller_loop, daemon=True, name="order-events-bridge")
+            _ORDER_EVENTS_POLLER["thread"] = t
+            t.start()
+    return wake
+
+
+def _order_events_unsubscribe(order_id: int, wake) -> None:
+    with _ORDER_EVENTS_LOCK:
+        subs = _ORDER_EVENTS_SUBSCRIBERS.get(int(order_id))
+        if subs is not None:
+            subs.discard(wake)
+            if not subs:
+                _ORDER_EVENTS_SUBSCRIBERS.pop(int(order_id), None)
+
+
+def _order_events_prune() -> int:
+    table = OrderProgressEvent.__table__
+    cutoff = datetime.utcnow() - timedelta(seconds=_ORDER_EVENTS_RETENTION_SECONDS)
+    with db.engine.begin() as conn:
+        return conn.execute(table.delete().where(table.c.created_at < cutoff)).rowcount or 0
+
+
+def _thanks_progress_delta(previous: dict, payload: dict) -> dict:
+    """Top-level keys of payload that differ from what the stream already sent."""
+    return {key: value for key, value in payload.items() if previous.get(key) != value}
+
+
 def _get_order_item_entries(order_obj):
     entries = []
     try:
@@ -5833,7 +7645,7 @@ def _dispatch_minigame_reward(order_obj, prize_item_id: int, tier: int):
         unit["attempt_count"] = int(unit.get("attempt_count") or 0) + 1
         try:
             if _unit_delivery_source(unit) == "game_script_direct":
-                script_result = _dispatch_game_script_unit(unit, order_obj, remote_meta)
+                script_result = _dispatch_game_script_unit(unit, order_obj.customer_id, remote_meta)
                 _apply_dispatch_result_to_unit(unit, script_result)
             else:
                 api_data = None
@@ -5851,7 +7663,7 @@ def _dispatch_minigame_reward(order_obj, prize_item_id: int, tier: int):
                         req_kwargs["json"] = legacy_payload
                     else:
                         req_kwargs["data"] = modern_payload
-                    api_resp = _requests_lib.post(f"{webb_url}{path}", **req_kwargs)
+                    api_resp = _http_request("revendedores", "POST", f"{webb_url}{path}", **req_kwargs)
                     try:
                         api_data = api_resp.json()
                     except Exception:
@@ -5977,6 +7789,197 @@ def _dispatch_order_auto_recharges(order_obj, *, binance_auto=False):
         _order_dispatch_lock_release(lock_handle, order_obj.id)
 
 
+# Units of one order are sent concurrently through a shared executor. Each
+# delivery source has its own cap on in-flight requests for the whole process,
+# so a big cart or several orders at once cannot flood one provider.
+# DISPATCH_MAX_WORKERS bounds the executor itself.
+_DISPATCH_PROVIDER_LIMITS = {
+    "revendedores_api": max(int(os.environ.get("DISPATCH_CONCURRENCY_REVENDEDORES", "5") or 5), 1),
+    "connection_api_pin": max(int(os.environ.get("DISPATCH_CONCURRENCY_CONNECTION_API", "3") or 3), 1),
+    "game_script_direct": max(int(os.environ.get("DISPATCH_CONCURRENCY_GAME_SCRIPT", "2") or 2), 1),
+}
+_DISPATCH_PROVIDER_SLOTS = {name: threading.BoundedSemaphore(limit) for name, limit in _DISPATCH_PROVIDER_LIMITS.items()}
+_DISPATCH_MAX_WORKERS = max(int(os.environ.get("DISPATCH_MAX_WORKERS", "10") or 10), 1)
+_DISPATCH_EXECUTOR = ThreadPoolExecutor(max_workers=_DISPATCH_MAX_WORKERS, thread_name_prefix="recharge-dispatch")
+
+
+def _dispatch_recharge_unit(unit, job):
+    """Send one auto-recharge unit (with retries) and return (unit, last_error).
+
+    Runs on a dispatch worker thread: it works on its own copy of the unit and
+    only uses the plain values prepared in `job`, never the DB session or the
+    Order row. The unit's external_order_id is reused on every attempt, so the
+    provider can deduplicate retries.
+    """
+    unit = dict(unit)
+    max_attempts = job["max_attempts"]
+    retry_delay_seconds = job["retry_delay_seconds"]
+    player_id = job["player_id"]
+    order_zone = job["order_zone"]
+    webb_url = job["webb_url"]
+    webb_api_key = job["webb_api_key"]
+    remote_meta = job["remote_meta"]
+    legacy_payload = job["legacy_payload"]
+    modern_payload = job["modern_payload"]
+    package_requires_zone = job["package_requires_zone"]
+    last_error = ""
+    for attempt in range(1, max_attempts + 1):
+        unit["last_attempt_at"] = datetime.utcnow().isoformat()
+        unit["attempt_count"] = int(unit.get("attempt_count") or 0) + 1
+        provider_slot = None
+        try:
+            delivery_source = _unit_delivery_source(unit)
+            provider_slot = _DISPATCH_PROVIDER_SLOTS.get(delivery_source)
+            if provider_slot is not None:
+                provider_slot.acquire()
+            if delivery_source == "game_script_direct":
+                script_result = _dispatch_game_script_unit(unit, player_id, remote_meta)
+                _apply_dispatch_result_to_unit(unit, script_result)
+            elif delivery_source == "connection_api_pin":
+                connection_url = (os.environ.get("CONNECTION_API_URL") or "").strip().rstrip("/")
+                if not connection_url:
+                    _apply_dispatch_result_to_unit(unit, {
+                        "status": "failed",
+                        "error": "CONNECTION_API_URL no configurada para entrega de PIN",
+                        "provider": "connection_api_pin",
+                    })
+                else:
+                    pin_payload = {
+                        "package_id": str(unit.get("remote_package_id") or ""),
+                        "quantity": "1",
+                        "external_order_id": str(unit.get("external_order_id") or ""),
+                    }
+                    api_resp = _http_request(
+                        "connection_api",
+                        "POST",
+                        f"{connection_url}/api/connection/pin-purchase",
+                        data=pin_payload,
+                        headers={
+                            "X-API-Key": webb_api_key,
+                            "X-Request-ID": str(unit.get("external_order_id") or ""),
+                        },
+                        timeout=60,
+                    )
+                    try:
+                        api_data = api_resp.json()
+                    except Exception:
+                        api_data = None
+                    if api_data and api_data.get("ok"):
+                        pin_value = api_data.get("pin") or ""
+                        pins_list = api_data.get("pins") or []
+                        if not pin_value and pins_list:
+                            pin_value = ", ".join(pins_list)
+                        _apply_dispatch_result_to_unit(unit, {
+                            "status": "completed",
+                            "player_name": f"PIN: {pin_value}" if pin_value else "PIN entregado",
+                            "reference_no": api_data.get("reference_no") or api_data.get("transaction_id") or "",
+                            "remaining_balance": None,
+                            "provider": "connection_api_pin",
+                            "pin_code": pin_value,
+                            "pins": pins_list if pins_list else ([pin_value] if pin_value else []),
+                        })
+                    else:
+                        pin_error = (api_data or {}).get("error") or "PIN purchase failed"
+                        _apply_dispatch_result_to_unit(unit, {
+                            "status": "failed",
+                            "error": pin_error,
+                            "provider": "connection_api_pin",
+                        })
+            else:
+                api_data = None
+                response_error = ""
+                api_resp = None
+                for path in _revendedores_recharge_paths():
+                    use_legacy_api = path.strip().startswith("/api/v1/")
+                    headers = {
+                        "X-API-Key": webb_api_key,
+                        "X-Request-ID": str(unit.get("external_order_id") or ""),
+                    }
+                    req_kwargs = {"headers": headers, "timeout": 60}
+                    if use_legacy_api:
+                        headers["Content-Type"] = "application/json"
+                        req_kwargs["json"] = legacy_payload
+                    else:
+                        req_kwargs["data"] = modern_payload
+
+                    api_resp = _http_request("revendedores", "POST", f"{webb_url}{path}", **req_kwargs)
+                    try:
+                        api_data = api_resp.json()
+                    except Exception:
+                        api_data = None
+
+                    if api_resp.status_code in (404, 405) and not use_legacy_api:
+                        response_error = f"HTTP {api_resp.status_code} en {path}"
+                        api_data = None
+                        continue
+
+                    if api_data is None:
+                        response_error = f"Respuesta inválida HTTP {api_resp.status_code} en {path}"
+                        if not use_legacy_api:
+                            continue
+                        api_data = {"ok": False, "error": response_error}
+
+                    break
+
+                if api_data is None:
+                    api_data = {"ok": False, "error": response_error or "No se pudo conectar con Revendedores"}
+                if api_data.get("ok"):
+                    _apply_dispatch_result_to_unit(unit, {
+                        "status": "completed",
+                        "player_name": api_data.get("player_name"),
+                        "reference_no": api_data.get("reference_no"),
+                        "remaining_balance": api_data.get("remaining_balance"),
+                        "provider": "revendedores_api",
+                    })
+                else:
+                    unit_status = str(api_data.get("purchase_status") or api_data.get("status") or "").strip().lower()
+                    unit_error = str(api_data.get("error") or api_data.get("message") or "Recarga no completada en Revendedores")
+                    if _revendedores_missing_zone_error(unit_error) and not order_zone:
+                        unit_error = (
+                            "El mapeo automático apunta a un paquete remoto que requiere Zone ID / input2. Revisa el mapeo de Revendedores de este item."
+                            if not package_requires_zone else
+                            "El proveedor pidió Zone ID / input2 y la orden no lo tiene."
+                        )
+                    if unit_status in {"processing", "procesando", "pending", "pendiente", "queued", "en_cola", "en cola"}:
+                        mapped_status = "processing"
+                    elif unit_status in {"not_found", "no_encontrada", "no encontrada"}:
+                        mapped_status = "not_found"
+                    elif api_resp is not None and api_resp.status_code == 404:
+                        mapped_status = "not_found"
+                    else:
+                        mapped_status = "failed"
+                    _apply_dispatch_result_to_unit(unit, {
+                        "status": mapped_status,
+                        "error": unit_error,
+                        "provider": "revendedores_api",
+                    })
+
+            if unit.get("status") == "completed":
+                last_error = ""
+                break
+            last_error = str(unit.get("error") or last_error)
+        except _requests_lib.exceptions.Timeout:
+            providers = {"game_script_direct": "Game Script", "revendedores_api": "Revendedores", "connection_api_pin": "Connection API"}
+            provider_name = providers.get(_unit_delivery_source(unit), "Revendedores")
+            unit["status"] = "processing"
+            unit["error"] = f"{provider_name} no respondió en 60 segundos"
+            last_error = unit["error"]
+        except Exception as exc:
+            unit["status"] = "processing"
+            unit["error"] = str(exc)
+            last_error = unit["error"]
+        finally:
+            if provider_slot is not None:
+                provider_slot.release()
+
+        if unit.get("status") == "completed":
+            break
+        if attempt < max_attempts:
+            time.sleep(retry_delay_seconds)
+
+    return unit, last_error
+
+
 def _dispatch_order_auto_recharges_locked(order_obj, *, binance_auto=False):
     max_attempts = 3
     retry_delay_seconds = 2
@@ -6060,11 +8063,12 @@ def _dispatch_order_auto_recharges_locked(order_obj, *, binance_auto=False):
 
     retryable_statuses = {"pending", "failed", "not_found"}
     last_error = ""
-    while True:
-        units_to_send = [unit for unit in units if (unit.get("status") or "") in retryable_statuses]
-        if not units_to_send:
-            break
-        unit = units_to_send[0]
+    package_requires_zone = _package_effective_requires_zone(order_obj.store_package_id)
+    order_zone = (order_obj.customer_zone or "").strip()
+    jobs = []
+    for index, unit in enumerate(units):
+        if (unit.get("status") or "") not in retryable_statuses:
+            continue
         unit["last_provider"] = _unit_delivery_source(unit)
         # For direct_to_pin units without a real player_id, use a placeholder so
         # Revendedores API accepts the request (it requires player_id as a string).
@@ -6077,7 +8081,6 @@ def _dispatch_order_auto_recharges_locked(order_obj, *, binance_auto=False):
             "player_id": effective_player_id,
             "external_order_id": unit.get("external_order_id"),
         }
-        order_zone = (order_obj.customer_zone or "").strip()
         if order_zone:
             legacy_payload["player_id2"] = order_zone
 
@@ -6089,184 +8092,60 @@ def _dispatch_order_auto_recharges_locked(order_obj, *, binance_auto=False):
         )
         if effective_remote_product_id is not None:
             legacy_payload["product_id"] = effective_remote_product_id
-        package_requires_zone = _package_effective_requires_zone(order_obj.store_package_id)
         remote_requires_zone = _revendedores_catalog_requires_player_id2(remote_meta)
         if remote_requires_zone and not order_zone:
             unit["status"] = "failed"
             unit["error"] = (
-                "El paquete remoto mapeado requiere Zone ID / segundo ID. Revisa el mapeo de Revendedores para este item."
-                if not package_requires_zone else
-                "La recarga automática requiere Zone ID para este mapeo y la orden no lo tiene."
-            )
-            last_error = unit["error"]
-            break
-
-        modern_payload = {
-            "api_key": webb_api_key,
-            "package_id": str(remote_meta.get("package_id") or remote_meta.get("remote_local_package_id") or unit.get("remote_package_id") or ""),
-            "player_id": effective_player_id,
-            "request_id": str(unit.get("external_order_id") or ""),
-            "external_order_id": str(unit.get("external_order_id") or ""),
-        }
-        if effective_remote_product_id is not None:
-            modern_payload["product_id"] = str(effective_remote_product_id)
-        provider_package_id = remote_meta.get("provider_package_id") or remote_meta.get("gamepoint_package_id")
-        if provider_package_id not in (None, "", 0, "0"):
-            modern_payload["provider_package_id"] = str(provider_package_id)
-        provider_package_key = (remote_meta.get("provider_package_key") or remote_meta.get("script_package_key") or "").strip()
-        if provider_package_key:
-            modern_payload["provider_package_key"] = provider_package_key
-        if order_zone:
-            modern_payload["player_id2"] = order_zone
-
-        for attempt in range(1, max_attempts + 1):
-            unit["last_attempt_at"] = datetime.utcnow().isoformat()
-            unit["attempt_count"] = int(unit.get("attempt_count") or 0) + 1
-            try:
-                delivery_source = _unit_delivery_source(unit)
-                if delivery_source == "game_script_direct":
-                    script_result = _dispatch_game_script_unit(unit, order_obj, remote_meta)
-                    _apply_dispatch_result_to_unit(unit, script_result)
-                elif delivery_source == "connection_api_pin":
-                    connection_url = (os.environ.get("CONNECTION_API_URL") or "").strip().rstrip("/")
-                    if not connection_url:
-                        _apply_dispatch_result_to_unit(unit, {
-                            "status": "failed",
-                            "error": "CONNECTION_API_URL no configurada para entrega de PIN",
-                            "provider": "connection_api_pin",
-                        })
-                    else:
-                        pin_payload = {
-                            "package_id": str(unit.get("remote_package_id") or ""),
-                            "quantity": "1",
-                            "external_order_id": str(unit.get("external_order_id") or ""),
-                        }
-                        api_resp = _requests_lib.post(
-                            f"{connection_url}/api/connection/pin-purchase",
-                            data=pin_payload,
-                            headers={
-                                "X-API-Key": webb_api_key,
-                                "X-Request-ID": str(unit.get("external_order_id") or ""),
-                            },
-                            timeout=60,
-                        )
-                        try:
-                            api_data = api_resp.json()
-                        except Exception:
-                            api_data = None
-                        if api_data and api_data.get("ok"):
-                            pin_value = api_data.get("pin") or ""
-                            pins_list = api_data.get("pins") or []
-                            if not pin_value and pins_list:
-                                pin_value = ", ".join(pins_list)
-                            _apply_dispatch_result_to_unit(unit, {
-                                "status": "completed",
-                                "player_name": f"PIN: {pin_value}" if pin_value else "PIN entregado",
-                                "reference_no": api_data.get("reference_no") or api_data.get("transaction_id") or "",
-                                "remaining_balance": None,
-                                "provider": "connection_api_pin",
-                                "pin_code": pin_value,
-                                "pins": pins_list if pins_list else ([pin_value] if pin_value else []),
-                            })
-                        else:
-                            pin_error = (api_data or {}).get("error") or "PIN purchase failed"
-                            _apply_dispatch_result_to_unit(unit, {
-                                "status": "failed",
-                                "error": pin_error,
-                                "provider": "connection_api_pin",
-                            })
-                else:
-                    api_data = None
-                    response_error = ""
-                    api_resp = None
-                    for path in _revendedores_recharge_paths():
-                        use_legacy_api = path.strip().startswith("/api/v1/")
-                        headers = {
-                            "X-API-Key": webb_api_key,
-                            "X-Request-ID": str(unit.get("external_order_id") or ""),
-                        }
-                        req_kwargs = {"headers": headers, "timeout": 60}
-                        if use_legacy_api:
-                            headers["Content-Type"] = "application/json"
-                            req_kwargs["json"] = legacy_payload
-                        else:
-                            req_kwargs["data"] = modern_payload
-
-                        api_resp = _requests_lib.post(f"{webb_url}{path}", **req_kwargs)
-                        try:
-                            api_data = api_resp.json()
-                        except Exception:
-                            api_data = None
-
-                        if api_resp.status_code in (404, 405) and not use_legacy_api:
-                            response_error = f"HTTP {api_resp.status_code} en {path}"
-                            api_data = None
-                            continue
-
-                        if api_data is None:
-                            response_error = f"Respuesta inválida HTTP {api_resp.status_code} en {path}"
-                            if not use_legacy_api:
-                                continue
-                            api_data = {"ok": False, "error": response_error}
-
-                        break
-
-                    if api_data is None:
-                        api_data = {"ok": False, "error": response_error or "No se pudo conectar con Revendedores"}
-                    if api_data.get("ok"):
-                        _apply_dispatch_result_to_unit(unit, {
-                            "status": "completed",
-                            "player_name": api_data.get("player_name"),
-                            "reference_no": api_data.get("reference_no"),
-                            "remaining_balance": api_data.get("remaining_balance"),
-                            "provider": "revendedores_api",
-                        })
-                    else:
-                        unit_status = str(api_data.get("purchase_status") or api_data.get("status") or "").strip().lower()
-                        unit_error = str(api_data.get("error") or api_data.get("message") or "Recarga no completada en Revendedores")
-                        if _revendedores_missing_zone_error(unit_error) and not order_zone:
-                            unit_error = (
-                                "El mapeo automático apunta a un paquete remoto que requiere Zone ID / input2. Revisa el mapeo de Revendedores de este item."
-                                if not package_requires_zone else
-                                "El proveedor pidió Zone ID / input2 y la orden no lo tiene."
-                            )
-                        if unit_status in {"processing", "procesando", "pending", "pendiente", "queued", "en_cola", "en cola"}:
-                            mapped_status = "processing"
-                        elif unit_status in {"not_found", "no_encontrada", "no encontrada"}:
-                            mapped_status = "not_found"
-                        elif api_resp is not None and api_resp.status_code == 404:
-                            mapped_status = "not_found"
-                        else:
-                            mapped_status = "failed"
-                        _apply_dispatch_result_to_unit(unit, {
-                            "status": mapped_status,
-                            "error": unit_error,
-                            "provider": "revendedores_api",
-                        })
-
-                if unit.get("status") == "completed":
-                    last_error = ""
-                    break
-                last_error = str(unit.get("error") or last_error)
-            except _requests_lib.exceptions.Timeout:
-                providers = {"game_script_direct": "Game Script", "revendedores_api": "Revendedores", "connection_api_pin": "Connection API"}
-                provider_name = providers.get(_unit_delivery_source(unit), "Revendedores")
-                unit["status"] = "processing"
-                unit["error"] = f"{provider_name} no respondió en 60 segundos"
-                last_error = unit["error"]
-            except Exception as exc:
-                unit["status"] = "processing"
-                unit["error"] = str(exc)
-                last_error = unit["error"]
+                "El paquete remoto mapeado requiere Zone ID / segundo ID. Revisa el mapeo de Revendedores para este item."
+                if not package_requires_zone else
+                "La recarga automática requiere Zone ID para este mapeo y la orden no lo tiene."
+            )
+            last_error = last_error or unit["error"]
+            continue
 
-            if unit.get("status") == "completed":
-                break
-            if attempt < max_attempts:
-                time.sleep(retry_delay_seconds)
+        modern_payload = {
+            "api_key": webb_api_key,
+            "package_id": str(remote_meta.get("package_id") or remote_meta.get("remote_local_package_id") or unit.get("remote_package_id") or ""),
+            "player_id": effective_player_id,
+            "request_id": str(unit.get("external_order_id") or ""),
+            "external_order_id": str(unit.get("external_order_id") or ""),
+        }
+        if effective_remote_product_id is not None:
+            modern_payload["product_id"] = str(effective_remote_product_id)
+        provider_package_id = remote_meta.get("provider_package_id") or remote_meta.get("gamepoint_package_id")
+        if provider_package_id not in (None, "", 0, "0"):
+            modern_payload["provider_package_id"] = str(provider_package_id)
+        provider_package_key = (remote_meta.get("provider_package_key") or remote_meta.get("script_package_key") or "").strip()
+        if provider_package_key:
+            modern_payload["provider_package_key"] = provider_package_key
+        if order_zone:
+            modern_payload["player_id2"] = order_zone
 
-        if unit.get("status") == "completed":
-            continue
-        break
+        jobs.append((index, {
+            "max_attempts": max_attempts,
+            "retry_delay_seconds": retry_delay_seconds,
+            "player_id": player_id,
+            "order_zone": order_zone,
+            "webb_url": webb_url,
+            "webb_api_key": webb_api_key,
+            "remote_meta": remote_meta,
+            "legacy_payload": legacy_payload,
+            "modern_payload": modern_payload,
+            "package_requires_zone": package_requires_zone,
+        }))
+
+    futures = [(index, _DISPATCH_EXECUTOR.submit(_dispatch_recharge_unit, units[index], job)) for index, job in jobs]
+    # Merge every result before touching automation_json, so the state below is
+    # written once, in a single commit, with all units' outcomes.
+    for index, future in futures:
+        try:
+            units[index], unit_error = future.result()
+        except Exception as exc:
+            units[index]["status"] = "processing"
+            units[index]["error"] = str(exc)
+            unit_error = units[index]["error"]
+        if unit_error and not last_error:
+            last_error = unit_error
 
     summary = _summarize_order_auto_recharges(units)
     state["units"] = units
@@ -6372,6 +8251,17 @@ class MinigameWinner(db.Model):
 # UPDATE condicional que garantiza que un código no se use dos veces aunque
 # lleguen dos peticiones a la vez.
 
+# Índices secundarios de gift_codes (nombre -> columnas). Declarados en el
+# modelo para create_all y aplicados a bases existentes por
+# _ensure_gift_codes_table_ready().
+_GIFT_CODE_MANAGED_INDEXES = (
+    # Listado paginado por cursor y exportación en orden de creación
+    ("ix_gift_codes_created_at_id", ("created_at", "id")),
+    # Totales y lotes del panel (_gift_stats_and_batches) sin leer la tabla
+    ("ix_gift_codes_batch_used_active", ("batch", "is_used", "active")),
+)
+
+
 class GiftCode(db.Model):
     __tablename__ = "gift_codes"
     id = db.Column(db.Integer, primary_key=True)
@@ -6394,13 +8284,22 @@ class GiftCode(db.Model):
     delivered = db.Column(db.Boolean, default=False)
     expires_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = tuple(db.Index(index_name, *index_cols) for index_name, index_cols in _GIFT_CODE_MANAGED_INDEXES)
 
 
 # Sin 0/O/1/I/L para que nadie se equivoque al copiar un código de un video.
 GIFT_CODE_ALPHABET = "23456789ABCDEFGHJKMNPQRSTUVWXYZ"
 GIFT_CODE_BLOCK = 4
 GIFT_CODE_BLOCKS = 3  # 3 bloques de 4 = 12 caracteres útiles
-GIFT_MAX_BATCH_SIZE = 500
+# Los lotes grandes (promociones) se generan por bloques: un IN (...) por bloque
+# para descartar choques con códigos existentes y un INSERT masivo (ver
+# _gift_create_batch). Con 31^12 combinaciones los choques son rarísimos.
+GIFT_MAX_BATCH_SIZE = max(int(os.environ.get("GIFT_MAX_BATCH_SIZE", "50000") or 50000), 1)
+GIFT_BULK_BLOCK_SIZE = 1000
+GIFT_LIST_PAGE_SIZE = 200
+GIFT_EXPORT_CHUNK_SIZE = 2000
+# Columnas opcionales del CSV de exportación, en este orden.
+GIFT_EXPORT_COLUMNS = ("prize", "batch", "expires_at")
 GIFT_ATTEMPT_LIMIT = 12
 GIFT_ATTEMPT_WINDOW_MINUTES = 15
 GIFT_ENABLED_KEY = "gift_redeem_enabled"
@@ -6446,6 +8345,26 @@ def _gift_generate_code() -> str:
     return "".join(secrets.choice(GIFT_CODE_ALPHABET) for _ in range(GIFT_CODE_BLOCK * GIFT_CODE_BLOCKS))
 
 
+def _gift_generate_codes(n: int) -> set:
+    """`n` códigos distintos entre sí (misma distribución que _gift_generate_code).
+
+    Un solo secrets.randbelow por código, escrito en base len(alfabeto), en vez
+    de un secrets.choice por carácter.
+    """
+    base = len(GIFT_CODE_ALPHABET)
+    length = GIFT_CODE_BLOCK * GIFT_CODE_BLOCKS
+    space = base ** length
+    codes = set()
+    while len(codes) < n:
+        value = secrets.randbelow(space)
+        chars = []
+        for _ in range(length):
+            value, digit = divmod(value, base)
+            chars.append(GIFT_CODE_ALPHABET[digit])
+        codes.add("".join(chars))
+    return codes
+
+
 def _gift_fmt_ve(value) -> str:
     """Fecha en hora de Venezuela. Las columnas se guardan en UTC naive."""
     if not value:
@@ -6542,7 +8461,12 @@ def _gift_item_is_eligible(item_id) -> bool:
 
 
 def _gift_create_batch(item_id, quantity, batch="", source="", expires_at=None):
-    """Genera `quantity` códigos para un ítem. Devuelve la lista creada."""
+    """Genera `quantity` códigos para un ítem. Devuelve (códigos, premio).
+
+    Los candidatos salen por bloques de GIFT_BULK_BLOCK_SIZE: un IN (...) por
+    bloque descarta los que ya existen, se rellena lo que falte y el bloque se
+    inserta de una vez. Todo el lote va en una sola transacción.
+    """
     item = GamePackageItem.query.get(int(item_id or 0))
     if not item:
         raise ValueError("El paquete no existe.")
@@ -6556,33 +8480,64 @@ def _gift_create_batch(item_id, quantity, batch="", source="", expires_at=None):
         raise ValueError(f"Máximo {GIFT_MAX_BATCH_SIZE} códigos por lote.")
 
     pkg = StorePackage.query.get(int(item.store_package_id))
-    prize_title = f"{pkg.name} - {item.title}" if pkg else str(item.title or "")
+    prize_title = (f"{pkg.name} - {item.title}" if pkg else str(item.title or ""))[:300]
+    row_base = {
+        "store_package_id": int(item.store_package_id),
+        "item_id": int(item.id),
+        "prize_title": prize_title,
+        "batch": (batch or "").strip()[:60],
+        "source": (source or "").strip()[:30],
+        "expires_at": expires_at,
+        "created_at": datetime.utcnow(),
+    }
+    table = GiftCode.__table__
 
     creados = []
-    for _ in range(quantity):
-        # Reintenta si el azar repite un código ya existente.
-        for _ in range(8):
-            code = _gift_generate_code()
-            if not GiftCode.query.filter_by(code=code).first():
-                break
-        else:
-            db.session.rollback()
-            raise RuntimeError("No se pudieron generar códigos únicos, intenta de nuevo.")
-
-        gift = GiftCode(
-            code=code,
-            store_package_id=int(item.store_package_id),
-            item_id=int(item.id),
-            prize_title=prize_title[:300],
-            batch=(batch or "").strip()[:60],
-            source=(source or "").strip()[:30],
-            expires_at=expires_at,
-        )
-        db.session.add(gift)
-        creados.append(gift)
-
-    db.session.commit()
-    return creados
+    try:
+        while len(creados) < quantity:
+            want = min(GIFT_BULK_BLOCK_SIZE, quantity - len(creados))
+            block = set()
+            # Reintenta si el azar repite un código ya existente.
+            for _ in range(8):
+                candidates = _gift_generate_codes(want - len(block)) - block
+                taken = {
+                    row[0] for row in db.session.execute(
+                        db.select(table.c.code).where(table.c.code.in_(sorted(candidates)))
+                    )
+                }
+                block |= candidates - taken
+                if len(block) >= want:
+                    break
+            else:
+                raise RuntimeError("No se pudieron generar códigos únicos, intenta de nuevo.")
+            codes = sorted(block)
+            db.session.execute(table.insert(), [{**row_base, "code": code} for code in codes])
+            creados.extend(codes)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return creados, prize_title
+
+
+def _gift_stats_and_batches():
+    """Totales del panel y lista de lotes con una sola consulta agrupada por lote."""
+    disponible = db.and_(GiftCode.is_used == False, GiftCode.active == True)
+    rows = db.session.query(
+        GiftCode.batch,
+        db.func.count(GiftCode.id),
+        db.func.count(GiftCode.id).filter(GiftCode.is_used == True),
+        db.func.count(GiftCode.id).filter(disponible),
+    ).group_by(GiftCode.batch).all()
+    stats = {"total": 0, "used": 0, "available": 0}
+    lotes = set()
+    for lote, total, usados, disponibles in rows:
+        stats["total"] += int(total or 0)
+        stats["used"] += int(usados or 0)
+        stats["available"] += int(disponibles or 0)
+        if (lote or "").strip():
+            lotes.add(lote.strip())
+    return stats, sorted(lotes)
 
 
 def _gift_find_code(raw_code):
@@ -6914,17 +8869,45 @@ def admin_gift_codes_list():
     if package_id.isdigit():
         query = query.filter(GiftCode.store_package_id == int(package_id))
 
-    codes = query.order_by(GiftCode.created_at.desc(), GiftCode.id.desc()).limit(500).all()
+    page_size = min(max(request.args.get("limit", type=int) or GIFT_LIST_PAGE_SIZE, 1), 500)
+    after = _keyset_parse_cursor(request.args.get("after") or "")
+    if after:
+        after_created, after_id = after
+        query = query.filter(
+            GiftCode.created_at <= after_created,
+            db.or_(GiftCode.created_at < after_created, GiftCode.id < after_id),
+        )
+    codes = query.order_by(GiftCode.created_at.desc(), GiftCode.id.desc()).limit(page_size + 1).all()
+    next_cursor = _keyset_cursor(codes[page_size - 1]) if len(codes) > page_size else None
+    codes = codes[:page_size]
 
-    total = GiftCode.query.count()
-    usados = GiftCode.query.filter(GiftCode.is_used == True).count()
-    disponibles = GiftCode.query.filter(GiftCode.is_used == False, GiftCode.active == True).count()
+    ahora = datetime.utcnow()
+    page = [
+        {
+            "id": g.id,
+            "code": _gift_format_code(g.code),
+            "prize": g.prize_title or "",
+            "batch": g.batch or "",
+            "source": g.source or "",
+            "active": bool(g.active),
+            "is_used": bool(g.is_used),
+            "delivered": bool(g.delivered),
+            "expired": bool(g.expires_at and g.expires_at < ahora),
+            "expires_at": _gift_fmt_ve(g.expires_at),
+            "used_at": _gift_fmt_ve(g.used_at),
+            "used_player_id": g.used_player_id or "",
+            "used_zone_id": g.used_zone_id or "",
+            "used_nickname": g.used_nickname or "",
+            "order_id": int(g.order_id or 0),
+            "created_at": _gift_fmt_ve(g.created_at),
+        }
+        for g in codes
+    ]
+    # "Cargar más" solo necesita la página siguiente.
+    if after:
+        return jsonify({"ok": True, "codes": page, "next_cursor": next_cursor})
 
-    lotes = sorted({
-        (row[0] or "").strip()
-        for row in db.session.query(GiftCode.batch).distinct().all()
-        if (row[0] or "").strip()
-    })
+    stats, lotes = _gift_stats_and_batches()
 
     # Cada juego con sus ítems: el ítem ES la recarga que va a entregar el
     # código, así que se elige juego y después monto.
@@ -6935,34 +8918,14 @@ def admin_gift_codes_list():
         entry = games.setdefault(pkg.id, {"id": pkg.id, "name": pkg.name, "items": []})
         entry["items"].append({"id": item.id, "title": item.title, "price": float(item.price or 0.0)})
 
-    ahora = datetime.utcnow()
     return jsonify({
         "ok": True,
         "enabled": _gift_redeem_enabled(),
-        "stats": {"total": total, "used": usados, "available": disponibles},
+        "stats": stats,
         "batches": lotes,
         "games": list(games.values()),
-        "codes": [
-            {
-                "id": g.id,
-                "code": _gift_format_code(g.code),
-                "prize": g.prize_title or "",
-                "batch": g.batch or "",
-                "source": g.source or "",
-                "active": bool(g.active),
-                "is_used": bool(g.is_used),
-                "delivered": bool(g.delivered),
-                "expired": bool(g.expires_at and g.expires_at < ahora),
-                "expires_at": _gift_fmt_ve(g.expires_at),
-                "used_at": _gift_fmt_ve(g.used_at),
-                "used_player_id": g.used_player_id or "",
-                "used_zone_id": g.used_zone_id or "",
-                "used_nickname": g.used_nickname or "",
-                "order_id": int(g.order_id or 0),
-                "created_at": _gift_fmt_ve(g.created_at),
-            }
-            for g in codes
-        ],
+        "codes": page,
+        "next_cursor": next_cursor,
     })
 
 
@@ -6979,7 +8942,7 @@ def admin_gift_codes_generate():
         return jsonify({"ok": False, "error": "La fecha de vencimiento no es válida."}), 400
 
     try:
-        creados = _gift_create_batch(
+        creados, premio = _gift_create_batch(
             data.get("item_id"),
             data.get("quantity"),
             batch=data.get("batch") or "",
@@ -6995,29 +8958,67 @@ def admin_gift_codes_generate():
     return jsonify({
         "ok": True,
         "created": len(creados),
-        "prize": creados[0].prize_title if creados else "",
-        "codes": [_gift_format_code(g.code) for g in creados],
+        "prize": premio,
+        "codes": [_gift_format_code(code) for code in creados],
     })
 
 
 @app.route("/admin/gift-codes/export", methods=["GET"])
 def admin_gift_codes_export():
-    """Descarga los códigos sin usar como texto plano, listos para repartir."""
+    """Descarga los códigos sin usar, listos para repartir.
+
+    ?format=txt (por defecto) da un código por línea; ?format=csv agrega las
+    columnas pedidas en ?columns=prize,batch,expires_at. La respuesta se arma
+    por bloques mientras se lee la tabla, así que la memoria no crece con el
+    tamaño del lote.
+    """
     user = session.get("user")
     if not user or user.get("role") != "admin":
         return jsonify({"ok": False, "error": "No autorizado"}), 401
 
     batch_filter = (request.args.get("batch") or "").strip()
-    query = GiftCode.query.filter(GiftCode.is_used == False, GiftCode.active == True)
+    formato = (request.args.get("format") or "txt").strip().lower()
+    if formato not in ("txt", "csv"):
+        return jsonify({"ok": False, "error": "Formato no válido (txt o csv)"}), 400
+    pedidas = {c.strip().lower() for c in (request.args.get("columns") or "").split(",") if c.strip()}
+    columnas = [c for c in GIFT_EXPORT_COLUMNS if c in pedidas] if formato == "csv" else []
+
+    stmt = (
+        db.select(GiftCode.code, GiftCode.prize_title, GiftCode.batch, GiftCode.expires_at)
+        .where(GiftCode.is_used == False, GiftCode.active == True)
+        .order_by(GiftCode.created_at.asc(), GiftCode.id.asc())
+        .execution_options(yield_per=GIFT_EXPORT_CHUNK_SIZE)
+    )
     if batch_filter:
-        query = query.filter(GiftCode.batch == batch_filter)
-    codes = query.order_by(GiftCode.created_at.asc()).all()
+        stmt = stmt.where(GiftCode.batch == batch_filter)
+
+    def _csv_line(values) -> str:
+        buf = io.StringIO()
+        csv.writer(buf, lineterminator="\n").writerow(values)
+        return buf.getvalue()
+
+    def generar():
+        with app.app_context():
+            if formato == "csv":
+                yield _csv_line(["code", *columnas])
+            primero = True
+            for filas in db.session.execute(stmt).partitions():
+                if formato == "csv":
+                    buf = io.StringIO()
+                    writer = csv.writer(buf, lineterminator="\n")
+                    for fila in filas:
+                        extra = {"prize": fila.prize_title or "", "batch": fila.batch or "", "expires_at": _gift_fmt_ve(fila.expires_at)}
+                        writer.writerow([_gift_format_code(fila.code), *(extra[c] for c in columnas)])
+                    yield buf.getvalue()
+                else:
+                    bloque = "\n".join(_gift_format_code(fila.code) for fila in filas)
+                    yield bloque if primero else "\n" + bloque
+                primero = False
 
-    cuerpo = "\n".join(_gift_format_code(g.code) for g in codes)
-    nombre = "codigos-{}.txt".format((batch_filter or "todos").replace(" ", "-"))
+    nombre = "codigos-{}.{}".format((batch_filter or "todos").replace(" ", "-"), formato)
     return Response(
-        cuerpo,
-        mimetype="text/plain; charset=utf-8",
+        generar(),
+        mimetype=("text/csv" if formato == "csv" else "text/plain") + "; charset=utf-8",
         headers={"Content-Disposition": 'attachment; filename="{}"'.format(nombre)},
     )
 
@@ -7124,6 +9125,149 @@ def _ensure_gift_codes_table_ready():
             db.create_all()
         except Exception:
             pass
+    # create_all no agrega índices a una tabla que ya existía
+    created = _ensure_managed_indexes("gift_codes", _GIFT_CODE_MANAGED_INDEXES)
+    if created:
+        print(f"[Migration] Created gift_codes indexes: {', '.join(created)}")
+
+
+# Session-level advisory lock serialising the boot-time index checks of all processes
+_INDEX_MIGRATION_LOCK_KEY = 4_000_000_001
+
+
+def _run_index_migration_locked(label: str, fn) -> bool:
+    """Call fn(conn) on an AUTOCOMMIT Postgres connection holding _INDEX_MIGRATION_LOCK_KEY.
+
+    Every gunicorn worker and worker.py check indexes at boot. A process that
+    does not get the lock skips the check instead of mistaking another
+    process's in-progress CONCURRENTLY build (also indisvalid = false) for an
+    interrupted leftover and dropping it. Returns False when skipped.
+    """
+    from sqlalchemy import text
+
+    with db.engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _INDEX_MIGRATION_LOCK_KEY}).scalar():
+            print(f"[Migration] {label}: otro proceso los está revisando, se omite")
+            return False
+        try:
+            fn(conn)
+        finally:
+            try:
+                conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _INDEX_MIGRATION_LOCK_KEY})
+            except Exception:
+                pass
+    return True
+
+
+def _ensure_managed_indexes_pg(conn, table: str, indexes, created: list) -> dict:
+    """Build the missing or INVALID indexes of `table` concurrently; conn must hold the lock.
+
+    Returns {index name: indisvalid} for the table as read before any change.
+    """
+    from sqlalchemy import text
+
+    rows = conn.execute(text(
+        "SELECT c.relname, i.indisvalid FROM pg_index i "
+        "JOIN pg_class c ON c.oid = i.indexrelid "
+        "JOIN pg_class t ON t.oid = i.indrelid "
+        "WHERE t.relname = :table"
+    ), {"table": table}).fetchall()
+    existing = {str(row[0]): bool(row[1]) for row in rows}
+    for index_name, index_cols in indexes:
+        if existing.get(index_name) is True:
+            continue
+        try:
+            if index_name in existing:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+            conn.execute(text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {table} ({', '.join(index_cols)})"
+            ))
+            created.append(index_name)
+        except Exception as exc:
+            print(f"[Migration] index {index_name}: {exc}")
+    return existing
+
+
+def _ensure_managed_indexes(table: str, indexes) -> list:
+    """Create any missing index from `indexes` (name -> columns) on an existing table.
+
+    Postgres builds them with CREATE INDEX CONCURRENTLY (outside a transaction)
+    under _run_index_migration_locked, so the table keeps accepting writes
+    while the index is built. SQLite just uses CREATE INDEX IF NOT EXISTS.
+    """
+    from sqlalchemy import text
+
+    created = []
+    if db.engine.dialect.name == "postgresql":
+        _run_index_migration_locked(
+            f"{table} indexes",
+            lambda conn: _ensure_managed_indexes_pg(conn, table, indexes, created),
+        )
+        return created
+    for index_name, index_cols in indexes:
+        try:
+            db.session.execute(text(
+                f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({', '.join(index_cols)})"
+            ))
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            print(f"[Migration] index {index_name}: {exc}")
+    return created
+
+
+def _ensure_order_indexes_pg(conn, created: list) -> None:
+    """Postgres half of _ensure_order_indexes; conn is AUTOCOMMIT and holds the lock."""
+    from sqlalchemy import text
+
+    existing = _ensure_managed_indexes_pg(conn, "orders", _ORDER_MANAGED_INDEXES, created)
+    try:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for index_name, col in _ORDER_SEARCH_TRGM_INDEXES:
+            if existing.get(index_name) is True:
+                continue
+            if index_name in existing:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+            conn.execute(text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON orders USING gin (lower({col}) gin_trgm_ops)"
+            ))
+            created.append(index_name)
+    except Exception as exc:
+        print(f"[Migration] trigram search indexes: {exc}")
+    for index_name in _ORDER_RETIRED_INDEXES:
+        if index_name in existing:
+            try:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+            except Exception as exc:
+                print(f"[Migration] drop index {index_name}: {exc}")
+
+
+def _ensure_order_indexes():
+    """Create any missing index from _ORDER_MANAGED_INDEXES on an existing orders table.
+
+    Same path as _ensure_managed_indexes: concurrent, advisory-locked builds on
+    Postgres, where an INVALID leftover from an interrupted build is dropped
+    and rebuilt. Postgres also gets the trigram search indexes when pg_trgm is
+    available. Retired indexes are dropped.
+    """
+    from sqlalchemy import text
+
+    created = []
+    if db.engine.dialect.name == "postgresql":
+        _run_index_migration_locked("order indexes", lambda conn: _ensure_order_indexes_pg(conn, created))
+    else:
+        for index_name in _ORDER_RETIRED_INDEXES:
+            try:
+                db.session.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+                db.session.commit()
+            except Exception as exc:
+                db.session.rollback()
+                print(f"[Migration] drop index {index_name}: {exc}")
+        created = _ensure_managed_indexes("orders", _ORDER_MANAGED_INDEXES)
+    if created:
+        print(f"[Migration] Created order indexes: {', '.join(created)}")
+    return created
 
 
 def _ensure_minigame_tables_ready():
@@ -7222,12 +9366,33 @@ with app.app_context():
             add_order_col('payment_verified_at', f"payment_verified_at {'TIMESTAMP' if _is_pg else 'TEXT'}")
             add_order_col('payment_verification_attempts', "payment_verification_attempts INTEGER DEFAULT 0")
             add_order_col('payment_last_verification_at', f"payment_last_verification_at {'TIMESTAMP' if _is_pg else 'TEXT'}")
+            # Sin DEFAULT a propósito: NULL marca las filas que faltan por rellenar
+            add_order_col('reference_norm', "reference_norm TEXT")
+            add_order_col('capture_reference_norm', "capture_reference_norm TEXT")
+            add_order_col('capture_sha256', "capture_sha256 TEXT")
+            add_order_col('reference_match_key', "reference_match_key TEXT")
+            add_order_col('method_norm', "method_norm TEXT")
             db.session.commit()
             try:
                 db.session.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_orders_idempotency_key ON orders (idempotency_key)"))
                 db.session.commit()
             except Exception:
                 db.session.rollback()
+            _ensure_order_indexes()
+            try:
+                n_backfilled = _backfill_order_reference_norms()
+                if n_backfilled:
+                    print(f"[Migration] Normalized references backfilled for {n_backfilled} orders")
+            except Exception as exc:
+                db.session.rollback()
+                print(f"[Migration] reference_norm backfill: {exc}")
+            _ensure_package_sales_counters_seeded()
+        try:
+            if "content_hash" not in _get_table_cols("rev_catalog_items"):
+                db.session.execute(text("ALTER TABLE rev_catalog_items ADD COLUMN content_hash TEXT DEFAULT ''"))
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
         try:
             rev_map_cols = _get_table_cols("rev_item_mappings")
             if "direct_to_script" not in rev_map_cols:
@@ -7342,9 +9507,11 @@ def admin_special_users_list():
     rows = SpecialUser.query.order_by(SpecialUser.created_at.desc()).all()
     # Pending mini influencer profiles bubble to the top so they get reviewed first
     rows.sort(key=lambda u: 0 if (u.status or "approved") == "pending" else 1)
+    uses_by_user = _special_code_uses_map(rows)
+    pending_videos = _mini_videos_pending_counts([u.id for u in rows])
     out = []
     for u in rows:
-        uses = _special_code_uses(u)
+        uses = uses_by_user.get(u.id, 0)
         entry = {
             "id": u.id, "name": u.name, "code": u.code, "secondary_code": u.secondary_code or "", "email": u.email or "", "balance": float(u.balance or 0.0), "active": bool(u.active),
             "discount_percent": float(u.discount_percent or 0.0),
@@ -7355,7 +9522,7 @@ def admin_special_users_list():
             "channel_url": u.channel_url or "",
             "bonus_usd": float(u.bonus_usd or 0.0),
             "code_uses": uses,
-            "videos_pending": _mini_videos_pending_count(u.id),
+            "videos_pending": pending_videos.get(u.id, 0),
         }
         if (u.kind or "affiliate") == "mini":
             rank = _mini_rank_state(u, uses)
@@ -7576,7 +9743,7 @@ def admin_special_users_set_status(uid: int):
                     "",
                     "Ya puedes entrar a tu panel y empezar a cargar tus videos.",
                 ])
-                send_email(su.email, "Tu perfil de mini influencer fue aprobado", body)
+                send_email_async(su.email, "Tu perfil de mini influencer fue aprobado", body)
             elif su.status == "rejected":
                 body = "\n".join([
                     f"Hola {su.name or ''},",
@@ -7584,7 +9751,7 @@ def admin_special_users_set_status(uid: int):
                     "Tu solicitud de mini influencer no fue aprobada por ahora.",
                     "Si crees que es un error puedes responder a este correo.",
                 ])
-                send_email(su.email, "Sobre tu solicitud de mini influencer", body)
+                send_email_async(su.email, "Sobre tu solicitud de mini influencer", body)
     except Exception:
         pass
     return jsonify({"ok": True, "status": su.status})
@@ -7610,7 +9777,7 @@ def admin_special_users_add_bonus(uid: int):
     db.session.commit()
     try:
         if su.email:
-            send_email(
+            send_email_async(
                 su.email,
                 "Recibiste un bono",
                 f"Se acreditó un bono de ${inc:.2f} USD a tu cuenta.\nSaldo actual: ${float(su.balance or 0.0):.2f} USD.",
@@ -7621,6 +9788,7 @@ def admin_special_users_add_bonus(uid: int):
 
 
 @app.route("/mini/tiers")
+@storefront_cached(ttl=300)
 def mini_tiers_public():
     """The two reward ladders. Public so the panel and the sign-up can show them."""
     return jsonify({
@@ -7705,7 +9873,7 @@ def admin_special_users_rank_award(uid: int):
     db.session.commit()
     try:
         if su.email:
-            send_email(
+            send_email_async(
                 su.email,
                 f"Desbloqueaste el rango {match['name']}",
                 "\n".join([
@@ -7789,10 +9957,10 @@ def admin_mini_videos_review(v_id: int):
         if su and su.email:
             if v.status == "approved":
                 extra = f"\nRecompensa acreditada: ${float(v.reward_usd or 0.0):.2f} USD" if float(v.reward_usd or 0.0) > 0 else ""
-                send_email(su.email, "Tu video fue aprobado", f"Video: {v.url}{extra}")
+                send_email_async(su.email, "Tu video fue aprobado", f"Video: {v.url}{extra}")
             else:
                 reason = f"\nMotivo: {v.note}" if v.note else ""
-                send_email(su.email, "Tu video no fue aprobado", f"Video: {v.url}{reason}")
+                send_email_async(su.email, "Tu video no fue aprobado", f"Video: {v.url}{reason}")
     except Exception:
         pass
     return jsonify({"ok": True, "video": _mini_video_payload(v)})
@@ -7900,7 +10068,7 @@ def mini_register():
     # Notify admin there is a profile to review
     try:
         to_addr = get_config_value("admin_notify_email", ADMIN_NOTIFY_EMAIL or ADMIN_EMAIL)
-        send_email(to_addr, f"Nuevo mini influencer pendiente: {su.name}", "\n".join([
+        send_email_async(to_addr, f"Nuevo mini influencer pendiente: {su.name}", "\n".join([
             "Se registró un mini influencer y está esperando aprobación.",
             f"Nombre: {su.name}",
             f"Email: {su.email}",
@@ -8221,7 +10389,7 @@ def mini_videos_create():
     db.session.commit()
     try:
         to_addr = get_config_value("admin_notify_email", ADMIN_NOTIFY_EMAIL or ADMIN_EMAIL)
-        send_email(to_addr, f"Nuevo video de {su.name or su.code}", "\n".join([
+        send_email_async(to_addr, f"Nuevo video de {su.name or su.code}", "\n".join([
             f"Mini influencer: {su.name or ''} ({su.code})",
             f"Video: {v.url}",
             f"Vistas declaradas: {v.views_declared}",
@@ -8335,7 +10503,7 @@ def affiliate_withdrawals_create():
         elif r.method == 'zinli':
             lines.append(f"Zinli: {r.zinli_email} · {r.zinli_tag}")
         lines.append(f"Fecha: {r.created_at.isoformat()}")
-        send_email(to_addr, f"Retiro afiliado #{r.id} pendiente", "\n".join(lines))
+        send_email_async(to_addr, f"Retiro afiliado #{r.id} pendiente", "\n".join(lines))
     except Exception:
         pass
     return jsonify({"ok": True, "id": r.id})
@@ -8416,7 +10584,7 @@ def admin_affiliate_withdrawals_set_status(w_id: int):
                     lines.append(f"Binance: {r.binance_email} · {r.binance_phone}")
                 elif r.method == 'zinli':
                     lines.append(f"Zinli: {r.zinli_email} · {r.zinli_tag}")
-                send_email(su.email, f"Retiro #{r.id} aprobado", "\n".join(lines))
+                send_email_async(su.email, f"Retiro #{r.id} aprobado", "\n".join(lines))
         except Exception:
             pass
         return jsonify({"ok": True, "balance": su.balance})
@@ -8433,7 +10601,7 @@ def admin_affiliate_withdrawals_set_status(w_id: int):
                     f"Solicitud #{r.id}",
                     f"Monto: ${float(r.amount_usd or 0.0):.2f}",
                 ]
-                send_email(su.email, f"Retiro #{r.id} rechazado", "\n".join(lines))
+                send_email_async(su.email, f"Retiro #{r.id} rechazado", "\n".join(lines))
         except Exception:
             pass
         return jsonify({"ok": True})
@@ -8552,9 +10720,10 @@ def admin_page():
     if not user or user.get("role") != "admin":
         return redirect("/?next=/admin")
     site_name = get_config_value("site_name", "InefableStore")
-    return render_template("admin.html", site_name=site_name, body_class="theme-admin-dark")
+    return render_template("admin.html", site_name=site_name, body_class="theme-admin-dark", gift_max_batch_size=GIFT_MAX_BATCH_SIZE)
 
 @app.route("/store/hero")
+@storefront_cached(ttl=300)
 def store_hero():
     return jsonify({
         "images": [
@@ -8674,6 +10843,7 @@ def store_rate():
 
 
 @app.route("/store/payments")
+@storefront_cached(ttl=300)
 def store_payments():
     """Public: payment method configuration used by details page."""
     data = {
@@ -8827,10 +10997,29 @@ def webhook_ubii():
             },
         }), 200
 
-    result = _ubii_verify_and_update_order(order_obj, extracted, payload=payload)
+    # Ack now; verification, auto-approve and dispatch run in a job so slow
+    # provider calls never hold the webhook open (and trigger Ubii retries).
+    queued = enqueue_job(
+        "ubii_verify_order",
+        {
+            "order_id": order_obj.id,
+            "extracted": {
+                "text": str(extracted.get("text") or ""),
+                "amount": str(extracted.get("amount") or ""),
+                "amount_raw": str(extracted.get("amount_raw") or ""),
+                "reference": str(extracted.get("reference") or ""),
+            },
+            "payload": payload,
+        },
+        dedupe_key=f"ubii_verify_order:{order_obj.id}",
+    )
+    if queued:
+        message = "Pago recibido; verificación en curso"
+    else:
+        message = _ubii_verify_and_update_order(order_obj, extracted, payload=payload).get("message") or "Pago verificado"
     return jsonify({
         "status": "success",
-        "message": result.get("message") or "Pago verificado",
+        "message": message,
         "order_id": order_obj.id,
         "data": {
             "monto": extracted.get("amount_raw") or "No encontrado",
@@ -9461,6 +11650,7 @@ def admin_smileone_connections_delete(cid: int):
 
 
 @app.route("/store/smileone/connections", methods=["GET"])
+@storefront_cached(ttl=300)
 def store_smileone_connections_public():
     """Public endpoint: returns active SmileOne connection package IDs for the details page."""
     conns = SmileOneConnection.query.filter_by(active=True).all()
@@ -9474,12 +11664,15 @@ def _allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def _save_capture(file) -> str:
-    """Save a payment capture image to captures/ subfolder. Returns relative path."""
+def _save_capture(file) -> tuple[str, str]:
+    """Save a payment capture image to captures/ subfolder, hashing it while streaming.
+
+    Returns (relative path, sha256 hex); both empty if the file was rejected.
+    """
     if not file or not file.filename:
-        return ""
+        return "", ""
     if not _allowed_file(file.filename):
-        return ""
+        return "", ""
     fname = secure_filename(file.filename)
     ts = now_ve().strftime("%Y%m%d%H%M%S%f")
     fname = f"{ts}_{fname}"
@@ -9488,8 +11681,12 @@ def _save_capture(file) -> str:
         os.makedirs(folder, exist_ok=True)
     except Exception:
         pass
-    file.save(os.path.join(folder, fname))
-    return "captures/" + fname
+    hasher = hashlib.sha256()
+    with open(os.path.join(folder, fname), "wb") as capture_handle:
+        for chunk in iter(lambda: file.stream.read(1024 * 1024), b""):
+            hasher.update(chunk)
+            capture_handle.write(chunk)
+    return "captures/" + fname, hasher.hexdigest()
 
 
 def _capture_absolute_path(relative_path: str) -> str:
@@ -9559,11 +11756,11 @@ def _is_genai_retryable_error(exc: Exception) -> bool:
     )
 
 
-def _genai_extract_reference_with_retries(uploaded_file):
+def _genai_extract_reference_with_retries(uploaded_file, attempts: int = 3):
     last_model_error = None
     last_retryable_error = None
 
-    for attempt in range(3):
+    for attempt in range(max(int(attempts), 1)):
         should_retry = False
         for model_name in _genai_candidate_model_names():
             model = genai.GenerativeModel(model_name)
@@ -9581,7 +11778,7 @@ def _genai_extract_reference_with_retries(uploaded_file):
 
             return model, response
 
-        if should_retry and attempt < 2:
+        if should_retry and attempt < attempts - 1:
             time.sleep(2 ** attempt)
             continue
         if should_retry and last_retryable_error is not None:
@@ -9621,6 +11818,53 @@ def _capture_reference_file_fingerprint(capture_path: str) -> str:
     return hasher.hexdigest()
 
 
+def _backfill_order_capture_sha256(batch_size: int = 500) -> int:
+    """Hash captures of orders saved before capture_sha256 existed.
+
+    Rows whose file is gone get an empty string so they are not retried.
+    """
+    from sqlalchemy import text
+
+    total = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            text(
+                "SELECT id, payment_capture FROM orders "
+                "WHERE id > :last_id AND capture_sha256 IS NULL "
+                "ORDER BY id LIMIT :lim"
+            ),
+            {"last_id": last_id, "lim": int(batch_size)},
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for order_id, relative_path in rows:
+            fingerprint = ""
+            try:
+                fingerprint = _capture_reference_file_fingerprint(_capture_absolute_path(relative_path))
+            except Exception:
+                fingerprint = ""
+            updates.append({"id": order_id, "sha": fingerprint})
+        db.session.execute(text("UPDATE orders SET capture_sha256 = :sha WHERE id = :id"), updates)
+        db.session.commit()
+        total += len(rows)
+        last_id = rows[-1][0]
+    return total
+
+
+def _ensure_capture_sha256_backfilled():
+    try:
+        with app.app_context():
+            n_backfilled = _backfill_order_capture_sha256()
+            if n_backfilled:
+                print(f"[Migration] capture_sha256 backfilled for {n_backfilled} orders")
+    except Exception as e:
+        print(f"[Migration] capture_sha256 backfill: {e}")
+
+_ensure_capture_sha256_backfilled()
+
+
 def _capture_reference_cache_get(cache_key: str):
     if not cache_key:
         return None
@@ -9632,6 +11876,7 @@ def _capture_reference_cache_get(cache_key: str):
         if float(entry.get("exp") or 0) <= now_ts:
             _CAPTURE_REFERENCE_CACHE.pop(cache_key, None)
             return None
+        _CAPTURE_REFERENCE_CACHE.move_to_end(cache_key)
         return {
             "reference": str(entry.get("reference") or ""),
             "status": str(entry.get("status") or "not_detected"),
@@ -9650,6 +11895,9 @@ def _capture_reference_cache_set(cache_key: str, reference: str, status: str, tt
             "status": str(status or "not_detected"),
             "exp": time.time() + ttl,
         }
+        _CAPTURE_REFERENCE_CACHE.move_to_end(cache_key)
+        while len(_CAPTURE_REFERENCE_CACHE) > _CAPTURE_REFERENCE_CACHE_MAX_ENTRIES:
+            _CAPTURE_REFERENCE_CACHE.popitem(last=False)
 
 
 def _genai_cooldown_remaining_seconds() -> int:
@@ -9664,15 +11912,17 @@ def _genai_activate_cooldown(reason: str = "", seconds: int | None = None):
     _GENAI_COOLDOWN_REASON = str(reason or "").strip()
 
 
-def _extract_capture_reference(relative_path: str):
+def _extract_capture_reference(relative_path: str, fingerprint: str = ""):
     global _GENAI_MODEL, _GENAI_MODEL_READY
     capture_path = _capture_absolute_path(relative_path)
     if not capture_path or not os.path.exists(capture_path):
         return "", "capture_not_found"
-    try:
-        cache_key = _capture_reference_file_fingerprint(capture_path)
-    except Exception:
-        cache_key = ""
+    cache_key = str(fingerprint or "").strip()
+    if not cache_key:
+        try:
+            cache_key = _capture_reference_file_fingerprint(capture_path)
+        except Exception:
+            cache_key = ""
     cached_result = _capture_reference_cache_get(cache_key)
     if cached_result is not None:
         return cached_result.get("reference") or "", cached_result.get("status") or "not_detected"
@@ -9685,7 +11935,9 @@ def _extract_capture_reference(relative_path: str):
     try:
         _genai_model()
         uploaded_file = genai.upload_file(path=capture_path)
-        model, response = _genai_extract_reference_with_retries(uploaded_file)
+        # One pass over the candidate models: a rate-limited call goes back to
+        # the capture_ocr job backoff instead of sleeping here.
+        model, response = _genai_extract_reference_with_retries(uploaded_file, attempts=1)
         if model is not None:
             _GENAI_MODEL = model
             _GENAI_MODEL_READY = True
@@ -9739,6 +11991,252 @@ def _capture_reference_status_error_message(status: str) -> str:
     return detail or "No se pudo analizar el comprobante con la IA."
 
 
+# ==============================
+# Capture OCR stage
+# ==============================
+# Reading the reference off a payment capture (Gemini upload + generate) takes
+# seconds, so it no longer runs inside requests. Captures are submitted by
+# content hash to capture_ocr_results and read by "capture_ocr" jobs; the
+# checkout polls /orders/capture-reference/<sha256>, and pending orders that
+# uploaded the same capture get capture_reference written when the job settles.
+# The table is also the GenAI budget shared by every process: a job only calls
+# Gemini while fewer than GENAI_OCR_MAX_CONCURRENCY rows are running and fewer
+# than GENAI_OCR_MAX_PER_MINUTE calls started in the last minute; otherwise the
+# job is deferred through the queue instead of waiting on its consumer thread.
+# CAPTURE_OCR_CONSUMERS threads per consuming process run these jobs, apart
+# from the shared consumers.
+_CAPTURE_OCR_SETTLED_STATUSES = ("ok", "not_detected")
+_CAPTURE_OCR_RUNNING_STALE_SECONDS = 120
+_CAPTURE_OCR_BUDGET_RETRY_SECONDS = 5
+_CAPTURE_OCR_CONSUMERS = max(int(os.environ.get("CAPTURE_OCR_CONSUMERS", "1") or 1), 1)
+_CAPTURE_OCR_RETENTION_DAYS = 7
+_CAPTURE_OCR_BUDGET_LOCK_KEY = 0x0C0C4
+_CAPTURE_OCR_STATS = {"submitted": 0, "stored_hits": 0, "genai_calls": 0, "budget_deferred": 0}
+_CAPTURE_OCR_STATS_LOCK = threading.Lock()
+
+
+def _capture_ocr_stat(name: str, n: int = 1) -> None:
+    with _CAPTURE_OCR_STATS_LOCK:
+        _CAPTURE_OCR_STATS[name] = _CAPTURE_OCR_STATS.get(name, 0) + n
+
+
+def _capture_ocr_get(sha256: str):
+    """The capture_ocr_results row for a capture hash, as a dict, or None."""
+    if not sha256:
+        return None
+    table = CaptureOcrResult.__table__
+    with db.engine.connect() as conn:
+        row = conn.execute(db.select(table).where(table.c.capture_sha256 == sha256)).mappings().first()
+    return dict(row) if row else None
+
+
+def _capture_ocr_submit(sha256: str, capture_path: str, *, temp: bool = False) -> dict:
+    """Queue OCR for a capture unless its result is already stored. Returns the row.
+
+    A temp capture (checkout preview) that is not needed — the result is known
+    or the row already points at a file — is deleted right away; otherwise the
+    row owns it and the job deletes it once the result settles.
+    """
+    table = CaptureOcrResult.__table__
+    now = datetime.utcnow()
+    row = _capture_ocr_get(sha256)
+    if row is None:
+        with db.engine.begin() as conn:
+            dialect = conn.dialect.name
+            if dialect not in ("postgresql", "sqlite"):
+                raise RuntimeError(f"capture_ocr_results: dialecto no soportado ({dialect})")
+            stmt = (pg_insert if dialect == "postgresql" else sqlite_insert)(table).values(
+                capture_sha256=sha256, status="queued", reference="", error="",
+                capture_path=capture_path, capture_is_temp=bool(temp), attempts=0,
+                created_at=now, updated_at=now,
+            )
+            conn.execute(stmt.on_conflict_do_nothing(index_elements=[table.c.capture_sha256]))
+        row = _capture_ocr_get(sha256)
+    if row["status"] in _CAPTURE_OCR_SETTLED_STATUSES:
+        _capture_ocr_stat("stored_hits")
+        if temp:
+            _delete_capture(capture_path)
+        return row
+
+    values = {}
+    current_path = row.get("capture_path") or ""
+    if current_path != capture_path:
+        if current_path and os.path.exists(_capture_absolute_path(current_path)):
+            if temp:
+                _delete_capture(capture_path)
+        else:
+            values.update(capture_path=capture_path, capture_is_temp=bool(temp))
+    if row["status"] == "error":
+        values["status"] = "queued"
+    if values:
+        values["updated_at"] = now
+        with db.engine.begin() as conn:
+            conn.execute(table.update().where(table.c.id == row["id"]).values(**values))
+        row.update(values)
+    enqueue_job("capture_ocr", {"sha256": sha256}, dedupe_key=f"capture_ocr:{sha256}")
+    _capture_ocr_stat("submitted")
+    return row
+
+
+def _capture_ocr_claim(sha256: str) -> bool:
+    """Mark the row running if the shared GenAI budget has room right now."""
+    from sqlalchemy import text
+
+    table = CaptureOcrResult.__table__
+    other = table.alias("budget")
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=_CAPTURE_OCR_RUNNING_STALE_SECONDS)
+    running = (
+        db.select(db.func.count()).select_from(other)
+        .where(other.c.status == "running", other.c.started_at >= stale_before)
+        .scalar_subquery()
+    )
+    last_minute = (
+        db.select(db.func.count()).select_from(other)
+        .where(other.c.started_at >= now - timedelta(seconds=60))
+        .scalar_subquery()
+    )
+    with db.engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # Serialise claimers so two processes cannot both take the last slot
+            conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _CAPTURE_OCR_BUDGET_LOCK_KEY})
+        result = conn.execute(
+            table.update()
+            .where(
+                table.c.capture_sha256 == sha256,
+                table.c.status.notin_(_CAPTURE_OCR_SETTLED_STATUSES),
+                db.or_(table.c.status != "running", table.c.started_at < stale_before),
+                running < GENAI_OCR_MAX_CONCURRENCY,
+                last_minute < GENAI_OCR_MAX_PER_MINUTE,
+            )
+            .values(status="running", started_at=now, attempts=table.c.attempts + 1, updated_at=now)
+        )
+    return bool(result.rowcount)
+
+
+def _capture_ocr_apply_to_orders(sha256: str, reference: str, status: str) -> int:
+    """Write a settled result onto the pending orders that uploaded this capture."""
+    orders = Order.query.filter(Order.capture_sha256 == sha256, Order.status == "pending").all()
+    for order_obj in orders:
+        if reference and not str(order_obj.capture_reference or "").strip():
+            order_obj.capture_reference = reference
+        current_payment_state = _pabilo_get_payment_state(order_obj)
+        _pabilo_set_payment_state(order_obj, {
+            **current_payment_state,
+            "capture_reference": str(order_obj.capture_reference or ""),
+            "capture_reference_status": status,
+            "capture_reference_source": "ocr_job",
+        })
+    if orders:
+        db.session.commit()
+    return len(orders)
+
+
+def _capture_ocr_process(sha256: str):
+    """Read the reference of a submitted capture within the GenAI budget.
+
+    Returns (reference, status) like _extract_capture_reference. When the
+    budget or the GenAI cooldown leaves no room right now, Gemini is not
+    called: the row is left queued and the status is "deferred:<seconds>".
+    """
+    table = CaptureOcrResult.__table__
+    row = _capture_ocr_get(sha256)
+    if row is None:
+        return "", "capture_not_found"
+    if row["status"] in _CAPTURE_OCR_SETTLED_STATUSES:
+        return row["reference"] or "", row["status"]
+
+    cooldown_remaining = _genai_cooldown_remaining_seconds()
+    if cooldown_remaining or not _capture_ocr_claim(sha256):
+        _capture_ocr_stat("budget_deferred")
+        return "", f"deferred:{cooldown_remaining or _CAPTURE_OCR_BUDGET_RETRY_SECONDS}"
+
+    row = _capture_ocr_get(sha256) or row
+    capture_path = row.get("capture_path") or ""
+    _capture_ocr_stat("genai_calls")
+    try:
+        reference, status = _extract_capture_reference(capture_path, sha256)
+    except Exception as exc:
+        reference, status = "", f"error:{exc}"
+
+    settled = status in _CAPTURE_OCR_SETTLED_STATUSES
+    values = {"reference": reference or "", "updated_at": datetime.utcnow()}
+    if settled:
+        values.update(status=status, error="")
+        if row.get("capture_is_temp"):
+            values.update(capture_path="", capture_is_temp=False)
+    else:
+        # Rate limits are retried by the job; other errors wait for a resubmit
+        values.update(
+            status="queued" if status.startswith("error:cooldown_active") else "error",
+            error=status,
+        )
+    with db.engine.begin() as conn:
+        conn.execute(table.update().where(table.c.capture_sha256 == sha256).values(**values))
+    if settled:
+        if row.get("capture_is_temp"):
+            _delete_capture(capture_path)
+        _capture_ocr_apply_to_orders(sha256, reference, status)
+    return reference or "", status
+
+
+def _capture_ocr_payload(row: dict) -> dict:
+    """What /orders/capture-reference/<id> (and the preview upload) answer for a row."""
+    status = str(row.get("status") or "queued")
+    reference = str(row.get("reference") or "") if status == "ok" else ""
+    payload = {
+        "ok": status != "error",
+        "capture_id": row["capture_sha256"],
+        "status": status,
+        "done": status in _CAPTURE_OCR_SETTLED_STATUSES or status == "error",
+        "found": bool(reference),
+        "reference": reference,
+        "status_url": f"/orders/capture-reference/{row['capture_sha256']}",
+    }
+    if status == "error":
+        payload["error"] = (
+            _capture_reference_status_error_message(row.get("error") or "")
+            or "No se pudo analizar el comprobante con la IA."
+        )
+    return payload
+
+
+def _capture_ocr_prune() -> int:
+    """Drop results older than _CAPTURE_OCR_RETENTION_DAYS, with any preview file they still hold."""
+    table = CaptureOcrResult.__table__
+    cutoff = datetime.utcnow() - timedelta(days=_CAPTURE_OCR_RETENTION_DAYS)
+    with db.engine.begin() as conn:
+        leftovers = conn.execute(
+            db.select(table.c.capture_path)
+            .where(table.c.updated_at < cutoff, table.c.capture_is_temp == True, table.c.capture_path != "")
+        ).scalars().all()
+        deleted = conn.execute(table.delete().where(table.c.updated_at < cutoff)).rowcount or 0
+    for path in leftovers:
+        _delete_capture(path)
+    return deleted
+
+
+@job_handler("capture_ocr", max_attempts=6, consumers=_CAPTURE_OCR_CONSUMERS)
+def _job_capture_ocr(payload):
+    """Read the reference off a submitted capture (see _capture_ocr_process).
+
+    No budget: deferred without using an attempt. A 429 from Gemini itself
+    uses one and goes through the usual backoff.
+    """
+    import random
+
+    sha256 = str(payload.get("sha256") or "").strip()
+    _reference, status = _capture_ocr_process(sha256)
+    if status.startswith("deferred:"):
+        try:
+            delay = float(status.split(":", 1)[1])
+        except ValueError:
+            delay = _CAPTURE_OCR_BUDGET_RETRY_SECONDS
+        raise JobDeferred(delay * random.uniform(1.0, 1.5), f"Presupuesto de GenAI sin cupo ({status})")
+    if status.startswith("error:cooldown_active"):
+        raise RuntimeError(f"Presupuesto de GenAI sin cupo ({status})")
+
+
 def _ensure_order_capture_reference(order_obj) -> dict:
     current_reference = str(getattr(order_obj, "capture_reference", "") or "").strip()
     if current_reference:
@@ -9756,7 +12254,19 @@ def _ensure_order_capture_reference(order_obj) -> dict:
             "source": "missing_capture",
         }
 
-    extracted_reference, extraction_status = _extract_capture_reference(payment_capture)
+    # Never calls GenAI here (this runs inside admin requests too): a settled
+    # OCR result is used, otherwise the capture is queued and a later
+    # verification attempt finds the reference already on the order.
+    capture_sha256 = str(getattr(order_obj, "capture_sha256", "") or "").strip()
+    extracted_reference, extraction_status = "", "capture_not_found"
+    if capture_sha256:
+        row = _capture_ocr_get(capture_sha256)
+        if row is None or row["status"] not in _CAPTURE_OCR_SETTLED_STATUSES:
+            row = _capture_ocr_submit(capture_sha256, payment_capture)
+        if row["status"] in _CAPTURE_OCR_SETTLED_STATUSES:
+            extracted_reference, extraction_status = row["reference"] or "", row["status"]
+        else:
+            extraction_status = "pending_ocr"
     if extracted_reference:
         order_obj.capture_reference = extracted_reference
 
@@ -9879,6 +12389,7 @@ def admin_images_delete_by_path():
 
 
 @app.route("/store/packages")
+@storefront_cached(ttl=60)
 def store_packages():
     category = (request.args.get("category") or '').strip().lower()
     sort_mode = (request.args.get("sort") or '').strip().lower()
@@ -9899,34 +12410,7 @@ def store_packages():
     # --- sort=popular: order by total successful sales (most purchased first) ---
     if sort_mode == "popular":
         try:
-            successful_statuses = ["approved", "delivered"]
-            sales_by_package = {}
-
-            live_counts = (
-                db.session.query(Order.store_package_id, db.func.count(Order.id).label("cnt"))
-                .filter(Order.status.in_(successful_statuses))
-                .group_by(Order.store_package_id)
-                .all()
-            )
-            for package_id, count in live_counts:
-                if package_id is None:
-                    continue
-                sales_by_package[int(package_id)] = sales_by_package.get(int(package_id), 0) + int(count or 0)
-
-            archived_counts = (
-                db.session.query(
-                    OrderSummary.store_package_id,
-                    db.func.coalesce(db.func.sum(OrderSummary.order_count), 0).label("cnt"),
-                )
-                .filter(OrderSummary.status.in_(successful_statuses))
-                .group_by(OrderSummary.store_package_id)
-                .all()
-            )
-            for package_id, count in archived_counts:
-                if package_id is None:
-                    continue
-                sales_by_package[int(package_id)] = sales_by_package.get(int(package_id), 0) + int(count or 0)
-
+            sales_by_package = dict(_package_sales_ranking())
             all_items = q.all()
             # Sort: highest sales first, then fall back to sort_order for ties
             all_items.sort(key=lambda p: (-sales_by_package.get(p.id, 0), p.sort_order or 0, p.name or ''))
@@ -9941,49 +12425,23 @@ def store_packages():
 
     return jsonify({
         "packages": [
-            {"id": p.id, "name": p.name, "image_path": p.image_path, "category": (p.category or 'mobile')}
-            for p in items
-        ]
-    })
-
-
-@app.route("/store/best_sellers")
-def store_best_sellers():
-    """Public: Top packages por ventas exitosas.
-
-    Suma órdenes activas y órdenes históricas agregadas en OrderSummary para que
-    la sección siga mostrando acumulado aunque la limpieza automática archive
-    pedidos viejos fuera de la tabla orders.
-    """
-    successful_statuses = ["approved", "delivered"]
-    sales_by_package = {}
-
-    live_counts = (
-        db.session.query(Order.store_package_id, db.func.count(Order.id).label("cnt"))
-        .filter(Order.status.in_(successful_statuses))
-        .group_by(Order.store_package_id)
-        .all()
-    )
-    for package_id, count in live_counts:
-        if package_id is None:
-            continue
-        sales_by_package[int(package_id)] = sales_by_package.get(int(package_id), 0) + int(count or 0)
+            {"id": p.id, "name": p.name, "image_path": p.image_path, "category": (p.category or 'mobile')}
+            for p in items
+        ]
+    })
 
-    archived_counts = (
-        db.session.query(
-            OrderSummary.store_package_id,
-            db.func.coalesce(db.func.sum(OrderSummary.order_count), 0).label("cnt"),
-        )
-        .filter(OrderSummary.status.in_(successful_statuses))
-        .group_by(OrderSummary.store_package_id)
-        .all()
-    )
-    for package_id, count in archived_counts:
-        if package_id is None:
-            continue
-        sales_by_package[int(package_id)] = sales_by_package.get(int(package_id), 0) + int(count or 0)
 
-    ids = [package_id for package_id, _ in sorted(sales_by_package.items(), key=lambda entry: entry[1], reverse=True)[:12]]
+@app.route("/store/best_sellers")
+@storefront_cached(ttl=60)
+def store_best_sellers():
+    """Public: Top packages por ventas exitosas.
+
+    Lee el ranking de package_sales_counters, que acumula órdenes activas y
+    órdenes históricas agregadas en OrderSummary para que la sección siga
+    mostrando acumulado aunque la limpieza automática archive pedidos viejos
+    fuera de la tabla orders.
+    """
+    ids = [package_id for package_id, _ in _package_sales_ranking(limit=12)]
     if not ids:
         # No approved sales yet -> return a stable fallback list so the homepage
         # section doesn't appear to "disappear".
@@ -10121,11 +12579,90 @@ def thanks_order(oid: int):
 
 @app.route("/gracias/<int:oid>/progress", methods=["GET"])
 def thanks_order_progress(oid: int):
-    """Public minimal progress endpoint for thank-you page polling."""
+    """Public minimal progress endpoint for thank-you page polling (ETag/304)."""
     o = Order.query.get(oid)
     if not o:
         return jsonify({"ok": False, "error": "No existe"}), 404
-    return jsonify(_thanks_progress_payload(o))
+    _payload, body, etag = _thanks_progress_cached(o)
+    resp = _storefront_response(body, 200, app.json.mimetype, etag)
+    if resp.status_code == 304:
+        _thanks_progress_memo_stat("not_modified")
+    return resp
+
+
+@app.route("/gracias/<int:oid>/events", methods=["GET"])
+def thanks_order_events(oid: int):
+    """Server-Sent Events for the thank-you page: the full progress payload
+    first, then only the keys that changed each time the order is published."""
+    if not _ORDER_EVENTS_ENABLED:
+        return jsonify({"ok": False, "error": "Eventos desactivados"}), 503
+    if not db.session.get(Order, oid):
+        return jsonify({"ok": False, "error": "No existe"}), 404
+    wake = _order_events_subscribe(oid)
+    if wake is None:
+        resp = jsonify({"ok": False, "error": "Demasiadas conexiones, usa /progress"})
+        resp.headers["Retry-After"] = "30"
+        return resp, 503
+    try:
+        first = _thanks_progress_cached(db.session.get(Order, oid))[0]
+    except Exception:
+        _order_events_unsubscribe(oid, wake)
+        raise
+    db.session.close()
+
+    def _event(data) -> str:
+        return f"event: progress\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+    def stream():
+        last = first
+        try:
+            yield "retry: 3000\n" + _event(first)
+            if first.get("completed") or first.get("status") == "rejected":
+                return
+            deadline = time.monotonic() + _ORDER_EVENTS_STREAM_SECONDS
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                if not wake.wait(min(_ORDER_EVENTS_HEARTBEAT_SECONDS, remaining)):
+                    yield ": ping\n\n"
+                    continue
+                wake.clear()
+                with app.app_context():
+                    order_obj = db.session.get(Order, oid)
+                    payload = _thanks_progress_cached(order_obj)[0] if order_obj else None
+                if payload is None:
+                    return
+                delta = _thanks_progress_delta(last, payload)
+                if delta:
+                    last = payload
+                    _order_events_stat("deltas_sent")
+                    yield _event(delta)
+                if payload.get("completed") or payload.get("status") == "rejected":
+                    return
+        finally:
+            _order_events_unsubscribe(oid, wake)
+
+    return Response(stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
+@app.route("/admin/order-events/stats", methods=["GET"])
+def admin_order_events_stats():
+    user = session.get("user")
+    if not user or user.get("role") != "admin":
+        return jsonify({"ok": False, "error": "No autorizado"}), 401
+    with _ORDER_EVENTS_LOCK:
+        stats = dict(_ORDER_EVENTS_STATS)
+        stats["open_streams"] = sum(len(subs) for subs in _ORDER_EVENTS_SUBSCRIBERS.values())
+        stats["bridge_running"] = _ORDER_EVENTS_POLLER["thread"] is not None
+    stats["enabled"] = _ORDER_EVENTS_ENABLED
+    stats["max_streams"] = _ORDER_EVENTS_MAX_STREAMS
+    with _THANKS_PROGRESS_MEMO_LOCK:
+        stats["progress_memo"] = dict(_THANKS_PROGRESS_MEMO_STATS, entries=len(_THANKS_PROGRESS_MEMO))
+    return jsonify({"ok": True, "stats": stats})
 
 
 @app.route("/gracias/<int:oid>/minijuego", methods=["GET"])
@@ -10360,50 +12897,45 @@ def thanks_order_minigame_play(oid: int):
     })
 
 
-def _start_checkout_automation(order_id: int, app_obj) -> None:
-    def _runner():
-        try:
-            with app_obj.app_context():
-                order_obj = Order.query.get(order_id)
-                if not order_obj:
-                    return
-
-                try:
-                    to_addr = get_config_value("admin_notify_email", ADMIN_NOTIFY_EMAIL or ADMIN_EMAIL)
-                    if to_addr:
-                        pkg = StorePackage.query.get(order_obj.store_package_id)
-                        it = GamePackageItem.query.get(order_obj.item_id) if order_obj.item_id else None
-                        admin_html, admin_text = build_admin_new_order_email(order_obj, pkg, it)
-                        brand = _email_brand()
-                        try:
-                            send_email_html(to_addr, f"[{brand}] Nueva orden #{order_obj.id}", admin_html, admin_text)
-                        except Exception:
-                            send_email_async(to_addr, f"Nueva orden #{order_obj.id} pendiente", admin_text)
-                except Exception:
-                    pass
+def _start_checkout_automation(order_id: int) -> None:
+    enqueue_job("checkout_automation", {"order_id": order_id}, dedupe_key=f"checkout_automation:{order_id}")
 
-                if (order_obj.status or "").lower() != "pending":
-                    return
 
-                request_info = _pabilo_request_info(order_obj)
-                eligibility = _pabilo_eligibility_info(order_obj)
-                if request_info.get("requestable"):
-                    _pabilo_verify_and_update_order(
-                        order_obj,
-                        auto_approve_on_verified=bool(eligibility.get("eligible")),
-                        source="checkout",
-                    )
-        except Exception:
-            try:
-                db.session.rollback()
-            except Exception:
-                pass
+@job_handler("checkout_automation", max_attempts=3)
+def _job_checkout_automation(payload):
+    """Aviso al admin de la orden nueva + primer intento de verificación Pabilo."""
+    order_obj = Order.query.get(int(payload.get("order_id") or 0))
+    if not order_obj:
+        return
 
     try:
-        threading.Thread(target=_runner, daemon=True, name=f"checkout-auto-{order_id}").start()
+        to_addr = get_config_value("admin_notify_email", ADMIN_NOTIFY_EMAIL or ADMIN_EMAIL)
+        if to_addr:
+            pkg = StorePackage.query.get(order_obj.store_package_id)
+            it = GamePackageItem.query.get(order_obj.item_id) if order_obj.item_id else None
+            admin_html, admin_text = build_admin_new_order_email(order_obj, pkg, it)
+            brand = _email_brand()
+            enqueue_job("send_email", {
+                "to": to_addr,
+                "subject": f"[{brand}] Nueva orden #{order_obj.id}",
+                "html": admin_html,
+                "text": admin_text,
+            })
     except Exception:
         pass
 
+    if (order_obj.status or "").lower() != "pending":
+        return
+
+    request_info = _pabilo_request_info(order_obj)
+    eligibility = _pabilo_eligibility_info(order_obj)
+    if request_info.get("requestable"):
+        _pabilo_verify_and_update_order(
+            order_obj,
+            auto_approve_on_verified=bool(eligibility.get("eligible")),
+            source="checkout",
+        )
+
 
 # ===============
 # Orders API
@@ -10486,32 +13018,25 @@ def check_reference():
 
 @app.route("/orders/extract-capture-reference", methods=["POST"])
 def extract_capture_reference_preview():
+    """Submit the checkout capture for OCR: 200 with the stored result, or 202 + status_url."""
     capture_file = request.files.get("payment_capture")
     if not capture_file or not capture_file.filename:
         return jsonify({"ok": False, "error": "Comprobante requerido"}), 400
     if not _allowed_file(capture_file.filename):
         return jsonify({"ok": False, "error": "Formato de imagen no permitido"}), 400
+    if not GENAI_API_KEY:
+        status = "error:GENAI_API_KEY no configurada"
+        return jsonify({"ok": False, "error": _capture_reference_status_error_message(status), "status": status}), 503
 
     temp_capture_path = ""
     try:
-        temp_capture_path = _save_capture(capture_file)
+        temp_capture_path, capture_sha256 = _save_capture(capture_file)
         if not temp_capture_path:
             return jsonify({"ok": False, "error": "No se pudo guardar el comprobante"}), 400
-
-        extracted_reference, extraction_status = _extract_capture_reference(temp_capture_path)
-        error_message = _capture_reference_status_error_message(extraction_status)
-        if error_message:
-            return jsonify({
-                "ok": False,
-                "error": error_message,
-                "status": extraction_status,
-            }), 503
-        return jsonify({
-            "ok": True,
-            "reference": str(extracted_reference or ""),
-            "status": extraction_status,
-            "found": bool(extracted_reference),
-        })
+        row = _capture_ocr_submit(capture_sha256, temp_capture_path, temp=True)
+        temp_capture_path = ""  # capture_ocr_results owns (or already deleted) the file
+        payload = _capture_ocr_payload(row)
+        return jsonify(payload), (200 if payload["done"] else 202)
     except Exception as exc:
         return jsonify({"ok": False, "error": str(exc)}), 500
     finally:
@@ -10519,6 +13044,16 @@ def extract_capture_reference_preview():
             _delete_capture(temp_capture_path)
 
 
+@app.route("/orders/capture-reference/<capture_id>", methods=["GET"])
+def capture_reference_status(capture_id: str):
+    """Public: OCR status of a capture submitted by the checkout (polled until done)."""
+    capture_sha256 = str(capture_id or "").strip().lower()
+    row = _capture_ocr_get(capture_sha256) if re.fullmatch(r"[0-9a-f]{64}", capture_sha256) else None
+    if not row:
+        return jsonify({"ok": False, "error": "No existe"}), 404
+    return jsonify(_capture_ocr_payload(row))
+
+
 @app.route("/admin/orders/<int:oid>/reference", methods=["POST"])
 def admin_orders_update_reference(oid: int):
     user = session.get("user")
@@ -10863,9 +13398,10 @@ def create_order():
             try:
                 capture_file = request.files.get("payment_capture")
                 if capture_file and capture_file.filename:
-                    capture_path = _save_capture(capture_file)
+                    capture_path, capture_sha256 = _save_capture(capture_file)
                     if capture_path:
                         o.payment_capture = capture_path
+                        o.capture_sha256 = capture_sha256
                         current_payment_state = _pabilo_get_payment_state(o)
                         _pabilo_set_payment_state(o, {
                             **current_payment_state,
@@ -10884,7 +13420,14 @@ def create_order():
                     return jsonify({"ok": True, "order_id": existing_idempotent_order.id, "idempotent": True})
             raise
         try:
-            _start_checkout_automation(o.id, current_app._get_current_object())
+            if o.capture_sha256 and GENAI_API_KEY:
+                ocr_row = _capture_ocr_submit(o.capture_sha256, o.payment_capture)
+                if ocr_row["status"] in _CAPTURE_OCR_SETTLED_STATUSES:
+                    _capture_ocr_apply_to_orders(o.capture_sha256, ocr_row["reference"] or "", ocr_row["status"])
+        except Exception as exc:
+            print(f"[CaptureOCR] Submit error orden #{o.id}: {exc}")
+        try:
+            _start_checkout_automation(o.id)
         except Exception:
             pass
         # Purge per-user beyond latest 30 (by email or customer_id)
@@ -10914,8 +13457,70 @@ def create_order():
         return jsonify({"ok": False, "error": f"Server error: {str(e)}"}), 500
 
 
+# /admin/orders lists with a slim column projection and keyset cursors on
+# (created_at, id): every page is one index range scan no matter how deep the
+# admin scrolls. The total is cached per (status, q) for a few seconds and, on
+# Postgres without filters, read from the planner estimate. The automation and
+# Pabilo state of each order comes from /admin/orders/<id>/detail, which the
+# panel loads per tile after painting the list.
+_ADMIN_ORDERS_COUNT_TTL_SECONDS = max(int(os.environ.get("ADMIN_ORDERS_COUNT_TTL_SECONDS", "30") or 30), 0)
+_ADMIN_ORDERS_ESTIMATE_MIN_ROWS = 100000
+_ADMIN_ORDERS_COUNT_CACHE = {}
+_ADMIN_ORDERS_COUNT_LOCK = threading.Lock()
+_ADMIN_ORDER_LIST_COLUMNS = (
+    Order.id,
+    Order.created_at,
+    Order.status,
+    Order.store_package_id,
+    Order.item_id,
+    Order.items_json,
+    Order.customer_id,
+    Order.customer_zone,
+    Order.customer_name,
+    Order.name,
+    Order.email,
+    Order.phone,
+    Order.method,
+    Order.currency,
+    Order.amount,
+    Order.special_code,
+    Order.reference,
+    Order.capture_reference,
+    Order.delivery_code,
+    Order.payment_capture,
+)
+
+
+def _admin_orders_total(query, status_filter: str, q: str) -> tuple[int, bool]:
+    """Total for the pagination label: (count, approximate)."""
+    key = (status_filter, q.lower())
+    now = time.monotonic()
+    with _ADMIN_ORDERS_COUNT_LOCK:
+        hit = _ADMIN_ORDERS_COUNT_CACHE.get(key)
+    if hit and now - hit[2] < _ADMIN_ORDERS_COUNT_TTL_SECONDS:
+        return hit[0], hit[1]
+    total, approx = None, False
+    if not status_filter and not q and db.engine.dialect.name == "postgresql":
+        try:
+            from sqlalchemy import text
+            estimate = db.session.execute(text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'orders'")).scalar()
+            if estimate and estimate >= _ADMIN_ORDERS_ESTIMATE_MIN_ROWS:
+                total, approx = int(estimate), True
+        except Exception:
+            db.session.rollback()
+    if total is None:
+        total = query.order_by(None).count()
+    with _ADMIN_ORDERS_COUNT_LOCK:
+        if len(_ADMIN_ORDERS_COUNT_CACHE) > 256:
+            _ADMIN_ORDERS_COUNT_CACHE.clear()
+        _ADMIN_ORDERS_COUNT_CACHE[key] = (total, approx, now)
+    return total, approx
+
+
 @app.route("/admin/orders", methods=["GET"])
 def admin_orders_list():
+    """Slim order list. Pages forward with ?after=<next_cursor> and back with
+    ?before=<prev_cursor>; ?page=N (OFFSET) still works for old clients."""
     user = session.get("user")
     if not user or user.get("role") != "admin":
         return jsonify({"ok": False, "error": "No autorizado"}), 401
@@ -10928,16 +13533,21 @@ def admin_orders_list():
     except Exception:
         per_page = 20
     per_page = 20 if per_page <= 0 else min(per_page, 20)
+    after = _keyset_parse_cursor(request.args.get("after") or "")
+    before = None if after else _keyset_parse_cursor(request.args.get("before") or "")
 
     # Busqueda por ultimos digitos de la referencia o por ID de jugador
     q = (request.args.get("q") or "").strip()
-    base_query = Order.query
+    base_query = db.session.query(*_ADMIN_ORDER_LIST_COLUMNS)
     # Filtro por estado (suiche Todas / Pendientes / etc. en el admin)
     status_filter = (request.args.get("status") or "").strip().lower()
     if status_filter in ("pending", "approved", "rejected", "delivered"):
         base_query = base_query.filter(Order.status == status_filter)
+    else:
+        status_filter = ""
     if q:
-        # % y _ son comodines de LIKE: se escapan para que se busquen literales
+        # % y _ son comodines de LIKE: se escapan para que se busquen literales.
+        # En Postgres los indices trigram (_ORDER_SEARCH_TRGM_INDEXES) resuelven el LIKE.
         safe = q.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
         like = f"%{safe}%"
         filters = [
@@ -10946,137 +13556,107 @@ def admin_orders_list():
             db.func.lower(Order.capture_reference).like(like, escape="\\"),
         ]
         base_query = base_query.filter(db.or_(*filters))
-    base_query = base_query.order_by(Order.created_at.desc())
-    total_orders = base_query.count()
+    total_orders, total_approx = _admin_orders_total(base_query, status_filter, q)
     total_pages = max((total_orders + per_page - 1) // per_page, 1)
-    if page > total_pages:
-        page = total_pages
-
-    orders = (
-        base_query
-        .offset((page - 1) * per_page)
-        .limit(per_page)
-        .all()
-    )
 
-    package_ids = sorted({int(x.store_package_id) for x in orders if int(getattr(x, "store_package_id", 0) or 0) > 0})
-    item_ids = sorted({int(x.item_id) for x in orders if int(getattr(x, "item_id", 0) or 0) > 0})
+    newest_first = (Order.created_at.desc(), Order.id.desc())
+    if before:
+        created, oid = before
+        rows = (
+            base_query
+            .filter(
+                Order.created_at >= created,  # sargable bound: the index range starts at the cursor
+                db.or_(Order.created_at > created, db.and_(Order.created_at == created, Order.id > oid)),
+            )
+            .order_by(Order.created_at.asc(), Order.id.asc())
+            .limit(per_page + 1)
+            .all()
+        )
+        has_prev = len(rows) > per_page
+        orders = list(reversed(rows[:per_page]))
+        has_next = True
+    elif after:
+        created, oid = after
+        rows = (
+            base_query
+            .filter(
+                Order.created_at <= created,
+                db.or_(Order.created_at < created, db.and_(Order.created_at == created, Order.id < oid)),
+            )
+            .order_by(*newest_first)
+            .limit(per_page + 1)
+            .all()
+        )
+        orders = rows[:per_page]
+        has_next = len(rows) > per_page
+        has_prev = True
+    else:
+        if page > total_pages and not total_approx:
+            page = total_pages
+        rows = base_query.order_by(*newest_first).offset((page - 1) * per_page).limit(per_page + 1).all()
+        orders = rows[:per_page]
+        has_next = len(rows) > per_page
+        has_prev = page > 1
+
+    package_ids = sorted({int(x.store_package_id) for x in orders if int(x.store_package_id or 0) > 0})
+    item_ids = sorted({int(x.item_id) for x in orders if int(x.item_id or 0) > 0})
     packages_by_id = {}
     items_by_id = {}
     if package_ids:
-        try:
-            packages_by_id = {
-                int(pkg.id): pkg
-                for pkg in StorePackage.query.filter(StorePackage.id.in_(package_ids)).all()
-            }
-        except Exception:
-            packages_by_id = {}
+        packages_by_id = {
+            int(pkg_id): (name, category)
+            for pkg_id, name, category in db.session.query(StorePackage.id, StorePackage.name, StorePackage.category)
+            .filter(StorePackage.id.in_(package_ids)).all()
+        }
     if item_ids:
-        try:
-            items_by_id = {
-                int(item.id): item
-                for item in GamePackageItem.query.filter(GamePackageItem.id.in_(item_ids)).all()
-            }
-        except Exception:
-            items_by_id = {}
+        items_by_id = {
+            int(item_id): (title, price)
+            for item_id, title, price in db.session.query(GamePackageItem.id, GamePackageItem.title, GamePackageItem.price)
+            .filter(GamePackageItem.id.in_(item_ids)).all()
+        }
 
-    out = []
+    upload_prefix = app.config.get('UPLOAD_URL_PREFIX', '/static/uploads').rstrip('/')
     active_payment_provider = _payment_verification_provider()
+    out = []
     for x in orders:
+        pkg_name, pkg_category = packages_by_id.get(int(x.store_package_id or 0), ("", ""))
+        item_title, item_price = items_by_id.get(int(x.item_id or 0), ("", 0.0))
+        items_payload = []
         try:
-            pkg = packages_by_id.get(int(x.store_package_id or 0)) if x.store_package_id else None
-            it = items_by_id.get(int(x.item_id or 0)) if x.item_id else None
-            items_payload = []
             if (x.items_json or '').strip():
                 parsed = json.loads(x.items_json or '[]')
                 if isinstance(parsed, list):
                     items_payload = parsed
-
-            delivery_codes = []
-            if (x.delivery_codes_json or '').strip():
-                dc_parsed = json.loads(x.delivery_codes_json or '[]')
-                if isinstance(dc_parsed, list):
-                    delivery_codes = [str(c or '').strip() for c in dc_parsed if str(c or '').strip()]
-
-            auto_summary = _summarize_order_auto_recharges(_build_order_auto_recharge_units(x))
-            payment_state = _pabilo_get_payment_state(x)
-            pabilo_request = _pabilo_request_info(x)
-            pabilo_eligibility = _pabilo_eligibility_info(x)
-            out.append({
-                "id": x.id,
-                "created_at": x.created_at.isoformat() if x.created_at else "",
-                "status": x.status,
-                "store_package_id": x.store_package_id,
-                "package_name": pkg.name if pkg else "",
-                "package_category": (pkg.category if pkg and pkg.category else "mobile"),
-                "item_id": x.item_id,
-                "item_title": it.title if it else "",
-                "item_price_usd": (it.price if it else 0.0),
-                "is_auto_mapped": bool(auto_summary.get("total_units")),
-                "auto_recharge_summary": auto_summary,
-                "payment_verification_provider_active": active_payment_provider,
-                "payment_verify": payment_state,
-                "pabilo_request": pabilo_request,
-                "pabilo_eligible": bool(pabilo_eligibility.get("eligible")),
-                "pabilo_eligibility": pabilo_eligibility,
-                "items": items_payload,
-                "customer_id": x.customer_id,
-                "customer_zone": x.customer_zone or "",
-                "customer_name": x.customer_name or "",
-                "name": x.name,
-                "email": x.email,
-                "phone": x.phone,
-                "method": x.method,
-                "currency": x.currency,
-                "amount": x.amount,
-                "affiliate_code": x.special_code or "",
-                "reference": x.reference,
-                "capture_reference": x.capture_reference or "",
-                "delivery_code": x.delivery_code or "",
-                "delivery_codes": delivery_codes,
-                "payment_capture": x.payment_capture or "",
-                "payment_capture_url": (
-                    f"{app.config.get('UPLOAD_URL_PREFIX', '/static/uploads').rstrip('/')}/{x.payment_capture}"
-                    if x.payment_capture else ""
-                ),
-            })
-        except Exception as order_error:
-            out.append({
-                "id": getattr(x, "id", None),
-                "created_at": x.created_at.isoformat() if getattr(x, "created_at", None) else "",
-                "status": getattr(x, "status", "pending") or "pending",
-                "store_package_id": getattr(x, "store_package_id", None),
-                "package_name": "",
-                "package_category": "mobile",
-                "item_id": getattr(x, "item_id", None),
-                "item_title": "",
-                "item_price_usd": 0.0,
-                "is_auto_mapped": False,
-                "auto_recharge_summary": {},
-                "payment_verification_provider_active": active_payment_provider,
-                "payment_verify": {},
-                "pabilo_request": {},
-                "pabilo_eligible": False,
-                "pabilo_eligibility": {},
-                "items": [],
-                "customer_id": getattr(x, "customer_id", "") or "",
-                "customer_zone": getattr(x, "customer_zone", "") or "",
-                "customer_name": getattr(x, "customer_name", "") or "",
-                "name": getattr(x, "name", "") or "",
-                "email": getattr(x, "email", "") or "",
-                "phone": getattr(x, "phone", "") or "",
-                "method": getattr(x, "method", "") or "",
-                "currency": getattr(x, "currency", "") or "",
-                "amount": getattr(x, "amount", 0),
-                "affiliate_code": getattr(x, "special_code", "") or "",
-                "reference": getattr(x, "reference", "") or "",
-                "capture_reference": getattr(x, "capture_reference", "") or "",
-                "delivery_code": getattr(x, "delivery_code", "") or "",
-                "delivery_codes": [],
-                "payment_capture": getattr(x, "payment_capture", "") or "",
-                "payment_capture_url": "",
-                "load_error": f"No se pudo procesar la orden: {str(order_error)}",
-            })
+        except Exception:
+            items_payload = []
+        out.append({
+            "id": x.id,
+            "created_at": x.created_at.isoformat() if x.created_at else "",
+            "status": x.status or "pending",
+            "store_package_id": x.store_package_id,
+            "package_name": pkg_name or "",
+            "package_category": pkg_category or "mobile",
+            "item_id": x.item_id,
+            "item_title": item_title or "",
+            "item_price_usd": item_price or 0.0,
+            "payment_verification_provider_active": active_payment_provider,
+            "items": items_payload,
+            "customer_id": x.customer_id,
+            "customer_zone": x.customer_zone or "",
+            "customer_name": x.customer_name or "",
+            "name": x.name,
+            "email": x.email,
+            "phone": x.phone,
+            "method": x.method,
+            "currency": x.currency,
+            "amount": x.amount,
+            "affiliate_code": x.special_code or "",
+            "reference": x.reference,
+            "capture_reference": x.capture_reference or "",
+            "delivery_code": x.delivery_code or "",
+            "payment_capture": x.payment_capture or "",
+            "payment_capture_url": f"{upload_prefix}/{x.payment_capture}" if x.payment_capture else "",
+        })
     return jsonify({
         "ok": True,
         "orders": out,
@@ -11084,14 +13664,76 @@ def admin_orders_list():
             "page": page,
             "per_page": per_page,
             "total_orders": total_orders,
+            "total_approx": total_approx,
             "total_pages": total_pages,
-            "has_prev": page > 1,
-            "has_next": page < total_pages,
+            "has_prev": has_prev,
+            "has_next": has_next,
+            "prev_cursor": _keyset_cursor(orders[0]) if orders and has_prev else "",
+            "next_cursor": _keyset_cursor(orders[-1]) if orders and has_next else "",
             "q": q,
         },
     })
 
 
+_ADMIN_ORDER_DETAILS_MAX_IDS = 50
+
+
+def _admin_order_detail(x) -> dict:
+    """Automation and Pabilo/Ubii state of one order (the heavy part of a tile)."""
+    try:
+        delivery_codes = []
+        if (x.delivery_codes_json or '').strip():
+            dc_parsed = json.loads(x.delivery_codes_json or '[]')
+            if isinstance(dc_parsed, list):
+                delivery_codes = [str(c or '').strip() for c in dc_parsed if str(c or '').strip()]
+        auto_summary = _summarize_order_auto_recharges(_build_order_auto_recharge_units(x))
+        pabilo_eligibility = _pabilo_eligibility_info(x)
+        return {
+            "id": x.id,
+            "status": x.status,
+            "is_auto_mapped": bool(auto_summary.get("total_units")),
+            "auto_recharge_summary": auto_summary,
+            "payment_verification_provider_active": _payment_verification_provider(),
+            "payment_verify": _pabilo_get_payment_state(x),
+            "pabilo_request": _pabilo_request_info(x),
+            "pabilo_eligible": bool(pabilo_eligibility.get("eligible")),
+            "pabilo_eligibility": pabilo_eligibility,
+            "delivery_codes": delivery_codes,
+        }
+    except Exception as order_error:
+        return {
+            "id": x.id,
+            "status": x.status,
+            "is_auto_mapped": False,
+            "auto_recharge_summary": {},
+            "payment_verify": {},
+            "pabilo_request": {},
+            "pabilo_eligible": False,
+            "pabilo_eligibility": {},
+            "delivery_codes": [],
+            "load_error": f"No se pudo procesar la orden: {str(order_error)}",
+        }
+
+
+@app.route("/admin/orders/details", methods=["GET"])
+def admin_order_details():
+    """Tile details for a page of orders in one request: ?ids=1,2,3 -> {"orders": {id: detail}}."""
+    user = session.get("user")
+    if not user or user.get("role") != "admin":
+        return jsonify({"ok": False, "error": "No autorizado"}), 401
+    ids = []
+    for raw in (request.args.get("ids") or "").split(","):
+        raw = raw.strip()
+        if raw.isdigit() and int(raw) not in ids:
+            ids.append(int(raw))
+    if not ids:
+        return jsonify({"ok": False, "error": "ids requerido"}), 400
+    if len(ids) > _ADMIN_ORDER_DETAILS_MAX_IDS:
+        return jsonify({"ok": False, "error": f"Máximo {_ADMIN_ORDER_DETAILS_MAX_IDS} órdenes por consulta"}), 400
+    orders = Order.query.filter(Order.id.in_(ids)).all()
+    return jsonify({"ok": True, "orders": {str(x.id): _admin_order_detail(x) for x in orders}})
+
+
 # ==============================
 # Blocked Customers (Player IDs) API
 # ==============================
@@ -11169,40 +13811,83 @@ def admin_blocked_customers_delete(bid: int):
     db.session.commit()
     return jsonify({"ok": True})
 
-@app.route("/orders/my", methods=["GET"])
-def orders_my():
-    user = session.get("user")
-    if not user:
-        return jsonify({"ok": False, "error": "No autorizado"}), 401
-    q = Order.query
-    role = user.get("role")
-    if role == "admin":
-        email = (request.args.get("email") or "").strip()
-        customer_id = (request.args.get("customer_id") or "").strip()
-        if email:
-            q = q.filter(Order.email == email)
-        if customer_id:
-            q = q.filter(Order.customer_id == customer_id)
-        q = q.order_by(Order.created_at.desc()).limit(50)
-    elif role == "user":
-        email = (user.get("email") or "").strip()
-        uid = user.get("user_id")
-        filters = []
-        if email:
-            filters.append(Order.email == email)
-        if uid:
-            filters.append(Order.user_id == uid)
-        if not filters:
-            return jsonify({"ok": True, "orders": []})
-        q = q.filter(db.or_(*filters)).order_by(Order.created_at.desc()).limit(50)
-    else:
-        # Affiliates or other roles: do not expose buyer orders
-        return jsonify({"ok": True, "orders": []})
-    rows = q.all()
+# /orders/my ("Mis pedidos" / "Mis códigos") for logged-in buyers. The full
+# response is cached per (email, user_id) for ORDERS_MY_CACHE_TTL_SECONDS and
+# dropped as soon as one of that buyer's orders is created, deleted or changes
+# status/delivery codes in this process (flush hook below, plus the bulk UPDATEs in
+# _try_transition_order_to_approved/_auto_reject_order). Changes committed by
+# another process (worker.py approves, rejects and delivers) are caught by the
+# fingerprint: a hit is only served while the buyer's (id, status, delivery
+# codes) projection still matches the one it was built from. ?since_id=N&ids=1,2
+# answers a poll with just the orders newer than N plus the listed ones,
+# straight from the DB instead of the 50 full rows.
+_ORDERS_MY_LIMIT = 50
+_ORDERS_MY_CACHE_TTL_SECONDS = max(float(os.environ.get("ORDERS_MY_CACHE_TTL_SECONDS", "20") or 20), 0.0)
+_ORDERS_MY_CACHE_MAX_ENTRIES = 2000
+_ORDERS_MY_CACHE = OrderedDict()
+_ORDERS_MY_CACHE_LOCK = threading.Lock()
+
+
+def _orders_my_invalidate(email, user_id) -> None:
+    email = (email or "").strip()
+    if not email and not user_id:
+        return
+    with _ORDERS_MY_CACHE_LOCK:
+        stale = [
+            key for key in _ORDERS_MY_CACHE
+            if (email and key[0] == email) or (user_id and key[1] == user_id)
+        ]
+        for key in stale:
+            _ORDERS_MY_CACHE.pop(key, None)
+
+
+@db.event.listens_for(db.session, "after_flush")
+def _orders_my_collect_changes(session_obj, flush_context):
+    changed = set()
+    for obj in list(session_obj.new) + list(session_obj.deleted):
+        if isinstance(obj, Order):
+            changed.add((obj.email, obj.user_id))
+    for obj in session_obj.dirty:
+        if not isinstance(obj, Order):
+            continue
+        attrs = db.inspect(obj).attrs
+        if any(attrs[name].history.has_changes() for name in ("status", "delivery_code", "delivery_codes_json")):
+            changed.add((obj.email, obj.user_id))
+    if changed:
+        session_obj.info.setdefault("orders_my_changed", set()).update(changed)
+
+
+def _orders_my_session_finished(session_obj, *args) -> None:
+    for email, user_id in session_obj.info.pop("orders_my_changed", None) or ():
+        _orders_my_invalidate(email, user_id)
+
+
+db.event.listen(db.session, "after_commit", _orders_my_session_finished)
+db.event.listen(db.session, "after_soft_rollback", _orders_my_session_finished)
+
+
+def _orders_my_fingerprint(rows) -> str:
+    """Digest of (id, status, delivery_code, delivery_codes_json) for the buyer's listed orders."""
+    digest = hashlib.sha1()
+    for row in rows:
+        digest.update(repr((row.id, row.status, row.delivery_code, row.delivery_codes_json)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _orders_my_payload(rows) -> list:
+    """Serialize orders for /orders/my with one query for packages and one for items."""
+    package_ids = sorted({int(x.store_package_id) for x in rows if int(x.store_package_id or 0) > 0})
+    item_ids = sorted({int(x.item_id) for x in rows if int(x.item_id or 0) > 0})
+    packages_by_id = {}
+    items_by_id = {}
+    if package_ids:
+        packages_by_id = {int(pkg.id): pkg for pkg in StorePackage.query.filter(StorePackage.id.in_(package_ids)).all()}
+    if item_ids:
+        items_by_id = {int(item.id): item for item in GamePackageItem.query.filter(GamePackageItem.id.in_(item_ids)).all()}
     out = []
     for x in rows:
-        pkg = StorePackage.query.get(x.store_package_id)
-        it = GamePackageItem.query.get(x.item_id) if x.item_id else None
+        pkg = packages_by_id.get(int(x.store_package_id or 0))
+        it = items_by_id.get(int(x.item_id or 0)) if x.item_id else None
         # Parse items_json if available
         items_payload = []
         try:
@@ -11246,8 +13931,85 @@ def orders_my():
             "delivery_code": x.delivery_code or "",
             "delivery_codes": delivery_codes,
         })
+    return out
+
+
+@app.route("/orders/my", methods=["GET"])
+def orders_my():
+    user = session.get("user")
+    if not user:
+        return jsonify({"ok": False, "error": "No autorizado"}), 401
+    # Poll incremental: órdenes con id > since_id más las que la página sigue mirando (ids=)
+    try:
+        since_id = max(int(request.args.get("since_id") or 0), 0)
+    except Exception:
+        since_id = 0
+    watch_ids = set()
+    for raw in (request.args.get("ids") or "").split(",")[:_ORDERS_MY_LIMIT]:
+        try:
+            watch_ids.add(int(raw))
+        except Exception:
+            continue
+    incremental = bool(since_id or watch_ids)
+
+    q = Order.query
+    cache_key = None
+    role = user.get("role")
+    if role == "admin":
+        email = (request.args.get("email") or "").strip()
+        customer_id = (request.args.get("customer_id") or "").strip()
+        if email:
+            q = q.filter(Order.email == email)
+        if customer_id:
+            q = q.filter(Order.customer_id == customer_id)
+    elif role == "user":
+        email = (user.get("email") or "").strip()
+        uid = user.get("user_id")
+        filters = []
+        if email:
+            filters.append(Order.email == email)
+        if uid:
+            filters.append(Order.user_id == uid)
+        if not filters:
+            return jsonify({"ok": True, "orders": []})
+        q = q.filter(db.or_(*filters))
+        cache_key = (email, uid)
+    else:
+        # Affiliates or other roles: do not expose buyer orders
+        return jsonify({"ok": True, "orders": []})
+
+    if incremental:
+        rows = (
+            q.filter(db.or_(Order.id > since_id, Order.id.in_(watch_ids or [0])))
+            .order_by(Order.created_at.desc())
+            .limit(_ORDERS_MY_LIMIT)
+            .all()
+        )
+        return jsonify({"ok": True, "orders": _orders_my_payload(rows), "incremental": True})
+
+    ordered = q.order_by(Order.created_at.desc()).limit(_ORDERS_MY_LIMIT)
+    use_cache = cache_key is not None and _ORDERS_MY_CACHE_TTL_SECONDS > 0
+    if use_cache:
+        with _ORDERS_MY_CACHE_LOCK:
+            hit = _ORDERS_MY_CACHE.get(cache_key)
+        if hit and time.monotonic() - hit[0] < _ORDERS_MY_CACHE_TTL_SECONDS:
+            current = ordered.with_entities(Order.id, Order.status, Order.delivery_code, Order.delivery_codes_json).all()
+            if _orders_my_fingerprint(current) == hit[2]:
+                with _ORDERS_MY_CACHE_LOCK:
+                    if cache_key in _ORDERS_MY_CACHE:
+                        _ORDERS_MY_CACHE.move_to_end(cache_key)
+                return jsonify({"ok": True, "orders": hit[1]})
+    rows = ordered.all()
+    out = _orders_my_payload(rows)
+    if use_cache:
+        with _ORDERS_MY_CACHE_LOCK:
+            _ORDERS_MY_CACHE[cache_key] = (time.monotonic(), out, _orders_my_fingerprint(rows))
+            _ORDERS_MY_CACHE.move_to_end(cache_key)
+            while len(_ORDERS_MY_CACHE) > _ORDERS_MY_CACHE_MAX_ENTRIES:
+                _ORDERS_MY_CACHE.popitem(last=False)
     return jsonify({"ok": True, "orders": out})
 
+
 @app.route("/admin/orders/<int:oid>/status", methods=["POST"])
 def admin_orders_set_status(oid: int):
     user = session.get("user")
@@ -11320,10 +14082,7 @@ def admin_orders_set_status(oid: int):
             if to_addr:
                 html, text = build_order_approved_email(o, pkg, it)
                 subject = _email_subject_for_order(o, pkg, brand)
-                try:
-                    send_email_html(to_addr, subject, html, text)
-                except Exception:
-                    send_email_async(to_addr, subject, text)
+                send_email_html_async(to_addr, subject, html, text)
     except Exception:
         pass
     # Notify buyer on rejection (HTML email)
@@ -11334,10 +14093,7 @@ def admin_orders_set_status(oid: int):
             reason = (data.get("reason") or "").strip()
             brand = _email_brand()
             html, text = build_order_rejected_email(o, pkg, it, reason=reason)
-            try:
-                send_email_html(o.email, f"Orden #{o.id} rechazada - {brand}", html, text)
-            except Exception:
-                send_email_async(o.email, f"Orden #{o.id} rechazada - {brand}", text)
+            send_email_html_async(o.email, f"Orden #{o.id} rechazada - {brand}", html, text)
     except Exception:
         pass
 
@@ -11534,7 +14290,9 @@ def _verify_order_processing_units_locked(o):
 
         ext_order_id = unit.get("external_order_id") or f"INE-{o.id}"
         try:
-            resp = _requests_lib.get(
+            resp = _http_request(
+                "revendedores",
+                "GET",
                 f"{webb_url}/api/v1/order-status",
                 params={"external_order_id": ext_order_id},
                 headers={"X-API-Key": webb_api_key},
@@ -11693,126 +14451,132 @@ def admin_orders_verify_recharge(oid: int):
 _REV_AUTO_RETRY_MAX_ATTEMPTS_PER_UNIT = 8
 
 
-def _revendedores_pending_verification_loop():
-    """Background: cada 60s re-verifica órdenes pendientes cuyas recargas siguen
-    'processing' en el proveedor (p.ej. pases de Blood Strike, que tardan más de
-    los 60s que espera el dispatch), y además reintenta automáticamente las
+def _rev_order_has_retries_left(state) -> bool:
+    summary = state.get("summary") or {}
+    if summary.get("processing_units", 0) > 0 or summary.get("retryable_units", 0) <= 0:
+        return False
+    return any(
+        (unit.get("status") or "") in ("failed", "not_found", "pending")
+        and int(unit.get("attempt_count") or 0) < _REV_AUTO_RETRY_MAX_ATTEMPTS_PER_UNIT
+        for unit in (state.get("units") or [])
+    )
+
+
+@job_handler("rev_verify_scan", max_attempts=1, interval_seconds=60)
+def _job_rev_verify_scan(payload):
+    """Periodic (60 s): encola la verificación de órdenes pendientes cuyas
+    recargas siguen 'processing' en el proveedor (p.ej. pases de Blood Strike,
+    que tardan más de los 60s que espera el dispatch), y el reenvío de las
     unidades que quedaron 'failed'/'not_found' (p.ej. por un timeout o error de
     red puntual al hablar con Revendedores) hasta un máximo de intentos. Así la
-    orden se aprueba y entrega sola sin que el admin tenga que darle a
-    'Verificar' o 'Reenviar' manualmente."""
-    import time as _t
-    _t.sleep(75)  # esperar a que la app termine de arrancar
-    while not _acquire_singleton_lock(_LOCK_REV_VERIFY):
-        _t.sleep(30)
-    while True:
-        try:
-            with app.app_context():
-                cutoff = datetime.utcnow() - timedelta(hours=48)
-                pending_orders = Order.query.filter(
-                    Order.status == "pending",
-                    Order.created_at >= cutoff,
-                ).all()
-                for order in pending_orders:
-                    try:
-                        state = _load_order_automation_state(order)
-                        if not state:
-                            continue
-                        summary = state.get("summary") or {}
-                        if state.get("pending_verification") or summary.get("processing_units", 0) > 0:
-                            result = _verify_order_processing_units(order)
-                            summary = result.get("summary") or {}
-                            if result.get("ok") and summary.get("processing_units", 0) <= 0:
-                                print(
-                                    f"[RevAutoVerify] Orden #{order.id} resuelta: "
-                                    f"{summary.get('completed_units', 0)}/{summary.get('total_units', 0)} "
-                                    f"completadas, estado={order.status}"
-                                )
-                            state = _load_order_automation_state(order)
-                            summary = state.get("summary") or {}
-
-                        if summary.get("processing_units", 0) <= 0 and summary.get("retryable_units", 0) > 0:
-                            units = state.get("units") or []
-                            has_retries_left = any(
-                                (unit.get("status") or "") in ("failed", "not_found", "pending")
-                                and int(unit.get("attempt_count") or 0) < _REV_AUTO_RETRY_MAX_ATTEMPTS_PER_UNIT
-                                for unit in units
-                            )
-                            if has_retries_left:
-                                retry_result = _dispatch_order_auto_recharges(order, binance_auto=bool(state.get("binance_auto")))
-                                retry_summary = retry_result.get("summary") or {}
-                                if retry_summary.get("total_units", 0) > 0 and retry_summary.get("completed_units", 0) >= retry_summary.get("total_units", 0):
-                                    _send_order_completed_email_if_needed(order)
-                                    print(f"[RevAutoVerify] Orden #{order.id} completada tras reintento automático.")
-                    except Exception as exc:
-                        print(f"[RevAutoVerify] Error orden #{order.id}: {exc}")
-                    _t.sleep(2)  # rate-limit entre órdenes
-        except Exception as exc:
-            print(f"[RevAutoVerify] Thread error: {exc}")
-        _t.sleep(60)
+    orden se aprueba y entrega sola sin que el admin tenga que darle a
+    'Verificar' o 'Reenviar' manualmente. Cada orden es un job aparte, así que
+    se procesan en paralelo según el número de consumidores."""
+    cutoff = datetime.utcnow() - timedelta(hours=48)
+    pending_orders = Order.query.filter(
+        Order.status == "pending",
+        Order.created_at >= cutoff,
+    ).all()
+    for order in pending_orders:
+        state = _load_order_automation_state(order)
+        if not state:
+            continue
+        summary = state.get("summary") or {}
+        if state.get("pending_verification") or summary.get("processing_units", 0) > 0:
+            enqueue_job("verify_order", {"order_id": order.id}, dedupe_key=f"verify_order:{order.id}")
+        elif _rev_order_has_retries_left(state):
+            enqueue_job("dispatch_units", {"order_id": order.id}, dedupe_key=f"dispatch_units:{order.id}")
+
+
+@job_handler("verify_order", max_attempts=3)
+def _job_verify_order(payload):
+    """Re-verifica en el proveedor las unidades 'processing' de una orden."""
+    order = Order.query.get(int(payload.get("order_id") or 0))
+    if not order or (order.status or "") != "pending":
+        return
+    result = _verify_order_processing_units(order)
+    summary = result.get("summary") or {}
+    if result.get("ok") and summary.get("processing_units", 0) <= 0:
+        print(
+            f"[RevAutoVerify] Orden #{order.id} resuelta: "
+            f"{summary.get('completed_units', 0)}/{summary.get('total_units', 0)} "
+            f"completadas, estado={order.status}"
+        )
+    state = _load_order_automation_state(order)
+    if (order.status or "") == "pending" and state and _rev_order_has_retries_left(state):
+        enqueue_job("dispatch_units", {"order_id": order.id}, dedupe_key=f"dispatch_units:{order.id}")
+
 
+@job_handler("dispatch_units", max_attempts=1)
+def _job_dispatch_units(payload):
+    """Reenvía las unidades reintentables de una orden pendiente.
 
-_rev_verify_thread = threading.Thread(target=_revendedores_pending_verification_loop, daemon=True)
-_rev_verify_thread.start()
+    Un solo intento por job: cada unidad lleva su propio attempt_count y el
+    scan periódico vuelve a encolar la orden mientras le queden reintentos.
+    """
+    order = Order.query.get(int(payload.get("order_id") or 0))
+    if not order or (order.status or "") != "pending":
+        return
+    state = _load_order_automation_state(order)
+    if not state or not _rev_order_has_retries_left(state):
+        return
+    retry_result = _dispatch_order_auto_recharges(order, binance_auto=bool(state.get("binance_auto")))
+    retry_summary = retry_result.get("summary") or {}
+    if retry_summary.get("total_units", 0) > 0 and retry_summary.get("completed_units", 0) >= retry_summary.get("total_units", 0):
+        _send_order_completed_email_if_needed(order)
+        print(f"[RevAutoVerify] Orden #{order.id} completada tras reintento automático.")
 
 
 _PABILO_AUTO_RETRY_WINDOW_MINUTES = 20
 _PABILO_AUTO_RETRY_MAX_ATTEMPTS = 8
 
 
-def _pabilo_pending_verification_loop():
-    """Background: reintenta la verificación de pago Pabilo de órdenes pending
-    durante los primeros ~20 minutos tras la creación.
+def _pabilo_order_needs_retry(order) -> bool:
+    payment_state = _pabilo_get_payment_state(order)
+    if payment_state.get("verified"):
+        return False
+    if int(payment_state.get("attempts") or 0) >= _PABILO_AUTO_RETRY_MAX_ATTEMPTS:
+        return False
+    return bool(_pabilo_request_info(order).get("requestable"))
+
 
-    _start_checkout_automation solo intenta verificar una vez, justo al crear la
-    orden. Si el pago del cliente aún no aparecía reflejado en Pabilo en ese
-    instante (el banco puede tardar unos segundos/minutos), la orden se quedaba
-    'procesando' para siempre hasta que un admin le diera a 'Verificar' a mano.
-    Este loop reintenta cada ~45s con un tope de intentos, así la mayoría de las
-    órdenes se aprueban solas apenas el pago aparece en Pabilo.
+@job_handler("pabilo_verify_scan", max_attempts=1, interval_seconds=45)
+def _job_pabilo_verify_scan(payload):
+    """Periodic (45 s): reintenta la verificación de pago Pabilo de órdenes
+    pending durante los primeros ~20 minutos tras la creación.
+
+    La automatización del checkout solo intenta verificar una vez, justo al
+    crear la orden. Si el pago del cliente aún no aparecía reflejado en Pabilo
+    en ese instante (el banco puede tardar unos segundos/minutos), la orden se
+    quedaba 'procesando' para siempre hasta que un admin le diera a 'Verificar'
+    a mano. Este scan encola un job por orden con un tope de intentos, así la
+    mayoría de las órdenes se aprueban solas apenas el pago aparece en Pabilo.
     """
-    import time as _t
-    _t.sleep(50)
-    while not _acquire_singleton_lock(_LOCK_PABILO_VERIFY):
-        _t.sleep(30)
-    while True:
-        try:
-            with app.app_context():
-                if _payment_verification_provider() == "pabilo":
-                    cutoff = datetime.utcnow() - timedelta(minutes=_PABILO_AUTO_RETRY_WINDOW_MINUTES)
-                    candidates = Order.query.filter(
-                        Order.status == "pending",
-                        Order.created_at >= cutoff,
-                    ).all()
-                    for order in candidates:
-                        try:
-                            payment_state = _pabilo_get_payment_state(order)
-                            if payment_state.get("verified"):
-                                continue
-                            attempts = int(payment_state.get("attempts") or 0)
-                            if attempts >= _PABILO_AUTO_RETRY_MAX_ATTEMPTS:
-                                continue
-                            request_info = _pabilo_request_info(order)
-                            if not request_info.get("requestable"):
-                                continue
-                            eligibility = _pabilo_eligibility_info(order)
-                            result = _pabilo_verify_and_update_order(
-                                order,
-                                auto_approve_on_verified=bool(eligibility.get("eligible")),
-                                source="pabilo_auto_retry",
-                            )
-                            if result.get("verified"):
-                                print(f"[PabiloAutoRetry] Orden #{order.id} verificada, estado={order.status}")
-                        except Exception as exc:
-                            print(f"[PabiloAutoRetry] Error orden #{order.id}: {exc}")
-                        _t.sleep(2)  # rate-limit entre órdenes
-        except Exception as exc:
-            print(f"[PabiloAutoRetry] Thread error: {exc}")
-        _t.sleep(45)
+    if _payment_verification_provider() != "pabilo":
+        return
+    cutoff = datetime.utcnow() - timedelta(minutes=_PABILO_AUTO_RETRY_WINDOW_MINUTES)
+    candidates = Order.query.filter(
+        Order.status == "pending",
+        Order.created_at >= cutoff,
+    ).all()
+    for order in candidates:
+        if _pabilo_order_needs_retry(order):
+            enqueue_job("pabilo_verify_order", {"order_id": order.id}, dedupe_key=f"pabilo_verify_order:{order.id}")
 
 
-_pabilo_verify_thread = threading.Thread(target=_pabilo_pending_verification_loop, daemon=True)
-_pabilo_verify_thread.start()
+@job_handler("pabilo_verify_order", max_attempts=1)
+def _job_pabilo_verify_order(payload):
+    order = Order.query.get(int(payload.get("order_id") or 0))
+    if not order or (order.status or "") != "pending" or not _pabilo_order_needs_retry(order):
+        return
+    eligibility = _pabilo_eligibility_info(order)
+    result = _pabilo_verify_and_update_order(
+        order,
+        auto_approve_on_verified=bool(eligibility.get("eligible")),
+        source="pabilo_auto_retry",
+    )
+    if result.get("verified"):
+        print(f"[PabiloAutoRetry] Orden #{order.id} verificada, estado={order.status}")
 
 
 @app.route("/admin/minigames/config", methods=["GET"])
@@ -11983,6 +14747,7 @@ def _package_has_verification(gid: int) -> bool:
 
 
 @app.route("/store/package/<int:gid>/items")
+@storefront_cached(ttl=300)
 def store_game_items(gid: int):
     game = StorePackage.query.get(gid)
     if not game or not game.active:
@@ -12006,27 +14771,49 @@ def store_game_items(gid: int):
         ]
     })
 
-@app.route("/admin/revendedores/sync", methods=["POST"])
-def admin_revendedores_sync_catalog():
-    user = session.get("user")
-    if not user or user.get("role") != "admin":
-        return jsonify({"ok": False, "error": "No autorizado"}), 401
+# ==============================
+# Revendedores catalog sync
+# ==============================
+# The remote catalog (~thousands of packages) is diffed against
+# rev_catalog_items instead of rewritten: existing keys are loaded in one
+# query, each normalized entry is content-hashed and only new/changed rows are
+# written (bulk INSERT ... ON CONFLICT on uq_rev_product_package), and rows
+# the remote stopped listing are deactivated with one UPDATE per id chunk.
+# Every change is recorded in rev_catalog_changes. Besides the admin button,
+# the "rev_catalog_sync" periodic job runs the same sync every
+# REV_CATALOG_SYNC_INTERVAL_MINUTES when the API credentials are configured.
+_REV_CATALOG_SYNC_INTERVAL_MINUTES = max(float(os.environ.get("REV_CATALOG_SYNC_INTERVAL_MINUTES", "360") or 360), 5.0)
+_REV_CATALOG_CHANGELOG_DAYS = 30
+_REV_CATALOG_WRITE_CHUNK = 500
+
+
+def _rev_catalog_hash(ent) -> str:
+    content = [
+        str(ent.get("remote_product_name") or ""),
+        str(ent.get("remote_package_name") or ""),
+        bool(ent.get("active")),
+        str(ent.get("raw_json") or ""),
+    ]
+    return hashlib.sha1(json.dumps(content, ensure_ascii=False).encode("utf-8")).hexdigest()
 
+
+def _revendedores_fetch_catalog():
+    """Fetch + normalize the remote catalog. Returns (normalized, error)."""
     base_url, api_key, catalog_path, _ = _revendedores_env()
     if not base_url:
-        return jsonify({"ok": False, "error": "Configura REVENDEDORES_BASE_URL o WEBB_URL"}), 400
+        return [], "Configura REVENDEDORES_BASE_URL o WEBB_URL"
     if not api_key:
-        return jsonify({"ok": False, "error": "Configura REVENDEDORES_API_KEY o WEBB_API_KEY"}), 400
+        return [], "Configura REVENDEDORES_API_KEY o WEBB_API_KEY"
 
-    normalized = []
     remote_error = ""
-
     attempted_paths = []
     key_preview = (api_key[:12] + "...") if len(api_key) > 12 else "(vacía)"
     for path in _revendedores_catalog_paths():
         attempted_paths.append(path)
         try:
-            resp = _requests_lib.get(
+            resp = _http_request(
+                "revendedores",
+                "GET",
                 f"{base_url}{path}",
                 headers={"X-API-Key": api_key},
                 timeout=30,
@@ -12042,15 +14829,182 @@ def admin_revendedores_sync_catalog():
                 continue
             normalized = _normalize_rev_catalog_payload(payload)
             if normalized:
-                catalog_path = path
-                break
+                return normalized, ""
             remote_error = f"Catálogo API sin paquetes válidos en {path}"
         except Exception as exc:
             remote_error = f"No se pudo consultar catálogo API en {path}: {str(exc)}"
 
+    tried_paths = ", ".join(attempted_paths) or catalog_path
+    return [], f"No se pudo sincronizar catálogo de Revendedores: {remote_error}. Rutas probadas: {tried_paths}"
+
+
+def _rev_catalog_upsert(rows: list) -> None:
+    """Insert/overwrite catalog rows. Keys with a NULL product id never hit
+    uq_rev_product_package (NULLs are distinct), so those are written by id."""
+    table = RevendedoresCatalogItem.__table__
+    dialect = (db.session.get_bind(mapper=RevendedoresCatalogItem.__mapper__).dialect.name or "").lower()
+    value_cols = ("remote_product_name", "remote_package_name", "active", "raw_json", "content_hash", "updated_at")
+    bulk = [r for r in rows if r["remote_product_id"] is not None]
+    if bulk and dialect in ("postgresql", "sqlite"):
+        stmt = (pg_insert if dialect == "postgresql" else sqlite_insert)(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.remote_product_id, table.c.remote_package_id],
+            set_={c: stmt.excluded[c] for c in value_cols},
+        )
+        for i in range(0, len(bulk), _REV_CATALOG_WRITE_CHUNK):
+            db.session.execute(stmt, [{k: v for k, v in r.items() if k != "id"} for r in bulk[i:i + _REV_CATALOG_WRITE_CHUNK]])
+        rows = [r for r in rows if r["remote_product_id"] is None]
+    for r in rows:
+        if r.get("id"):
+            db.session.execute(table.update().where(table.c.id == r["id"]).values({c: r[c] for c in value_cols}))
+        else:
+            db.session.execute(table.insert().values({k: v for k, v in r.items() if k != "id"}))
+
+
+def _revendedores_catalog_apply(normalized, *, source: str = "admin", guard_mass_deactivation: bool = False) -> dict:
+    """Diff the normalized remote catalog against rev_catalog_items and write only the changes.
+
+    With guard_mass_deactivation (scheduled runs), a sync that would deactivate
+    more than half of the active rows skips the deactivations: that is far more
+    likely a partial answer from the remote than a real catalog change.
+    """
+    table = RevendedoresCatalogItem.__table__
+    now = datetime.utcnow()
+    sync_id = uuid.uuid4().hex
+    incoming = {}
+    for ent in normalized:
+        incoming[(ent.get("remote_product_id"), ent.get("remote_package_id"))] = ent
+
+    existing = {
+        (r.remote_product_id, r.remote_package_id): r
+        for r in db.session.execute(db.select(
+            table.c.id, table.c.remote_product_id, table.c.remote_package_id,
+            table.c.remote_product_name, table.c.remote_package_name, table.c.active, table.c.content_hash,
+        ))
+    }
+
+    writes = []
+    changes = []
+    created = updated = unchanged = 0
+    for key, ent in incoming.items():
+        content_hash = _rev_catalog_hash(ent)
+        old = existing.get(key)
+        if old is not None and (old.content_hash or "") == content_hash and bool(old.active) == bool(ent.get("active")):
+            unchanged += 1
+            continue
+        row = {
+            "id": old.id if old is not None else None,
+            "remote_product_id": key[0],
+            "remote_package_id": key[1],
+            "remote_product_name": ent.get("remote_product_name", ""),
+            "remote_package_name": ent.get("remote_package_name", ""),
+            "active": bool(ent.get("active")),
+            "raw_json": ent.get("raw_json", ""),
+            "content_hash": content_hash,
+            "created_at": now,
+            "updated_at": now,
+        }
+        writes.append(row)
+        if old is None:
+            created += 1
+            action, fields = "created", ""
+        else:
+            updated += 1
+            action = "updated"
+            before = {
+                "remote_product_name": old.remote_product_name or "",
+                "remote_package_name": old.remote_package_name or "",
+                "active": bool(old.active),
+            }
+            fields = ",".join(name for name, value in before.items() if value != row[name]) or "raw_json"
+        changes.append({
+            "sync_id": sync_id, "source": source, "action": action,
+            "remote_product_id": key[0], "remote_package_id": key[1],
+            "remote_package_name": row["remote_package_name"][:250], "fields": fields, "created_at": now,
+        })
+
+    stale = [r for key, r in existing.items() if key not in incoming and r.active]
+    active_before = sum(1 for r in existing.values() if r.active)
+    deactivation_skipped = 0
+    if guard_mass_deactivation and stale and len(stale) * 2 > active_before:
+        deactivation_skipped, stale = len(stale), []
+        print(f"[RevCatalog] {deactivation_skipped}/{active_before} paquetes activos no vinieron en el catálogo; no se desactivan")
+    for r in stale:
+        changes.append({
+            "sync_id": sync_id, "source": source, "action": "deactivated",
+            "remote_product_id": r.remote_product_id, "remote_package_id": r.remote_package_id,
+            "remote_package_name": (r.remote_package_name or "")[:250], "fields": "active", "created_at": now,
+        })
+
+    try:
+        if writes:
+            _rev_catalog_upsert(writes)
+        stale_ids = [r.id for r in stale]
+        for i in range(0, len(stale_ids), _REV_CATALOG_WRITE_CHUNK):
+            db.session.execute(
+                table.update()
+                .where(table.c.id.in_(stale_ids[i:i + _REV_CATALOG_WRITE_CHUNK]))
+                # Clear the hash so the package is rewritten (reactivated) if it comes back
+                .values(active=False, content_hash="", updated_at=now)
+            )
+        if changes:
+            db.session.execute(RevendedoresCatalogChange.__table__.insert(), changes)
+        change_table = RevendedoresCatalogChange.__table__
+        db.session.execute(change_table.delete().where(
+            change_table.c.created_at < now - timedelta(days=_REV_CATALOG_CHANGELOG_DAYS)
+        ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    active_in_db = db.session.execute(
+        db.select(db.func.count()).select_from(table).where(table.c.active == True)
+    ).scalar() or 0
+    return {
+        "sync_id": sync_id,
+        "created": created,
+        "updated": updated,
+        "unchanged": unchanged,
+        "deactivated": len(stale),
+        "deactivation_skipped": deactivation_skipped,
+        "total_normalized": len(normalized),
+        "active_in_db": int(active_in_db),
+    }
+
+
+@job_handler("rev_catalog_sync", max_attempts=1, interval_seconds=_REV_CATALOG_SYNC_INTERVAL_MINUTES * 60)
+def _job_rev_catalog_sync(payload):
+    """Periodic: pull the Revendedores catalog and apply the diff (no-op without credentials)."""
+    base_url, api_key, _, _ = _revendedores_env()
+    if not base_url or not api_key:
+        return
+    normalized, error = _revendedores_fetch_catalog()
+    if not normalized:
+        raise RuntimeError(error)
+    result = _revendedores_catalog_apply(normalized, source="job", guard_mass_deactivation=True)
+    if result["created"] or result["updated"] or result["deactivated"]:
+        print(
+            f"[RevCatalog] Sync {result['sync_id'][:8]}: {result['created']} nuevos, "
+            f"{result['updated']} actualizados, {result['deactivated']} desactivados, {result['unchanged']} sin cambios"
+        )
+
+
+@app.route("/admin/revendedores/sync", methods=["POST"])
+def admin_revendedores_sync_catalog():
+    user = session.get("user")
+    if not user or user.get("role") != "admin":
+        return jsonify({"ok": False, "error": "No autorizado"}), 401
+
+    base_url, api_key, _, _ = _revendedores_env()
+    if not base_url:
+        return jsonify({"ok": False, "error": "Configura REVENDEDORES_BASE_URL o WEBB_URL"}), 400
+    if not api_key:
+        return jsonify({"ok": False, "error": "Configura REVENDEDORES_API_KEY o WEBB_API_KEY"}), 400
+
+    normalized, error = _revendedores_fetch_catalog()
     if not normalized:
-        tried_paths = ", ".join(attempted_paths) or catalog_path
-        return jsonify({"ok": False, "error": f"No se pudo sincronizar catálogo de Revendedores: {remote_error}. Rutas probadas: {tried_paths}"}), 502
+        return jsonify({"ok": False, "error": error}), 502
 
     # Per-game breakdown for debugging
     games_summary = {}
@@ -12064,59 +15018,50 @@ def admin_revendedores_sync_catalog():
         k = f"{gname} (pid={pid})"
         games_summary[k] = games_summary.get(k, 0) + 1
 
-    created = 0
-    updated = 0
-    seen_keys = set()
-
     try:
-        for ent in normalized:
-            key = (ent.get("remote_product_id"), ent.get("remote_package_id"))
-            seen_keys.add(key)
-            row = RevendedoresCatalogItem.query.filter_by(
-                remote_product_id=ent.get("remote_product_id"),
-                remote_package_id=ent.get("remote_package_id"),
-            ).first()
-            if not row:
-                row = RevendedoresCatalogItem(**ent)
-                db.session.add(row)
-                created += 1
-            else:
-                row.remote_product_name = ent.get("remote_product_name", "")
-                row.remote_package_name = ent.get("remote_package_name", "")
-                row.active = bool(ent.get("active"))
-                row.raw_json = ent.get("raw_json", "")
-                updated += 1
-
-        deactivated = 0
-        for row in RevendedoresCatalogItem.query.all():
-            key = (row.remote_product_id, row.remote_package_id)
-            if key not in seen_keys:
-                if row.active:
-                    deactivated += 1
-                row.active = False
-
-        db.session.commit()
+        result = _revendedores_catalog_apply(normalized, source="admin")
     except Exception as exc:
-        try:
-            db.session.rollback()
-        except Exception:
-            pass
         return jsonify({"ok": False, "error": f"Error guardando catálogo: {str(exc)}"}), 500
 
-    active_count = RevendedoresCatalogItem.query.filter_by(active=True).count()
-
     return jsonify({
         "ok": True,
         "source": "api",
-        "created": created,
-        "updated": updated,
-        "deactivated": deactivated,
-        "total_normalized": len(normalized),
-        "active_in_db": active_count,
+        **result,
         "games": games_summary,
     })
 
 
+@app.route("/admin/revendedores/catalog-changes", methods=["GET"])
+def admin_revendedores_catalog_changes():
+    """Changelog of recent catalog syncs, newest first."""
+    user = session.get("user")
+    if not user or user.get("role") != "admin":
+        return jsonify({"ok": False, "error": "No autorizado"}), 401
+    limit = min(max(request.args.get("limit", type=int) or 200, 1), 1000)
+    rows = (
+        RevendedoresCatalogChange.query
+        .order_by(RevendedoresCatalogChange.id.desc())
+        .limit(limit)
+        .all()
+    )
+    return jsonify({
+        "ok": True,
+        "changes": [
+            {
+                "sync_id": r.sync_id,
+                "source": r.source or "",
+                "action": r.action,
+                "remote_product_id": r.remote_product_id,
+                "remote_package_id": r.remote_package_id,
+                "remote_package_name": r.remote_package_name or "",
+                "fields": [f for f in (r.fields or "").split(",") if f],
+                "created_at": r.created_at.isoformat() if r.created_at else "",
+            }
+            for r in rows
+        ],
+    })
+
+
 @app.route("/admin/revendedores/mapping-data", methods=["GET"])
 def admin_revendedores_mapping_data():
     user = session.get("user")
@@ -12693,9 +15638,201 @@ def admin_packages_delete(pid: int):
     return jsonify({"ok": True})
 
 
+# Config snapshot cache: every worker keeps the whole `config` table in memory
+# and only re-reads it when the version token (bumped by _upsert_config_values)
+# changes. The token is polled at most once per CONFIG_CACHE_POLL_SECONDS, so
+# admin edits reach every gunicorn worker within that window.
+CONFIG_VERSION_KEY = "config_version"
+_CONFIG_CACHE_ENABLED = (os.environ.get("CONFIG_CACHE_ENABLED", "1").strip().lower() not in ("0", "false", "no"))
+_CONFIG_CACHE_POLL_SECONDS = max(float(os.environ.get("CONFIG_CACHE_POLL_SECONDS", "1") or 1), 0.0)
+# Read-modify-write counters: always read from the DB and never bump the
+# version, otherwise every minigame assignment would flush all snapshots.
+_CONFIG_UNCACHED_KEYS = {
+    MINIGAME_GLOBAL_COUNT_KEY,
+    MINIGAME_CYCLE_PROGRESS_KEY,
+    MINIGAME_PENDING_TIERS_KEY,
+    BINANCE_RECONCILE_CURSOR_KEY,
+}
+_CONFIG_SNAPSHOT = {"values": None, "version": None, "checked_at": 0.0}
+_CONFIG_SNAPSHOT_LOCK = threading.Lock()
+_CONFIG_CACHE_STATS = {"hits": 0, "misses": 0, "reloads": 0, "version_checks": 0, "invalidations": 0}
+
+
+def _config_cache_stat(name: str, amount: int = 1) -> None:
+    with _CONFIG_SNAPSHOT_LOCK:
+        _CONFIG_CACHE_STATS[name] = _CONFIG_CACHE_STATS.get(name, 0) + amount
+
+
+def _config_snapshot_invalidate() -> None:
+    with _CONFIG_SNAPSHOT_LOCK:
+        _CONFIG_SNAPSHOT["values"] = None
+        _CONFIG_SNAPSHOT["version"] = None
+        _CONFIG_SNAPSHOT["checked_at"] = 0.0
+        _CONFIG_CACHE_STATS["invalidations"] += 1
+
+
+def _config_snapshot_values():
+    """Return the in-memory config dict, reloading it when the version changed."""
+    now_ts = time.monotonic()
+    with _CONFIG_SNAPSHOT_LOCK:
+        values = _CONFIG_SNAPSHOT["values"]
+        version = _CONFIG_SNAPSHOT["version"]
+        fresh = values is not None and (now_ts - _CONFIG_SNAPSHOT["checked_at"]) < _CONFIG_CACHE_POLL_SECONDS
+    if fresh:
+        return values
+
+    if values is not None:
+        _config_cache_stat("version_checks")
+        current_version = db.session.query(AppConfig.value).filter(AppConfig.key == CONFIG_VERSION_KEY).scalar()
+        if (current_version or "") == (version or ""):
+            with _CONFIG_SNAPSHOT_LOCK:
+                if _CONFIG_SNAPSHOT["values"] is values:
+                    _CONFIG_SNAPSHOT["checked_at"] = now_ts
+            return values
+
+    rows = db.session.query(AppConfig.key, AppConfig.value).all()
+    values = {str(row_key): (row_value if row_value is not None else "") for row_key, row_value in rows}
+    with _CONFIG_SNAPSHOT_LOCK:
+        _CONFIG_SNAPSHOT["values"] = values
+        _CONFIG_SNAPSHOT["version"] = values.get(CONFIG_VERSION_KEY, "")
+        _CONFIG_SNAPSHOT["checked_at"] = now_ts
+        _CONFIG_CACHE_STATS["reloads"] += 1
+    return values
+
+
 def get_config_value(key: str, default: str = "") -> str:
-    row = AppConfig.query.filter_by(key=key).first()
-    return row.value if row else default
+    key = str(key)
+    # Uncommitted writes in this session must be visible to the same request,
+    # and must not leak into the shared snapshot if the transaction rolls back.
+    if (
+        not _CONFIG_CACHE_ENABLED
+        or key in _CONFIG_UNCACHED_KEYS
+        or db.session.info.get("config_dirty")
+    ):
+        _config_cache_stat("misses")
+        row = AppConfig.query.filter_by(key=key).first()
+        return row.value if row else default
+    try:
+        values = _config_snapshot_values()
+    except Exception:
+        _config_cache_stat("misses")
+        row = AppConfig.query.filter_by(key=key).first()
+        return row.value if row else default
+    _config_cache_stat("hits")
+    value = values.get(key)
+    return value if value is not None else default
+
+
+def _config_session_finished(session_obj, *args) -> None:
+    if session_obj.info.pop("config_dirty", None):
+        _config_snapshot_invalidate()
+
+
+db.event.listen(db.session, "after_commit", _config_session_finished)
+db.event.listen(db.session, "after_soft_rollback", _config_session_finished)
+
+
+@app.route("/admin/config/cache-stats", methods=["GET"])
+def admin_config_cache_stats():
+    user = session.get("user")
+    if not user or user.get("role") != "admin":
+        return jsonify({"ok": False, "error": "No autorizado"}), 401
+    with _CONFIG_SNAPSHOT_LOCK:
+        stats = dict(_CONFIG_CACHE_STATS)
+        stats["cached_keys"] = len(_CONFIG_SNAPSHOT["values"] or {})
+        stats["version"] = _CONFIG_SNAPSHOT["version"] or ""
+    stats["enabled"] = _CONFIG_CACHE_ENABLED
+    stats["poll_seconds"] = _CONFIG_CACHE_POLL_SECONDS
+    with _STOREFRONT_CACHE_LOCK:
+        storefront = dict(_STOREFRONT_CACHE_STATS)
+        storefront["entries"] = len(_STOREFRONT_CACHE)
+    storefront["enabled"] = _STOREFRONT_CACHE_ENABLED
+    return jsonify({"ok": True, "stats": stats, "storefront": storefront})
+
+
+@app.route("/admin/player-lookup/cache-stats", methods=["GET"])
+def admin_player_lookup_cache_stats():
+    user = session.get("user")
+    if not user or user.get("role") != "admin":
+        return jsonify({"ok": False, "error": "No autorizado"}), 401
+    with _PLAYER_LOOKUP_LOCK:
+        stats = dict(_PLAYER_NICK_STATS)
+        stats["local_entries"] = len(_PLAYER_SCRAPE_CACHE)
+    saved = stats["local_hits"] + stats["negative_hits"] + stats["shared_hits"] + stats["local_waits"] + stats["lease_waits"]
+    stats["upstream_calls_saved"] = saved
+    stats["hit_rate"] = round(saved / stats["lookups"], 4) if stats["lookups"] else 0.0
+    stats["shared_enabled"] = _PLAYER_NICK_SHARED_CACHE
+    stats["max_entries"] = _PLAYER_NICK_CACHE_MAX_ENTRIES
+    return jsonify({"ok": True, "stats": stats})
+
+
+@app.route("/admin/http/pool-stats", methods=["GET"])
+def admin_http_pool_stats():
+    user = session.get("user")
+    if not user or user.get("role") != "admin":
+        return jsonify({"ok": False, "error": "No autorizado"}), 401
+    return jsonify({"ok": True, "providers": _http_pool_stats()})
+
+
+@app.route("/admin/mail/outbox-stats", methods=["GET"])
+def admin_mail_outbox_stats():
+    user = session.get("user")
+    if not user or user.get("role") != "admin":
+        return jsonify({"ok": False, "error": "No autorizado"}), 401
+    return jsonify({"ok": True, "mail": _mail_outbox_stats()})
+
+
+@app.route("/admin/jobs/stats", methods=["GET"])
+def admin_jobs_stats():
+    user = session.get("user")
+    if not user or user.get("role") != "admin":
+        return jsonify({"ok": False, "error": "No autorizado"}), 401
+    table = BackgroundJob.__table__
+    now = datetime.utcnow()
+    rows = db.session.execute(
+        db.select(table.c.kind, table.c.status, db.func.count(), db.func.min(table.c.run_at))
+        .group_by(table.c.kind, table.c.status)
+    ).all()
+    queue = {}
+    for kind, status, count, oldest in rows:
+        entry = queue.setdefault(kind, {})
+        entry[status] = int(count or 0)
+        if status == "queued" and oldest:
+            entry["max_delay_seconds"] = max(int((now - oldest).total_seconds()), 0)
+    dead = db.session.execute(
+        db.select(table.c.id, table.c.kind, table.c.attempts, table.c.last_error, table.c.finished_at)
+        .where(table.c.status == "dead").order_by(table.c.id.desc()).limit(20)
+    ).all()
+    with _JOB_STATS_LOCK:
+        process_stats = dict(_JOB_STATS)
+    ocr_table = CaptureOcrResult.__table__
+    ocr_counts = dict(db.session.execute(
+        db.select(ocr_table.c.status, db.func.count()).group_by(ocr_table.c.status)
+    ).all())
+    ocr_last_minute = db.session.execute(
+        db.select(db.func.count()).select_from(ocr_table)
+        .where(ocr_table.c.started_at >= now - timedelta(seconds=60))
+    ).scalar() or 0
+    with _CAPTURE_OCR_STATS_LOCK:
+        ocr_process = dict(_CAPTURE_OCR_STATS)
+    return jsonify({
+        "ok": True,
+        "mode": _JOB_QUEUE_MODE,
+        "queue": queue,
+        "process": process_stats,
+        "capture_ocr": {
+            "results": {k: int(v or 0) for k, v in ocr_counts.items()},
+            "genai_calls_last_minute": int(ocr_last_minute),
+            "max_concurrency": GENAI_OCR_MAX_CONCURRENCY,
+            "max_per_minute": GENAI_OCR_MAX_PER_MINUTE,
+            "process": ocr_process,
+        },
+        "recent_dead": [
+            {"id": r.id, "kind": r.kind, "attempts": r.attempts, "last_error": r.last_error or "",
+             "finished_at": r.finished_at.isoformat() if r.finished_at else None}
+            for r in dead
+        ],
+    })
 
 
 @app.context_processor
@@ -12712,6 +15849,16 @@ def static_url(filename):
     return url_for('static', filename=filename, v=DEPLOY_VERSION)
 
 
+@app.route("/admin/stats/sales-counters/reconcile", methods=["GET", "POST"])
+def admin_stats_sales_counters_reconcile():
+    """GET: reporta el drift de package_sales_counters; POST: además lo corrige."""
+    user = session.get("user")
+    if not user or user.get("role") != "admin":
+        return jsonify({"ok": False, "error": "No autorizado"}), 401
+    report = _reconcile_package_sales_counters(apply=(request.method == "POST"))
+    return jsonify(report), (200 if report.get("ok") else 500)
+
+
 @app.route("/admin/stats/packages", methods=["GET"])
 def admin_stats_packages():
     user = session.get("user")
@@ -12748,125 +15895,13 @@ def admin_stats_summary():
     if not user or user.get("role") != "admin":
         return jsonify({"ok": False, "error": "No autorizado"}), 401
 
-    items = GamePackageItem.query.all()
-    items_by_id = {it.id: it for it in items}
-
-    total_profit_net = 0.0
-    total_commission_affiliates = 0.0
-
     # Optional period filter
     period = (request.args.get("period") or "").strip().lower()
+    filters = []
     if period == "weekly":
-        cutoff = get_stats_reset_cutoff()
-        approved_orders = Order.query.filter(
-            Order.status.in_(["approved", "delivered"]),
-            db.func.coalesce(Order.method, "") != "gift",
-            Order.created_at >= cutoff,
-        ).all()
-    else:
-        # Lifetime stats: do not restrict by weekly cutoff so resets don't wipe accumulated totals
-        approved_orders = Order.query.filter(
-            Order.status.in_(["approved", "delivered"]),
-            db.func.coalesce(Order.method, "") != "gift",
-        ).all()
-    for o in approved_orders:
-        try:
-            use_affiliate = False
-            su = None
-            if o.special_user_id:
-                su = SpecialUser.query.get(o.special_user_id)
-            if (not su) and (o.special_code or ""):
-                su = SpecialUser.query.filter(
-                    db.func.lower(SpecialUser.code) == (o.special_code or "").lower(),
-                    SpecialUser.active == True,
-                ).first()
-            if su and su.active:
-                scope_ok = True
-                sc = (su.scope or "all")
-                if sc == "package":
-                    try:
-                        scope_ok = (su.scope_package_id == o.store_package_id)
-                    except Exception:
-                        scope_ok = False
-                use_affiliate = scope_ok
-
-            # items_map: iid -> {qty, revenue, cost_total}
-            items_map = {}
-            try:
-                if (o.items_json or "").strip():
-                    payload = json.loads(o.items_json or "[]")
-                    if isinstance(payload, list):
-                        for ent in payload:
-                            try:
-                                iid = int(ent.get("item_id") or 0)
-                            except Exception:
-                                iid = 0
-                            if iid <= 0:
-                                continue
-                            q = int(ent.get("qty") or 1)
-                            if q <= 0:
-                                q = 1
-                            try:
-                                p = float(ent.get("price") or 0.0)
-                            except Exception:
-                                p = 0.0
-                            # Usar costo guardado en la orden, o costo actual si no existe
-                            it = items_by_id.get(iid)
-                            cost_unit = float(ent.get("cost_unit_usd") or (it.profit_net_usd if it else 0.0) or 0.0)
-                            
-                            cur = items_map.get(iid) or {"qty": 0, "revenue": 0.0, "cost_total": 0.0}
-                            cur["qty"] += q
-                            cur["revenue"] += (p * q)
-                            cur["cost_total"] += (cost_unit * q)
-                            items_map[iid] = cur
-            except Exception:
-                items_map = {}
-            if not items_map and o.item_id:
-                # Legacy: single item orders without items_json
-                try:
-                    iid = int(o.item_id)
-                    if iid > 0:
-                        it = items_by_id.get(iid)
-                        if it:
-                            cur = items_map.get(iid) or {"qty": 0, "revenue": 0.0, "cost_total": 0.0}
-                            cur["qty"] += 1
-                            cur["revenue"] += float(it.price or 0.0)
-                            cur["cost_total"] += float(it.profit_net_usd or 0.0)
-                            items_map[iid] = cur
-                except Exception:
-                    pass
-
-            # Determinar comisión del influencer una vez por orden (solo para registro)
-            comm_pct = 0.0
-            if use_affiliate and su:
-                comm_pct = float(su.commission_percent or 0.0)
-
-            # Calcular ganancia por cada ítem
-            for iid, agg in items_map.items():
-                it = items_by_id.get(iid)
-                if not it:
-                    continue
-                qty = int(agg.get("qty") or 0)
-                revenue = float(agg.get("revenue") or 0.0)
-                cost_total = float(agg.get("cost_total") or 0.0)
-                
-                if qty <= 0 or cost_total <= 0.0:
-                    continue
-                
-                # Registrar comisión del influencer (solo informativo)
-                if use_affiliate and comm_pct > 0:
-                    commission_item = round(revenue * (comm_pct / 100.0), 2)
-                    total_commission_affiliates += commission_item
-                    # Restar comisión del influencer de la ganancia
-                    profit_val = revenue - cost_total - commission_item
-                else:
-                    # Ganancia = precio pagado por cliente - costo guardado en la orden
-                    profit_val = revenue - cost_total
-                if profit_val < 0.0:
-                    profit_val = 0.0
-                total_profit_net += profit_val
-        except Exception:
-            continue
+        filters.append(Order.created_at >= get_stats_reset_cutoff())
+    # Lifetime stats: do not restrict by weekly cutoff so resets don't wipe accumulated totals
+    total_profit_net, total_commission_affiliates = _stats_profit_totals(*filters)
 
     return jsonify({
         "ok": True,
@@ -12888,69 +15923,14 @@ def _maybe_snapshot_previous_period():
         existing = ProfitSnapshot.query.filter_by(period_start=prev_cutoff, period_end=current_cutoff).first()
         if existing:
             return
-        prev_orders = Order.query.filter(
-            Order.status.in_(["approved", "delivered"]),
-            Order.created_at >= prev_cutoff,
-            Order.created_at < current_cutoff,
-        ).all()
-        if not prev_orders:
+        period_filters = (Order.created_at >= prev_cutoff, Order.created_at < current_cutoff)
+        has_orders = db.session.query(Order.id).filter(
+            Order.status.in_(_STATS_SUCCESS_STATUSES),
+            *period_filters,
+        ).first()
+        if not has_orders:
             return
-        all_items = GamePackageItem.query.all()
-        items_by_id = {it.id: it for it in all_items}
-        profit = 0.0
-        commission = 0.0
-        for o in prev_orders:
-            try:
-                su = None
-                use_affiliate = False
-                if o.special_user_id:
-                    su = SpecialUser.query.get(o.special_user_id)
-                if (not su) and (o.special_code or ""):
-                    su = SpecialUser.query.filter(
-                        db.func.lower(SpecialUser.code) == (o.special_code or "").lower(),
-                        SpecialUser.active == True,
-                    ).first()
-                if su and su.active:
-                    sc = (su.scope or "all")
-                    scope_ok = True
-                    if sc == "package":
-                        try:
-                            scope_ok = (su.scope_package_id == o.store_package_id)
-                        except Exception:
-                            scope_ok = False
-                    use_affiliate = scope_ok
-                items_map = {}
-                if (o.items_json or "").strip():
-                    payload = json.loads(o.items_json or "[]")
-                    if isinstance(payload, list):
-                        for ent in payload:
-                            iid = int(ent.get("item_id") or 0)
-                            if iid <= 0:
-                                continue
-                            q = max(int(ent.get("qty") or 1), 1)
-                            p = float(ent.get("price") or 0.0)
-                            it = items_by_id.get(iid)
-                            cu = float(ent.get("cost_unit_usd") or (it.profit_net_usd if it else 0.0) or 0.0)
-                            cur = items_map.get(iid, {"rev": 0.0, "cost": 0.0})
-                            cur["rev"] += p * q
-                            cur["cost"] += cu * q
-                            items_map[iid] = cur
-                comm_pct = float(su.commission_percent or 0.0) if use_affiliate and su else 0.0
-                for iid, agg in items_map.items():
-                    rev = agg["rev"]
-                    cost = agg["cost"]
-                    if cost <= 0.0:
-                        continue
-                    if comm_pct > 0:
-                        ci = round(rev * (comm_pct / 100.0), 2)
-                        commission += ci
-                        pv = rev - cost - ci
-                    else:
-                        pv = rev - cost
-                    if pv > 0:
-                        profit += pv
-            except Exception:
-                continue
+        profit, commission = _stats_profit_totals(*period_filters)
         snap = ProfitSnapshot(
             period_start=prev_cutoff,
             period_end=current_cutoff,
@@ -13018,156 +15998,45 @@ def admin_stats_package(pkg_id: int):
     total_profit_net = 0.0
     total_commission_affiliates = 0.0
 
-    # Optional period filter per package
+    # Optional period filter per package; lifetime stats have no cutoff
     period = (request.args.get("period") or "").strip().lower()
+    filters = [Order.store_package_id == pkg_id]
     if period == "weekly":
-        cutoff = get_stats_reset_cutoff()
-        approved_orders = Order.query.filter(
-            Order.store_package_id == pkg_id,
-            Order.status.in_(["approved", "delivered"]),
-            db.func.coalesce(Order.method, "") != "gift",
-            Order.created_at >= cutoff,
-        ).all()
-    else:
-        # Lifetime stats per package (no cutoff)
-        approved_orders = Order.query.filter(
-            Order.store_package_id == pkg_id,
-            Order.status.in_(["approved", "delivered"]),
-            db.func.coalesce(Order.method, "") != "gift",
-        ).all()
-    for o in approved_orders:
-        try:
-            use_affiliate = False
-            su = None
-            if o.special_user_id:
-                su = SpecialUser.query.get(o.special_user_id)
-            if (not su) and (o.special_code or ""):
-                su = SpecialUser.query.filter(
-                    db.func.lower(SpecialUser.code) == (o.special_code or "").lower(),
-                    SpecialUser.active == True,
-                ).first()
-            if su and su.active:
-                scope_ok = True
-                sc = (su.scope or "all")
-                if sc == "package":
-                    try:
-                        scope_ok = (su.scope_package_id == o.store_package_id)
-                    except Exception:
-                        scope_ok = False
-                use_affiliate = scope_ok
-
-            # items_map: iid -> {qty, revenue, cost_total}
-            items_map = {}
-            try:
-                if (o.items_json or "").strip():
-                    payload = json.loads(o.items_json or "[]")
-                    if isinstance(payload, list):
-                        for ent in payload:
-                            try:
-                                iid = int(ent.get("item_id") or 0)
-                            except Exception:
-                                iid = 0
-                            if iid <= 0:
-                                continue
-                            q = int(ent.get("qty") or 1)
-                            if q <= 0:
-                                q = 1
-                            try:
-                                p = float(ent.get("price") or 0.0)
-                            except Exception:
-                                p = 0.0
-                            # Usar costo guardado en la orden, o costo actual si no existe
-                            it = items_by_id.get(iid)
-                            cost_unit = float(ent.get("cost_unit_usd") or (it.profit_net_usd if it else 0.0) or 0.0)
-                            
-                            cur = items_map.get(iid) or {"qty": 0, "revenue": 0.0, "cost_total": 0.0}
-                            cur["qty"] += q
-                            cur["revenue"] += (p * q)
-                            cur["cost_total"] += (cost_unit * q)
-                            items_map[iid] = cur
-            except Exception:
-                items_map = {}
-            if not items_map and o.item_id:
-                # Legacy: single item orders without items_json
-                try:
-                    iid = int(o.item_id)
-                    if iid > 0:
-                        it = items_by_id.get(iid)
-                        if it:
-                            cur = items_map.get(iid) or {"qty": 0, "revenue": 0.0, "cost_total": 0.0}
-                            cur["qty"] += 1
-                            cur["revenue"] += float(it.price or 0.0)
-                            cur["cost_total"] += float(it.profit_net_usd or 0.0)
-                            items_map[iid] = cur
-                except Exception:
-                    pass
-
-            # Determinar comisión del influencer una vez por orden (solo para registro)
-            comm_pct = 0.0
-            if use_affiliate and su:
-                comm_pct = float(su.commission_percent or 0.0)
-
-            # Calcular ganancia por cada ítem
-            for iid, agg in items_map.items():
-                it = items_by_id.get(iid)
-                if not it:
-                    continue
-                
-                qty = int(agg.get("qty") or 0)
-                revenue = float(agg.get("revenue") or 0.0)
-                cost_total = float(agg.get("cost_total") or 0.0)
-                
-                if qty <= 0 or cost_total <= 0.0:
-                    continue
-                
-                # Costo actual del ítem (para mostrar en UI)
-                cost_unit = float(it.profit_net_usd or 0.0)
-                # Precio estándar y ganancia estándar por unidad (informativa)
-                price_std = float(it.price or 0.0)
-                profit_unit_std = price_std - cost_unit
-                if profit_unit_std < 0.0:
-                    profit_unit_std = 0.0
-                
-                # Registrar comisión del influencer (solo informativo)
-                if use_affiliate and comm_pct > 0:
-                    commission_item = round(revenue * (comm_pct / 100.0), 2)
-                    total_commission_affiliates += commission_item
-                    # Restar comisión del influencer de la ganancia
-                    profit_val = revenue - cost_total - commission_item
-                else:
-                    profit_val = revenue - cost_total
-                rec = stats.setdefault(
-                    iid,
-                    {
-                        "id": it.id,
-                        "title": it.title,
-                        "price": price_std,
-                        "cost_unit_usd": cost_unit,
-                        "profit_unit_std_usd": profit_unit_std,
-                        "revenue_total_usd": 0.0,
-                        "revenue_affiliate_usd": 0.0,
-                        "qty_total": 0,
-                        "qty_normal": 0,
-                        "qty_with_affiliate": 0,
-                        "profit_total_usd": 0.0,
-                    },
-                )
-                rec["qty_total"] += qty
-                if use_affiliate:
-                    rec["qty_with_affiliate"] += qty
-                    rec["revenue_affiliate_usd"] = rec.get("revenue_affiliate_usd", 0.0) + revenue
-                else:
-                    rec["qty_normal"] += qty
-                # acumular revenue para poder calcular promedio real
-                rec["revenue_total_usd"] = rec.get("revenue_total_usd", 0.0) + revenue
-                if profit_val < 0.0:
-                    profit_val = 0.0
-                rec["profit_total_usd"] = rec.get("profit_total_usd", 0.0) + profit_val
-                total_profit_net += profit_val
-        except Exception:
-            continue
+        filters.append(Order.created_at >= get_stats_reset_cutoff())
+    for record in _stats_profit_records(*filters, items_by_id=items_by_id):
+        it = items_by_id[record["item_id"]]
+        # Costo actual del ítem y ganancia estándar por unidad (informativa, para la UI)
+        cost_unit = float(it.profit_net_usd or 0.0)
+        price_std = float(it.price or 0.0)
+        rec = stats.setdefault(
+            it.id,
+            {
+                "id": it.id,
+                "title": it.title,
+                "price": price_std,
+                "cost_unit_usd": cost_unit,
+                "profit_unit_std_usd": max(price_std - cost_unit, 0.0),
+                "revenue_total_usd": 0.0,
+                "revenue_affiliate_usd": 0.0,
+                "qty_total": 0,
+                "qty_normal": 0,
+                "qty_with_affiliate": 0,
+                "profit_total_usd": 0.0,
+            },
+        )
+        rec["qty_total"] += record["qty"]
+        if record["use_affiliate"]:
+            rec["qty_with_affiliate"] += record["qty"]
+            rec["revenue_affiliate_usd"] += record["revenue"]
+        else:
+            rec["qty_normal"] += record["qty"]
+        rec["revenue_total_usd"] += record["revenue"]
+        rec["profit_total_usd"] += record["profit"]
+        total_profit_net += record["profit"]
+        total_commission_affiliates += record["commission"]
 
     items_out = []
+    avg_disc = None
     for it in items:
         price_std = float(it.price or 0.0)
         cost_unit = float(it.profit_net_usd or 0.0)
@@ -13200,13 +16069,14 @@ def admin_stats_package(pkg_id: int):
             profit_with_disc = avg_price_disc - cost_unit
         else:
             # Sin datos reales: estimar con descuento promedio de afiliados activos
-            avg_disc = 0.0
-            try:
-                active_affs = SpecialUser.query.filter_by(active=True).all()
-                if active_affs:
-                    avg_disc = sum(float(a.discount_percent or 0) for a in active_affs) / len(active_affs) / 100.0
-            except Exception:
-                pass
+            if avg_disc is None:
+                avg_disc = 0.0
+                try:
+                    active_affs = SpecialUser.query.filter_by(active=True).all()
+                    if active_affs:
+                        avg_disc = sum(float(a.discount_percent or 0) for a in active_affs) / len(active_affs) / 100.0
+                except Exception:
+                    pass
             profit_with_disc = (price_std * (1.0 - avg_disc)) - cost_unit
         if profit_with_disc < 0.0:
             profit_with_disc = 0.0
@@ -13256,6 +16126,9 @@ def _upsert_config_values(values: dict[str, str]) -> None:
     ]
     if not rows:
         return
+    if any(row_data["key"] not in _CONFIG_UNCACHED_KEYS for row_data in rows):
+        rows.append({"key": CONFIG_VERSION_KEY, "value": uuid.uuid4().hex})
+        db.session.info["config_dirty"] = True
 
     table = AppConfig.__table__
     bind = None
@@ -13438,5 +16311,11 @@ def auth_register():
     return jsonify({"ok": True, "user": session["user"]})
 
 
+with app.app_context():
+    _ensure_periodic_jobs()
+if _JOB_QUEUE_MODE == "inline":
+    _start_job_consumers(_JOB_QUEUE_INLINE_CONSUMERS)
+
+
 if __name__ == "__main__":
     app.run(debug=True)
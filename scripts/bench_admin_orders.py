@@ -0,0 +1,157 @@
+"""Latency of /admin/orders pages: legacy COUNT + OFFSET + heavy rows vs keyset slim list.
+
+Uso:
+    python scripts/bench_admin_orders.py [--orders 500000] [--repeat 5]
+
+Siembra N órdenes en una base SQLite temporal y mide, como admin con el test
+client, la primera página, una página profunda (~la mitad de la tabla), un
+filtro por estado y una búsqueda por los últimos dígitos de la referencia. La
+versión anterior se reproduce aquí (count() exacto, OFFSET y por fila
+_build_order_auto_recharge_units / _pabilo_request_info /
+_pabilo_eligibility_info); la nueva pasa por el endpoint con cursores y,
+aparte, se mide /admin/orders/details con los ids de la primera página, la
+única consulta extra que hace el panel por página.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_admin_orders_")
+os.environ["SQLITE_PATH"] = os.path.join(_TMP_DIR, "bench.sqlite")
+os.environ.pop("DATABASE_URL", None)
+os.environ["JOB_QUEUE_MODE"] = "worker"
+
+import app as store_app  # noqa: E402
+from app import GamePackageItem, Order, StorePackage, app, db  # noqa: E402
+
+
+def legacy_page(page: int, q: str = "", status: str = "", per_page: int = 20):
+    """admin_orders_list before keyset pagination (only the DB/row-building work)."""
+    base_query = Order.query
+    if status:
+        base_query = base_query.filter(Order.status == status)
+    if q:
+        like = f"%{q.lower()}%"
+        base_query = base_query.filter(db.or_(
+            db.func.lower(Order.reference).like(like),
+            db.func.lower(Order.customer_id).like(like),
+            db.func.lower(Order.capture_reference).like(like),
+        ))
+    base_query = base_query.order_by(Order.created_at.desc())
+    total = base_query.count()
+    orders = base_query.offset((page - 1) * per_page).limit(per_page).all()
+    out = []
+    for x in orders:
+        json.loads(x.items_json or "[]")
+        json.loads(x.delivery_codes_json or "[]")
+        summary = store_app._summarize_order_auto_recharges(store_app._build_order_auto_recharge_units(x))
+        out.append((x.id, summary, store_app._pabilo_get_payment_state(x), store_app._pabilo_request_info(x), store_app._pabilo_eligibility_info(x)))
+    return total, out
+
+
+def seed(n_orders: int):
+    rng = random.Random(17)
+    for p in range(1, 9):
+        db.session.add(StorePackage(id=p, name=f"Juego {p}", image_path="/static/x.png", active=True))
+        for i in range(5):
+            db.session.add(GamePackageItem(id=p * 10 + i, store_package_id=p, title=f"{100 * (i + 1)} diamantes", price=1.0 + i))
+    db.session.commit()
+    now = datetime.utcnow()
+    batch = []
+    for i in range(n_orders):
+        pkg_id = rng.randrange(1, 9)
+        batch.append({
+            "store_package_id": pkg_id,
+            "item_id": pkg_id * 10 + rng.randrange(5),
+            "status": rng.choices(("pending", "approved", "delivered", "rejected"), (3, 40, 50, 7))[0],
+            "method": rng.choice(("pm", "binance", "pabilo")),
+            "currency": "BsD",
+            "amount": float(rng.randrange(100, 5000)),
+            "reference": str(rng.randrange(10**7, 10**12)),
+            "customer_id": str(rng.randrange(10**8, 10**10)),
+            "email": f"c{i % 40000}@example.com",
+            "items_json": json.dumps([{"item_id": pkg_id * 10, "title": "100 diamantes", "qty": 1, "price": 1.0}]),
+            "delivery_codes_json": "[]",
+            "created_at": now - timedelta(seconds=n_orders - i),
+        })
+        if len(batch) == 20000:
+            db.session.execute(Order.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(Order.__table__.insert(), batch)
+    db.session.commit()
+    db.session.execute(db.text("ANALYZE"))
+    db.session.commit()
+
+
+def timed(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=500000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        print(f"Sembrando {args.orders} órdenes...")
+        started = time.perf_counter()
+        seed(args.orders)
+        print(f"  {time.perf_counter() - started:.1f}s")
+        deep_page = max(args.orders // 40, 1)
+        deep_row = db.session.query(Order.id, Order.created_at).order_by(Order.created_at.desc(), Order.id.desc()).offset(deep_page * 20 - 1).limit(1).one()
+        deep_cursor = store_app._keyset_cursor(deep_row)
+        sample_ref = db.session.query(Order.reference).filter(Order.id == args.orders // 3).scalar()
+        suffix = sample_ref[-6:]
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user"] = {"id": 1, "role": "admin", "email": "admin@example.com"}
+
+    def new(qs):
+        resp = client.get(f"/admin/orders?{qs}")
+        assert resp.status_code == 200 and resp.get_json()["ok"], resp.data[:200]
+        return resp.get_json()
+
+    first = new("")
+    detail_ids = ",".join(str(o["id"]) for o in first["orders"])
+
+    cases = [
+        ("primera página", lambda: legacy_page(1), lambda: new("")),
+        (f"página {deep_page + 1}", lambda: legacy_page(deep_page + 1), lambda: new(f"after={deep_cursor}")),
+        ("estado=pending", lambda: legacy_page(1, status="pending"), lambda: new("status=pending")),
+        (f"búsqueda '{suffix}'", lambda: legacy_page(1, q=suffix), lambda: new(f"q={suffix}")),
+    ]
+    print(f"{'caso':<26}{'anterior ms':>14}{'nuevo ms':>12}")
+    for label, legacy_fn, new_fn in cases:
+        with app.app_context():
+            legacy_ms = timed(legacy_fn, args.repeat)
+        new_ms = timed(new_fn, args.repeat)
+        print(f"{label:<26}{legacy_ms:>14.1f}{new_ms:>12.1f}")
+    detail_ms = timed(lambda: client.get(f"/admin/orders/details?ids={detail_ids}"), args.repeat)
+    print(f"{'detalles de la página':<26}{'':>14}{detail_ms:>12.1f}")
+    deep = new(f"after={deep_cursor}")
+    back = new(f"before={deep['pagination']['prev_cursor']}")
+    print(f"  Anterior desde la página {deep_page + 1} devuelve la página {deep_page}: {back['orders'][-1]['id'] == deep_row.id}")
+    print("  (los totales se sirven de caché durante ADMIN_ORDERS_COUNT_TTL_SECONDS; la búsqueda en SQLite no usa los índices trigram de Postgres)")
+
+
+if __name__ == "__main__":
+    main()
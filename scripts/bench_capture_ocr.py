@@ -0,0 +1,238 @@
+"""Capture OCR under a checkout burst: synchronous GenAI in the request vs the capture_ocr job stage.
+
+Uso:
+    python scripts/bench_capture_ocr.py [--captures 100] [--dupes 0.25] [--threads 16]
+                                        [--latency 0.8] [--quota 60] [--budget 50]
+                                        [--ocr-consumers 2]
+
+No llama a Gemini: reemplaza el módulo genai de app.py por un doble (FakeGenAI)
+que tarda --latency segundos por llamada, lee la referencia del contenido del
+archivo y responde 429 (TooManyRequests) cuando se pasan --quota llamadas por
+minuto, como la cuota real. Una fracción --dupes de los comprobantes se sube
+dos veces (el cliente reintenta o vuelve al checkout).
+
+Con --threads hilos (los de gunicorn gthread) se suben todos a la vez a
+/orders/extract-capture-reference:
+  - anterior: la ruta sube el archivo a GenAI y espera la respuesta (con los
+    reintentos time.sleep(2 ** n) de antes) dentro de la petición;
+  - job: la ruta responde 202, --ocr-consumers hilos dedicados a capture_ocr
+    (CAPTURE_OCR_CONSUMERS, aparte de los 4 de worker.py --consumers 4)
+    procesan la cola con GENAI_OCR_MAX_PER_MINUTE=--budget y el cliente
+    consulta /orders/capture-reference/<id> hasta que termina.
+Reporta la latencia de la subida, el tiempo hasta tener la referencia, las
+llamadas a GenAI, los 429, el máximo de llamadas simultáneas y cuántas
+referencias se obtuvieron.
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_capture_ocr_")
+os.environ["SQLITE_PATH"] = os.path.join(_TMP_DIR, "bench.sqlite")
+os.environ["UPLOAD_FOLDER"] = os.path.join(_TMP_DIR, "uploads")
+os.environ.pop("DATABASE_URL", None)
+os.environ["JOB_QUEUE_MODE"] = "worker"
+os.environ["ORDER_EVENTS_ENABLED"] = "0"
+os.environ["GENAI_API_KEY"] = "bench-fake-key"
+
+import app as store_app  # noqa: E402
+from app import app, db, jsonify, request  # noqa: E402
+
+
+class FakeGenAI:
+    """Stand-in for google.generativeai: upload_file / GenerativeModel / delete_file."""
+
+    def __init__(self, latency: float, quota_per_minute: int):
+        self.latency = latency
+        self.quota = quota_per_minute
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.calls = []
+            self.total_calls = 0
+            self.rate_limited = 0
+            self.in_flight = 0
+            self.max_in_flight = 0
+
+    def configure(self, api_key=None):
+        pass
+
+    def upload_file(self, path):
+        with open(path, "rb") as fh:
+            return type("Uploaded", (), {"name": os.path.basename(path), "data": fh.read()})()
+
+    def delete_file(self, name=None):
+        pass
+
+    def GenerativeModel(self, model_name):
+        fake = self
+
+        class _Model:
+            def generate_content(self, parts):
+                uploaded = parts[-1]
+                with fake.lock:
+                    now = time.monotonic()
+                    fake.calls = [t for t in fake.calls if now - t < 60]
+                    if len(fake.calls) >= fake.quota:
+                        fake.rate_limited += 1
+                        raise store_app.google_api_exceptions.TooManyRequests("429 Resource has been exhausted (quota)")
+                    fake.calls.append(now)
+                    fake.total_calls += 1
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                try:
+                    time.sleep(fake.latency)
+                finally:
+                    with fake.lock:
+                        fake.in_flight -= 1
+                ref = uploaded.data.split(b"REF:", 1)[1].split(b";", 1)[0].decode()
+                return type("Response", (), {"text": ref})()
+
+        return _Model()
+
+
+def legacy_extract(relative_path: str, fingerprint: str):
+    """_extract_capture_reference before the job stage (3 passes with sleeps)."""
+    cached = store_app._capture_reference_cache_get(fingerprint)
+    if cached is not None:
+        return cached["reference"], cached["status"]
+    remaining = store_app._genai_cooldown_remaining_seconds()
+    if remaining > 0:
+        return "", f"error:cooldown_active:{remaining}"
+    try:
+        uploaded = store_app.genai.upload_file(path=store_app._capture_absolute_path(relative_path))
+        _model, response = store_app._genai_extract_reference_with_retries(uploaded, attempts=3)
+        reference = store_app._normalize_extracted_capture_reference(getattr(response, "text", ""))
+        status = "ok" if reference else "not_detected"
+        store_app._capture_reference_cache_set(fingerprint, reference, status)
+        return reference, status
+    except Exception as exc:
+        if store_app._is_genai_retryable_error(exc):
+            store_app._genai_activate_cooldown(str(exc))
+            return "", f"error:cooldown_active:{store_app._genai_cooldown_remaining_seconds()}"
+        return "", f"error:{exc}"
+
+
+def legacy_preview():
+    capture_file = request.files.get("payment_capture")
+    temp_path, sha = store_app._save_capture(capture_file)
+    try:
+        reference, status = legacy_extract(temp_path, sha)
+    finally:
+        store_app._delete_capture(temp_path)
+    if status.startswith("error:"):
+        return jsonify({"ok": False, "status": status}), 503
+    return jsonify({"ok": True, "found": bool(reference), "reference": reference, "status": status})
+
+
+app.add_url_rule("/bench/legacy-extract", "bench_legacy_extract", legacy_preview, methods=["POST"])
+
+
+def make_captures(n: int, dupes: float, rng):
+    unique = [
+        (f"cap{i}.png", b"PNG;REF:" + str(rng.randrange(10**9, 10**12)).encode() + b";" + os.urandom(2048))
+        for i in range(int(n * (1 - dupes)))
+    ]
+    uploads = unique + [rng.choice(unique) for _ in range(n - len(unique))]
+    rng.shuffle(uploads)
+    return uploads
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+
+def run(uploads, threads: int, url: str, poll: bool):
+    def one(upload):
+        name, data = upload
+        client = app.test_client()
+        started = time.perf_counter()
+        resp = client.post(url, data={"payment_capture": (io.BytesIO(data), name)}, content_type="multipart/form-data")
+        post_s = time.perf_counter() - started
+        body = resp.get_json() or {}
+        while poll and body.get("ok") and not body.get("done") and time.perf_counter() - started < 300:
+            time.sleep(0.25)
+            body = client.get(body["status_url"]).get_json() or {}
+        return post_s, time.perf_counter() - started, bool(body.get("found"))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(one, uploads))
+    return results, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--captures", type=int, default=100)
+    parser.add_argument("--dupes", type=float, default=0.25)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.8)
+    parser.add_argument("--quota", type=int, default=60, help="cuota falsa de GenAI, llamadas/minuto")
+    parser.add_argument("--budget", type=int, default=50, help="GENAI_OCR_MAX_PER_MINUTE")
+    parser.add_argument("--ocr-consumers", type=int, default=2, help="CAPTURE_OCR_CONSUMERS")
+    args = parser.parse_args()
+
+    fake = FakeGenAI(args.latency, args.quota)
+    store_app.genai = fake
+    store_app.GENAI_OCR_MAX_PER_MINUTE = args.budget
+    store_app._JOB_HANDLERS["capture_ocr"]["consumers"] = max(args.ocr_consumers, 1)
+    uploads = make_captures(args.captures, args.dupes, random.Random(25))
+    unique = len({data for _, data in uploads})
+    print(
+        f"{len(uploads)} subidas ({unique} comprobantes distintos), {args.threads} hilos web, "
+        f"GenAI falso {args.latency:.1f}s/llamada con cuota {args.quota}/min, "
+        f"presupuesto {store_app.GENAI_OCR_MAX_CONCURRENCY} simultáneas / {args.budget} por minuto"
+    )
+    print(f"{'modo':<10}{'subida p50':>12}{'p95 s':>8}{'resultado p95 s':>17}{'total s':>9}"
+          f"{'GenAI':>7}{'429':>6}{'simult.':>9}{'encontradas':>13}")
+
+    stop = threading.Event()
+    for label, url, poll in (
+        ("anterior", "/bench/legacy-extract", False),
+        ("job", "/orders/extract-capture-reference", True),
+    ):
+        fake.reset()
+        store_app._CAPTURE_REFERENCE_CACHE.clear()
+        store_app._GENAI_COOLDOWN_UNTIL = 0.0
+        consumers = store_app._start_job_consumers(4, stop) if poll else []
+        results, total = run(uploads, args.threads, url, poll)
+        post = [r[0] for r in results]
+        done = [r[1] for r in results]
+        found = sum(1 for r in results if r[2])
+        print(
+            f"{label:<10}{statistics.median(post):>12.3f}{percentile(post, 0.95):>8.2f}"
+            f"{percentile(done, 0.95):>17.2f}{total:>9.1f}{fake.total_calls:>7}{fake.rate_limited:>6}"
+            f"{fake.max_in_flight:>9}{found:>9}/{len(uploads)}"
+        )
+        if consumers:
+            stop.set()
+            store_app._JOB_WAKE.set()
+            for t in consumers:
+                t.join(timeout=15)
+
+    with app.app_context():
+        rows = db.session.execute(
+            db.select(store_app.CaptureOcrResult.status, db.func.count()).group_by(store_app.CaptureOcrResult.status)
+        ).all()
+    left = os.listdir(os.path.join(app.config["UPLOAD_FOLDER"], "captures"))
+    print(f"  capture_ocr_results: {dict(rows)}; archivos temporales restantes: {len(left)}")
+    print("  capture_ocr:", store_app._CAPTURE_OCR_STATS)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Queries-per-request for the storefront routes with and without the config snapshot cache.
+
+Uso:
+    python scripts/bench_config_cache.py [--requests 200]
+
+Crea una base SQLite temporal, siembra la configuración y un paquete, y cuenta
+las sentencias SQL que emite cada ruta con el caché apagado y encendido.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_cfg_")
+os.environ["SQLITE_PATH"] = os.path.join(_TMP_DIR, "bench.sqlite")
+os.environ.pop("DATABASE_URL", None)
+
+import app as store_app  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+
+def seed():
+    with store_app.app.app_context():
+        pkg = store_app.StorePackage(name="Free Fire", image_path="/static/x.png", active=True, category="mobile")
+        store_app.db.session.add(pkg)
+        store_app.db.session.commit()
+        store_app.set_config_values({
+            "site_name": "InefableStore",
+            "logo_path": "/static/logo.png",
+            "pm_bank": "0102",
+            "pm_name": "Inefable",
+            "binance_email": "pay@example.com",
+            "thanks_image_path": "",
+        })
+        return pkg.id
+
+
+def measure(client, path: str, n: int, counter: dict):
+    counter["n"] = 0
+    started = time.perf_counter()
+    for _ in range(n):
+        resp = client.get(path)
+        if resp.status_code >= 400:
+            raise SystemExit(f"{path} -> {resp.status_code}")
+    elapsed = time.perf_counter() - started
+    return counter["n"] / n, (elapsed / n) * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    gid = seed()
+    counter = {"n": 0}
+    with store_app.app.app_context():
+        engine = store_app.db.engine
+
+    def _count(*_a, **_kw):
+        counter["n"] += 1
+
+    event.listen(engine, "before_cursor_execute", _count)
+    client = store_app.app.test_client()
+    routes = ["/store/payments", f"/store/package/{gid}", "/"]
+
+    print(f"{'route':<28}{'cache':>7}{'queries/req':>14}{'ms/req':>10}")
+    for enabled in (False, True):
+        store_app._CONFIG_CACHE_ENABLED = enabled
+        store_app._config_snapshot_invalidate()
+        for path in routes:
+            client.get(path)  # warm-up
+            qpr, ms = measure(client, path, args.requests, counter)
+            print(f"{path:<28}{'on' if enabled else 'off':>7}{qpr:>14.2f}{ms:>10.2f}")
+    print("stats:", store_app._CONFIG_CACHE_STATS)
+
+
+if __name__ == "__main__":
+    main()
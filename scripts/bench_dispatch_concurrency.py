@@ -0,0 +1,107 @@
+"""Wall time of _dispatch_order_auto_recharges for 1, 5 and 20-unit orders against a slow stub.
+
+Uso:
+    python scripts/bench_dispatch_concurrency.py [--latency 2.0] [--units 1,5,20]
+
+Levanta un stub HTTP de Revendedores que tarda --latency segundos por recarga
+y registra cada external_order_id recibido. Para cada tamaño de orden despacha
+una orden nueva con el límite de Revendedores en 1 (equivalente al envío
+secuencial de antes) y con el límite configurado (DISPATCH_CONCURRENCY_REVENDEDORES).
+Verifica además que cada unidad se envió una sola vez con su propio
+external_order_id.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_dispatch_")
+os.environ["SQLITE_PATH"] = os.path.join(_TMP_DIR, "bench.sqlite")
+os.environ.pop("DATABASE_URL", None)
+
+_STUB = {"latency": 2.0, "received": Counter(), "lock": threading.Lock()}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        with _STUB["lock"]:
+            _STUB["received"][self.headers.get("X-Request-ID") or ""] += 1
+        time.sleep(_STUB["latency"])
+        body = json.dumps({"ok": True, "player_name": "Jugador", "reference_no": "R-1", "remaining_balance": 10}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=2.0)
+    parser.add_argument("--units", default="1,5,20")
+    args = parser.parse_args()
+    _STUB["latency"] = args.latency
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["REVENDEDORES_BASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ["REVENDEDORES_API_KEY"] = "bench-key"
+
+    import app as store_app
+
+    db = store_app.db
+    with store_app.app.app_context():
+        pkg = store_app.StorePackage(name="Free Fire", image_path="/static/x.png", active=True)
+        db.session.add(pkg)
+        db.session.commit()
+        item = store_app.GamePackageItem(store_package_id=pkg.id, title="100 diamantes", price=1.0, active=True)
+        db.session.add(item)
+        db.session.commit()
+        db.session.add(store_app.RevendedoresItemMapping(
+            store_package_id=pkg.id, store_item_id=item.id, remote_product_id=1, remote_package_id=10, auto_enabled=True,
+        ))
+        db.session.commit()
+
+        limit = store_app._DISPATCH_PROVIDER_LIMITS["revendedores_api"]
+        print(f"{'unidades':>9}{'límite':>8}{'segundos':>10}{'completadas':>13}{'envíos dup.':>13}")
+        for n_units in [int(x) for x in args.units.split(",") if x.strip()]:
+            for provider_limit in (1, limit):
+                store_app._DISPATCH_PROVIDER_SLOTS["revendedores_api"] = threading.BoundedSemaphore(provider_limit)
+                order = store_app.Order(
+                    store_package_id=pkg.id, item_id=item.id, status="approved", customer_id="123456789",
+                    email="bench@example.com", items_json=json.dumps([{"item_id": item.id, "qty": n_units}]),
+                )
+                db.session.add(order)
+                db.session.commit()
+                _STUB["received"].clear()
+                started = time.perf_counter()
+                result = store_app._dispatch_order_auto_recharges(order)
+                elapsed = time.perf_counter() - started
+                summary = result.get("summary") or {}
+                dupes = sum(1 for count in _STUB["received"].values() if count > 1)
+                if len(_STUB["received"]) != n_units:
+                    print(f"  ! {len(_STUB['received'])} external_order_id distintos para {n_units} unidades")
+                print(f"{n_units:>9}{provider_limit:>8}{elapsed:>10.2f}{summary.get('completed_units', 0):>13}{dupes:>13}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Micro-benchmark: emails rendered per second by the order email builders.
+
+Uso:
+    python scripts/bench_email_render.py [--seconds 2] [--items 3]
+
+Construye en memoria una orden con varios items y códigos de entrega y llama
+en bucle a build_order_approved_email, build_order_created_email,
+build_order_rejected_email y build_admin_new_order_email (HTML + texto plano),
+contra una base SQLite temporal con la marca y los enlaces de soporte
+configurados. Reporta correos por segundo de cada uno, y del aprobado además
+justo después de cada cambio de configuración (caché de marca invalidado).
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_email_")
+os.environ["SQLITE_PATH"] = os.path.join(_TMP_DIR, "bench.sqlite")
+os.environ.pop("DATABASE_URL", None)
+os.environ["JOB_QUEUE_MODE"] = "worker"
+
+import app as store_app  # noqa: E402
+
+
+def rate(fn, seconds: float) -> float:
+    n = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        fn()
+        n += 1
+    return n / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--items", type=int, default=3)
+    args = parser.parse_args()
+
+    with store_app.app.app_context():
+        store_app.set_config_values({
+            "site_name": "InefableStore",
+            "whatsapp_url": "https://wa.me/584120000000",
+            "support_url": "https://inefablestore.com/soporte",
+            "privacy_url": "https://inefablestore.com/privacidad",
+        })
+        pkg = store_app.StorePackage(id=1, name="Free Fire", category="mobile", image_path="/static/x.png")
+        it = store_app.GamePackageItem(id=1, store_package_id=1, title="100 diamantes", price=1.0)
+        items = [{"item_id": i, "title": f"{100 * (i + 1)} diamantes", "qty": i + 1, "price": 1.5 * (i + 1)} for i in range(args.items)]
+        order = store_app.Order(
+            id=123456, store_package_id=1, item_id=1, status="approved", amount=350.0, currency="BsD",
+            method="pm", reference="123456789", email="cliente@example.com", phone="04120000000",
+            customer_id="987654321", customer_name="Jugador<1>", special_code="MINI10",
+            items_json=json.dumps(items), delivery_codes_json=json.dumps(["ABCD-EFGH-IJKL", "MNOP-QRST-UVWX"]),
+        )
+        cases = [
+            ("aprobada", lambda: store_app.build_order_approved_email(order, pkg, it)),
+            ("creada", lambda: store_app.build_order_created_email(order, pkg, it)),
+            ("rechazada", lambda: store_app.build_order_rejected_email(order, pkg, it, reason="Pago no recibido")),
+            ("admin nueva orden", lambda: store_app.build_admin_new_order_email(order, pkg, it)),
+        ]
+        print(f"{'correo':<30}{'correos/s':>12}")
+        for label, fn in cases:
+            fn()  # warm-up (compilación de plantillas)
+            print(f"{label:<30}{rate(fn, args.seconds):>12.0f}")
+
+        counter = {"n": 0}
+
+        def after_config_change():
+            counter["n"] += 1
+            store_app.set_config_value("support_url", f"https://inefablestore.com/soporte?v={counter['n']}")
+            store_app.build_order_approved_email(order, pkg, it)
+
+        change_rate = rate(after_config_change, args.seconds)
+        print(f"{'aprobada tras cambio config':<30}{change_rate:>12.0f}  (incluye la escritura de config)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Gift-code generation: one SELECT + ORM add per code (legacy) vs block IN + bulk insert.
+
+Uso:
+    python scripts/bench_gift_codes.py [--sizes 500,10000,100000] [--existing 100000]
+
+Crea un ítem elegible y --existing códigos previos en una base SQLite temporal
+(para que la comprobación de choques vaya contra una tabla con datos), y
+genera lotes de cada tamaño primero con la implementación anterior
+(filter_by(code).first() por candidato y db.session.add uno a uno) y luego con
+_gift_create_batch. Reporta códigos por segundo y comprueba que no hay
+códigos repetidos en la tabla.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_gift_codes_")
+os.environ["SQLITE_PATH"] = os.path.join(_TMP_DIR, "bench.sqlite")
+os.environ.pop("DATABASE_URL", None)
+os.environ["JOB_QUEUE_MODE"] = "worker"
+
+import app as store_app  # noqa: E402
+from app import GamePackageItem, GiftCode, StorePackage, app, db  # noqa: E402
+
+
+def legacy_create_batch(item_id, quantity, batch="", source="", expires_at=None):
+    """_gift_create_batch before the bulk version (validation omitted)."""
+    item = GamePackageItem.query.get(int(item_id or 0))
+    pkg = StorePackage.query.get(int(item.store_package_id))
+    prize_title = f"{pkg.name} - {item.title}" if pkg else str(item.title or "")
+    creados = []
+    for _ in range(quantity):
+        for _ in range(8):
+            code = store_app._gift_generate_code()
+            if not GiftCode.query.filter_by(code=code).first():
+                break
+        else:
+            db.session.rollback()
+            raise RuntimeError("No se pudieron generar códigos únicos, intenta de nuevo.")
+        gift = GiftCode(
+            code=code,
+            store_package_id=int(item.store_package_id),
+            item_id=int(item.id),
+            prize_title=prize_title[:300],
+            batch=(batch or "").strip()[:60],
+            source=(source or "").strip()[:30],
+            expires_at=expires_at,
+        )
+        db.session.add(gift)
+        creados.append(gift)
+    db.session.commit()
+    return creados
+
+
+def seed(existing: int):
+    db.session.add(StorePackage(id=1, name="Free Fire", image_path="/static/x.png", active=True, category="mobile"))
+    db.session.add(GamePackageItem(id=1, store_package_id=1, title="100 diamantes", price=1.0, active=True))
+    db.session.commit()
+    if existing:
+        store_app.GIFT_MAX_BATCH_SIZE = max(store_app.GIFT_MAX_BATCH_SIZE, existing)
+        store_app._gift_create_batch(1, existing, batch="previos")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="500,10000,100000")
+    parser.add_argument("--existing", type=int, default=100000)
+    args = parser.parse_args()
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    store_app.GIFT_MAX_BATCH_SIZE = max(sizes + [store_app.GIFT_MAX_BATCH_SIZE])
+
+    with app.app_context():
+        seed(args.existing)
+        print(f"{GiftCode.query.count()} códigos previos")
+        print(f"{'códigos':>9}{'anterior cód/s':>17}{'nuevo cód/s':>14}{'x':>7}")
+        for n in sizes:
+            started = time.perf_counter()
+            legacy_create_batch(1, n, batch=f"legacy-{n}")
+            legacy_rate = n / (time.perf_counter() - started)
+            db.session.expunge_all()
+            started = time.perf_counter()
+            codes, _prize = store_app._gift_create_batch(1, n, batch=f"bulk-{n}")
+            new_rate = len(codes) / (time.perf_counter() - started)
+            print(f"{n:>9}{legacy_rate:>17.0f}{new_rate:>14.0f}{new_rate / legacy_rate:>7.1f}")
+        total = GiftCode.query.count()
+        distinct = db.session.query(db.func.count(db.distinct(GiftCode.code))).scalar()
+        print(f"  {total} códigos en la tabla, {distinct} distintos")
+
+
+if __name__ == "__main__":
+    main()
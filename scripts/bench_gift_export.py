@@ -0,0 +1,160 @@
+"""Gift-code admin at scale: export memory, panel stats and deep listing pages.
+
+Uso:
+    python scripts/bench_gift_export.py [--codes 150000]
+
+Genera --codes códigos (una parte canjeados o desactivados, en varios lotes)
+en una base SQLite temporal y mide, como admin con el test client:
+  - exportación: la versión anterior (.all() + join en memoria) contra la
+    respuesta por bloques, en .txt y en CSV con todas las columnas, con el
+    pico de memoria de Python (tracemalloc) mientras se consume la descarga;
+  - totales del panel: tres COUNT + DISTINCT batch contra la consulta agrupada;
+  - listado: primera página y una página profunda siguiendo next_cursor.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_gift_export_")
+os.environ["SQLITE_PATH"] = os.path.join(_TMP_DIR, "bench.sqlite")
+os.environ.pop("DATABASE_URL", None)
+os.environ["JOB_QUEUE_MODE"] = "worker"
+
+import app as store_app  # noqa: E402
+from app import GiftCode, app, db  # noqa: E402
+
+
+def legacy_export_body(batch_filter: str = "") -> str:
+    """admin_gift_codes_export before streaming."""
+    query = GiftCode.query.filter(GiftCode.is_used == False, GiftCode.active == True)
+    if batch_filter:
+        query = query.filter(GiftCode.batch == batch_filter)
+    codes = query.order_by(GiftCode.created_at.asc()).all()
+    return "\n".join(store_app._gift_format_code(g.code) for g in codes)
+
+
+def legacy_stats():
+    total = GiftCode.query.count()
+    usados = GiftCode.query.filter(GiftCode.is_used == True).count()
+    disponibles = GiftCode.query.filter(GiftCode.is_used == False, GiftCode.active == True).count()
+    lotes = sorted({
+        (row[0] or "").strip()
+        for row in db.session.query(GiftCode.batch).distinct().all()
+        if (row[0] or "").strip()
+    })
+    return {"total": total, "used": usados, "available": disponibles}, lotes
+
+
+def seed(n_codes: int):
+    rng = random.Random(23)
+    codes = sorted(store_app._gift_generate_codes(n_codes))
+    now = datetime.utcnow()
+    rows = []
+    for i, code in enumerate(codes):
+        used = rng.random() < 0.2
+        rows.append({
+            "code": code,
+            "store_package_id": 1,
+            "item_id": 1,
+            "prize_title": "Free Fire - 100 diamantes",
+            "batch": f"promo-{i % 12}",
+            "source": "tiktok",
+            "active": rng.random() > 0.05,
+            "is_used": used,
+            "used_player_id": str(rng.randrange(10**8, 10**9)) if used else "",
+            "expires_at": now + timedelta(days=30) if i % 3 == 0 else None,
+            "created_at": now - timedelta(seconds=n_codes - i),
+        })
+        if len(rows) == 20000:
+            db.session.execute(GiftCode.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(GiftCode.__table__.insert(), rows)
+    db.session.commit()
+
+
+def measure(fn):
+    """(ms, pico MB, bytes). El tiempo se toma en una pasada sin tracemalloc."""
+    started = time.perf_counter()
+    size = fn()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed * 1000, peak / 1024 / 1024, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=150000)
+    args = parser.parse_args()
+
+    with app.app_context():
+        print(f"Sembrando {args.codes} códigos...")
+        seed(args.codes)
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user"] = {"id": 1, "role": "admin", "email": "admin@example.com"}
+
+    def streamed(qs):
+        def run():
+            resp = client.get(f"/admin/gift-codes/export?{qs}", buffered=False)
+            size = 0
+            for chunk in resp.response:
+                size += len(chunk)
+            resp.close()
+            return size
+        return run
+
+    def legacy():
+        with app.app_context():
+            return len(legacy_export_body().encode("utf-8"))
+
+    print(f"{'exportación':<28}{'ms':>8}{'pico MB':>10}{'KB':>9}")
+    for label, fn in (
+        ("anterior .txt", legacy),
+        ("por bloques .txt", streamed("format=txt")),
+        ("por bloques .csv (3 col)", streamed("format=csv&columns=prize,batch,expires_at")),
+    ):
+        ms, peak, size = measure(fn)
+        print(f"{label:<28}{ms:>8.0f}{peak:>10.1f}{size / 1024:>9.0f}")
+    with app.app_context():
+        same = legacy_export_body().encode("utf-8") == b"".join(client.get("/admin/gift-codes/export").response)
+    print(f"  el .txt por bloques es idéntico al anterior: {same}")
+
+    with app.app_context():
+        started = time.perf_counter()
+        old = legacy_stats()
+        legacy_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        new = store_app._gift_stats_and_batches()
+        new_ms = (time.perf_counter() - started) * 1000
+    print(f"totales del panel: anterior {legacy_ms:.0f} ms, agrupado {new_ms:.0f} ms, iguales: {old == new}")
+
+    started = time.perf_counter()
+    first = client.get("/admin/gift-codes").get_json()
+    first_ms = (time.perf_counter() - started) * 1000
+    cursor, pages, seen = first["next_cursor"], 1, len(first["codes"])
+    deep_ms = 0.0
+    while cursor and pages < 200:
+        started = time.perf_counter()
+        page = client.get(f"/admin/gift-codes?after={cursor}").get_json()
+        deep_ms = (time.perf_counter() - started) * 1000
+        cursor, pages, seen = page["next_cursor"], pages + 1, seen + len(page["codes"])
+    print(f"listado: primera página {first_ms:.0f} ms, página {pages} ({seen} códigos vistos) {deep_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
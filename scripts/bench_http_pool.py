@@ -0,0 +1,124 @@
+"""Latency saved by the pooled provider sessions on a dispatch burst over HTTPS.
+
+Uso:
+    python scripts/bench_http_pool.py [--burst 50] [--workers 5] [--rounds 3] [--latency-ms 5]
+
+Levanta un servidor HTTPS local (certificado autofirmado generado con openssl)
+que imita el endpoint de recarga de Revendedores, y envía ráfagas de POSTs
+como lo hace el despacho: primero con requests.post() suelto (un handshake
+TCP+TLS por llamada) y luego con _http_request("revendedores", ...), que
+reutiliza las conexiones del pool.
+"""
+import argparse
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_http_")
+os.environ["SQLITE_PATH"] = os.path.join(_TMP_DIR, "bench.sqlite")
+os.environ.pop("DATABASE_URL", None)
+
+import requests  # noqa: E402
+
+import app as store_app  # noqa: E402
+
+_LATENCY = {"seconds": 0.0}
+_HANDSHAKES = {"n": 0}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        _HANDSHAKES["n"] += 1
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        time.sleep(_LATENCY["seconds"])
+        body = json.dumps({"ok": True, "status": "completed", "order_id": "R-1"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_cert(directory: str):
+    cert = os.path.join(directory, "stub.crt")
+    key = os.path.join(directory, "stub.key")
+    subprocess.run([
+        "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+        "-keyout", key, "-out", cert, "-subj", "/CN=127.0.0.1",
+        "-addext", "subjectAltName=IP:127.0.0.1",
+    ], check=True, capture_output=True)
+    return cert, key
+
+
+def burst(send, url: str, n: int, workers: int):
+    def one(i):
+        started = time.perf_counter()
+        resp = send(url, i)
+        resp.raise_for_status()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = list(pool.map(one, range(n)))
+    return time.perf_counter() - started, sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--burst", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    args = parser.parse_args()
+    _LATENCY["seconds"] = args.latency_ms / 1000.0
+
+    cert, key = make_cert(_TMP_DIR)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    server.socket = ctx.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"https://127.0.0.1:{server.server_port}/api/v1/recharge"
+
+    def bare(u, i):
+        return requests.post(u, data={"external_order_id": f"INE-{i}"}, timeout=30, verify=cert)
+
+    def pooled(u, i):
+        return store_app._http_request("revendedores", "POST", u, data={"external_order_id": f"INE-{i}"}, verify=cert)
+
+    print(f"{'modo':<10}{'ronda':>6}{'total ms':>10}{'p50 ms':>9}{'p95 ms':>9}{'handshakes':>12}")
+    for label, send in (("suelto", bare), ("pool", pooled)):
+        for rnd in range(1, args.rounds + 1):
+            _HANDSHAKES["n"] = 0
+            total, lat = burst(send, url, args.burst, args.workers)
+            p50 = lat[len(lat) // 2] * 1000
+            p95 = lat[int(len(lat) * 0.95) - 1] * 1000
+            print(f"{label:<10}{rnd:>6}{total * 1000:>10.1f}{p50:>9.1f}{p95:>9.1f}{_HANDSHAKES['n']:>12}")
+    server.shutdown()
+    print("pool:", store_app._http_pool_stats().get("revendedores"))
+
+
+if __name__ == "__main__":
+    main()
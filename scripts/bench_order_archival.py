@@ -0,0 +1,186 @@
+"""Archival of old orders: legacy single transaction vs chunked _aggregate_and_cleanup_orders.
+
+Uso:
+    python scripts/bench_order_archival.py [--orders 50000] [--chunk 500]
+
+Siembra N órdenes terminadas de hace 8-60 días (más unas pendientes y
+recientes que no se deben tocar) con su captura en disco, en una base SQLite
+temporal. Archiva primero con la implementación anterior (todo con .all(),
+StorePackage/GamePackageItem .get por fila, un filter_by().first() por resumen
+y un único commit) y luego, sobre la misma siembra, con la versión por lotes.
+Compara OrderSummary, ProfitSnapshot, los contadores de ventas y las capturas
+borradas, y reporta filas/s de cada una.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_archive_")
+os.environ["SQLITE_PATH"] = os.path.join(_TMP_DIR, "bench.sqlite")
+os.environ["UPLOAD_FOLDER"] = os.path.join(_TMP_DIR, "uploads")
+os.environ.pop("DATABASE_URL", None)
+os.environ["JOB_QUEUE_MODE"] = "worker"
+
+import app as store_app  # noqa: E402
+from app import GamePackageItem, Order, OrderSummary, ProfitSnapshot, StorePackage, app, db  # noqa: E402
+
+
+def legacy_aggregate_and_cleanup_orders():
+    """_aggregate_and_cleanup_orders before the chunked version."""
+    cutoff = datetime.utcnow() - timedelta(days=store_app._ORDER_CLEANUP_DAYS)
+    old_orders = Order.query.filter(
+        Order.status.in_(("approved", "rejected", "delivered")),
+        Order.created_at < cutoff,
+    ).all()
+    if not old_orders:
+        return 0
+    store_app._snapshot_closed_periods_from_orders(old_orders)
+    agg = {}
+    for o in old_orders:
+        period = o.created_at.strftime("%Y-%m-%d") if o.created_at else "unknown"
+        pkg = db.session.get(StorePackage, o.store_package_id)
+        it = db.session.get(GamePackageItem, o.item_id) if o.item_id else None
+        key = (period, o.store_package_id, o.item_id, o.status, o.method, o.currency or "USD")
+        if key not in agg:
+            agg[key] = {
+                "period": period, "store_package_id": o.store_package_id, "item_id": o.item_id,
+                "package_name": pkg.name if pkg else "", "item_title": it.title if it else "",
+                "status": o.status, "method": o.method, "currency": o.currency or "USD",
+                "order_count": 0, "total_amount": 0.0, "total_price_usd": 0.0,
+            }
+        agg[key]["order_count"] += 1
+        agg[key]["total_amount"] += float(o.amount or 0)
+        agg[key]["total_price_usd"] += float(o.price or 0)
+    for data in agg.values():
+        row = OrderSummary.query.filter_by(**{k: data[k] for k in ("period", "store_package_id", "item_id", "status", "method", "currency")}).first()
+        if row:
+            row.order_count += data["order_count"]
+            row.total_amount += data["total_amount"]
+            row.total_price_usd += data["total_price_usd"]
+        else:
+            db.session.add(OrderSummary(**data))
+    archived_sales = {}
+    for o in old_orders:
+        if o.status in store_app._SALES_COUNTER_STATUSES:
+            archived_sales[o.store_package_id] = archived_sales.get(o.store_package_id, 0) + 1
+        store_app._delete_capture(o.payment_capture)
+        db.session.delete(o)
+    store_app._package_sales_adjust(archived_sales)
+    db.session.commit()
+    return len(old_orders)
+
+
+def seed(n_orders: int):
+    rng = random.Random(16)
+    upload_dir = app.config["UPLOAD_FOLDER"]
+    os.makedirs(os.path.join(upload_dir, "captures"), exist_ok=True)
+    for table in (Order, OrderSummary, ProfitSnapshot, store_app.PackageSalesCounter):
+        db.session.execute(table.__table__.delete())
+    db.session.commit()
+    if not StorePackage.query.count():
+        for p in range(1, 6):
+            db.session.add(StorePackage(id=p, name=f"Juego {p}", image_path="/static/x.png", active=True))
+            for i in range(4):
+                db.session.add(GamePackageItem(id=p * 10 + i, store_package_id=p, title=f"{100 * (i + 1)} diamantes", price=1.0 + i, profit_net_usd=0.2))
+        db.session.commit()
+    now = datetime.utcnow()
+    rows = []
+    for i in range(n_orders):
+        recent = i % 20 == 0
+        status = "pending" if i % 25 == 0 else rng.choice(("approved", "approved", "delivered", "rejected"))
+        pkg_id = rng.randrange(1, 6)
+        capture = f"captures/o{i}.png"
+        with open(os.path.join(upload_dir, capture), "wb") as fh:
+            fh.write(b"x")
+        rows.append({
+            "store_package_id": pkg_id,
+            "item_id": None if i % 50 == 0 else pkg_id * 10 + rng.randrange(4),
+            "status": status,
+            "method": None if i % 97 == 0 else rng.choice(("pm", "binance", "pabilo")),
+            "currency": rng.choice(("BsD", "USD", None)),
+            "amount": float(rng.randrange(100, 5000)),
+            "price": round(rng.uniform(1, 20), 2),
+            "reference": str(rng.randrange(10**8, 10**9)),
+            "payment_capture": capture,
+            "created_at": now - (timedelta(hours=rng.randrange(1, 100)) if recent else timedelta(days=8, minutes=rng.randrange(60 * 24 * 52))),
+        })
+    db.session.execute(Order.__table__.insert(), rows)
+    db.session.commit()
+    store_app._reconcile_package_sales_counters(apply=True)
+    db.session.commit()
+
+
+def capture_count():
+    return len(os.listdir(os.path.join(app.config["UPLOAD_FOLDER"], "captures")))
+
+
+def snapshot_state():
+    summaries = sorted(
+        (r.period, r.store_package_id, r.item_id, r.status, r.method, r.currency, r.package_name, r.item_title,
+         r.order_count, round(r.total_amount, 2), round(r.total_price_usd, 2))
+        for r in OrderSummary.query.all()
+    )
+    profits = sorted((str(r.period_start), r.profit_usd, r.commission_usd) for r in ProfitSnapshot.query.all())
+    counters = sorted((r.store_package_id, r.sales_count) for r in store_app.PackageSalesCounter.query.all())
+    return {"summaries": summaries, "profits": profits, "counters": counters, "orders_left": Order.query.count()}
+
+
+def drain_capture_jobs():
+    stop = threading.Event()
+    threads = store_app._start_job_consumers(4, stop)
+    while True:
+        left = db.session.execute(
+            db.select(db.func.count()).select_from(store_app.BackgroundJob).where(
+                store_app.BackgroundJob.kind == "delete_captures",
+                store_app.BackgroundJob.status.in_(("queued", "running")),
+            )
+        ).scalar()
+        db.session.rollback()
+        if not left:
+            break
+        time.sleep(0.1)
+    stop.set()
+    store_app._JOB_WAKE.set()
+    for t in threads:
+        t.join(timeout=5)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=50000)
+    parser.add_argument("--chunk", type=int, default=500)
+    args = parser.parse_args()
+    store_app._ORDER_CLEANUP_CHUNK_SIZE = args.chunk
+
+    results = {}
+    print(f"{'modo':<22}{'órdenes':>10}{'seg':>8}{'filas/s':>10}{'capturas restantes':>20}")
+    with app.app_context():
+        for label, fn in (("legacy (1 commit)", legacy_aggregate_and_cleanup_orders), ("por lotes", store_app._aggregate_and_cleanup_orders)):
+            seed(args.orders)
+            db.session.expire_all()
+            started = time.perf_counter()
+            n = fn()
+            elapsed = time.perf_counter() - started
+            if fn is store_app._aggregate_and_cleanup_orders:
+                drain_capture_jobs()
+            results[label] = snapshot_state()
+            print(f"{label:<22}{n:>10}{elapsed:>8.2f}{n / max(elapsed, 1e-6):>10.0f}{capture_count():>20}")
+    a, b = results.values()
+    for key in a:
+        print(f"  {key}: {'iguales' if a[key] == b[key] else 'DISTINTOS'}")
+    print(json.dumps({"resumenes": len(b["summaries"]), "snapshots": len(b["profits"]), "ordenes_vivas": b["orders_left"]}))
+
+
+if __name__ == "__main__":
+    main()
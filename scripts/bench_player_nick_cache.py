@@ -0,0 +1,86 @@
+"""Upstream scrapes saved by the shared player-nick cache across worker processes.
+
+Uso:
+    python scripts/bench_player_nick_cache.py [--workers 4] [--threads 8] [--uids 50] [--lookups 400]
+
+Lanza N procesos (como N workers de gunicorn) sobre la misma base SQLite
+temporal. Cada uno consulta los mismos IDs con un scraper falso que tarda
+--scrape-ms y responde "no encontrado" para uno de cada diez IDs. Compara las
+llamadas al upstream con el nivel compartido apagado y encendido.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def worker(db_path: str, shared: bool, threads: int, uids: int, lookups: int, scrape_ms: int, seed: int, start_at: float):
+    os.environ.pop("DATABASE_URL", None)
+    os.environ["SQLITE_PATH"] = db_path
+    os.environ["PLAYER_NICK_SHARED_CACHE"] = "db" if shared else "off"
+    import threading
+
+    import app as store_app
+
+    def fake_scrape(uid: str) -> str:
+        time.sleep(scrape_ms / 1000.0)
+        return "" if int(uid) % 10 == 0 else f"Jugador{uid}"
+
+    def run(thread_seed: int):
+        rng = random.Random(thread_seed)
+        with store_app.app.app_context():
+            for _ in range(lookups // threads):
+                uid = str(1000 + rng.randrange(uids))
+                store_app._player_nick_lookup(f"bench:{uid}", lambda: fake_scrape(uid))
+
+    time.sleep(max(start_at - time.time(), 0))
+    pool = [threading.Thread(target=run, args=(seed * 100 + i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return dict(store_app._PLAYER_NICK_STATS)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--uids", type=int, default=50)
+    parser.add_argument("--lookups", type=int, default=400, help="consultas por proceso")
+    parser.add_argument("--scrape-ms", type=int, default=300)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{'compartido':<12}{'consultas':>10}{'upstream':>10}{'ahorradas':>11}{'hit rate':>10}{'seg':>7}")
+    for shared in (False, True):
+        db_path = os.path.join(tempfile.mkdtemp(prefix="bench_nick_"), "bench.sqlite")
+        # Create the schema once so the workers do not race on create_all.
+        init = ctx.Process(target=worker, args=(db_path, shared, 1, 1, 0, 0, 0, 0.0))
+        init.start()
+        init.join()
+        started = time.perf_counter()
+        start_at = time.time() + 3
+        with ctx.Pool(args.workers) as pool:
+            results = pool.starmap(worker, [
+                (db_path, shared, args.threads, args.uids, args.lookups, args.scrape_ms, w, start_at)
+                for w in range(args.workers)
+            ])
+        elapsed = time.perf_counter() - started - 3
+        total = {k: sum(r.get(k, 0) for r in results) for k in results[0]}
+        saved = total["lookups"] - total["upstream_calls"]
+        rate = saved / total["lookups"] if total["lookups"] else 0.0
+        print(f"{'sí' if shared else 'no':<12}{total['lookups']:>10}{total['upstream_calls']:>10}{saved:>11}{rate:>10.1%}{elapsed:>7.1f}")
+        print(f"    {total}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""create_order latency with the legacy full-scan reference check vs the indexed lookup.
+
+Uso:
+    python scripts/bench_reference_lookup.py [--orders 100000] [--requests 50]
+
+Siembra N órdenes en una base SQLite temporal y mide POST /orders (que llama a
+_find_existing_order_by_reference y _find_existing_order_by_capture_reference)
+con la implementación anterior (escaneo en Python) y con reference_norm indexado.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_ref_")
+os.environ["SQLITE_PATH"] = os.path.join(_TMP_DIR, "bench.sqlite")
+os.environ.pop("DATABASE_URL", None)
+
+import app as store_app  # noqa: E402
+from app import Order, app, db  # noqa: E402
+
+
+def _legacy_scan(attr):
+    def _find(reference, *, exclude_order_id=None, statuses=None):
+        normalized_reference = store_app._normalize_order_reference_for_match(reference)
+        if not normalized_reference:
+            return None
+        query = Order.query
+        if statuses:
+            query = query.filter(Order.status.in_(tuple(statuses)))
+        if exclude_order_id:
+            query = query.filter(Order.id != int(exclude_order_id))
+        for existing_order in query.order_by(Order.created_at.desc()).all():
+            if store_app._normalize_order_reference_for_match(getattr(existing_order, attr) or "") == normalized_reference:
+                return existing_order
+        return None
+    return _find
+
+
+def seed(n_orders: int):
+    with app.app_context():
+        pkg = store_app.StorePackage(name="Free Fire", image_path="/static/x.png", active=True)
+        db.session.add(pkg)
+        db.session.flush()
+        item = store_app.GamePackageItem(store_package_id=pkg.id, title="100 diamantes", price=1.0, active=True)
+        db.session.add(item)
+        db.session.commit()
+        statuses = ("pending", "approved", "delivered", "rejected")
+        base = datetime.utcnow() - timedelta(days=5)
+        rows = []
+        for i in range(n_orders):
+            ref = str(10_000_000 + i)
+            cap = str(90_000_000 + i) if i % 3 == 0 else ""
+            rows.append({
+                "created_at": base + timedelta(seconds=i),
+                "status": statuses[i % len(statuses)],
+                "store_package_id": pkg.id,
+                "item_id": item.id,
+                "method": "pm",
+                "reference": ref,
+                "reference_norm": store_app._normalize_order_reference_for_match(ref),
+                "capture_reference": cap,
+                "capture_reference_norm": store_app._normalize_order_reference_for_match(cap),
+                "email": f"seed{i}@example.com",
+            })
+            if len(rows) >= 5000:
+                db.session.execute(Order.__table__.insert(), rows)
+                rows = []
+        if rows:
+            db.session.execute(Order.__table__.insert(), rows)
+        db.session.commit()
+        return pkg.id, item.id
+
+
+def run(client, gid: int, item_id: int, n_requests: int, label: str):
+    latencies = []
+    for i in range(n_requests):
+        payload = {
+            "store_package_id": gid,
+            "item_id": item_id,
+            "method": "pm",
+            "currency": "USD",
+            "amount": 1,
+            "reference": str(random.randint(1, 10**12)),
+            "email": f"bench-{label}-{i}@example.com",
+            "phone": "04140000000",
+        }
+        started = time.perf_counter()
+        resp = client.post("/orders", json=payload)
+        latencies.append((time.perf_counter() - started) * 1000.0)
+        if resp.status_code != 200:
+            raise SystemExit(f"create_order -> {resp.status_code}: {resp.get_data(as_text=True)[:200]}")
+    latencies.sort()
+    p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)]
+    print(f"{label:<10}{statistics.mean(latencies):>12.2f}{statistics.median(latencies):>12.2f}{p95:>12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"Sembrando {args.orders} órdenes...")
+    gid, item_id = seed(args.orders)
+    client = app.test_client()
+
+    indexed = (store_app._find_existing_order_by_reference, store_app._find_existing_order_by_capture_reference)
+    print(f"{'lookup':<10}{'mean ms':>12}{'p50 ms':>12}{'p95 ms':>12}")
+    store_app._find_existing_order_by_reference = _legacy_scan("reference")
+    store_app._find_existing_order_by_capture_reference = _legacy_scan("capture_reference")
+    run(client, gid, item_id, args.requests, "legacy")
+    store_app._find_existing_order_by_reference, store_app._find_existing_order_by_capture_reference = indexed
+    run(client, gid, item_id, args.requests, "indexed")
+
+
+if __name__ == "__main__":
+    main()
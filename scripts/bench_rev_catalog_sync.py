@@ -0,0 +1,151 @@
+"""Revendedores catalog sync: per-entry ORM lookup/update (legacy) vs hashed diff + bulk upsert.
+
+Uso:
+    python scripts/bench_rev_catalog_sync.py [--packages 20000] [--changed 0.02]
+
+Arma un catálogo remoto falso de --packages paquetes (algunos sin product id,
+como llegan ciertos juegos) y sincroniza cuatro veces sobre una base SQLite
+temporal, primero con la implementación anterior (filter_by().first() por
+paquete, todos los campos reescritos, desactivación con .all()) y luego con
+_revendedores_catalog_apply: la primera carga, una resincronización sin
+cambios y otra donde cambia una fracción --changed de los paquetes y otra igual
+desaparece del catálogo, y una última con el catálogo original (los que
+desaparecieron vuelven y deben quedar activos). Compara las filas resultantes
+de ambas versiones.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_rev_catalog_")
+os.environ["SQLITE_PATH"] = os.path.join(_TMP_DIR, "bench.sqlite")
+os.environ.pop("DATABASE_URL", None)
+os.environ["JOB_QUEUE_MODE"] = "worker"
+
+import app as store_app  # noqa: E402
+from app import RevendedoresCatalogChange, RevendedoresCatalogItem, app, db  # noqa: E402
+
+
+def legacy_apply(normalized):
+    """admin_revendedores_sync_catalog before the diff (DB part only)."""
+    created = updated = deactivated = 0
+    seen = set()
+    for ent in normalized:
+        key = (ent.get("remote_product_id"), ent.get("remote_package_id"))
+        seen.add(key)
+        row = RevendedoresCatalogItem.query.filter_by(
+            remote_product_id=key[0],
+            remote_package_id=key[1],
+        ).first()
+        if not row:
+            row = RevendedoresCatalogItem(remote_product_id=key[0], remote_package_id=key[1])
+            db.session.add(row)
+            created += 1
+        else:
+            updated += 1
+        row.remote_product_name = ent.get("remote_product_name", "")
+        row.remote_package_name = ent.get("remote_package_name", "")
+        row.active = bool(ent.get("active"))
+        row.raw_json = ent.get("raw_json", "")
+    for row in RevendedoresCatalogItem.query.all():
+        if (row.remote_product_id, row.remote_package_id) not in seen and row.active:
+            row.active = False
+            deactivated += 1
+    db.session.commit()
+    return {"created": created, "updated": updated, "deactivated": deactivated}
+
+
+def fake_catalog(n: int, rng):
+    out = []
+    for i in range(n):
+        product_id = None if i % 200 == 0 else 1 + i // 40
+        raw = {"id": 100000 + i, "name": f"{(i % 40 + 1) * 100} diamantes", "price": round(rng.uniform(0.5, 80), 2)}
+        out.append({
+            "remote_product_id": product_id,
+            "remote_product_name": f"Juego {1 + i // 40}",
+            "remote_package_id": 100000 + i,
+            "remote_package_name": raw["name"],
+            "active": True,
+            "raw_json": json.dumps(raw, ensure_ascii=False),
+        })
+    return out
+
+
+def mutate(catalog, fraction: float, rng):
+    n = max(int(len(catalog) * fraction), 1)
+    out = [dict(ent) for ent in catalog]
+    for ent in rng.sample(out, n):
+        raw = json.loads(ent["raw_json"])
+        raw["price"] = round(raw["price"] * 1.1, 2)
+        ent["raw_json"] = json.dumps(raw, ensure_ascii=False)
+    gone = set(rng.sample(range(len(out)), n))
+    return [ent for i, ent in enumerate(out) if i not in gone]
+
+
+def table_state():
+    return sorted(
+        (r.remote_product_id or 0, r.remote_package_id, r.remote_product_name, r.remote_package_name, bool(r.active), r.raw_json)
+        for r in RevendedoresCatalogItem.query.all()
+    )
+
+
+def reset():
+    db.session.execute(RevendedoresCatalogItem.__table__.delete())
+    db.session.execute(RevendedoresCatalogChange.__table__.delete())
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packages", type=int, default=20000)
+    parser.add_argument("--changed", type=float, default=0.02)
+    args = parser.parse_args()
+
+    rng = random.Random(24)
+    first = fake_catalog(args.packages, rng)
+    rounds = [
+        ("primera carga", first),
+        ("sin cambios", first),
+        (f"{args.changed:.0%} cambia/desaparece", mutate(first, args.changed, rng)),
+        ("vuelven los que faltaban", first),
+    ]
+
+    states = {}
+    print(f"{args.packages} paquetes en el catálogo remoto")
+    print(f"{'ronda':<26}{'anterior ms':>13}{'nuevo ms':>10}{'escritos':>10}{'desactivados':>14}")
+    with app.app_context():
+        timings = {}
+        for label, fn in (("anterior", legacy_apply), ("diff", store_app._revendedores_catalog_apply)):
+            reset()
+            db.session.expire_all()
+            states[label] = []
+            for round_label, catalog in rounds:
+                started = time.perf_counter()
+                result = fn(catalog)
+                timings[(label, round_label)] = ((time.perf_counter() - started) * 1000, result)
+                db.session.expire_all()
+                states[label].append(table_state())
+        for round_label, _ in rounds:
+            legacy_ms, _ = timings[("anterior", round_label)]
+            new_ms, result = timings[("diff", round_label)]
+            written = result["created"] + result["updated"]
+            print(f"{round_label:<26}{legacy_ms:>13.0f}{new_ms:>10.0f}{written:>10}{result['deactivated']:>14}")
+        same = states["anterior"] == states["diff"]
+        reactivated = all(row[4] for row in states["diff"][-1])
+        changes = RevendedoresCatalogChange.query.count()
+    print(f"  filas iguales tras cada ronda: {same}")
+    print(f"  todos activos tras volver al catálogo original: {reactivated}")
+    print(f"  {changes} cambios registrados en rev_catalog_changes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Burst of order emails: one SMTP session per message (legacy) vs the pooled outbox.
+
+Uso:
+    pip install aiosmtpd
+    python scripts/bench_smtp_outbox.py [--emails 200] [--consumers 4] [--pool 4] [--smtp-ms 20]
+
+Levanta un servidor SMTP local con aiosmtpd (STARTTLS con certificado
+autofirmado generado con openssl + AUTH, como Gmail) que tarda --smtp-ms por
+mensaje. Envía la misma ráfaga de correos primero como antes (un hilo por
+correo, cada uno con EHLO/STARTTLS/login/quit propios) y luego encolándolos
+en el outbox (jobs "send_email") y drenándolos con N consumidores que
+comparten el pool de conexiones persistentes. Reporta tiempo total, sesiones
+SMTP abiertas y la latencia por mensaje.
+"""
+import argparse
+import logging
+import os
+import smtplib
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    from aiosmtpd.controller import Controller
+    from aiosmtpd.smtp import AuthResult
+except ImportError:
+    sys.exit("Este benchmark necesita aiosmtpd: pip install aiosmtpd")
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_smtp_")
+os.environ["SQLITE_PATH"] = os.path.join(_TMP_DIR, "bench.sqlite")
+os.environ.pop("DATABASE_URL", None)
+os.environ["JOB_QUEUE_MODE"] = "worker"
+
+logging.getLogger("mail.log").setLevel(logging.ERROR)
+
+_STUB = {"latency": 0.02, "sessions": 0, "messages": 0, "lock": threading.Lock()}
+
+
+class StubHandler:
+    async def handle_DATA(self, server, session, envelope):
+        import asyncio
+        await asyncio.sleep(_STUB["latency"])
+        with _STUB["lock"]:
+            _STUB["messages"] += 1
+        return "250 OK"
+
+
+def authenticator(server, session, envelope, mechanism, auth_data):
+    with _STUB["lock"]:
+        _STUB["sessions"] += 1
+    return AuthResult(success=True)
+
+
+def make_cert(directory: str):
+    cert = os.path.join(directory, "stub.crt")
+    key = os.path.join(directory, "stub.key")
+    subprocess.run([
+        "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+        "-keyout", key, "-out", cert, "-subj", "/CN=127.0.0.1",
+    ], check=True, capture_output=True)
+    return cert, key
+
+
+def legacy_send(store_app, to_email: str, payload: str):
+    """send_email_html before the pool: a full session per message."""
+    with smtplib.SMTP(store_app.MAIL_SMTP_HOST, store_app.MAIL_SMTP_PORT, timeout=15) as server:
+        server.ehlo()
+        server.starttls()
+        server.ehlo()
+        server.login(store_app.MAIL_USER, store_app.MAIL_APP_PASSWORD)
+        server.sendmail(store_app.MAIL_USER, to_email, payload)
+
+
+def reset_stub():
+    with _STUB["lock"]:
+        _STUB["sessions"] = 0
+        _STUB["messages"] = 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=200)
+    parser.add_argument("--consumers", type=int, default=4)
+    parser.add_argument("--pool", type=int, default=4, help="MAIL_SMTP_POOL_SIZE")
+    parser.add_argument("--smtp-ms", type=float, default=20.0)
+    parser.add_argument("--rate", type=int, default=100000, help="MAIL_RATE_PER_MINUTE para la prueba")
+    args = parser.parse_args()
+    _STUB["latency"] = args.smtp_ms / 1000.0
+
+    cert, key = make_cert(_TMP_DIR)
+    tls = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    tls.load_cert_chain(cert, key)
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    controller = Controller(
+        StubHandler(), hostname="127.0.0.1", port=port,
+        tls_context=tls, require_starttls=True, authenticator=authenticator, auth_require_tls=True,
+    )
+    controller.start()
+    os.environ.update({
+        "MAIL_USER": "tienda@example.com",
+        "MAIL_APP_PASSWORD": "secreto",
+        "MAIL_SMTP_HOST": "127.0.0.1",
+        "MAIL_SMTP_PORT": str(port),
+        "MAIL_RATE_PER_MINUTE": str(args.rate),
+        "MAIL_SMTP_POOL_SIZE": str(args.pool),
+    })
+
+    import app as store_app
+
+    with store_app.app.app_context():
+        html = store_app._email_wrap("Orden aprobada", "<p>Tu recarga fue procesada.</p>")
+    emails = [(f"cliente{i}@example.com", f"Orden #{1000 + i} aprobada", html, "Tu recarga fue procesada.") for i in range(args.emails)]
+
+    print(f"{'modo':<24}{'correos':>8}{'seg':>8}{'sesiones SMTP':>15}{'recibidos':>11}")
+    with store_app.app.app_context():
+        legacy = [(e[0], store_app._build_html_message(*e).as_string()) for e in emails]
+    reset_stub()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(emails)) as pool:  # un hilo por correo, como antes
+        list(pool.map(lambda e: legacy_send(store_app, *e), legacy))
+    print(f"{'una sesión por correo':<24}{len(emails):>8}{time.perf_counter() - started:>8.2f}{_STUB['sessions']:>15}{_STUB['messages']:>11}")
+
+    reset_stub()
+    with store_app.app.app_context():
+        for to_email, subject, body, text in emails:
+            store_app.send_email_html_async(to_email, subject, body, text)
+    stop = threading.Event()
+    started = time.perf_counter()
+    threads = store_app._start_job_consumers(args.consumers, stop)
+    while _STUB["messages"] < len(emails) and time.perf_counter() - started < 300:
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    store_app._JOB_WAKE.set()
+    for t in threads:
+        t.join(timeout=5)
+    print(f"{'outbox + pool':<24}{len(emails):>8}{elapsed:>8.2f}{_STUB['sessions']:>15}{_STUB['messages']:>11}")
+    with store_app.app.app_context():
+        print("outbox:", store_app._mail_outbox_stats())
+    store_app._smtp_pool_close_all()
+    controller.stop()
+
+
+if __name__ == "__main__":
+    main()
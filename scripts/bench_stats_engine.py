@@ -0,0 +1,114 @@
+"""Queries and latency of the admin stats endpoints at different order counts.
+
+Uso:
+    python scripts/bench_stats_engine.py [--orders 10000 100000]
+
+Para cada tamaño siembra órdenes aprobadas (con items_json y códigos de
+afiliado) en una base SQLite temporal y mide /admin/stats/summary,
+/admin/stats/package/<id> y /admin/stats/history. El número de consultas
+debe mantenerse constante al crecer la cantidad de órdenes.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def seed(store_app, n_orders: int):
+    db = store_app.db
+    rng = random.Random(11)
+    pkg = store_app.StorePackage(name="Free Fire", image_path="/static/x.png", active=True)
+    db.session.add(pkg)
+    db.session.flush()
+    items = []
+    for i in range(12):
+        it = store_app.GamePackageItem(store_package_id=pkg.id, title=f"{(i + 1) * 100} diamantes",
+                                       price=1.0 + i, profit_net_usd=0.7 + i * 0.8, active=True)
+        db.session.add(it)
+        items.append(it)
+    affiliates = []
+    for i in range(30):
+        su = store_app.SpecialUser(name=f"aff{i}", code=f"AFF{i}", active=True,
+                                   discount_percent=10.0, commission_percent=5.0 + (i % 3))
+        db.session.add(su)
+        affiliates.append(su)
+    db.session.commit()
+    base = datetime.utcnow() - timedelta(days=60)
+    rows = []
+    for i in range(n_orders):
+        it = rng.choice(items)
+        qty = rng.randint(1, 3)
+        su = rng.choice(affiliates) if i % 4 == 0 else None
+        rows.append({
+            "created_at": base + timedelta(seconds=i * (60 * 86400 // max(n_orders, 1))),
+            "status": "approved" if i % 5 else "delivered",
+            "store_package_id": pkg.id,
+            "item_id": it.id,
+            "method": "pm",
+            "price": round(it.price * qty, 2),
+            "items_json": json.dumps([{"item_id": it.id, "qty": qty, "title": it.title,
+                                       "price": it.price, "cost_unit_usd": it.profit_net_usd}]),
+            "special_user_id": su.id if su and i % 8 == 0 else None,
+            "special_code": su.code.lower() if su else "",
+        })
+        if len(rows) >= 5000:
+            db.session.execute(store_app.Order.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(store_app.Order.__table__.insert(), rows)
+    db.session.commit()
+    return pkg.id
+
+
+def run_size(n_orders: int):
+    os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench_stats_"), "bench.sqlite")
+    os.environ.pop("DATABASE_URL", None)
+    import app as store_app
+    from sqlalchemy import event
+
+    with store_app.app.app_context():
+        pkg_id = seed(store_app, n_orders)
+        engine = store_app.db.engine
+    counter = {"n": 0}
+    event.listen(engine, "before_cursor_execute", lambda *a, **k: counter.__setitem__("n", counter["n"] + 1))
+
+    client = store_app.app.test_client()
+    with client.session_transaction() as sess:
+        sess["user"] = {"email": "admin@example.com", "role": "admin"}
+    for path in ("/admin/stats/summary", "/admin/stats/summary?period=weekly",
+                 f"/admin/stats/package/{pkg_id}", "/admin/stats/history"):
+        counter["n"] = 0
+        started = time.perf_counter()
+        resp = client.get(path)
+        elapsed = (time.perf_counter() - started) * 1000.0
+        body = resp.get_json() or {}
+        summary = body.get("summary") or {}
+        print(f"{n_orders:>8} {path:<40}{counter['n']:>8}{elapsed:>12.1f}  profit={summary.get('total_profit_net_usd', '-')}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.single:
+        run_size(args.single)
+        return
+    print(f"{'orders':>8} {'endpoint':<40}{'queries':>8}{'ms':>12}")
+    # Cada tamaño corre en su propio proceso: app.py fija la base al importarse.
+    for n in args.orders:
+        subprocess.run([sys.executable, __file__, "--single", str(n)], check=True)
+
+
+if __name__ == "__main__":
+    main()
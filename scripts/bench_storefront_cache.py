@@ -0,0 +1,140 @@
+"""Load test: requests/second on the homepage JSON fan-out with and without the storefront cache.
+
+Uso:
+    python scripts/bench_storefront_cache.py [--packages 60] [--orders 20000] [--clients 8] [--seconds 5]
+
+Crea una base SQLite temporal con paquetes, items y órdenes, levanta la app en
+un servidor HTTP local con hilos y dispara desde varios clientes las mismas
+peticiones que hace home.js (hero, best_sellers y los tres listados populares)
+más las de la página de detalles. Mide con el caché apagado, encendido, y
+encendido revalidando con If-None-Match (respuestas 304).
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_storefront_")
+os.environ["SQLITE_PATH"] = os.path.join(_TMP_DIR, "bench.sqlite")
+os.environ.pop("DATABASE_URL", None)
+
+import requests  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+import app as store_app  # noqa: E402
+
+
+def seed(n_packages: int, n_orders: int) -> list[int]:
+    rng = random.Random(8)
+    db = store_app.db
+    with store_app.app.app_context():
+        categories = ("mobile", "gift", "other")
+        pkgs = [
+            store_app.StorePackage(name=f"Juego {i}", image_path="/static/x.png", active=True, category=categories[i % 3], sort_order=i)
+            for i in range(n_packages)
+        ]
+        db.session.add_all(pkgs)
+        db.session.commit()
+        for pkg in pkgs:
+            for j in range(8):
+                db.session.add(store_app.GamePackageItem(store_package_id=pkg.id, title=f"{j * 100} diamantes", price=1.0 + j, active=True))
+        db.session.commit()
+        statuses = ("approved", "delivered", "rejected", "pending")
+        db.session.execute(store_app.Order.__table__.insert(), [
+            {"store_package_id": rng.choice(pkgs).id, "status": rng.choice(statuses), "email": f"c{i}@example.com"}
+            for i in range(n_orders)
+        ])
+        db.session.commit()
+        store_app._reconcile_package_sales_counters(apply=True)
+        store_app.set_config_values({"hero_1": "/static/h1.png", "pm_bank": "0102", "binance_email": "pay@example.com"})
+        return [p.id for p in pkgs]
+
+
+def run_load(base_url: str, paths: list[str], clients: int, seconds: float, revalidate: bool):
+    done = {"requests": 0, "not_modified": 0, "errors": 0}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + seconds
+
+    def worker():
+        sess = requests.Session()
+        etags = {}
+        n = n304 = errors = 0
+        while time.perf_counter() < stop_at:
+            for path in paths:
+                headers = {"If-None-Match": etags[path]} if revalidate and path in etags else {}
+                resp = sess.get(base_url + path, headers=headers)
+                n += 1
+                if resp.status_code == 304:
+                    n304 += 1
+                elif resp.status_code != 200:
+                    errors += 1
+                elif resp.headers.get("ETag"):
+                    etags[path] = resp.headers["ETag"]
+        with lock:
+            done["requests"] += n
+            done["not_modified"] += n304
+            done["errors"] += errors
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return done, done["requests"] / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packages", type=int, default=60)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"Sembrando {args.packages} paquetes y {args.orders} órdenes...")
+    ids = seed(args.packages, args.orders)
+    gid = ids[0]
+    paths = [
+        "/store/hero",
+        "/store/best_sellers",
+        "/store/packages?category=mobile&sort=popular",
+        "/store/packages?category=gift&sort=popular",
+        "/store/packages?category=other&sort=popular",
+        f"/store/package/{gid}/items",
+        "/store/payments",
+        "/store/smileone/connections",
+        "/mini/tiers",
+    ]
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, store_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    print(f"{'modo':<24}{'req/s':>10}{'304':>8}{'errores':>9}")
+    for label, enabled, revalidate in (
+        ("sin caché", False, False),
+        ("caché", True, False),
+        ("caché + If-None-Match", True, True),
+    ):
+        store_app._STOREFRONT_CACHE_ENABLED = enabled
+        store_app._storefront_cache_invalidate(broadcast=False)
+        done, rps = run_load(base_url, paths, args.clients, args.seconds, revalidate)
+        print(f"{label:<24}{rps:>10.1f}{done['not_modified']:>8}{done['errors']:>9}")
+    server.shutdown()
+    print("stats:", store_app._STOREFRONT_CACHE_STATS)
+
+
+if __name__ == "__main__":
+    main()
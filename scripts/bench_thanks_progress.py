@@ -0,0 +1,197 @@
+"""500 thank-you pages polling /gracias/<id>/progress: legacy full JSON vs memo + ETag/304.
+
+Uso:
+    python scripts/bench_thanks_progress.py [--pages 500] [--rounds 6] [--threads 32] [--churn 0.05]
+
+Siembra --pages órdenes con recarga automática mapeada y verificación de pago
+en curso (el camino caro de _thanks_progress_payload) en una base SQLite
+temporal. Cada ronda equivale a un tick de 5 s: cambia el estado de una
+fracción --churn de las órdenes y luego todas las páginas consultan a la vez
+con --threads hilos (como los hilos de gunicorn gthread). La versión anterior
+se reproduce con una ruta de este script que arma el payload y lo serializa en
+cada consulta; la nueva usa el endpoint real enviando If-None-Match con el
+último ETag. Reporta peticiones/s, latencia p50/p95, bytes enviados y 304.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_thanks_progress_")
+os.environ["SQLITE_PATH"] = os.path.join(_TMP_DIR, "bench.sqlite")
+os.environ.pop("DATABASE_URL", None)
+os.environ["JOB_QUEUE_MODE"] = "worker"
+os.environ["ORDER_EVENTS_ENABLED"] = "0"
+
+import app as store_app  # noqa: E402
+from app import GamePackageItem, Order, RevendedoresItemMapping, StorePackage, app, db, jsonify  # noqa: E402
+
+
+def legacy_progress(oid: int):
+    """thanks_order_progress before the memo and ETag."""
+    o = Order.query.get(oid)
+    if not o:
+        return jsonify({"ok": False, "error": "No existe"}), 404
+    return jsonify(store_app._thanks_progress_payload(o))
+
+
+app.add_url_rule("/bench/legacy-progress/<int:oid>", "bench_legacy_progress", legacy_progress)
+
+
+def automation_state(rng, items, done: int) -> str:
+    units = []
+    for i, item in enumerate(items):
+        units.append({
+            "unit_key": f"{i + 1}:{item['item_id']}:1",
+            "status": "completed" if i < done else rng.choice(("pending", "processing")),
+            "external_order_id": str(rng.randrange(10**6, 10**7)) if i < done else "",
+            "player_name": "Jugador",
+        })
+    return json.dumps({
+        "units": units,
+        "payment_verify": {"provider": "pabilo", "attempts": 1, "message": "Pago en revisión"},
+    })
+
+
+def seed(n_pages: int):
+    rng = random.Random(20)
+    for p in range(1, 6):
+        db.session.add(StorePackage(id=p, name=f"Juego {p}", image_path="/static/x.png", active=True))
+        for i in range(4):
+            item_id = p * 10 + i
+            db.session.add(GamePackageItem(id=item_id, store_package_id=p, title=f"{100 * (i + 1)} diamantes", price=1.0 + i))
+            db.session.add(RevendedoresItemMapping(
+                store_package_id=p, store_item_id=item_id, remote_package_id=item_id,
+                auto_enabled=True, active=True,
+            ))
+    db.session.commit()
+    store_app.set_config_values({"payment_verification_provider": "pabilo", "pabilo_auto_verify_enabled": "1"})
+    rows = []
+    for i in range(n_pages):
+        pkg_id = rng.randrange(1, 6)
+        items = [{"item_id": pkg_id * 10 + j, "title": f"{100 * (j + 1)} diamantes", "qty": 1, "price": 1.0} for j in range(rng.randrange(1, 4))]
+        rows.append({
+            "store_package_id": pkg_id,
+            "item_id": items[0]["item_id"],
+            "status": "approved",
+            "method": "pm",
+            "currency": "BsD",
+            "amount": float(rng.randrange(100, 5000)),
+            "reference": str(rng.randrange(10**7, 10**12)),
+            "customer_id": str(rng.randrange(10**8, 10**10)),
+            "email": f"c{i}@example.com",
+            "items_json": json.dumps(items),
+            "automation_json": automation_state(rng, items, 0),
+            "payment_verification_attempts": 1,
+            "delivery_codes_json": "[]",
+        })
+    db.session.execute(Order.__table__.insert(), rows)
+    db.session.commit()
+    return [oid for (oid,) in db.session.query(Order.id).order_by(Order.id).all()]
+
+
+def churn(order_ids, fraction: float, rng):
+    """Advance some orders one step, as the recharge/verification jobs would."""
+    changed = rng.sample(order_ids, max(int(len(order_ids) * fraction), 1))
+    for o in Order.query.filter(Order.id.in_(changed)).all():
+        state = json.loads(o.automation_json or "{}")
+        pending = [u for u in state.get("units") or [] if u.get("status") != "completed"]
+        if pending:
+            pending[0]["status"] = "completed"
+            pending[0]["external_order_id"] = str(rng.randrange(10**6, 10**7))
+        o.automation_json = json.dumps(state)
+    db.session.commit()
+
+
+def run(order_ids, args, url_for_page, conditional: bool):
+    rng = random.Random(21)
+    etags = {}
+    latencies = []
+    sent = {"bytes": 0, "not_modified": 0, "requests": 0}
+    last_bodies = {}
+
+    def poll(oid):
+        headers = {"If-None-Match": etags[oid]} if conditional and oid in etags else {}
+        started = time.perf_counter()
+        resp = app.test_client().get(url_for_page(oid), headers=headers)
+        elapsed = (time.perf_counter() - started) * 1000
+        body = resp.get_data()
+        if resp.status_code == 304:
+            sent["not_modified"] += 1
+        else:
+            assert resp.status_code == 200, resp.status_code
+            last_bodies[oid] = body
+            if resp.headers.get("ETag"):
+                etags[oid] = resp.headers["ETag"]
+        sent["bytes"] += len(body)
+        sent["requests"] += 1
+        return elapsed
+
+    total = 0.0
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        for round_no in range(args.rounds):
+            if round_no:
+                with app.app_context():
+                    churn(order_ids, args.churn, rng)
+            started = time.perf_counter()
+            latencies.extend(pool.map(poll, order_ids))
+            total += time.perf_counter() - started
+    latencies.sort()
+    return {
+        "rps": sent["requests"] / total,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "kb": sent["bytes"] / 1024,
+        "not_modified": sent["not_modified"],
+        "requests": sent["requests"],
+        "bodies": last_bodies,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=6)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--churn", type=float, default=0.05)
+    args = parser.parse_args()
+
+    with app.app_context():
+        order_ids = seed(args.pages)
+        snapshot = {o.id: o.automation_json for o in Order.query.all()}
+
+    def restore():
+        with app.app_context():
+            for oid, automation in snapshot.items():
+                db.session.execute(Order.__table__.update().where(Order.id == oid).values(automation_json=automation))
+            db.session.commit()
+
+    print(f"{args.pages} páginas x {args.rounds} rondas, {args.threads} hilos, {args.churn:.0%} de órdenes cambian por ronda")
+    print(f"{'modo':<22}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'KB enviados':>13}{'304':>7}")
+    results = {}
+    for label, url, conditional in (
+        ("anterior", lambda oid: f"/bench/legacy-progress/{oid}", False),
+        ("memo + ETag", lambda oid: f"/gracias/{oid}/progress", True),
+    ):
+        restore()
+        res = run(order_ids, args, url, conditional)
+        results[label] = res
+        print(f"{label:<22}{res['rps']:>9.0f}{res['p50']:>9.2f}{res['p95']:>9.2f}{res['kb']:>13.0f}{res['not_modified']:>7}")
+    legacy, new = results["anterior"]["bodies"], results["memo + ETag"]["bodies"]
+    same = all(json.loads(legacy[oid]) == json.loads(new[oid]) for oid in order_ids)
+    print(f"  último payload de cada página igual en ambos modos: {same}")
+    print("  memo:", store_app._THANKS_PROGRESS_MEMO_STATS)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Load test: /webhook-ubii with the legacy in-Python scan vs the indexed reference_match_key lookup.
+
+Uso:
+    python scripts/bench_ubii_webhook.py [--orders 50000] [--notifications 1000] [--legacy-sample 50]
+
+Siembra N órdenes en una base SQLite temporal (las columnas normalizadas se
+rellenan con _backfill_order_reference_norms, como en la migración) y dispara
+notificaciones Ubii: ~60% de órdenes pendientes, ~20% de órdenes ya aprobadas
+y ~20% de referencias desconocidas. Mide la latencia del webhook con el match
+indexado + encolado, y con la implementación anterior (escaneo de todas las
+órdenes y verificación síncrona) sobre una muestra, ya que tarda demasiado para
+las 1k. Comprueba que ambas eligen la misma orden y al final drena la cola con
+4 consumidores.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_ubii_")
+os.environ["SQLITE_PATH"] = os.path.join(_TMP_DIR, "bench.sqlite")
+os.environ.pop("DATABASE_URL", None)
+os.environ["JOB_QUEUE_MODE"] = "worker"  # the webhook only enqueues; drained at the end
+
+import app as store_app  # noqa: E402
+from app import Order, app, db  # noqa: E402
+
+
+def legacy_find_matching_order(reference, amount, method):
+    """_ubii_find_matching_order before reference_match_key existed."""
+    normalized_reference = store_app._ubii_normalize_reference_value(reference)
+    reference_match_key = store_app._ubii_reference_match_key(reference)
+    if not normalized_reference or not reference_match_key:
+        return None, "Referencia no encontrada en la notificación", False
+    normalized_method = store_app._pabilo_normalize_method(method or "pm")
+    pending_rows = Order.query.filter(Order.status == "pending").order_by(Order.created_at.desc()).all()
+    candidates = [
+        row for row in pending_rows
+        if store_app._ubii_reference_match_key(row.reference or "") == reference_match_key
+        and store_app._pabilo_normalize_method(row.method or "") == normalized_method
+    ]
+    if amount is not None:
+        amount_candidates = [row for row in candidates if store_app._ubii_order_amount_matches(row, amount)]
+        if amount_candidates:
+            candidates = amount_candidates
+        elif candidates:
+            return None, "La referencia existe pero el monto no coincide con ninguna orden pendiente", False
+    if len(candidates) > 1:
+        return None, "Hay varias órdenes pendientes con esa referencia; incluye el monto exacto para decidir", False
+    if len(candidates) == 1:
+        return candidates[0], "", False
+    processed_rows = Order.query.filter(Order.status.in_(["approved", "delivered"])).order_by(Order.created_at.desc()).all()
+    processed = [
+        row for row in processed_rows
+        if store_app._ubii_reference_match_key(row.reference or "") == reference_match_key
+        and store_app._pabilo_normalize_method(row.method or "") == normalized_method
+        and store_app._ubii_order_amount_matches(row, amount)
+    ]
+    if processed:
+        return processed[0], "La orden ya estaba procesada anteriormente", True
+    return None, "No existe una orden pendiente que coincida con la referencia recibida", False
+
+
+def seed(n_orders: int, rng: random.Random):
+    with app.app_context():
+        pkg = store_app.StorePackage(name="Free Fire", image_path="/static/x.png", active=True)
+        db.session.add(pkg)
+        db.session.commit()
+        now = datetime.utcnow()
+        rows = []
+        for i in range(n_orders):
+            status = rng.choices(("pending", "approved", "delivered", "rejected"), (25, 35, 30, 10))[0]
+            rows.append({
+                "store_package_id": pkg.id,
+                "status": status,
+                "method": rng.choice(("pm", "pm", "pm", "binance")),
+                "reference": str(rng.randrange(10**7, 10**12)),
+                "amount": float(rng.randrange(50, 5000)),
+                "created_at": now - timedelta(minutes=rng.randrange(60 * 24 * 6)),
+                "email": f"c{i}@example.com",
+                # NULL, como las filas anteriores a la migración
+                "reference_norm": None,
+                "capture_reference_norm": None,
+                "reference_match_key": None,
+                "method_norm": None,
+            })
+        db.session.execute(Order.__table__.insert(), rows)
+        db.session.commit()
+        started = time.perf_counter()
+        n = store_app._backfill_order_reference_norms()
+        print(f"Backfill de columnas normalizadas: {n} órdenes en {time.perf_counter() - started:.1f}s")
+        store_app.set_config_values({"payment_verification_provider": "ubii", "ubii_method": "pm"})
+        return db.session.execute(
+            db.select(Order.id, Order.reference, Order.amount, Order.status).where(Order.method == "pm")
+        ).all()
+
+
+def build_notifications(orders, n: int, rng: random.Random):
+    pending = [o for o in orders if o.status == "pending"]
+    processed = [o for o in orders if o.status in ("approved", "delivered")]
+    out = []
+    for _ in range(n):
+        roll = rng.random()
+        if roll < 0.6:
+            o = rng.choice(pending)
+            ref, amount = o.reference, o.amount
+        elif roll < 0.8:
+            o = rng.choice(processed)
+            ref, amount = o.reference, o.amount
+        else:
+            ref, amount = str(rng.randrange(10**7, 10**12)), float(rng.randrange(50, 5000))
+        bs = f"{amount:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+        out.append({"texto": f"Recibiste un Pago Movil por Bs. {bs} referencia {ref}"})
+    return out
+
+
+def fire(client, notifications):
+    latencies, outcomes = [], []
+    for body in notifications:
+        started = time.perf_counter()
+        resp = client.post("/webhook-ubii", json=body)
+        latencies.append(time.perf_counter() - started)
+        data = resp.get_json() or {}
+        outcomes.append((data.get("status"), data.get("order_id")))
+    return latencies, outcomes
+
+
+def report(label, latencies):
+    lat = sorted(latencies)
+    p95 = lat[max(int(len(lat) * 0.95) - 1, 0)]
+    print(f"{label:<22}{len(lat):>8}{statistics.mean(lat) * 1000:>10.1f}{p95 * 1000:>10.1f}{sum(lat):>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=50000)
+    parser.add_argument("--notifications", type=int, default=1000)
+    parser.add_argument("--legacy-sample", type=int, default=50)
+    args = parser.parse_args()
+    rng = random.Random(13)
+
+    print(f"Sembrando {args.orders} órdenes...")
+    orders = seed(args.orders, rng)
+    notifications = build_notifications(orders, args.notifications, rng)
+    client = app.test_client()
+
+    print(f"{'modo':<22}{'notif.':>8}{'media ms':>10}{'p95 ms':>10}{'total s':>10}")
+    indexed_lat, indexed_out = fire(client, notifications)
+    report("indexado + cola", indexed_lat)
+
+    sample = notifications[: args.legacy_sample]
+    indexed_find = store_app._ubii_find_matching_order
+    indexed_enqueue = store_app.enqueue_job
+    store_app._ubii_find_matching_order = legacy_find_matching_order
+    store_app.enqueue_job = lambda *a, **k: False  # verificación síncrona, como antes
+    legacy_lat, legacy_out = fire(client, sample)
+    store_app._ubii_find_matching_order = indexed_find
+    store_app.enqueue_job = indexed_enqueue
+    report("escaneo (muestra)", legacy_lat)
+    print(f"  escaneo extrapolado a {len(notifications)}: {statistics.mean(legacy_lat) * len(notifications):.1f}s")
+    mismatches = sum(1 for a, b in zip(indexed_out, legacy_out) if a[1] != b[1])
+    print(f"  orden elegida distinta en la muestra: {mismatches}")
+    counts = {}
+    for status, _order_id in indexed_out:
+        counts[status] = counts.get(status, 0) + 1
+    print(f"  respuestas: {counts}")
+
+    with app.app_context():
+        queued = db.session.execute(
+            db.select(db.func.count()).select_from(store_app.BackgroundJob).where(
+                store_app.BackgroundJob.kind == "ubii_verify_order",
+                store_app.BackgroundJob.status == "queued",
+            )
+        ).scalar()
+    stop = store_app.threading.Event()
+    started = time.perf_counter()
+    threads = store_app._start_job_consumers(4, stop)
+    while True:
+        with app.app_context():
+            left = db.session.execute(
+                db.select(db.func.count()).select_from(store_app.BackgroundJob).where(
+                    store_app.BackgroundJob.kind == "ubii_verify_order",
+                    store_app.BackgroundJob.status.in_(("queued", "running")),
+                )
+            ).scalar()
+        if not left:
+            break
+        time.sleep(0.2)
+    stop.set()
+    store_app._JOB_WAKE.set()
+    for t in threads:
+        t.join(timeout=5)
+    print(f"Cola: {queued} jobs ubii_verify_order drenados en {time.perf_counter() - started:.1f}s con 4 consumidores")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Stub Binance Pay server + one-cycle reconciliation check for 500 pending orders.
+
+Uso:
+    python scripts/binance_stub_reconcile.py [--orders 500]
+
+Levanta un servidor HTTP local que imita /sapi/v1/pay/transactions (paginado por
+endTime, más reciente primero), siembra órdenes Binance pendientes en una base
+SQLite temporal y corre _binance_reconcile_pending_orders una vez. Verifica que
+todas las órdenes pagadas se aprueben con una sola ventana de consultas y que
+el siguiente ciclo sólo pida transacciones nuevas. El cursor se guarda en la
+tabla config, así que un tercer ciclo con una orden nueva pagada antes de ese
+cursor (como si lo corriera otro proceso) también debe aprobarla.
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+STUB_TRANSACTIONS = []
+STUB_REQUESTS = []
+
+
+class BinanceStubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path != "/sapi/v1/pay/transactions":
+            self.send_response(404)
+            self.end_headers()
+            return
+        qs = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        start_ms = int(qs.get("startTime") or 0)
+        end_ms = int(qs.get("endTime") or 2**62)
+        limit = min(int(qs.get("limit") or 100), 100)
+        STUB_REQUESTS.append({"startTime": start_ms, "endTime": qs.get("endTime")})
+        rows = [tx for tx in STUB_TRANSACTIONS if start_ms <= tx["transactionTime"] <= end_ms]
+        rows.sort(key=lambda tx: tx["transactionTime"], reverse=True)
+        body = json.dumps({"code": "000000", "data": rows[:limit]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args):
+        pass
+
+
+def _start_stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BinanceStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _random_code(rng):
+    return "".join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(6))
+
+
+def _tx(rng, when: datetime, memo: str, amount: float, currency: str = "USDT"):
+    return {
+        "transactionId": f"T{rng.getrandbits(48)}",
+        "transactionTime": int(when.timestamp() * 1000),
+        "orderMemo": memo,
+        "amount": f"{amount:.2f}",
+        "currency": currency,
+        "fundsDetail": [{"currency": currency, "amount": f"{amount:.2f}"}],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=500)
+    args = parser.parse_args()
+
+    server = _start_stub()
+    tmp_dir = tempfile.mkdtemp(prefix="binance_stub_")
+    os.environ["SQLITE_PATH"] = os.path.join(tmp_dir, "stub.sqlite")
+    os.environ.pop("DATABASE_URL", None)
+    os.environ["BINANCE_API_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["BINANCE_API_KEY"] = "stub-key"
+    os.environ["BINANCE_API_SECRET"] = "stub-secret"
+
+    import app as store_app
+    from app import Order, app, db
+
+    approved_ids = []
+
+    def _approve(order):
+        if store_app._try_transition_order_to_approved(order):
+            approved_ids.append(order.id)
+
+    store_app._order_has_auto_recharges = lambda _order: True
+    store_app._binance_auto_approve = _approve
+
+    rng = random.Random(7)
+    now = datetime.utcnow()
+    expected_paid = set()
+    with app.app_context():
+        for i in range(args.orders):
+            created = now - timedelta(hours=3) + timedelta(seconds=i * 20)
+            code = _random_code(rng)
+            amount = round(rng.uniform(1, 50), 2)
+            order = Order(store_package_id=1, method="binance", status="pending", reference=code,
+                          amount=amount, currency="USDT", created_at=created)
+            db.session.add(order)
+            db.session.flush()
+            paid_at = created + timedelta(minutes=1)
+            if i % 10 == 0:
+                continue  # no payment yet
+            if i % 10 == 1:
+                STUB_TRANSACTIONS.append(_tx(rng, paid_at, code, amount + 1))  # wrong amount
+                continue
+            memo = code if i % 3 else f"pago {code.lower()} gracias"
+            STUB_TRANSACTIONS.append(_tx(rng, paid_at, memo, amount))
+            expected_paid.add(order.id)
+        for _ in range(200):
+            STUB_TRANSACTIONS.append(_tx(rng, now - timedelta(minutes=rng.randint(1, 170)), _random_code(rng), 5.0))
+        db.session.commit()
+
+        stats = store_app._binance_reconcile_pending_orders()
+        first_requests = len(STUB_REQUESTS)
+        print(f"ciclo 1: {stats}  requests={first_requests}  transacciones={len(STUB_TRANSACTIONS)}")
+        ok = set(approved_ids) == expected_paid
+        ok = ok and first_requests <= (len(STUB_TRANSACTIONS) // 100) + 1
+
+        late = Order.query.filter_by(status="pending").order_by(Order.id.asc()).first()
+        STUB_TRANSACTIONS.append(_tx(rng, datetime.utcnow(), late.reference, float(late.amount)))
+        stats = store_app._binance_reconcile_pending_orders()
+        second = STUB_REQUESTS[first_requests:]
+        print(f"ciclo 2: {stats}  requests={len(second)}  startTime={second[0]['startTime'] if second else '-'}")
+        ok = ok and late.id in approved_ids and stats["fetched"] < 20
+
+        code = _random_code(rng)
+        fresh = Order(store_package_id=1, method="binance", status="pending", reference=code,
+                      amount=12.5, currency="USDT", created_at=datetime.utcnow())
+        db.session.add(fresh)
+        db.session.commit()
+        STUB_TRANSACTIONS.append(_tx(rng, datetime.utcnow() - timedelta(minutes=4), code, 12.5))
+        requests_before = len(STUB_REQUESTS)
+        stats = store_app._binance_reconcile_pending_orders()
+        print(f"ciclo 3: {stats}  requests={len(STUB_REQUESTS) - requests_before}  "
+              f"cursor={store_app.get_config_value(store_app.BINANCE_RECONCILE_CURSOR_KEY)[:60]}...")
+        ok = ok and fresh.id in approved_ids and stats["fetched"] < 20
+
+    server.shutdown()
+    print("OK" if ok else "FALLO")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""EXPLAIN regression check: every hot orders query must use an index.
+
+Uso:
+    python scripts/check_order_indexes.py [--orders 200000]
+
+Siembra N órdenes en una base SQLite temporal (o usa DATABASE_URL si se
+exporta CHECK_USE_DATABASE_URL=1), corre ANALYZE y revisa el plan de cada
+consulta caliente sobre `orders`. Sale con código 1 si alguna hace un
+escaneo completo de la tabla.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+if os.environ.get("CHECK_USE_DATABASE_URL") != "1":
+    os.environ.pop("DATABASE_URL", None)
+    os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="check_idx_"), "check.sqlite")
+
+from app import Order, app, db  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+
+def seed(n_orders: int):
+    rng = random.Random(5)
+    statuses = ("approved", "delivered", "rejected", "approved", "delivered", "pending")
+    methods = ("pm", "pm", "binance")
+    base = datetime.utcnow() - timedelta(days=120)
+    rows = []
+    for i in range(n_orders):
+        rows.append({
+            "created_at": base + timedelta(seconds=i * 50),
+            "status": statuses[i % len(statuses)],
+            "store_package_id": rng.randint(1, 40),
+            "item_id": rng.randint(1, 600),
+            "method": methods[i % len(methods)],
+            "reference": str(10_000_000 + i),
+            "reference_norm": str(10_000_000 + i)[-6:],
+            "capture_reference_norm": "",
+            "capture_sha256": "",
+            "email": f"buyer{rng.randint(1, 40000)}@example.com",
+            "user_id": rng.randint(1, 20000),
+            "customer_id": str(rng.randint(10**8, 10**9)),
+        })
+        if len(rows) >= 5000:
+            db.session.execute(Order.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(Order.__table__.insert(), rows)
+    db.session.commit()
+
+
+def hot_queries():
+    now = datetime.utcnow()
+    return {
+        "rev_auto_verify": Order.query.filter(Order.status == "pending", Order.created_at >= now - timedelta(hours=48)),
+        "pabilo_auto_retry": Order.query.filter(Order.status == "pending", Order.created_at >= now - timedelta(minutes=20)),
+        "cleanup": Order.query.filter(Order.status.in_(("approved", "rejected", "delivered")), Order.created_at < now - timedelta(days=7)),
+        "binance_pending": Order.query.filter_by(method="binance", status="pending"),
+        "recent_recharges": (
+            Order.query.filter(Order.status.in_(("delivered", "approved")))
+            .filter(Order.item_id.in_([3, 7, 11, 42]))
+            .order_by(Order.id.desc()).limit(12)
+        ),
+        "best_sellers": (
+            db.session.query(Order.store_package_id, db.func.count(Order.id))
+            .filter(Order.status.in_(["approved", "delivered"]))
+            .group_by(Order.store_package_id)
+        ),
+        "orders_my_email": Order.query.filter(Order.email == "buyer7@example.com").order_by(Order.created_at.desc()).limit(50),
+        "orders_my_user": Order.query.filter(db.or_(Order.email == "buyer7@example.com", Order.user_id == 7)).order_by(Order.created_at.desc()).limit(50),
+        "customer_id": Order.query.filter(Order.customer_id == "123456789").order_by(Order.created_at.desc()),
+        "reference_dup": Order.query.filter(Order.reference_norm == "000123", Order.status.in_(("pending", "approved", "delivered"))),
+        "admin_list": Order.query.order_by(Order.created_at.desc()).limit(20),
+    }
+
+
+def explain(query) -> str:
+    compiled = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True})
+    if db.engine.dialect.name == "postgresql":
+        rows = db.session.execute(text(f"EXPLAIN {compiled}")).fetchall()
+        return "\n".join(str(r[0]) for r in rows)
+    rows = db.session.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).fetchall()
+    return "\n".join(str(r[-1]) for r in rows)
+
+
+def uses_index(plan: str) -> bool:
+    if db.engine.dialect.name == "postgresql":
+        return "Seq Scan on orders" not in plan
+    return not any(
+        line.strip().startswith("SCAN orders") and "INDEX" not in line
+        for line in plan.splitlines()
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=200_000)
+    args = parser.parse_args()
+
+    failures = 0
+    with app.app_context():
+        if Order.query.count() < args.orders:
+            print(f"Sembrando {args.orders} órdenes...")
+            seed(args.orders)
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+        for name, query in hot_queries().items():
+            plan = explain(query)
+            ok = uses_index(plan)
+            failures += 0 if ok else 1
+            print(f"[{'OK' if ok else 'FULL SCAN'}] {name}")
+            for line in plan.splitlines():
+                print(f"    {line}")
+    print("OK" if not failures else f"{failures} consultas sin índice")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Recalcula package_sales_counters desde cero y reporta el drift.
+
+Uso:
+    python scripts/reconcile_sales_counters.py [--apply]
+
+Usa la base configurada (DATABASE_URL / SQLITE_PATH). Sin --apply solo
+reporta las diferencias entre los contadores y el recuento real (órdenes
+aprobadas/entregadas + OrderSummary); con --apply además los corrige.
+Sale con código 1 si encontró drift.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app import _reconcile_package_sales_counters, app  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--apply", action="store_true", help="Reescribe los contadores con el recuento")
+    args = parser.parse_args()
+
+    with app.app_context():
+        report = _reconcile_package_sales_counters(apply=args.apply)
+    if not report.get("ok"):
+        print(f"Error: {report.get('error')}")
+        return 2
+    print(f"Paquetes con ventas: {report['packages']}  ventas totales: {report['total_sales']}")
+    for d in report["drift"]:
+        print(f"  paquete {d['store_package_id']}: contador={d['stored']} real={d['expected']} (diff {d['diff']:+d})")
+    if not report["drift"]:
+        print("Sin drift.")
+    elif report["applied"]:
+        print(f"Corregidos {len(report['drift'])} contadores.")
+    return 1 if report["drift"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -399,11 +399,16 @@ document.addEventListener('DOMContentLoaded', () => {
   const btnGiftRefresh = document.getElementById('btn-gift-refresh');
   const btnGiftGenerate = document.getElementById('btn-gift-generate');
   const btnGiftExport = document.getElementById('btn-gift-export');
+  const btnGiftExportCsv = document.getElementById('btn-gift-export-csv');
+  const btnGiftMore = document.getElementById('btn-gift-more');
   const btnGiftBatchDisable = document.getElementById('btn-gift-batch-disable');
   const btnGiftCopy = document.getElementById('btn-gift-copy');
   const btnGiftVerifyAll = document.getElementById('btn-gift-verify-all');
   let giftGamesCache = [];
   let giftStatus = '';
+  // Lista paginada por cursor: "Cargar más" pide la página siguiente y la suma
+  let giftCodesShown = [];
+  let giftNextCursor = null;
 
   function giftEsc(value) {
     return String(value == null ? '' : value).replace(/[&<>"']/g, c => (
@@ -453,10 +458,14 @@ document.addEventListener('DOMContentLoaded', () => {
       batches.map(b => `<option value="${giftEsc(b)}">${giftEsc(b)}</option>`).join('');
     if (previo && batches.includes(previo)) giftBatchFilter.value = previo;
     if (btnGiftBatchDisable) btnGiftBatchDisable.disabled = !giftBatchFilter.value;
-    if (btnGiftExport) {
-      const lote = giftBatchFilter.value;
-      btnGiftExport.href = '/admin/gift-codes/export' + (lote ? `?batch=${encodeURIComponent(lote)}` : '');
-    }
+    updateGiftExportLinks();
+  }
+
+  function updateGiftExportLinks() {
+    const lote = giftBatchFilter ? giftBatchFilter.value : '';
+    const loteParam = lote ? `&batch=${encodeURIComponent(lote)}` : '';
+    if (btnGiftExport) btnGiftExport.href = '/admin/gift-codes/export?format=txt' + loteParam;
+    if (btnGiftExportCsv) btnGiftExportCsv.href = '/admin/gift-codes/export?format=csv&columns=prize,batch,expires_at' + loteParam;
   }
 
   function renderGiftCodes(codes) {
@@ -558,25 +567,60 @@ document.addEventListener('DOMContentLoaded', () => {
     }
   }
 
-  async function fetchGiftCodes() {
-    if (!giftCodesList) return;
+  function giftListParams() {
     const params = new URLSearchParams();
     if (giftStatus) params.set('status', giftStatus);
     if (giftBatchFilter && giftBatchFilter.value) params.set('batch', giftBatchFilter.value);
+    return params;
+  }
+
+  function updateGiftMoreButton() {
+    if (btnGiftMore) btnGiftMore.hidden = !giftNextCursor;
+  }
+
+  async function fetchGiftCodes() {
+    if (!giftCodesList) return;
     try {
-      const res = await fetch('/admin/gift-codes?' + params.toString());
+      const res = await fetch('/admin/gift-codes?' + giftListParams().toString());
       const data = await res.json().catch(() => ({}));
       if (!res.ok || !data.ok) throw new Error(data.error || 'No se pudieron cargar los códigos');
       giftGamesCache = Array.isArray(data.games) ? data.games : [];
       renderGiftGames(giftGamesCache);
       renderGiftSummary(data.stats || {});
       renderGiftBatches(data.batches || []);
-      renderGiftCodes(data.codes || []);
+      giftCodesShown = data.codes || [];
+      giftNextCursor = data.next_cursor || null;
+      renderGiftCodes(giftCodesShown);
       if (giftEnabledToggle) giftEnabledToggle.checked = !!data.enabled;
     } catch (error) {
+      giftCodesShown = [];
+      giftNextCursor = null;
       giftCodesList.innerHTML = `<div class="empty-state"><p>${giftEsc(error.message || 'No se pudieron cargar los códigos')}</p></div>`;
       if (giftSummary) giftSummary.innerHTML = '<span class="ty-pill">Sin datos</span>';
     }
+    updateGiftMoreButton();
+  }
+
+  if (btnGiftMore) {
+    btnGiftMore.addEventListener('click', async () => {
+      if (!giftNextCursor) return;
+      const params = giftListParams();
+      params.set('after', giftNextCursor);
+      try {
+        btnGiftMore.disabled = true;
+        const res = await fetch('/admin/gift-codes?' + params.toString());
+        const data = await res.json().catch(() => ({}));
+        if (!res.ok || !data.ok) throw new Error(data.error || 'No se pudieron cargar más códigos');
+        giftCodesShown = giftCodesShown.concat(data.codes || []);
+        giftNextCursor = data.next_cursor || null;
+        renderGiftCodes(giftCodesShown);
+      } catch (e) {
+        toast(e.message || 'No se pudieron cargar más códigos', 'error');
+      } finally {
+        btnGiftMore.disabled = false;
+        updateGiftMoreButton();
+      }
+    });
   }
 
   if (giftGameSelect) {
@@ -586,10 +630,7 @@ document.addEventListener('DOMContentLoaded', () => {
   if (giftBatchFilter) {
     giftBatchFilter.addEventListener('change', () => {
       if (btnGiftBatchDisable) btnGiftBatchDisable.disabled = !giftBatchFilter.value;
-      if (btnGiftExport) {
-        const lote = giftBatchFilter.value;
-        btnGiftExport.href = '/admin/gift-codes/export' + (lote ? `?batch=${encodeURIComponent(lote)}` : '');
-      }
+      updateGiftExportLinks();
       fetchGiftCodes();
     });
   }
@@ -848,6 +889,11 @@ document.addEventListener('DOMContentLoaded', () => {
   const ordersSearchInfo = document.getElementById('orders-search-info');
   let ordersCurrentPage = 1;
   const ordersPerPage = 20;
+  // Keyset cursors from /admin/orders: the current page is re-fetched with the
+  // same cursor, Anterior/Siguiente use prev_cursor/next_cursor.
+  let ordersPageCursor = {};
+  let ordersLastPagination = {};
+  let ordersRenderSeq = 0;
   let ordersQuery = '';
   let ordersStatusFilter = '';
   const ordersStatusFilterWrap = document.getElementById('orders-status-filter');
@@ -3319,29 +3365,17 @@ window.refreshGallery = refreshGallery;
   function renderOrdersPagination(meta) {
     if (!ordersPagination) return;
     const pagination = meta || {};
-    const totalPages = Math.max(parseInt(pagination.total_pages || 1, 10) || 1, 1);
-    const page = Math.min(Math.max(parseInt(pagination.page || 1, 10) || 1, 1), totalPages);
     const totalOrders = parseInt(pagination.total_orders || 0, 10) || 0;
-
-    if (totalOrders <= ordersPerPage) {
+    if (!pagination.has_prev && !pagination.has_next) {
       ordersPagination.innerHTML = '';
       return;
     }
-
-    const pageButtons = [];
-    const start = Math.max(1, page - 2);
-    const end = Math.min(totalPages, start + 4);
-    for (let current = start; current <= end; current += 1) {
-      pageButtons.push(`
-        <button class="btn btn-orders-page${current === page ? ' primary' : ''}" data-page="${current}" type="button" ${current === page ? 'disabled' : ''}>${current}</button>
-      `);
-    }
-
+    const totalPages = Math.max(parseInt(pagination.total_pages || 1, 10) || 1, 1);
+    const totalText = `${pagination.total_approx ? '~' : ''}${totalOrders} órdenes`;
     ordersPagination.innerHTML = `
-      <button class="btn btn-orders-page-nav" data-page="${page - 1}" type="button" ${page <= 1 ? 'disabled' : ''}>Anterior</button>
-      <span style="color:#cbd5e1;font-size:13px;">Página ${page} de ${totalPages} · ${totalOrders} órdenes</span>
-      ${pageButtons.join('')}
-      <button class="btn btn-orders-page-nav" data-page="${page + 1}" type="button" ${page >= totalPages ? 'disabled' : ''}>Siguiente</button>
+      <button class="btn btn-orders-page-nav" data-nav="prev" type="button" ${pagination.has_prev ? '' : 'disabled'}>Anterior</button>
+      <span style="color:#cbd5e1;font-size:13px;">Página ${ordersCurrentPage} de ${pagination.total_approx ? '~' : ''}${totalPages} · ${totalText}</span>
+      <button class="btn btn-orders-page-nav" data-nav="next" type="button" ${pagination.has_next ? '' : 'disabled'}>Siguiente</button>
     `;
   }
 
@@ -3359,17 +3393,34 @@ window.refreshGallery = refreshGallery;
     ordersSearchInfo.removeAttribute('hidden');
   }
 
+  // fetchOrders('next' | 'prev') pagina; fetchOrders(ordersCurrentPage) recarga
+  // la pagina actual; cualquier otro valor vuelve a la primera.
   async function fetchOrders(page = ordersCurrentPage) {
     try {
-      const normalizedPage = Math.max(parseInt(page || 1, 10) || 1, 1);
-      const params = new URLSearchParams({ page: normalizedPage, per_page: ordersPerPage });
+      let cursor = {};
+      let nextPage = 1;
+      if (page === 'next' && ordersLastPagination.next_cursor) {
+        cursor = { after: ordersLastPagination.next_cursor };
+        nextPage = ordersCurrentPage + 1;
+      } else if (page === 'prev' && ordersLastPagination.prev_cursor) {
+        cursor = ordersCurrentPage > 2 ? { before: ordersLastPagination.prev_cursor } : {};
+        nextPage = Math.max(ordersCurrentPage - 1, 1);
+      } else if (page === ordersCurrentPage && page > 1) {
+        cursor = ordersPageCursor;
+        nextPage = ordersCurrentPage;
+      }
+      const params = new URLSearchParams({ per_page: ordersPerPage });
+      if (cursor.after) params.set('after', cursor.after);
+      if (cursor.before) params.set('before', cursor.before);
       if (ordersQuery) params.set('q', ordersQuery);
       if (ordersStatusFilter) params.set('status', ordersStatusFilter);
       const res = await fetch(`/admin/orders?${params.toString()}`);
       const data = await res.json();
       if (!res.ok || !data.ok) throw new Error(data.error || 'No se pudo listar');
       const pagination = data.pagination || {};
-      ordersCurrentPage = Math.max(parseInt(pagination.page || normalizedPage, 10) || normalizedPage, 1);
+      ordersCurrentPage = nextPage;
+      ordersPageCursor = cursor;
+      ordersLastPagination = pagination;
       renderOrders(data.orders || []);
       renderOrdersPagination(pagination);
       renderOrdersSearchInfo(pagination);
@@ -3455,10 +3506,37 @@ window.refreshGallery = refreshGallery;
       ordersList.innerHTML = '<div class="empty-state"><h3>Sin Ã³rdenes</h3><p>Cuando los clientes confirmen pagos, sus Ã³rdenes aparecerÃ¡n aquÃ­.</p></div>';
       return;
     }
+    const seq = ++ordersRenderSeq;
+    const tiles = [];
     items.forEach(o => {
       const tile = document.createElement('div');
       tile.className = 'order-tile';
+      fillOrderTile(tile, o);
+      ordersList.appendChild(tile);
+      tiles.push({ tile, o });
+    });
+    loadOrderDetails(tiles, seq);
+
+    // La automatizacion y el estado Pabilo/Ubii de toda la pagina llegan en
+    // una sola consulta aparte; hasta entonces Aprobar/Rechazar quedan deshabilitados.
+    async function loadOrderDetails(tiles, renderSeq) {
+      try {
+        const ids = tiles.map(t => t.o.id).join(',');
+        const res = await fetch(`/admin/orders/details?ids=${encodeURIComponent(ids)}`);
+        const data = await res.json().catch(() => ({}));
+        if (!res.ok || !data.ok || renderSeq !== ordersRenderSeq) return;
+        const details = data.orders || {};
+        tiles.forEach(({ tile, o }) => {
+          const detail = details[String(o.id)];
+          if (!detail) return;
+          fillOrderTile(tile, Object.assign({}, o, detail, { detail_loaded: true }));
+        });
+      } catch (_) { /* los tiles quedan con los datos de la lista */ }
+    }
+
+    function fillOrderTile(tile, o) {
       tile.setAttribute('data-customer-name', o.customer_name || '');
+      const detailLoaded = !!o.detail_loaded;
       const autoSummary = o.auto_recharge_summary || {};
       const payVerify = o.payment_verify || {};
       const pabiloRequest = o.pabilo_request || {};
@@ -3472,8 +3550,8 @@ window.refreshGallery = refreshGallery;
       const approveLabel = isAutoMapped
         ? `${completedAutoUnits > 0 ? 'Continuar' : 'Procesar'} ${autoActionUnits} recarga${autoActionUnits === 1 ? '' : 's'}`
         : 'Aprobar';
-      const approveDisabled = o.status !== 'pending' || (isAutoMapped && processingAutoUnits > 0 && retryableAutoUnits === 0);
-      const rejectDisabled = o.status !== 'pending' || (isAutoMapped && processingAutoUnits > 0);
+      const approveDisabled = !detailLoaded || o.status !== 'pending' || (isAutoMapped && processingAutoUnits > 0 && retryableAutoUnits === 0);
+      const rejectDisabled = !detailLoaded || o.status !== 'pending' || (isAutoMapped && processingAutoUnits > 0);
       const autoSummaryText = isAutoMapped
         ? `Auto: ${completedAutoUnits}/${totalAutoUnits} completadas${processingAutoUnits ? ` · ${processingAutoUnits} verificando` : ''}${retryableAutoUnits ? ` · ${retryableAutoUnits} por reenviar` : ''}`
         : '';
@@ -3585,8 +3663,7 @@ window.refreshGallery = refreshGallery;
           <button class="btn btn-reject" data-id="${o.id}" ${rejectDisabled ? 'disabled' : ''} style="background:#dc2626;">Rechazar</button>
         </div>
       `;
-      ordersList.appendChild(tile);
-    });
+    }
   }
 
   if (btnOrdersRefresh) btnOrdersRefresh.addEventListener('click', fetchOrders);
@@ -3890,10 +3967,9 @@ window.refreshGallery = refreshGallery;
   }
   if (ordersPagination) {
     ordersPagination.addEventListener('click', async (e) => {
-      const btn = e.target.closest('[data-page]');
+      const btn = e.target.closest('[data-nav]');
       if (!btn) return;
-      const page = parseInt(btn.getAttribute('data-page') || '1', 10) || 1;
-      await fetchOrders(page);
+      await fetchOrders(btn.getAttribute('data-nav'));
     });
   }
 
@@ -128,12 +128,25 @@ document.addEventListener('DOMContentLoaded', () => {
         method: 'POST',
         body: fd,
       });
-      const data = await res.json().catch(() => ({}));
+      let data = await res.json().catch(() => ({}));
       if (currentLookupId !== captureReferenceLookupId) return '';
       if (!res.ok || !data.ok) {
         renderCaptureReferenceState('idle');
         return '';
       }
+      // 202: the capture is queued for OCR; poll its status until the job settles
+      const pollUntil = Date.now() + 60000;
+      while (!data.done && data.status_url && Date.now() < pollUntil) {
+        await new Promise(resolve => setTimeout(resolve, 1500));
+        if (currentLookupId !== captureReferenceLookupId) return '';
+        const statusRes = await fetch(data.status_url, { cache: 'no-store' });
+        data = await statusRes.json().catch(() => ({}));
+        if (currentLookupId !== captureReferenceLookupId) return '';
+        if (!statusRes.ok || !data.ok) {
+          renderCaptureReferenceState('idle');
+          return '';
+        }
+      }
       if (data.found && data.reference) {
         renderCaptureReferenceState('success', data.reference);
         return String(data.reference || '').trim();
@@ -124,14 +124,44 @@ document.addEventListener('DOMContentLoaded', () => {
       const res = await fetch(url);
       const data = await res.json();
       const orders = (data && data.orders) || [];
+      myOrdersState = orders;
       renderMyOrders(orders);
       renderMyCodes(orders);
     } catch (_) {
+      myOrdersState = [];
       renderMyOrders([]);
       renderMyCodes([]);
     }
   }
 
+  // Poll incremental para compradores: pide solo las órdenes nuevas (since_id)
+  // y las que siguen en curso (ids), y las mezcla con la lista ya pintada.
+  let myOrdersState = [];
+  const MY_ORDERS_POLL_MS = 20000;
+  async function pollMyOrders() {
+    if (document.visibilityState !== 'visible') return;
+    const sinceId = myOrdersState.reduce((max, o) => Math.max(max, Number(o.id) || 0), 0);
+    const openIds = myOrdersState
+      .filter(o => ['pending', 'approved'].includes(String(o.status || '').toLowerCase()))
+      .map(o => o.id);
+    const params = new URLSearchParams({ since_id: sinceId });
+    if (openIds.length) params.set('ids', openIds.join(','));
+    try {
+      const res = await fetch(`/orders/my?${params.toString()}`);
+      const data = await res.json();
+      const changed = (data && data.orders) || [];
+      if (!res.ok || !data.ok || !changed.length) return;
+      const byId = new Map(myOrdersState.map(o => [o.id, o]));
+      changed.forEach(o => byId.set(o.id, o));
+      myOrdersState = Array.from(byId.values())
+        .sort((a, b) => String(b.created_at).localeCompare(String(a.created_at)) || (b.id - a.id))
+        .slice(0, 50);
+      renderMyOrders(myOrdersState);
+      renderMyCodes(myOrdersState);
+    } catch (_) { /* se reintenta en el siguiente ciclo */ }
+  }
+  if (!IS_ADMIN && myOrders) setInterval(pollMyOrders, MY_ORDERS_POLL_MS);
+
   // Códigos de Gift Cards compradas (órdenes aprobadas/entregadas con código)
   const myCodes = document.getElementById('my-codes');
   function renderMyCodes(items) {
@@ -0,0 +1,52 @@
+"""Consumidor de la cola de jobs (background_jobs).
+
+Uso:
+    python worker.py [--consumers 4]
+
+Ejecuta N consumidores en este proceso (hilos) que reclaman y ejecutan los jobs
+que encolan los workers web: verificación de órdenes, reenvío de recargas,
+correos, Pabilo/Binance y el archivado periódico de órdenes. Se pueden lanzar
+varios procesos worker a la vez: cada job lo reclama un solo consumidor.
+Para que los workers web solo encolen, arrancarlos con JOB_QUEUE_MODE=worker.
+"""
+import argparse
+import os
+import signal
+import threading
+
+# This process is the consumer: keep app.py from starting its inline consumers.
+os.environ["JOB_QUEUE_MODE"] = "worker"
+
+import app as store_app  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--consumers",
+        type=int,
+        default=int(os.environ.get("JOB_WORKER_CONSUMERS", "4") or 4),
+        help="Hilos consumidores en este proceso",
+    )
+    args = parser.parse_args()
+
+    stop = threading.Event()
+
+    def _shutdown(signum, frame):
+        print(f"[JobQueue] Señal {signum}: terminando los jobs en curso...")
+        stop.set()
+        store_app._JOB_WAKE.set()
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+
+    threads = store_app._start_job_consumers(args.consumers, stop)
+    print(f"[JobQueue] Worker {os.getpid()} con {len(threads)} consumidores")
+    while not stop.wait(1.0):
+        pass
+    for t in threads:
+        t.join(timeout=store_app._JOB_LEASE_SECONDS)
+
+
+if __name__ == "__main__":
+    main()